@@ -4,19 +4,108 @@ from tqdm import tqdm
 from collections import defaultdict
 import numpy as np
 
+from .batch_controller import AdaptiveBatchController
+from .formula_prune import get_formula_prune_enable, get_surviving_formulas
+from .inference_cache import cached_batch_predict, get_formula_latex_cache, get_inference_cache, hash_image, \
+    mfd_res_from_cache, mfd_res_to_cache
 from .model_init import AtomModelSingleton
-from ...utils.config_reader import get_formula_enable, get_table_enable
+from ...utils.formula_screen import get_formula_screen_enable, layout_may_contain_formula
+from ...utils.metrics import get_metrics_collector, stage_timer
+from ...utils.config_reader import get_device, get_formula_enable, get_table_enable
 from ...utils.model_utils import crop_img, get_res_list_from_layout_res
+from ...utils.pdf_image_tools import MultiResolutionPage
 from ...utils.ocr_utils import get_adjusted_mfdetrec_res, get_ocr_result_list, OcrConfidence
 
 YOLO_LAYOUT_BASE_BATCH_SIZE = 1
 MFD_BASE_BATCH_SIZE = 1
 MFR_BASE_BATCH_SIZE = 16
+OCR_DET_BASE_BATCH_SIZE = 16
+OCR_REC_BASE_BATCH_SIZE = 6
+
+
+def _to_bgr_array(image):
+    """统一为BGR numpy数组，渲染时已经是BGR数组的页面和按区域渲染的多分辨率页面直接使用，不做拷贝"""
+    if isinstance(image, (np.ndarray, MultiResolutionPage)):
+        return image
+    return cv2.cvtColor(np.asarray(image.convert('RGB')), cv2.COLOR_RGB2BGR)
+
+
+def _detection_image(image):
+    """版面和公式检测使用的整页位图，多分辨率页面使用低分辨率位图"""
+    if isinstance(image, MultiResolutionPage):
+        return image.detection_image
+    return image
+
+
+def _detection_ratio(image):
+    """检测结果坐标到页面坐标的缩放比例"""
+    if isinstance(image, MultiResolutionPage):
+        return image.detection_ratio
+    return 1
+
+
+def _scale_layout_res(layout_res, ratio):
+    if ratio == 1:
+        return layout_res
+    return [{**res, 'poly': [round(p * ratio) for p in res['poly']]} for res in layout_res]
+
+
+def _scale_mfd_res(mfd_res, ratio):
+    if ratio == 1:
+        return mfd_res
+    value = mfd_res_to_cache(mfd_res)
+    value['xyxy'] = value['xyxy'] * ratio
+    return mfd_res_from_cache(value)
+
+
+def _hash_page(image):
+    if isinstance(image, MultiResolutionPage):
+        return f'{hash_image(image.detection_image)}|{image.detection_ratio}'
+    return hash_image(image)
+
+
+def _formula_candidates(images_with_extra_info, images_layout_res):
+    """
+    开启公式预筛时，只有文本页字符流预判包含公式，或者版面检测到行间公式的页面才进行公式检测和识别。
+    extra_info的第4个元素为文本页的预判结果，ocr页面为None
+    """
+    page_indices = list(range(len(images_with_extra_info)))
+    if not get_formula_screen_enable():
+        return page_indices
+    candidates = [
+        i for i in page_indices
+        if (len(images_with_extra_info[i]) > 3 and images_with_extra_info[i][3])
+        or layout_may_contain_formula(images_layout_res[i])
+    ]
+    collector = get_metrics_collector()
+    if collector is not None and len(candidates) < len(page_indices):
+        collector.record('formula_screen_skip', 0, items=len(page_indices) - len(candidates))
+    return candidates
+
+
+def _page_geometry(extra_info):
+    """
+    extra_info的第5个元素为(scale, page_w, page_h)，在当前进程推理时为返回该元组的函数，
+    只有检测到公式的页面才会调用；未提供时不做公式裁剪
+    """
+    if len(extra_info) <= 4 or extra_info[4] is None:
+        return None
+    page_geometry = extra_info[4]
+    return page_geometry() if callable(page_geometry) else page_geometry
+
+
+def _hash_images(cache, images):
+    if cache is None:
+        return None
+    return [_hash_page(image) for image in images]
 
 
 class BatchAnalyze:
-    def __init__(self, model_manager, batch_ratio: int, formula_enable, table_enable, enable_ocr_det_batch: bool = True):
+    def __init__(self, model_manager, batch_ratio: int, formula_enable, table_enable, enable_ocr_det_batch: bool = True,
+                 batch_controller=None):
         self.batch_ratio = batch_ratio
+        # 未传入时使用固定batch大小，仅保留OOM时减半重试的能力
+        self.batch_controller = batch_controller or AdaptiveBatchController(get_device(), adaptive=False)
         self.formula_enable = get_formula_enable(formula_enable)
         self.table_enable = get_table_enable(table_enable)
         self.model_manager = model_manager
@@ -35,34 +124,106 @@ class BatchAnalyze:
         )
         atom_model_manager = AtomModelSingleton()
 
-        images = [image for image, _, _ in images_with_extra_info]
-
-        # doclayout_yolo
-        layout_images = []
-        for image_index, image in enumerate(images):
-            layout_images.append(image)
+        # 页面统一使用BGR numpy数组，layout/mfd/ocr直接使用，公式、ocr和表格的裁剪都基于该数组。
+        # 多分辨率页面的检测在低分辨率位图上进行，检测结果缩放到页面坐标后，裁剪时只渲染需要识别的区域
+        images = [_to_bgr_array(extra_info[0]) for extra_info in images_with_extra_info]
+        detection_images = [_detection_image(image) for image in images]
+        detection_ratios = [_detection_ratio(image) for image in images]
 
+        # 推理结果缓存，未开启时为None，各阶段直接调用模型
+        cache = get_inference_cache()
+        page_hashes = _hash_images(cache, images)
 
-        images_layout_res += self.model.layout_model.batch_predict(
-            layout_images, YOLO_LAYOUT_BASE_BATCH_SIZE
+        # doclayout_yolo
+        layout_model = self.model.layout_model
+        # 版面检测按letterbox后的尺寸分桶批量推理，batch大小由batch_controller决定，耗时按batch记录在layout阶段
+        layout_results = cached_batch_predict(
+            cache, 'layout', layout_model.cache_id, page_hashes, detection_images,
+            lambda batch_images: layout_model.batch_predict(
+                batch_images, self.batch_ratio * YOLO_LAYOUT_BASE_BATCH_SIZE, batch_controller=self.batch_controller
+            )
         )
+        images_layout_res += [
+            _scale_layout_res(layout_res, ratio) for layout_res, ratio in zip(layout_results, detection_ratios)
+        ]
 
         if self.formula_enable:
-            # 公式检测
-            images_mfd_res = self.model.mfd_model.batch_predict(
-                images, MFD_BASE_BATCH_SIZE
-            )
+            mfd_model = self.model.mfd_model
+            mfr_model = self.model.mfr_model
+
+            def formula_predict(image_indices):
+                formula_images = [images[i] for i in image_indices]
+                mfd_images = [detection_images[i] for i in image_indices]
+                # 公式检测
+                mfd_batch_size = self.batch_ratio * MFD_BASE_BATCH_SIZE
+                if cache is None:
+                    images_mfd_res = mfd_model.batch_predict(
+                        mfd_images, mfd_batch_size, batch_controller=self.batch_controller
+                    )
+                else:
+                    images_mfd_res = [mfd_res_from_cache(mfd_res) for mfd_res in cached_batch_predict(
+                        cache, 'mfd', mfd_model.cache_id, [page_hashes[i] for i in image_indices], mfd_images,
+                        lambda batch_images: [
+                            mfd_res_to_cache(mfd_res)
+                            for mfd_res in mfd_model.batch_predict(
+                                batch_images, mfd_batch_size, batch_controller=self.batch_controller
+                            )
+                        ]
+                    )]
+                images_mfd_res = [
+                    _scale_mfd_res(mfd_res, detection_ratios[i]) for mfd_res, i in zip(images_mfd_res, image_indices)
+                ]
+
+                def formula_filter(batch_index, formula_list):
+                    # 按后处理规则判断公式能否保留，图片、表格区块中的公式等不需要识别
+                    nonlocal pruned_count
+                    image_index = image_indices[batch_index]
+                    page_geometry = _page_geometry(images_with_extra_info[image_index])
+                    if page_geometry is None:
+                        return None
+                    keep_list = get_surviving_formulas(
+                        images_layout_res[image_index], formula_list, page_geometry,
+                        ocr_enable=images_with_extra_info[image_index][1],
+                    )
+                    pruned_count += keep_list.count(False)
+                    return keep_list
+
+                # 公式识别
+                return mfr_model.batch_predict(
+                    images_mfd_res,
+                    formula_images,
+                    batch_size=self.batch_ratio * MFR_BASE_BATCH_SIZE,
+                    batch_controller=self.batch_controller,
+                    latex_cache=latex_cache,
+                    formula_filter=formula_filter if prune_enable else None,
+                )
 
-            # 公式识别
-            images_formula_list = self.model.mfr_model.batch_predict(
-                images_mfd_res,
-                images,
-                batch_size=self.batch_ratio * MFR_BASE_BATCH_SIZE,
-            )
-            mfr_count = 0
+            def formula_cache_key(image_index):
+                # 裁剪结果取决于页面的ocr模式和页面尺寸，一并作为缓存键
+                if not prune_enable:
+                    return page_hashes[image_index]
+                extra_info = images_with_extra_info[image_index]
+                return f'{page_hashes[image_index]}|{extra_info[1]}|{_page_geometry(extra_info)}'
+
+            # 公式裁剪图级别的识别结果缓存，重复出现的行内符号、公式编号无需再次解码
+            latex_cache = get_formula_latex_cache()
+            prune_enable = get_formula_prune_enable()
+            pruned_count = 0
+            # 公式识别结果命中缓存的页面无需再做公式检测
+            formula_indices = _formula_candidates(images_with_extra_info, images_layout_res)
+            images_formula_list = [[] for _ in images]
+            if formula_indices:
+                formula_results = cached_batch_predict(
+                    cache, 'mfr', f'{mfd_model.cache_id}|{mfr_model.cache_id}',
+                    [formula_cache_key(i) for i in formula_indices] if page_hashes is not None else None,
+                    formula_indices, formula_predict
+                )
+                for image_index, formula_res in zip(formula_indices, formula_results):
+                    images_formula_list[image_index] = formula_res
             for image_index in range(len(images)):
                 images_layout_res[image_index] += images_formula_list[image_index]
-                mfr_count += len(images_formula_list[image_index])
+            if pruned_count:
+                logger.info(f'formula recognition skipped {pruned_count} detections discarded by post-processing')
 
         # 清理显存
         # clean_vram(self.model.device, vram_threshold=8)
@@ -70,9 +231,9 @@ class BatchAnalyze:
         ocr_res_list_all_page = []
         table_res_list_all_page = []
         for index in range(len(images)):
-            _, ocr_enable, _lang = images_with_extra_info[index]
+            ocr_enable, _lang = images_with_extra_info[index][1:3]
             layout_res = images_layout_res[index]
-            pil_img = images[index]
+            page_img = images[index]
 
             ocr_res_list, table_res_list, single_page_mfdetrec_res = (
                 get_res_list_from_layout_res(layout_res)
@@ -81,13 +242,13 @@ class BatchAnalyze:
             ocr_res_list_all_page.append({'ocr_res_list':ocr_res_list,
                                           'lang':_lang,
                                           'ocr_enable':ocr_enable,
-                                          'pil_img':pil_img,
+                                          'page_img':page_img,
                                           'single_page_mfdetrec_res':single_page_mfdetrec_res,
                                           'layout_res':layout_res,
                                           })
 
             for table_res in table_res_list:
-                table_img, _ = crop_img(table_res, pil_img)
+                table_img, _ = crop_img(table_res, page_img)
                 table_res_list_all_page.append({'table_res':table_res,
                                                 'lang':_lang,
                                                 'table_img':table_img,
@@ -103,16 +264,14 @@ class BatchAnalyze:
                 _lang = ocr_res_list_dict['lang']
 
                 for res in ocr_res_list_dict['ocr_res_list']:
+                    # 页面已经是BGR数组，裁剪结果可以直接用于OCR
                     new_image, useful_list = crop_img(
-                        res, ocr_res_list_dict['pil_img'], crop_paste_x=50, crop_paste_y=50
+                        res, ocr_res_list_dict['page_img'], crop_paste_x=50, crop_paste_y=50
                     )
                     adjusted_mfdetrec_res = get_adjusted_mfdetrec_res(
                         ocr_res_list_dict['single_page_mfdetrec_res'], useful_list
                     )
 
-                    # BGR转换
-                    new_image = cv2.cvtColor(np.asarray(new_image), cv2.COLOR_RGB2BGR)
-
                     all_cropped_images_info.append((
                         new_image, useful_list, ocr_res_list_dict, res, adjusted_mfdetrec_res, _lang
                     ))
@@ -170,9 +329,15 @@ class BatchAnalyze:
                         batch_images.append(padded_img)
 
                     # 批处理检测
-                    batch_size = min(len(batch_images), self.batch_ratio * 16)  # 增加批处理大小
-                    # logger.debug(f"OCR-det batch: {batch_size} images, target size: {target_h}x{target_w}")
-                    batch_results = ocr_model.text_detector.batch_predict(batch_images, batch_size)
+                    batch_results = cached_batch_predict(
+                        cache, 'ocr_det', ocr_model.cache_id, _hash_images(cache, batch_images), batch_images,
+                        lambda miss_images: self.batch_controller.run(
+                            'ocr_det', miss_images,
+                            lambda det_images: ocr_model.text_detector.batch_predict(det_images, len(det_images)),
+                            base_batch_size=self.batch_ratio * OCR_DET_BASE_BATCH_SIZE,
+                            group=(lang, target_h, target_w),
+                        )
+                    )
 
                     # 处理批处理结果
                     for i, (crop_info, (dt_boxes, elapse)) in enumerate(zip(group_crops, batch_results)):
@@ -225,16 +390,16 @@ class BatchAnalyze:
                 )
                 for res in ocr_res_list_dict['ocr_res_list']:
                     new_image, useful_list = crop_img(
-                        res, ocr_res_list_dict['pil_img'], crop_paste_x=50, crop_paste_y=50
+                        res, ocr_res_list_dict['page_img'], crop_paste_x=50, crop_paste_y=50
                     )
                     adjusted_mfdetrec_res = get_adjusted_mfdetrec_res(
                         ocr_res_list_dict['single_page_mfdetrec_res'], useful_list
                     )
                     # OCR-det
-                    new_image = cv2.cvtColor(np.asarray(new_image), cv2.COLOR_RGB2BGR)
-                    ocr_res = ocr_model.ocr(
-                        new_image, mfd_res=adjusted_mfdetrec_res, rec=False
-                    )[0]
+                    with stage_timer('ocr_det'):
+                        ocr_res = ocr_model.ocr(
+                            new_image, mfd_res=adjusted_mfdetrec_res, rec=False
+                        )[0]
 
                     # Integration results
                     if ocr_res:
@@ -252,7 +417,12 @@ class BatchAnalyze:
                     atom_model_name='table',
                     lang=_lang,
                 )
-                html_code, table_cell_bboxes, logic_points, elapse = table_model.predict(table_res_dict['table_img'])
+                table_img = table_res_dict['table_img']
+                with stage_timer('table'):
+                    html_code, table_cell_bboxes, logic_points, elapse = cached_batch_predict(
+                        cache, 'table', table_model.cache_id, _hash_images(cache, [table_img]), [table_img],
+                        lambda table_images: [table_model.predict(table_images[0])]
+                    )[0]
                 # 判断是否返回正常
                 if html_code:
                     expected_ending = html_code.strip().endswith('</html>') or html_code.strip().endswith('</table>')
@@ -305,7 +475,7 @@ class BatchAnalyze:
                         det_db_box_thresh=0.3,
                         lang=lang
                     )
-                    ocr_res_list = ocr_model.ocr(img_crop_list, det=False, tqdm_enable=True)[0]
+                    ocr_res_list = self.ocr_rec_predict(ocr_model, img_crop_list)
 
                     # Verify we have matching counts
                     assert len(ocr_res_list) == len(
@@ -321,4 +491,29 @@ class BatchAnalyze:
 
                     total_processed += len(img_crop_list)
 
+        if cache is not None:
+            logger.info(f'inference cache hits: {cache.summary()}')
+        if self.formula_enable and latex_cache is not None:
+            logger.info(f'formula recognition {latex_cache.summary()}')
+
         return images_layout_res
+
+    def ocr_rec_predict(self, ocr_model, img_crop_list):
+        """OCR-rec，先按宽高比全局排序再交给batch_controller分批，每个batch即为一次模型推理"""
+        wh_ratios = [img.shape[1] / float(img.shape[0]) for img in img_crop_list]
+        indices = sorted(range(len(img_crop_list)), key=lambda i: wh_ratios[i])
+        sorted_crop_list = [img_crop_list[i] for i in indices]
+
+        def infer_batch(images):
+            return ocr_model.ocr(images, det=False, rec_batch_num=len(images))[0]
+
+        sorted_res_list = self.batch_controller.run(
+            'ocr_rec', sorted_crop_list, infer_batch,
+            base_batch_size=self.batch_ratio * OCR_REC_BASE_BATCH_SIZE, desc='OCR-rec Predict',
+            # 文本行缩放到固定高度，计算量与宽高比成正比，按宽高比统计吞吐
+            cost_fn=lambda img: max(img.shape[1] / float(img.shape[0]), 1.0),
+        )
+        ocr_res_list = [None] * len(img_crop_list)
+        for sorted_index, original_index in enumerate(indices):
+            ocr_res_list[original_index] = sorted_res_list[sorted_index]
+        return ocr_res_list
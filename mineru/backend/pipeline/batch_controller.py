@@ -0,0 +1,269 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import os
+import time
+
+import torch
+from loguru import logger
+from tqdm import tqdm
+
+from mineru.utils.metrics import get_metrics_collector
+from mineru.utils.model_utils import clean_memory
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# 吞吐提升不足该比例时不再增大batch
+GROWTH_MIN_SPEEDUP = 1.05
+# 增大batch后预计的显存占用不能超过可用显存的该比例
+GROWTH_MEMORY_RATIO = 0.8
+# OOM后batch上限保持的轮数（batch_image_analyze调用次数），之后恢复原上限重新探测
+OOM_LIMIT_ROUNDS = 4
+
+
+def is_oom_error(e):
+    if isinstance(e, MemoryError):
+        return True
+    if hasattr(torch.cuda, 'OutOfMemoryError') and isinstance(e, torch.cuda.OutOfMemoryError):
+        return True
+    return isinstance(e, RuntimeError) and 'out of memory' in str(e).lower()
+
+
+def _get_device_module(device):
+    device = str(device)
+    if device.startswith('cuda') and torch.cuda.is_available():
+        return torch.cuda
+    if device.startswith('npu'):
+        try:
+            import torch_npu
+            if torch_npu.npu.is_available():
+                return torch_npu.npu
+        except ImportError:
+            pass
+    return None
+
+
+def get_available_memory(device):
+    """
+    返回当前可用于推理的显存(bytes)，包含本进程已缓存但未使用的部分。
+    非cuda/npu设备返回None。
+    """
+    device_module = _get_device_module(device)
+    if device_module is None or not hasattr(device_module, 'mem_get_info'):
+        return None
+    free, _ = device_module.mem_get_info()
+    cached = device_module.memory_reserved() - device_module.memory_allocated()
+    return free + cached
+
+
+def get_cpu_memory_budget():
+    """cpu模式下的内存预算(bytes)，通过环境变量MINERU_CPU_MEMORY_BUDGET(GB)设置，默认为物理内存的80%"""
+    budget = os.getenv('MINERU_CPU_MEMORY_BUDGET', None)
+    if budget is not None:
+        try:
+            return float(budget) * (1024 ** 3)
+        except ValueError:
+            logger.warning(f'Invalid MINERU_CPU_MEMORY_BUDGET value: {budget}, using default budget')
+    if psutil is None:
+        logger.warning('psutil is not installed, cpu memory budget is disabled and batch size grows by throughput only')
+        return None
+    return psutil.virtual_memory().total * 0.8
+
+
+def get_rss():
+    if psutil is None:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+class _StageState:
+    def __init__(self, batch_size, max_batch_size):
+        self.batch_size = batch_size
+        self.max_batch_size = max_batch_size
+        self.best_batch_size = batch_size
+        self.best_throughput = 0.0
+        self.settled = False
+        self.oom_count = 0
+        # OOM或超出内存预算后的batch上限，及其剩余的保持轮数
+        self.oom_limit = None
+        self.oom_limit_rounds = 0
+
+    @property
+    def batch_limit(self):
+        if self.oom_limit is None:
+            return self.max_batch_size
+        return min(self.max_batch_size, self.oom_limit)
+
+    def limit(self, batch_size):
+        self.batch_size = max(1, batch_size)
+        self.oom_limit = self.batch_size
+        self.oom_limit_rounds = OOM_LIMIT_ROUNDS
+        self.best_batch_size = min(self.best_batch_size, self.batch_size)
+        self.settled = True
+
+    def new_round(self):
+        # 不同调用之间的输入不同，吞吐不可比，从上一轮吞吐最高的大小重新探测
+        self.settled = False
+        self.best_throughput = 0.0
+        if self.oom_limit is not None:
+            self.oom_limit_rounds -= 1
+            if self.oom_limit_rounds <= 0:
+                self.oom_limit = None
+        self.batch_size = min(self.best_batch_size, self.batch_limit)
+
+
+class AdaptiveBatchController:
+    """
+    自适应batch大小控制器，每个阶段(mfr/ocr_det/ocr_rec等)按输入尺寸分组(group)独立维护batch大小：
+    1. 初始batch大小由调用方根据当前可用显存计算；
+    2. 每个满batch完成后统计吞吐，吞吐提升且显存(cpu模式下为RSS预算)有余量时将batch翻倍，否则固定在吞吐最高的大小；
+       同一组内各项的计算量不同时（如按长度排序的公式），由cost_fn给出每项的计算量，吞吐按计算量统计；
+    3. 出现OOM时释放缓存、batch减半并重试失败的batch，batch为1仍然OOM时抛出异常；
+       减半后的上限保持OOM_LIMIT_ROUNDS轮，每轮(new_round)开始时重新探测。
+    """
+
+    def __init__(self, device, adaptive=None):
+        self.device = str(device)
+        if adaptive is None:
+            adaptive = os.getenv('MINERU_ADAPTIVE_BATCH_SIZE', 'true').lower() in ('1', 'true', 'yes')
+        self.adaptive = adaptive
+        self.device_module = _get_device_module(self.device)
+        self.cpu_memory_budget = get_cpu_memory_budget() if self.device_module is None else None
+        self.stages = {}
+
+    def new_round(self):
+        """一次batch_image_analyze调用开始时调用，解除上一轮固定的batch大小，OOM上限按轮数逐渐过期"""
+        for state in self.stages.values():
+            state.new_round()
+
+    def _get_state(self, stage, base_batch_size, max_batch_size=None, group=None):
+        key = stage if group is None else (stage, group)
+        state = self.stages.get(key)
+        if state is None:
+            if max_batch_size is None:
+                max_batch_size = base_batch_size * 8
+            state = _StageState(max(1, base_batch_size), max(1, max_batch_size, base_batch_size))
+            self.stages[key] = state
+        return state
+
+    def get_batch_size(self, stage, base_batch_size, max_batch_size=None, group=None):
+        return self._get_state(stage, base_batch_size, max_batch_size, group).batch_size
+
+    def run(self, stage, items, infer_fn, base_batch_size, max_batch_size=None, desc=None, group=None, cost_fn=None):
+        """
+        按自适应的batch大小依次对items执行infer_fn，infer_fn接收一个batch的列表并返回等长的结果列表。
+
+        Args:
+            group: 输入尺寸分组，不同分组的batch大小独立调整，如ocr检测的(语言, 高, 宽)
+            cost_fn: 返回单项的相对计算量，用于统计吞吐；为None时每项计为1
+
+        Returns:
+            list: 与items一一对应的结果
+        """
+        state = self._get_state(stage, base_batch_size, max_batch_size, group)
+        results = []
+        index = 0
+        with tqdm(total=len(items), desc=desc, disable=desc is None) as pbar:
+            while index < len(items):
+                batch_size = state.batch_size
+                batch = items[index: index + batch_size]
+                oom = False
+                try:
+                    batch_results, elapse, memory_usage = self._run_batch(infer_fn, batch)
+                except Exception as e:
+                    if not is_oom_error(e):
+                        raise
+                    oom = True
+                if oom:
+                    # 在except块之外处理，确保异常栈中引用的中间张量已经释放
+                    self._on_oom(stage, state, batch_size)
+                    continue
+                results.extend(batch_results)
+                index += len(batch)
+                pbar.update(len(batch))
+                collector = get_metrics_collector()
+                if collector is not None:
+                    collector.record(stage, elapse, items=len(batch), batch_size=batch_size)
+                # 只有满batch的吞吐具有可比性
+                if len(batch) == batch_size:
+                    cost = len(batch) if cost_fn is None else sum(cost_fn(item) for item in batch)
+                    self._on_success(stage, state, batch_size, cost / max(elapse, 1e-6), memory_usage)
+        return results
+
+    def _run_batch(self, infer_fn, batch):
+        memory_before = None
+        if self.device_module is not None and hasattr(self.device_module, 'reset_peak_memory_stats'):
+            self.device_module.reset_peak_memory_stats()
+            memory_before = self.device_module.memory_allocated()
+        start = time.time()
+        batch_results = infer_fn(batch)
+        elapse = time.time() - start
+        memory_usage = None
+        if memory_before is not None:
+            memory_usage = self.device_module.max_memory_allocated() - memory_before
+        return batch_results, elapse, memory_usage
+
+    def _on_oom(self, stage, state, batch_size):
+        clean_memory(self.device)
+        state.oom_count += 1
+        if batch_size <= 1:
+            raise RuntimeError(f'{stage} out of memory with batch size 1')
+        state.limit(batch_size // 2)
+        logger.warning(f'{stage} out of memory with batch size {batch_size}, retry with batch size {state.batch_size}')
+
+    def _on_success(self, stage, state, batch_size, throughput, memory_usage):
+        if not self.adaptive:
+            return
+
+        if self.cpu_memory_budget is not None:
+            rss = get_rss()
+            if rss is not None and rss > self.cpu_memory_budget and batch_size > 1:
+                # 超出内存预算时提前缩小batch，避免触发系统OOM
+                state.limit(batch_size // 2)
+                logger.warning(f'{stage} rss {rss / 1024 ** 3:.1f} GB exceeds memory budget, batch size reduced to {state.batch_size}')
+                return
+
+        if state.settled:
+            return
+
+        if throughput < state.best_throughput * GROWTH_MIN_SPEEDUP:
+            # 吞吐不再提升，回退到吞吐最高的batch大小
+            state.batch_size = state.best_batch_size
+            state.settled = True
+            logger.debug(f'{stage} batch size settled at {state.batch_size}')
+            return
+
+        state.best_throughput = throughput
+        state.best_batch_size = batch_size
+
+        next_batch_size = min(batch_size * 2, state.batch_limit)
+        if next_batch_size == batch_size or not self._can_grow(memory_usage):
+            state.settled = True
+            logger.debug(f'{stage} batch size settled at {state.batch_size}')
+            return
+        state.batch_size = next_batch_size
+        logger.debug(f'{stage} batch size grows to {next_batch_size}, throughput: {throughput:.1f} items/s')
+
+    def _can_grow(self, memory_usage):
+        if self.device_module is not None:
+            available = get_available_memory(self.device)
+            if available is None or memory_usage is None:
+                return True
+            # batch翻倍后激活显存约增加一倍
+            return memory_usage < available * GROWTH_MEMORY_RATIO
+        if self.cpu_memory_budget is not None:
+            rss = get_rss()
+            return rss is None or rss < self.cpu_memory_budget * GROWTH_MEMORY_RATIO
+        return True
+
+
+_controllers = {}
+
+
+def get_batch_controller(device):
+    """按设备缓存控制器，使学习到的batch大小在多次batch_image_analyze调用之间保留，调用方在每轮开始时调用new_round"""
+    device = str(device)
+    if device not in _controllers:
+        _controllers[device] = AdaptiveBatchController(device)
+    return _controllers[device]
@@ -0,0 +1,63 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import copy
+import os
+
+from mineru.backend.pipeline.model_json_to_middle_json import get_page_spans_and_bboxes
+from mineru.backend.pipeline.pipeline_magic_model import MagicModel
+from mineru.utils.block_pre_proc import process_groups
+from mineru.utils.enum_class import ContentType
+from mineru.utils.model_utils import get_res_list_from_layout_res
+
+
+def get_formula_prune_enable():
+    """
+    公式识别前是否跳过后处理必然丢弃的公式检测框，通过环境变量MINERU_MFR_PRUNE设置，默认关闭。
+    判断时需要在版面结果的副本上重新执行一遍区块整理，只有图片、表格中公式较多的文档才能抵消这部分开销。
+    被跳过的公式仍保留在模型结果中（latex为空），ocr检测时照常屏蔽公式区域
+    """
+    return os.getenv('MINERU_MFR_PRUNE', 'false').lower() == 'true'
+
+
+def get_surviving_formulas(layout_res, formula_list, page_geometry, ocr_enable=False):
+    """
+    在版面检测结果上按后处理的规则（get_page_spans_and_bboxes中的区块整理和remove_outside_spans）
+    判断每个公式检测框能否保留，图片、表格区块中的公式等会被删除，不需要识别。
+
+    ocr页面中没有标题和脚注的图片，在ocr识别出足够多的文字后会被当作文本块，公式识别前无法判断，
+    这样的页面不做裁剪；公式之间按内容去重的结果也无法提前知道，这里每个公式使用不同的占位内容，只会多保留。
+
+    Args:
+        layout_res: 页面的版面检测结果，不会被修改
+        formula_list: 公式检测结果，poly为页面位图坐标
+        page_geometry: (scale, page_w, page_h)，与后处理中的页面缩放比例和页面尺寸一致
+
+    Returns:
+        list[bool]: 与formula_list一一对应，False表示该公式在后处理中必然被删除
+    """
+    if not formula_list:
+        return []
+    scale, page_w, page_h = page_geometry
+    layout_dets = copy.deepcopy(layout_res)
+    formula_dets = [
+        {**formula, 'poly': list(formula['poly']), 'latex': f'formula_{index}'}
+        for index, formula in enumerate(formula_list)
+    ]
+    layout_dets += formula_dets
+    # 与batch_analyze中ocr检测前一致：合并重叠的表格、删除嵌套的表格，合并重叠的文本区块
+    get_res_list_from_layout_res(layout_dets)
+
+    magic_model = MagicModel({'layout_dets': layout_dets}, scale)
+    if ocr_enable:
+        _, _, _, maybe_text_image_blocks = process_groups(
+            magic_model.get_imgs(), 'image_body', 'image_caption_list', 'image_footnote_list'
+        )
+        if maybe_text_image_blocks:
+            return [True] * len(formula_list)
+
+    spans, _, _, _ = get_page_spans_and_bboxes(magic_model, page_w, page_h, ocr_enable=ocr_enable, formula_enabled=True)
+    # span的bbox与公式检测结果的bbox是同一个对象，被删除（包括尺寸为0、置信度过低）的公式不在其中
+    surviving_bboxes = {
+        id(span['bbox']) for span in spans
+        if span['type'] in (ContentType.INLINE_EQUATION, ContentType.INTERLINE_EQUATION)
+    }
+    return [id(formula_det.get('bbox')) in surviving_bboxes for formula_det in formula_dets]
@@ -0,0 +1,368 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from loguru import logger
+
+
+def hash_image(image):
+    """对渲染后的页面或裁剪图的像素内容计算哈希，支持PIL.Image和np.ndarray"""
+    array = np.ascontiguousarray(np.asarray(image))
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(str((array.shape, array.dtype.str)).encode('utf-8'))
+    hasher.update(array.data)
+    return hasher.hexdigest()
+
+
+def make_cache_key(model_id, content_hash):
+    return hashlib.sha256(f'{model_id}|{content_hash}'.encode('utf-8')).hexdigest()
+
+
+# 缓存值的格式标记，之后依次为json长度、json和np.save格式的数组
+_VALUE_MAGIC = b'MNRC1'
+_ARRAY_MARKER = '__ndarray__'
+
+
+def encode_cache_value(value):
+    """
+    把推理结果序列化为json，其中的numpy数组以np.save格式（不允许pickle）附加在json之后。
+    缓存目录可能被多个进程、多个用户共享，读取时不会执行任何数据中的代码。
+    tuple按list保存，只支持由dict（键为str）、list、tuple、numpy数组和标量组成的结果
+    """
+    arrays = []
+
+    def encode(obj):
+        if isinstance(obj, np.ndarray):
+            arrays.append(obj)
+            return {_ARRAY_MARKER: len(arrays) - 1}
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, (list, tuple)):
+            return [encode(item) for item in obj]
+        if isinstance(obj, dict):
+            if not all(isinstance(key, str) for key in obj):
+                raise TypeError('only str keys are supported')
+            return {key: encode(item) for key, item in obj.items()}
+        if obj is None or isinstance(obj, (str, int, float, bool)):
+            return obj
+        raise TypeError(f'unsupported type: {type(obj).__name__}')
+
+    header = json.dumps(encode(value), separators=(',', ':')).encode('utf-8')
+    out = io.BytesIO()
+    out.write(_VALUE_MAGIC)
+    out.write(struct.pack('<I', len(header)))
+    out.write(header)
+    for array in arrays:
+        np.save(out, array, allow_pickle=False)
+    return out.getvalue()
+
+
+def decode_cache_value(blob):
+    """encode_cache_value的逆过程，格式不符（如旧版本写入的数据）时抛出ValueError"""
+    blob = bytes(blob)
+    if not blob.startswith(_VALUE_MAGIC):
+        raise ValueError('unknown inference cache value format')
+    f = io.BytesIO(blob)
+    f.seek(len(_VALUE_MAGIC))
+    header_size, = struct.unpack('<I', f.read(4))
+    header = json.loads(f.read(header_size).decode('utf-8'))
+    arrays = []
+
+    def decode(obj):
+        if isinstance(obj, dict):
+            if _ARRAY_MARKER in obj and len(obj) == 1:
+                index = obj[_ARRAY_MARKER]
+                while len(arrays) <= index:
+                    arrays.append(np.load(f, allow_pickle=False))
+                return arrays[index]
+            return {key: decode(item) for key, item in obj.items()}
+        if isinstance(obj, list):
+            return [decode(item) for item in obj]
+        return obj
+
+    return decode(header)
+
+
+def mfd_res_to_cache(mfd_res):
+    boxes = mfd_res.boxes
+    return {
+        'xyxy': boxes.xyxy.cpu().numpy(),
+        'conf': boxes.conf.cpu().numpy(),
+        'cls': boxes.cls.cpu().numpy(),
+    }
+
+
+def mfd_res_from_cache(value):
+    """还原为与ultralytics Results.boxes接口一致的轻量对象，供公式识别使用"""
+    return SimpleNamespace(boxes=SimpleNamespace(
+        xyxy=torch.from_numpy(value['xyxy']),
+        conf=torch.from_numpy(value['conf']),
+        cls=torch.from_numpy(value['cls']),
+    ))
+
+
+class InferenceCache:
+    """
+    基于SQLite的推理结果缓存，按最近访问时间做LRU淘汰，缓存总大小超过上限时删除最久未访问的结果。
+    key由模型标识(权重和推理参数)与输入图像的内容哈希计算得到，模型或参数变化时自动失效。
+    同一缓存目录可以被多个进程共享。
+    """
+
+    def __init__(self, cache_dir, max_size_gb=10):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, 'inference_cache.sqlite')
+        self.max_size = int(max_size_gb * (1024 ** 3))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, stage TEXT, value BLOB, size INTEGER, last_access REAL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS cache_last_access ON cache(last_access)')
+        self._total_size = self._query_total_size()
+        self.stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+    def _query_total_size(self):
+        return self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+
+    def get_many(self, stage, keys):
+        """返回命中的{key: value}，并刷新这些key的访问时间"""
+        if not keys:
+            return {}
+        results = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # sqlite单条语句的参数数量有上限，分批查询
+            for index in range(0, len(unique_keys), 500):
+                chunk = unique_keys[index: index + 500]
+                rows = self._conn.execute(
+                    f'SELECT key, value FROM cache WHERE key IN ({",".join("?" * len(chunk))})', chunk
+                ).fetchall()
+                for key, value in rows:
+                    try:
+                        results[key] = decode_cache_value(value)
+                    except Exception as e:
+                        logger.warning(f'failed to load inference cache entry: {e}')
+            if results:
+                now = time.time()
+                self._conn.executemany(
+                    'UPDATE cache SET last_access = ? WHERE key = ?', [(now, key) for key in results]
+                )
+        hits = sum(1 for key in keys if key in results)
+        self.stats[stage]['hits'] += hits
+        self.stats[stage]['misses'] += len(keys) - hits
+        return results
+
+    def put_many(self, stage, items):
+        """items: [(key, value)]，value为None时不缓存"""
+        rows = {}
+        now = time.time()
+        for key, value in items:
+            if value is None:
+                continue
+            try:
+                blob = encode_cache_value(value)
+            except (TypeError, ValueError) as e:
+                logger.warning(f'skip caching {stage} result: {e}')
+                continue
+            rows[key] = (key, stage, blob, len(blob), now)
+        if not rows:
+            return
+        with self._lock:
+            # 覆盖已有的key时，总大小中减去旧数据的大小
+            replaced_size = 0
+            keys = list(rows)
+            for index in range(0, len(keys), 500):
+                chunk = keys[index: index + 500]
+                replaced_size += self._conn.execute(
+                    f'SELECT COALESCE(SUM(size), 0) FROM cache WHERE key IN ({",".join("?" * len(chunk))})', chunk
+                ).fetchone()[0]
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO cache (key, stage, value, size, last_access) VALUES (?, ?, ?, ?, ?)',
+                list(rows.values())
+            )
+            self._total_size += sum(row[3] for row in rows.values()) - replaced_size
+            if self._total_size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        # 其他进程可能也写入了数据，淘汰前重新统计
+        self._total_size = self._query_total_size()
+        target_size = int(self.max_size * 0.9)
+        if self._total_size <= target_size:
+            return
+        need_free = self._total_size - target_size
+        freed = 0
+        evict_keys = []
+        for key, size in self._conn.execute('SELECT key, size FROM cache ORDER BY last_access ASC'):
+            evict_keys.append((key,))
+            freed += size
+            if freed >= need_free:
+                break
+        self._conn.executemany('DELETE FROM cache WHERE key = ?', evict_keys)
+        self._total_size -= freed
+        logger.debug(f'inference cache evicted {len(evict_keys)} entries, {freed / 1024 ** 2:.1f} MB')
+
+    def summary(self):
+        return ', '.join(
+            f"{stage} {stats['hits']}/{stats['hits'] + stats['misses']}" for stage, stats in self.stats.items()
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def cached_batch_predict(cache, stage, model_id, content_hashes, inputs, predict_fn):
+    """
+    先查询缓存，只对未命中的输入调用predict_fn，结果写回缓存，返回与inputs一一对应的结果。
+    cache为None时直接调用predict_fn(inputs)。
+    """
+    if cache is None:
+        return predict_fn(inputs)
+
+    keys = [make_cache_key(model_id, content_hash) for content_hash in content_hashes]
+    cached = cache.get_many(stage, keys)
+    miss_indices = [i for i, key in enumerate(keys) if key not in cached]
+
+    results = [cached.get(key) for key in keys]
+    if miss_indices:
+        miss_results = predict_fn([inputs[i] for i in miss_indices])
+        # 写入缓存时立即序列化，后续对结果的原地修改不会影响缓存内容
+        cache.put_many(stage, [(keys[i], result) for i, result in zip(miss_indices, miss_results)])
+        for i, result in zip(miss_indices, miss_results):
+            results[i] = result
+    return results
+
+
+class FormulaLatexCache:
+    """
+    公式识别结果缓存：公式裁剪图的内容哈希 -> LaTeX。
+    教材中同一个行内符号、公式编号会重复出现成千上万次，命中后无需再做一次完整的自回归解码。
+    内存中按条目数做LRU淘汰；开启了推理缓存时，内存未命中的再查询持久化缓存，跨文档、跨进程复用。
+    """
+
+    def __init__(self, max_entries, persistent_cache=None):
+        self.max_entries = max_entries
+        self.persistent_cache = persistent_cache
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'crops': 0, 'deduplicated': 0, 'hits': 0, 'persistent_hits': 0, 'misses': 0}
+
+    def _put_memory(self, items):
+        if self.max_entries <= 0:
+            return
+        for key, latex in items:
+            self._entries[key] = latex
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_many(self, model_id, content_hashes):
+        """content_hashes需已去重，返回命中的{content_hash: latex}"""
+        keys = {content_hash: make_cache_key(model_id, content_hash) for content_hash in content_hashes}
+        results = {}
+        with self._lock:
+            for content_hash, key in keys.items():
+                latex = self._entries.get(key)
+                if latex is not None:
+                    self._entries.move_to_end(key)
+                    results[content_hash] = latex
+        memory_hits = len(results)
+        if self.persistent_cache is not None and len(results) < len(keys):
+            miss_hashes = {keys[content_hash]: content_hash for content_hash in keys if content_hash not in results}
+            persistent_results = self.persistent_cache.get_many('mfr_crop', list(miss_hashes))
+            for key, latex in persistent_results.items():
+                results[miss_hashes[key]] = latex
+            with self._lock:
+                self._put_memory(persistent_results.items())
+        with self._lock:
+            self.stats['hits'] += memory_hits
+            self.stats['persistent_hits'] += len(results) - memory_hits
+            self.stats['misses'] += len(keys) - len(results)
+        return results
+
+    def put_many(self, model_id, items):
+        """items: [(content_hash, latex)]"""
+        items = [(make_cache_key(model_id, content_hash), latex) for content_hash, latex in items]
+        with self._lock:
+            self._put_memory(items)
+        if self.persistent_cache is not None:
+            self.persistent_cache.put_many('mfr_crop', items)
+
+    def record_crops(self, crops, deduplicated):
+        with self._lock:
+            self.stats['crops'] += crops
+            self.stats['deduplicated'] += deduplicated
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['persistent_hits'] + stats['misses']
+        hit_rate = (stats['hits'] + stats['persistent_hits']) / lookups if lookups else 0
+        return (
+            f"crops {stats['crops']}, deduplicated {stats['deduplicated']}, "
+            f"cache hits {stats['hits']}+{stats['persistent_hits']}/{lookups} ({hit_rate:.1%})"
+        )
+
+
+_inference_cache = None
+_inference_cache_lock = threading.Lock()
+
+
+def get_inference_cache():
+    """
+    通过环境变量MINERU_INFERENCE_CACHE_DIR开启推理缓存，
+    MINERU_INFERENCE_CACHE_SIZE设置缓存大小上限(GB)，默认为10。
+    未开启时返回None。
+    """
+    global _inference_cache
+    cache_dir = os.getenv('MINERU_INFERENCE_CACHE_DIR', None)
+    if not cache_dir:
+        return None
+    with _inference_cache_lock:
+        if _inference_cache is None:
+            max_size_gb = float(os.getenv('MINERU_INFERENCE_CACHE_SIZE', 10))
+            _inference_cache = InferenceCache(cache_dir, max_size_gb)
+            logger.info(f'inference cache enabled at {_inference_cache.db_path}, max size: {max_size_gb} GB')
+    return _inference_cache
+
+
+DEFAULT_FORMULA_CACHE_SIZE = 20000
+_formula_latex_cache = None
+
+
+def get_formula_latex_cache():
+    """
+    公式识别结果缓存，通过环境变量MINERU_MFR_CACHE_SIZE设置内存中缓存的公式条数，默认为20000，设为0关闭内存缓存。
+    开启了推理缓存(MINERU_INFERENCE_CACHE_DIR)时同时写入持久化缓存。两者都关闭时返回None。
+    """
+    global _formula_latex_cache
+    try:
+        max_entries = int(os.getenv('MINERU_MFR_CACHE_SIZE', DEFAULT_FORMULA_CACHE_SIZE))
+    except ValueError:
+        logger.warning(f'MINERU_MFR_CACHE_SIZE is not a valid integer, use default {DEFAULT_FORMULA_CACHE_SIZE}')
+        max_entries = DEFAULT_FORMULA_CACHE_SIZE
+    persistent_cache = get_inference_cache()
+    if max_entries <= 0 and persistent_cache is None:
+        return None
+    with _inference_cache_lock:
+        if (
+            _formula_latex_cache is None
+            or _formula_latex_cache.max_entries != max_entries
+            or _formula_latex_cache.persistent_cache is not persistent_cache
+        ):
+            _formula_latex_cache = FormulaLatexCache(max_entries, persistent_cache)
+    return _formula_latex_cache
@@ -1,4 +1,6 @@
 # Copyright (c) Opendatalab. All rights reserved.
+import io
+import os
 import time
 
 from loguru import logger
@@ -11,25 +13,108 @@ from mineru.utils.block_pre_proc import prepare_block_bboxes, process_groups
 from mineru.utils.block_sort import sort_blocks_by_bbox
 from mineru.utils.boxbase import calculate_overlap_area_in_bbox1_area_ratio
 from mineru.utils.cut_image import cut_image_and_table
+from mineru.utils.document_context import DocumentContext, ImageDocument
 from mineru.utils.enum_class import ContentType
 from mineru.utils.llm_aided import llm_aided_title
+from mineru.utils.metrics import stage_timer
 from mineru.utils.model_utils import clean_memory
 from mineru.backend.pipeline.pipeline_magic_model import MagicModel
 from mineru.utils.ocr_utils import OcrConfidence
+from mineru.utils.pdf_classify import get_page_ocr_enable
+from mineru.utils.pdf_reader import pdfium_lock
 from mineru.utils.span_block_fix import fill_spans_in_blocks, fix_discarded_block, fix_block_spans
 from mineru.utils.span_pre_proc import remove_outside_spans, remove_overlaps_low_confidence_spans, \
     remove_overlaps_min_spans, txt_spans_extract
 from mineru.version import __version__
-from mineru.utils.hash_utils import str_md5
 
 
-def page_model_info_to_page_info(page_model_info, image_dict, page, image_writer, page_index, ocr_enable=False, formula_enabled=True):
+def page_model_info_to_page_info(page_model_info, image_dict, page, image_writer, page_index, ocr_enable=False, formula_enabled=True, textpage=None):
+    with stage_timer('page_blocks', page_idx=page_index):
+        page_blocks = page_model_info_to_page_blocks(
+            page_model_info, image_dict, page, image_writer, page_index, ocr_enable=ocr_enable, formula_enabled=formula_enabled,
+            textpage=textpage
+        )
+    if page_blocks is None:
+        return None
+    fix_blocks, footnote_blocks, fix_discarded_blocks, page_w, page_h = page_blocks
+
+    """对block进行排序"""
+    with stage_timer('page_sort', page_idx=page_index):
+        sorted_blocks = sort_blocks_by_bbox(fix_blocks, page_w, page_h, footnote_blocks)
+
+    """构造page_info"""
+    page_info = make_page_info_dict(sorted_blocks, page_index, page_w, page_h, fix_discarded_blocks)
+
+    return page_info
+
+
+def page_model_info_to_page_blocks(page_model_info, image_dict, page, image_writer, page_index, ocr_enable=False, formula_enabled=True, textpage=None):
+    """
+    构造页面中未排序的block，不依赖layoutreader模型，可以在子进程中执行。
+    textpage为分类阶段已缓存的文本页，传入时文本提取直接复用，不再重新创建。
+
+    Returns:
+        (fix_blocks, footnote_blocks, fix_discarded_blocks, page_w, page_h)，当前页面没有有效的bbox时返回None
+    """
     scale = image_dict["scale"]
-    page_pil_img = image_dict["img_pil"]
-    page_img_md5 = str_md5(image_dict["img_base64"])
-    page_w, page_h = map(int, page.get_size())
+    page_img = image_dict.crop_source
+    page_img_md5 = image_dict.fingerprint
+    with pdfium_lock:
+        page_w, page_h = map(int, page.get_size())
     magic_model = MagicModel(page_model_info, scale)
+    spans, all_bboxes, all_discarded_blocks, footnote_blocks = get_page_spans_and_bboxes(
+        magic_model, page_w, page_h, ocr_enable=ocr_enable, formula_enabled=formula_enabled
+    )
+
+    """删除重叠spans中置信度较低的那些"""
+    spans, dropped_spans_by_confidence = remove_overlaps_low_confidence_spans(spans)
+    """删除重叠spans中较小的那些"""
+    spans, dropped_spans_by_span_overlap = remove_overlaps_min_spans(spans)
+
+    """根据parse_mode，构造spans，主要是文本类的字符填充"""
+    if ocr_enable:
+        pass
+    else:
+        """使用新版本的混合ocr方案."""
+        spans = txt_spans_extract(page, spans, page_img, scale, all_bboxes, all_discarded_blocks, textpage=textpage)
 
+    """先处理不需要排版的discarded_blocks"""
+    discarded_block_with_spans, spans = fill_spans_in_blocks(
+        all_discarded_blocks, spans, 0.4
+    )
+    fix_discarded_blocks = fix_discarded_block(discarded_block_with_spans)
+
+    """如果当前页面没有有效的bbox则跳过"""
+    if len(all_bboxes) == 0:
+        return None
+
+    """对image/table/interline_equation截图"""
+    for span in spans:
+        if span['type'] in [ContentType.IMAGE, ContentType.TABLE, ContentType.INTERLINE_EQUATION]:
+            span = cut_image_and_table(
+                span, page_img, page_img_md5, page_index, image_writer, scale=scale
+            )
+
+    """span填充进block"""
+    block_with_spans, spans = fill_spans_in_blocks(all_bboxes, spans, 0.5)
+
+    """对block进行fix操作"""
+    fix_blocks = fix_block_spans(block_with_spans)
+
+    """同一行被断开的titile合并"""
+    # merge_title_blocks(fix_blocks)
+
+    return fix_blocks, footnote_blocks, fix_discarded_blocks, page_w, page_h
+
+
+def get_page_spans_and_bboxes(magic_model, page_w, page_h, ocr_enable=False, formula_enabled=True):
+    """
+    整理页面的区块，并按区块过滤span，只依赖模型结果和页面尺寸，不需要页面位图和文本层。
+    公式识别前按同样的规则判断公式检测框能否保留（见formula_prune）。
+
+    Returns:
+        (spans, all_bboxes, all_discarded_blocks, footnote_blocks)
+    """
     """从magic_model对象中获取后面会用到的区块信息"""
     discarded_blocks = magic_model.get_discarded()
     text_blocks = magic_model.get_text_blocks()
@@ -116,66 +201,31 @@ def page_model_info_to_page_info(page_model_info, image_dict, page, image_writer
     """顺便删除大水印并保留abandon的span"""
     spans = remove_outside_spans(spans, all_bboxes, all_discarded_blocks)
 
-    """删除重叠spans中置信度较低的那些"""
-    spans, dropped_spans_by_confidence = remove_overlaps_low_confidence_spans(spans)
-    """删除重叠spans中较小的那些"""
-    spans, dropped_spans_by_span_overlap = remove_overlaps_min_spans(spans)
-
-    """根据parse_mode，构造spans，主要是文本类的字符填充"""
-    if ocr_enable:
-        pass
-    else:
-        """使用新版本的混合ocr方案."""
-        spans = txt_spans_extract(page, spans, page_pil_img, scale, all_bboxes, all_discarded_blocks)
-
-    """先处理不需要排版的discarded_blocks"""
-    discarded_block_with_spans, spans = fill_spans_in_blocks(
-        all_discarded_blocks, spans, 0.4
-    )
-    fix_discarded_blocks = fix_discarded_block(discarded_block_with_spans)
-
-    """如果当前页面没有有效的bbox则跳过"""
-    if len(all_bboxes) == 0:
-        return None
-
-    """对image/table/interline_equation截图"""
-    for span in spans:
-        if span['type'] in [ContentType.IMAGE, ContentType.TABLE, ContentType.INTERLINE_EQUATION]:
-            span = cut_image_and_table(
-                span, page_pil_img, page_img_md5, page_index, image_writer, scale=scale
-            )
+    return spans, all_bboxes, all_discarded_blocks, footnote_blocks
 
-    """span填充进block"""
-    block_with_spans, spans = fill_spans_in_blocks(all_bboxes, spans, 0.5)
-
-    """对block进行fix操作"""
-    fix_blocks = fix_block_spans(block_with_spans)
 
-    """同一行被断开的titile合并"""
-    # merge_title_blocks(fix_blocks)
-
-    """对block进行排序"""
-    sorted_blocks = sort_blocks_by_bbox(fix_blocks, page_w, page_h, footnote_blocks)
-
-    """构造page_info"""
-    page_info = make_page_info_dict(sorted_blocks, page_index, page_w, page_h, fix_discarded_blocks)
-
-    return page_info
-
-
-def result_to_middle_json(model_list, images_list, pdf_doc, image_writer, lang=None, ocr_enable=False, formula_enabled=True):
+def result_to_middle_json(model_list, images_list, pdf_doc, image_writer, lang=None, ocr_enable=False, formula_enabled=True, pdf_bytes=None):
     middle_json = {"pdf_info": [], "_backend":"pipeline", "_version_name": __version__}
     formula_enabled = get_formula_enable(formula_enabled)
-    for page_index, page_model_info in tqdm(enumerate(model_list), total=len(model_list), desc="Processing pages"):
-        page = pdf_doc[page_index]
-        image_dict = images_list[page_index]
-        page_info = page_model_info_to_page_info(
-            page_model_info, image_dict, page, image_writer, page_index, ocr_enable=ocr_enable, formula_enabled=formula_enabled
+
+    page_process_workers = get_page_process_workers()
+    if page_process_workers > 1 and len(model_list) > 1:
+        """多进程并行构造页面block，layoutreader在主进程中批量排序"""
+        from mineru.backend.pipeline.page_process_pool import pages_to_page_info_parallel
+        if pdf_bytes is None:
+            if isinstance(pdf_doc, (DocumentContext, ImageDocument)):
+                pdf_bytes = pdf_doc.pdf_bytes
+            else:
+                with pdfium_lock:
+                    pdf_bytes = get_pdf_doc_bytes(pdf_doc)
+        middle_json["pdf_info"] = pages_to_page_info_parallel(
+            model_list, images_list, pdf_bytes, image_writer, page_process_workers,
+            ocr_enable=ocr_enable, formula_enabled=formula_enabled
         )
-        if page_info is None:
-            page_w, page_h = map(int, page.get_size())
-            page_info = make_page_info_dict([], page_index, page_w, page_h, [])
-        middle_json["pdf_info"].append(page_info)
+        for image_dict in images_list:
+            image_dict.release()
+    else:
+        middle_json["pdf_info"] = pages_to_page_info(model_list, images_list, pdf_doc, image_writer, ocr_enable, formula_enabled)
 
     """后置ocr处理"""
     need_ocr_list = []
@@ -206,7 +256,8 @@ def result_to_middle_json(model_list, images_list, pdf_doc, image_writer, lang=N
             det_db_box_thresh=0.3,
             lang=lang
         )
-        ocr_res_list = ocr_model.ocr(img_crop_list, det=False, tqdm_enable=True)[0]
+        with stage_timer('post_ocr_rec', items=len(img_crop_list)):
+            ocr_res_list = ocr_model.ocr(img_crop_list, det=False, tqdm_enable=True)[0]
         assert len(ocr_res_list) == len(
             need_ocr_list), f'ocr_res_list: {len(ocr_res_list)}, need_ocr_list: {len(need_ocr_list)}'
         for index, span in enumerate(need_ocr_list):
@@ -219,7 +270,8 @@ def result_to_middle_json(model_list, images_list, pdf_doc, image_writer, lang=N
                 span['score'] = 0.0
 
     """分段"""
-    para_split(middle_json["pdf_info"])
+    with stage_timer('para_split', items=len(middle_json["pdf_info"])):
+        para_split(middle_json["pdf_info"])
 
     """llm优化"""
     llm_aided_config = get_llm_aided_config()
@@ -234,12 +286,56 @@ def result_to_middle_json(model_list, images_list, pdf_doc, image_writer, lang=N
                 logger.info(f'llm aided title time: {round(time.time() - llm_aided_title_start_time, 2)}')
 
     """清理内存"""
-    pdf_doc.close()
+    with pdfium_lock:
+        pdf_doc.close()
     clean_memory(get_device())
 
     return middle_json
 
 
+def pages_to_page_info(model_list, images_list, pdf_doc, image_writer, ocr_enable=False, formula_enabled=True):
+    pdf_info = []
+    for page_index, page_model_info in tqdm(enumerate(model_list), total=len(model_list), desc="Processing pages"):
+        page_ocr_enable = get_page_ocr_enable(ocr_enable, page_index)
+        use_textpage_cache = isinstance(pdf_doc, DocumentContext)
+        with pdfium_lock:
+            page = pdf_doc[page_index]
+            # 复用DocumentContext中分类阶段缓存的文本页，ocr页面不需要文本页
+            textpage = pdf_doc.get_textpage(page_index) if use_textpage_cache and not page_ocr_enable else None
+        image_dict = images_list[page_index]
+        page_info = page_model_info_to_page_info(
+            page_model_info, image_dict, page, image_writer, page_index,
+            ocr_enable=page_ocr_enable, formula_enabled=formula_enabled, textpage=textpage
+        )
+        if page_info is None:
+            with pdfium_lock:
+                page_w, page_h = map(int, page.get_size())
+            page_info = make_page_info_dict([], page_index, page_w, page_h, [])
+        if use_textpage_cache:
+            pdf_doc.release_textpage(page_index)
+        # 该页的图片、表格截图已经完成，释放页面位图
+        image_dict.release()
+        with pdfium_lock:
+            page.close()
+        pdf_info.append(page_info)
+    return pdf_info
+
+
+def get_page_process_workers():
+    """页面后处理的进程数，通过环境变量MINERU_PAGE_PROCESS_WORKERS设置，默认不启用多进程"""
+    try:
+        return int(os.getenv('MINERU_PAGE_PROCESS_WORKERS', 0))
+    except ValueError:
+        logger.warning('MINERU_PAGE_PROCESS_WORKERS is not a valid integer, page process pool disabled')
+        return 0
+
+
+def get_pdf_doc_bytes(pdf_doc):
+    output_buffer = io.BytesIO()
+    pdf_doc.save(output_buffer)
+    return output_buffer.getvalue()
+
+
 def make_page_info_dict(blocks, page_id, page_w, page_h, discarded_blocks):
     return_dict = {
         'preproc_blocks': blocks,
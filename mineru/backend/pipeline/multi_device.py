@@ -0,0 +1,154 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import multiprocessing
+import os
+import queue
+
+from loguru import logger
+
+
+def parse_devices(devices):
+    """将"cuda:0,cuda:1"形式的字符串解析为设备列表。"""
+    if devices is None:
+        return []
+    if isinstance(devices, str):
+        devices = devices.split(',')
+    return [device.strip() for device in devices if device.strip()]
+
+
+def get_device_env(device):
+    """
+    计算worker进程需要设置的环境变量。
+    cuda:N/npu:N会通过CUDA_VISIBLE_DEVICES/ASCEND_RT_VISIBLE_DEVICES只暴露对应的卡，
+    使worker内的所有模型和显存分配都落在该卡上。
+    """
+    env = {}
+    if ':' in device:
+        device_type, device_index = device.split(':', 1)
+        if device_type == 'cuda':
+            env['CUDA_VISIBLE_DEVICES'] = device_index
+            env['MINERU_DEVICE_MODE'] = 'cuda'
+            return env
+        elif device_type == 'npu':
+            env['ASCEND_RT_VISIBLE_DEVICES'] = device_index
+            env['MINERU_DEVICE_MODE'] = 'npu'
+            return env
+    env['MINERU_DEVICE_MODE'] = device
+    return env
+
+
+def _device_worker(device, env, task_queue, result_queue, formula_enable, table_enable, analyze_fn=None):
+    # 必须在导入torch之前设置环境变量
+    os.environ.update(env)
+    if analyze_fn is None:
+        from .pipeline_analyze import batch_image_analyze as analyze_fn
+
+    logger.info(f'pipeline worker started on {device}')
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, images_with_extra_info = task
+        try:
+            results = analyze_fn(images_with_extra_info, formula_enable, table_enable)
+            result_queue.put((task_id, results, None))
+        except Exception as e:
+            logger.exception(e)
+            result_queue.put((task_id, None, f'{device}: {type(e).__name__}: {e}'))
+
+
+class MultiDeviceBatchAnalyzer:
+    """
+    多设备数据并行推理，每个设备启动一个worker进程并加载一套独立的模型，
+    worker从共享的任务队列中获取页面批次，结果按提交顺序返回。
+    analyze_fn为worker中代替batch_image_analyze的函数（如测试中不加载模型的替身），需要能在spawn的子进程中导入。
+    """
+
+    def __init__(self, devices, formula_enable=True, table_enable=True, max_in_flight=None, analyze_fn=None):
+        self.devices = parse_devices(devices)
+        if len(self.devices) == 0:
+            raise ValueError('at least one device is required')
+        self.formula_enable = formula_enable
+        self.table_enable = table_enable
+        self.analyze_fn = analyze_fn
+        # 每个设备保留两个批次在途，一个在推理，一个在排队
+        self.max_in_flight = max_in_flight or len(self.devices) * 2
+        self._ctx = multiprocessing.get_context('spawn')
+        self._task_queue = self._ctx.Queue()
+        self._result_queue = self._ctx.Queue()
+        self._workers = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        for device in self.devices:
+            worker = self._ctx.Process(
+                target=_device_worker,
+                args=(device, get_device_env(device), self._task_queue, self._result_queue,
+                      self.formula_enable, self.table_enable, self.analyze_fn),
+                name=f'mineru-worker-{device}',
+                daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f'started {len(self._workers)} pipeline workers on {self.devices}')
+
+    def close(self):
+        for worker in self._workers:
+            if worker.is_alive():
+                self._task_queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout=30)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+
+    def imap(self, tasks):
+        """
+        Args:
+            tasks: 可迭代对象，元素为(tag, images_with_extra_info)，按需惰性读取
+
+        Yields:
+            (tag, results)，与输入顺序一致
+        """
+        tasks = iter(tasks)
+        tags = {}
+        finished = {}
+        next_submit_id = 0
+        next_yield_id = 0
+        exhausted = False
+        while True:
+            while not exhausted and next_submit_id - next_yield_id < self.max_in_flight:
+                task = next(tasks, None)
+                if task is None:
+                    exhausted = True
+                    break
+                tag, images_with_extra_info = task
+                tags[next_submit_id] = tag
+                self._task_queue.put((next_submit_id, images_with_extra_info))
+                next_submit_id += 1
+
+            if next_yield_id == next_submit_id:
+                break
+
+            while next_yield_id not in finished:
+                task_id, results, error = self._get_result()
+                if error is not None:
+                    raise RuntimeError(f'pipeline worker failed: {error}')
+                finished[task_id] = results
+
+            yield tags.pop(next_yield_id), finished.pop(next_yield_id)
+            next_yield_id += 1
+
+    def _get_result(self):
+        while True:
+            try:
+                return self._result_queue.get(timeout=1)
+            except queue.Empty:
+                dead_workers = [worker.name for worker in self._workers if not worker.is_alive()]
+                if dead_workers:
+                    raise RuntimeError(f'pipeline workers exited unexpectedly: {dead_workers}')
@@ -0,0 +1,154 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import atexit
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pypdfium2 as pdfium
+import torch
+from loguru import logger
+from tqdm import tqdm
+
+from mineru.backend.pipeline.model_json_to_middle_json import page_model_info_to_page_blocks, make_page_info_dict
+from mineru.utils.block_sort import get_line_height, prepare_lines_for_model, sort_blocks_by_sorted_lines, \
+    do_predict_batch, ModelSingleton
+from mineru.utils.metrics import get_metrics_collector, stage_timer
+from mineru.utils.pdf_classify import get_page_ocr_enable
+
+# worker进程内缓存最近打开的pdf，同一文档的页面无需重复打开
+_WORKER_DOC_CACHE_SIZE = 2
+_worker_docs = OrderedDict()
+
+_executor = None
+_executor_workers = 0
+
+
+def _get_worker_doc(pdf_path):
+    pdf_doc = _worker_docs.get(pdf_path)
+    if pdf_doc is not None:
+        _worker_docs.move_to_end(pdf_path)
+        return pdf_doc
+    pdf_doc = pdfium.PdfDocument(pdf_path)
+    _worker_docs[pdf_path] = pdf_doc
+    while len(_worker_docs) > _WORKER_DOC_CACHE_SIZE:
+        _, old_doc = _worker_docs.popitem(last=False)
+        old_doc.close()
+    return pdf_doc
+
+
+def _process_page(pdf_path, page_index, page_model_info, image_dict, image_writer, ocr_enable, formula_enabled):
+    """
+    worker进程中构造单页未排序的block，并准备好layoutreader的输入。
+
+    Returns:
+        (page_index, page_blocks, page_line_list, boxes, page_size, elapsed)
+    """
+    start = time.perf_counter()
+    pdf_doc = _get_worker_doc(pdf_path)
+    page = pdf_doc[page_index]
+    try:
+        page_blocks = page_model_info_to_page_blocks(
+            page_model_info, image_dict, page, image_writer, page_index, ocr_enable=ocr_enable, formula_enabled=formula_enabled
+        )
+        if page_blocks is None:
+            page_w, page_h = map(int, page.get_size())
+            return page_index, None, None, None, (page_w, page_h), time.perf_counter() - start
+
+        fix_blocks, footnote_blocks, fix_discarded_blocks, page_w, page_h = page_blocks
+        line_height = get_line_height(fix_blocks)
+        page_line_list, boxes = prepare_lines_for_model(fix_blocks, page_w, page_h, line_height, footnote_blocks)
+        return page_index, page_blocks, page_line_list, boxes, (page_w, page_h), time.perf_counter() - start
+    finally:
+        page.close()
+
+
+def _worker_init():
+    # 页面后处理为cpu密集型，限制每个worker的torch线程数，避免多个worker之间互相争抢
+    torch.set_num_threads(1)
+
+
+def get_page_executor(max_workers):
+    """进程池在多个文档之间复用，worker数量变化时重建"""
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers != max_workers:
+        shutdown_page_executor()
+        _executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_worker_init,
+        )
+        _executor_workers = max_workers
+        logger.info(f'started page process pool with {max_workers} workers')
+    return _executor
+
+
+def shutdown_page_executor():
+    global _executor, _executor_workers
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+        _executor_workers = 0
+
+
+atexit.register(shutdown_page_executor)
+
+
+def pages_to_page_info_parallel(model_list, images_list, pdf_bytes, image_writer, max_workers, ocr_enable=False, formula_enabled=True):
+    """
+    多进程构造页面block，layoutreader排序在主进程中按batch执行。
+
+    image_writer会被传入worker进程，需要支持pickle（如FileBasedDataWriter）。
+    """
+    # worker通过文件路径打开pdf，避免每个页面任务都传输完整的pdf bytes
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
+        f.write(pdf_bytes)
+        pdf_path = f.name
+
+    try:
+        executor = get_page_executor(max_workers)
+        futures = [
+            executor.submit(
+                _process_page, pdf_path, page_index, page_model_info, images_list[page_index],
+                image_writer, get_page_ocr_enable(ocr_enable, page_index), formula_enabled
+            )
+            for page_index, page_model_info in enumerate(model_list)
+        ]
+        page_results = [None] * len(model_list)
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing pages"):
+            result = future.result()
+            page_results[result[0]] = result[:5]
+            collector = get_metrics_collector()
+            if collector is not None:
+                collector.record('page_blocks', result[5], page_idx=result[0])
+    finally:
+        try:
+            os.remove(pdf_path)
+        except OSError as e:
+            logger.warning(f'failed to remove temp pdf {pdf_path}: {e}')
+
+    """layoutreader批量排序"""
+    model_pages = [result for result in page_results if result[3] is not None]
+    if len(model_pages) > 0:
+        model = ModelSingleton().get_model('layoutreader')
+        with torch.no_grad(), stage_timer('layoutreader', items=len(model_pages)):
+            orders_list = do_predict_batch([result[3] for result in model_pages], model)
+        orders_map = {result[0]: orders for result, orders in zip(model_pages, orders_list)}
+    else:
+        orders_map = {}
+
+    pdf_info = []
+    for page_index, page_blocks, page_line_list, _, (page_w, page_h) in page_results:
+        if page_blocks is None:
+            pdf_info.append(make_page_info_dict([], page_index, page_w, page_h, []))
+            continue
+        fix_blocks, footnote_blocks, fix_discarded_blocks, page_w, page_h = page_blocks
+        if page_index in orders_map:
+            sorted_bboxes = [page_line_list[i] for i in orders_map[page_index]]
+        else:
+            sorted_bboxes = None
+        sorted_blocks = sort_blocks_by_sorted_lines(fix_blocks, sorted_bboxes)
+        pdf_info.append(make_page_info_dict(sorted_blocks, page_index, page_w, page_h, fix_discarded_blocks))
+    return pdf_info
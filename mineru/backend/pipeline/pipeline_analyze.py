@@ -1,13 +1,27 @@
 import os
 import time
-from typing import List, Tuple
+from collections import deque
+from functools import partial
+from typing import Callable, List, Tuple
+import numpy as np
 import PIL.Image
 from loguru import logger
 
 from .model_init import MineruPipelineModel
-from mineru.utils.config_reader import get_device
-from ...utils.pdf_classify import classify
-from ...utils.pdf_image_tools import load_images_from_pdf
+from .batch_controller import get_available_memory, get_batch_controller
+from .formula_prune import get_formula_prune_enable
+from .multi_device import MultiDeviceBatchAnalyzer, parse_devices
+from mineru.utils.config_reader import get_device, get_formula_enable
+from ...utils.blank_page import get_blank_page_skip_enable, has_text_objects, is_blank_image, is_empty_pdf_page
+from ...utils.document_context import DocumentContext, ImageDocument
+from ...utils.formula_screen import get_formula_screen_enable, text_page_may_contain_formula
+from ...utils.pdf_classify import PageClassifier, get_ocr_enable
+from ...utils.metrics import get_metrics_collector, stage_timer
+from ...utils.page_image_store import get_page_image_store
+from ...utils.pdf_image_tools import MultiResolutionPage, PageImage, is_multi_resolution_enabled, make_page_render_fn, \
+    pdf_page_to_image, pdf_page_to_multi_resolution_image
+from ...utils.pdf_render_pool import get_render_workers, iter_rendered_pages
+from ...utils.pdf_reader import pdfium_lock
 from ...utils.model_utils import get_vram, clean_memory
 
 
@@ -66,92 +80,342 @@ def custom_model_init(
     return custom_model
 
 
-def doc_analyze(
+class _StreamingDoc:
+    """流式推理过程中单个文档的状态，收集已推理完成的页面，直到最后一页完成。"""
+
+    def __init__(self, pdf_idx, pdf_doc, lang, ocr_enable, classifier=None):
+        self.pdf_idx = pdf_idx
+        self.pdf_doc = pdf_doc
+        self.lang = lang
+        # 整个文档的OCR设置，classifier不为None时逐页判断
+        self.ocr_enable = ocr_enable
+        self.classifier = classifier
+        # page_idx -> 'txt' 或 'ocr'
+        self.page_decisions = {}
+        self.page_count = len(pdf_doc)
+        self.model_list = []
+        self.images_list = []
+        self.blank_pages = 0
+        # 开启公式预筛时文本页根据字符流预判的结果，page_idx -> bool
+        self.formula_hints = {}
+
+    def add_page(self, page_idx, image_dict, layout_dets, is_blank=False):
+        self.blank_pages += is_blank
+        page_info_dict = {'page_no': page_idx, 'width': image_dict.width, 'height': image_dict.height}
+        self.model_list.append({'layout_dets': layout_dets, 'page_info': page_info_dict})
+        self.images_list.append(image_dict)
+
+    def classify_page(self, page_idx):
+        """页面进入推理窗口时才逐页判断是否需要OCR，不需要在推理前扫描整个文档"""
+        if self.classifier is not None and page_idx not in self.page_decisions:
+            self.page_decisions[page_idx] = self.classifier.classify(page_idx)
+
+    def page_ocr_enable(self, page_idx):
+        if self.classifier is None:
+            return self.ocr_enable
+        return self.page_decisions[page_idx] == 'ocr'
+
+    def page_geometry(self, page_idx, image_dict):
+        """(scale, page_w, page_h)，与后处理中的页面缩放比例和页面尺寸一致，公式识别前按后处理规则裁剪公式时使用"""
+        with pdfium_lock:
+            page_w, page_h = map(int, self.pdf_doc.get_page_size(page_idx))
+        return image_dict.scale, page_w, page_h
+
+    def is_complete(self):
+        return len(self.model_list) == self.page_count
+
+    def to_result(self):
+        if self.blank_pages > 0:
+            logger.info(f'skipped model inference on {self.blank_pages} blank pages')
+        ocr_enable = self.ocr_enable
+        if self.classifier is not None:
+            ocr_enable = get_ocr_enable([self.page_decisions[page_idx] for page_idx in range(self.page_count)])
+        return self.pdf_idx, self.model_list, self.images_list, self.pdf_doc, self.lang, ocr_enable
+
+
+def _open_doc(pdf_idx, pdf_bytes, lang, parse_method):
+    """打开单个文档并确定OCR设置，分类、渲染和后处理共用同一个DocumentContext"""
+    if callable(pdf_bytes):
+        pdf_bytes = pdf_bytes()
+        if pdf_bytes is None:
+            return None
+    pdf_doc = pdf_bytes if isinstance(pdf_bytes, (DocumentContext, ImageDocument)) else DocumentContext(pdf_bytes)
+
+    # 确定OCR设置，auto模式下先抽样做文档级判断，可以直接提取文本的文档再逐页判断，混合文档中只有扫描页开启OCR；
+    # 图片没有文本层，始终使用OCR
+    _ocr_enable = False
+    classifier = None
+    if isinstance(pdf_doc, ImageDocument):
+        _ocr_enable = True
+    elif parse_method == 'auto':
+        classifier = PageClassifier(pdf_doc)
+        if classifier.doc_decision == 'ocr':
+            _ocr_enable = True
+            classifier = None
+    elif parse_method == 'ocr':
+        _ocr_enable = True
+
+    return _StreamingDoc(pdf_idx, pdf_doc, lang, _ocr_enable, classifier)
+
+
+def _iter_docs(pdf_bytes_list, lang_list, parse_method):
+    """
+    按输入顺序逐个打开文档。由_iter_page_windows驱动，上一个文档的页面全部进入窗口后才打开和分类下一个文档，
+    同时打开的文档、文本页缓存和分类状态与窗口大小相关，而不是与输入的文档数量相关
+    """
+    for pdf_idx, pdf_bytes in enumerate(pdf_bytes_list):
+        doc = _open_doc(pdf_idx, pdf_bytes, lang_list[pdf_idx], parse_method)
+        if doc is not None:
+            yield doc
+
+
+def _is_blank_page(doc, page_idx, image_dict, page=None):
+    """
+    空白页预筛。pdf页面没有任何对象时直接判定为空白，包含文本对象时不是空白页，其余页面根据渲染结果的墨迹占比判断。
+    page为None（渲染进程池中渲染）时先看位图，只有判定为空白时才打开页面确认没有文本对象
+    """
+    # 多分辨率页面只在检测分辨率的位图上判断，不触发整页渲染
+    screen_image = image_dict.detection_image if isinstance(image_dict, MultiResolutionPage) else image_dict.img_np
+    with stage_timer('blank_page_screen', page_idx=page_idx):
+        if not isinstance(doc.pdf_doc, DocumentContext):
+            return is_blank_image(screen_image)
+        if page is not None:
+            with pdfium_lock:
+                if is_empty_pdf_page(page):
+                    return True
+                if has_text_objects(page):
+                    return False
+            return is_blank_image(screen_image)
+        if not is_blank_image(screen_image):
+            return False
+        with pdfium_lock:
+            page = doc.pdf_doc[page_idx]
+            try:
+                return not has_text_objects(page)
+            finally:
+                page.close()
+
+
+def _text_formula_hint(doc, page_idx):
+    """文本页根据pdfium字符流预判是否包含公式，ocr页面和图片返回None，只根据版面检测结果判断"""
+    if not isinstance(doc.pdf_doc, DocumentContext) or doc.page_ocr_enable(page_idx):
+        return None
+    with stage_timer('formula_screen', page_idx=page_idx):
+        with pdfium_lock:
+            try:
+                return text_page_may_contain_formula(doc.pdf_doc.get_textpage(page_idx))
+            finally:
+                # 文本页留在缓存中，文本提取阶段复用
+                doc.pdf_doc.release_textpage(page_idx, keep_cached=True)
+
+
+def _iter_doc_pages(doc, dpi=200):
+    """
+    按页面顺序渲染单个文档，设置MINERU_RENDER_WORKERS时由渲染进程池并行渲染。
+
+    Yields:
+        (page_idx, image_dict, is_blank)，MINERU_BLANK_PAGE_SKIP为false时is_blank始终为False
+    """
+    skip_blank = get_blank_page_skip_enable()
+    render_workers = get_render_workers()
+    if render_workers > 1 and doc.page_count > 1:
+        pdf_doc = doc.pdf_doc
+        # worker直接打开原始数据并只渲染范围内的页面，不需要重新生成pdf
+        rendered_pages = iter_rendered_pages(
+            pdf_doc.source_bytes, render_workers, dpi=dpi,
+            start_page_id=pdf_doc.start_page_id, end_page_id=pdf_doc.end_page_id
+        )
+        while True:
+            # 只统计等待渲染结果的时间，不包含调用方处理页面的时间
+            with stage_timer('render'):
+                rendered = next(rendered_pages, None)
+            if rendered is None:
+                return
+            source_page_idx, img_np, scale = rendered
+            image_dict = PageImage(img_np, scale)
+            page_idx = source_page_idx - pdf_doc.start_page_id
+            yield page_idx, image_dict, skip_blank and _is_blank_page(doc, page_idx, image_dict)
+    # 多分辨率模式下整页只按检测分辨率渲染，识别区域在裁剪时再从页面渲染，页面保持打开，该页后处理完成后由release()关闭
+    multi_resolution = is_multi_resolution_enabled() and isinstance(doc.pdf_doc, DocumentContext)
+    for page_idx in range(doc.page_count):
+        with pdfium_lock:
+            page = doc.pdf_doc[page_idx]
+        with stage_timer('render', page_idx=page_idx):
+            if multi_resolution:
+                image_dict = pdf_page_to_multi_resolution_image(page, dpi=dpi)
+            else:
+                image_dict = pdf_page_to_image(page, dpi=dpi)
+        is_blank = skip_blank and _is_blank_page(doc, page_idx, image_dict, page)
+        if not isinstance(image_dict, MultiResolutionPage):
+            with pdfium_lock:
+                page.close()
+        yield page_idx, image_dict, is_blank
+
+
+def _iter_page_windows(docs, window_size, dpi=200, opened_docs=None):
+    """
+    按需渲染页面，每次只渲染下一个窗口内的页面，窗口可以跨越文档边界。
+    docs可以是惰性打开文档的迭代器，打开的文档按顺序追加到opened_docs中，调用方据此按输入顺序产出结果（包括没有页面的文档）。
+    设置MINERU_PAGE_IMAGE_BUDGET_MB时，页面位图由PageImageStore管理，超出预算后较早的页面被淘汰，后处理时再重建。
+    """
+    store = get_page_image_store()
+    formula_screen = get_formula_screen_enable()
+    window = []
+    for doc in docs:
+        if opened_docs is not None:
+            opened_docs.append(doc)
+        for page_idx, image_dict, is_blank in _iter_doc_pages(doc, dpi=dpi):
+            doc.classify_page(page_idx)
+            if formula_screen and not is_blank:
+                doc.formula_hints[page_idx] = _text_formula_hint(doc, page_idx)
+            # 多分辨率页面只常驻检测分辨率的位图，不需要管理
+            if store is not None and not isinstance(image_dict, MultiResolutionPage):
+                store.add(image_dict, make_page_render_fn(doc.pdf_doc, page_idx, dpi=dpi))
+            window.append((doc, page_idx, image_dict, is_blank))
+            if len(window) >= window_size:
+                yield window
+                window = []
+    if window:
+        yield window
+
+
+def _infer_windows(windows, formula_enable=True, table_enable=True, devices=None):
+    """
+    逐窗口推理，按顺序产出(window, batch_results)。
+    指定devices时，每个设备启动一个worker进程，多个窗口同时在不同设备上推理。
+    空白页不参与推理，结果直接为空的layout_dets。
+    """
+    # 页面尺寸只在公式裁剪时使用，需要持有pdfium_lock读取
+    prune_enable = get_formula_enable(formula_enable) and get_formula_prune_enable()
+
+    def page_geometry(doc, page_idx, image_dict, local):
+        if not prune_enable:
+            return None
+        # 在当前进程推理时只有检测到公式的页面才读取页面尺寸
+        if local:
+            return partial(doc.page_geometry, page_idx, image_dict)
+        return doc.page_geometry(page_idx, image_dict)
+
+    def to_task(window, local=False):
+        # 在当前进程推理时直接传入页面，多分辨率页面可以按区域渲染；发送到其他进程时传入整页位图
+        return window, [
+            (
+                image_dict.crop_source if local else image_dict.img_np, doc.page_ocr_enable(page_idx), doc.lang,
+                doc.formula_hints.get(page_idx), page_geometry(doc, page_idx, image_dict, local)
+            )
+            for doc, page_idx, image_dict, is_blank in window
+            if not is_blank
+        ]
+
+    def with_blank_pages(window, batch_results):
+        blank_count = sum(1 for _, _, _, is_blank in window if is_blank)
+        if blank_count == 0:
+            return window, batch_results
+        collector = get_metrics_collector()
+        if collector is not None:
+            collector.record('blank_page_skip', 0, items=blank_count)
+        batch_results = iter(batch_results)
+        return window, [[] if is_blank else next(batch_results) for _, _, _, is_blank in window]
+
+    devices = parse_devices(devices)
+    if len(devices) > 0:
+        with MultiDeviceBatchAnalyzer(devices, formula_enable, table_enable) as analyzer:
+            for window, batch_results in analyzer.imap(to_task(window) for window in windows):
+                yield with_blank_pages(window, batch_results)
+    else:
+        for window in windows:
+            _, images_with_extra_info = to_task(window, local=True)
+            yield with_blank_pages(window, batch_image_analyze(images_with_extra_info, formula_enable, table_enable))
+
+
+def doc_analyze_streaming(
         pdf_bytes_list,
         lang_list,
         parse_method: str = 'auto',
         formula_enable=True,
         table_enable=True,
+        devices=None,
 ):
     """
-    适当调大MIN_BATCH_INFERENCE_SIZE可以提高性能，可能会增加显存使用量，
-    可通过环境变量MINERU_MIN_BATCH_INFERENCE_SIZE设置，默认值为100。
-    """
-    min_batch_inference_size = int(os.environ.get('MINERU_MIN_BATCH_INFERENCE_SIZE', 100))
+    流式版本的doc_analyze，每次只渲染MINERU_MIN_BATCH_INFERENCE_SIZE个页面并推理，
+    某个文档的最后一页推理完成后立即产出该文档的结果，峰值内存与窗口大小成正比，而不是与总页数成正比。
+    指定devices（如["cuda:0", "cuda:1"]）时，在多个设备上数据并行推理，结果仍按文档顺序产出。
 
-    # 收集所有页面信息
-    all_pages_info = []  # 存储(dataset_index, page_index, img, ocr, lang, width, height)
-
-    all_image_lists = []
-    all_pdf_docs = []
-    ocr_enabled_list = []
-    for pdf_idx, pdf_bytes in enumerate(pdf_bytes_list):
-        # 确定OCR设置
-        _ocr_enable = False
-        if parse_method == 'auto':
-            if classify(pdf_bytes) == 'ocr':
-                _ocr_enable = True
-        elif parse_method == 'ocr':
-            _ocr_enable = True
+    pdf_bytes_list中的元素可以是pdf字节数据，也可以是已经指定了页面范围的DocumentContext，或图片输入的ImageDocument，
+    还可以是返回上述对象的无参函数（返回None时跳过该文档）。文档在其第一页进入窗口时才打开和分类。
 
-        ocr_enabled_list.append(_ocr_enable)
-        _lang = lang_list[pdf_idx]
+    Yields:
+        tuple: (pdf_idx, model_list, images_list, pdf_doc, lang, ocr_enable)，按输入顺序逐个文档产出，
+        pdf_doc为DocumentContext或ImageDocument。
+        auto模式下混合文档的ocr_enable为按页的bool列表，其余情况为bool
+    """
+    min_batch_inference_size = int(os.environ.get('MINERU_MIN_BATCH_INFERENCE_SIZE', 100))
 
-        # 收集每个数据集中的页面
-        images_list, pdf_doc = load_images_from_pdf(pdf_bytes)
-        all_image_lists.append(images_list)
-        all_pdf_docs.append(pdf_doc)
-        for page_idx in range(len(images_list)):
-            img_dict = images_list[page_idx]
-            all_pages_info.append((
-                pdf_idx, page_idx,
-                img_dict['img_pil'], _ocr_enable, _lang,
-            ))
-
-    # 准备批处理
-    images_with_extra_info = [(info[2], info[3], info[4]) for info in all_pages_info]
-    batch_size = min_batch_inference_size
-    batch_images = [
-        images_with_extra_info[i:i + batch_size]
-        for i in range(0, len(images_with_extra_info), batch_size)
-    ]
-
-    # 执行批处理
-    results = []
+    # 已打开、尚未产出的文档，按输入顺序排列
+    opened_docs = deque()
+    yielded_docs = 0
     processed_images_count = 0
-    for index, batch_image in enumerate(batch_images):
-        processed_images_count += len(batch_image)
+    docs = _iter_docs(pdf_bytes_list, lang_list, parse_method)
+    windows = _iter_page_windows(docs, min_batch_inference_size, opened_docs=opened_docs)
+    for index, (window, batch_results) in enumerate(_infer_windows(windows, formula_enable, table_enable, devices)):
+        processed_images_count += len(window)
+
+        for (doc, page_idx, image_dict, is_blank), result in zip(window, batch_results):
+            doc.add_page(page_idx, image_dict, result, is_blank)
+        del window, batch_results
+
+        # 按输入顺序产出已完成的文档，产出后释放对该文档的引用
+        while opened_docs and opened_docs[0].is_complete():
+            yielded_docs += 1
+            yield opened_docs.popleft().to_result()
         logger.info(
-            f'Batch {index + 1}/{len(batch_images)}: '
-            f'{processed_images_count} pages/{len(images_with_extra_info)} pages'
+            f'Batch {index + 1}: {processed_images_count} pages, '
+            f'{yielded_docs}/{len(pdf_bytes_list)} docs'
         )
-        batch_results = batch_image_analyze(batch_image, formula_enable, table_enable)
-        results.extend(batch_results)
-
-    # 构建返回结果
-    infer_results = []
-
-    for _ in range(len(pdf_bytes_list)):
-        infer_results.append([])
 
-    for i, page_info in enumerate(all_pages_info):
-        pdf_idx, page_idx, pil_img, _, _ = page_info
-        result = results[i]
+    # 剩余的文档（如空文档）
+    while opened_docs:
+        yield opened_docs.popleft().to_result()
 
-        page_info_dict = {'page_no': page_idx, 'width': pil_img.width, 'height': pil_img.height}
-        page_dict = {'layout_dets': result, 'page_info': page_info_dict}
 
-        infer_results[pdf_idx].append(page_dict)
+def doc_analyze(
+        pdf_bytes_list,
+        lang_list,
+        parse_method: str = 'auto',
+        formula_enable=True,
+        table_enable=True,
+        devices=None,
+):
+    """
+    适当调大MIN_BATCH_INFERENCE_SIZE可以提高性能，可能会增加显存使用量，
+    可通过环境变量MINERU_MIN_BATCH_INFERENCE_SIZE设置，默认值为100。
+    该函数会一次性返回所有文档的结果，大批量输入时建议使用doc_analyze_streaming。
+    """
+    infer_results = []
+    all_image_lists = []
+    all_pdf_docs = []
+    ocr_enabled_list = []
+    for _, model_list, images_list, pdf_doc, _, _ocr_enable in doc_analyze_streaming(
+            pdf_bytes_list, lang_list, parse_method, formula_enable, table_enable, devices
+    ):
+        infer_results.append(model_list)
+        all_image_lists.append(images_list)
+        all_pdf_docs.append(pdf_doc)
+        ocr_enabled_list.append(_ocr_enable)
 
     return infer_results, all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list
 
 
 def batch_image_analyze(
-        images_with_extra_info: List[Tuple[PIL.Image.Image, bool, str]],
+        images_with_extra_info: List[Tuple[np.ndarray | PIL.Image.Image, bool, str, bool | None, tuple | Callable | None]],
         formula_enable=True,
         table_enable=True):
     # os.environ['CUDA_VISIBLE_DEVICES'] = str(idx)
 
+    # 整个窗口都是空白页时不需要加载模型
+    if len(images_with_extra_info) == 0:
+        return []
+
     from .batch_analyze import BatchAnalyze
 
     model_manager = ModelSingleton()
@@ -171,7 +435,12 @@ def batch_image_analyze(
             ) from e
 
     if str(device).startswith('npu') or str(device).startswith('cuda'):
-        vram = get_vram(device)
+        # 优先使用当前可用显存计算初始batch大小，与其他进程共享显卡时不会按总显存过度分配
+        vram = get_available_memory(device)
+        if vram is not None:
+            vram = vram / (1024 ** 3)
+        else:
+            vram = get_vram(device)
         if vram is not None:
             gpu_memory = int(os.getenv('MINERU_VIRTUAL_VRAM_SIZE', round(vram)))
             if gpu_memory >= 16:
@@ -190,7 +459,11 @@ def batch_image_analyze(
             batch_ratio = 1
             logger.info(f'Could not determine GPU memory, using default batch_ratio: {batch_ratio}')
 
-    batch_model = BatchAnalyze(model_manager, batch_ratio, formula_enable, table_enable)
+    batch_controller = get_batch_controller(device)
+    batch_controller.new_round()
+    batch_model = BatchAnalyze(
+        model_manager, batch_ratio, formula_enable, table_enable, batch_controller=batch_controller
+    )
     results = batch_model(images_with_extra_info)
 
     clean_memory(get_device())
@@ -0,0 +1,223 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from loguru import logger
+
+from .pipeline_analyze import _iter_docs, _iter_page_windows, _infer_windows
+
+_SENTINEL = object()
+
+
+class _StageAborted(Exception):
+    pass
+
+
+class StageStats:
+    """单个阶段的占用统计：处理耗时、等待上游耗时、等待下游耗时和处理的页数。"""
+
+    def __init__(self, name):
+        self.name = name
+        self.busy_time = 0.0
+        self.wait_input_time = 0.0
+        self.wait_output_time = 0.0
+        self.items = 0
+
+    def to_dict(self, wall_time):
+        return {
+            'busy_time': round(self.busy_time, 3),
+            'wait_input_time': round(self.wait_input_time, 3),
+            'wait_output_time': round(self.wait_output_time, 3),
+            'pages': self.items,
+            'occupancy': round(self.busy_time / wall_time, 3) if wall_time > 0 else 0.0,
+        }
+
+
+class PipelineStageExecutor:
+    """
+    渲染 / 推理 / 后处理三阶段流水线执行器。
+
+    渲染线程按窗口渲染页面，推理在调用线程中执行batch_image_analyze，后处理线程组装文档并调用postprocess_fn，
+    阶段之间使用有界队列连接，因此第N个窗口推理时，第N+1个窗口在渲染，已完成的文档在后处理。
+    指定devices时推理阶段在多个设备上数据并行执行。
+    队列长度可通过环境变量MINERU_PIPELINE_QUEUE_SIZE设置，默认值为2。
+    """
+
+    STAGES = ('render', 'infer', 'postprocess')
+
+    def __init__(self, formula_enable=True, table_enable=True, queue_size=None, devices=None):
+        self.formula_enable = formula_enable
+        self.table_enable = table_enable
+        self.devices = devices
+        if queue_size is None:
+            queue_size = int(os.environ.get('MINERU_PIPELINE_QUEUE_SIZE', 2))
+        self.queue_size = max(1, queue_size)
+        self.stats = {name: StageStats(name) for name in self.STAGES}
+        self._stop = threading.Event()
+        self._errors = []
+
+    def run(self, pdf_bytes_list, lang_list, postprocess_fn, parse_method='auto'):
+        """
+        Args:
+            postprocess_fn: 每个文档推理完成后调用，参数为(pdf_idx, model_list, images_list, pdf_doc, lang, ocr_enable)，
+                按输入顺序在后处理线程中调用
+
+        Returns:
+            dict: 各阶段的占用统计
+        """
+        window_size = int(os.environ.get('MINERU_MIN_BATCH_INFERENCE_SIZE', 100))
+        # 文档由渲染线程按顺序惰性打开并追加到opened_docs，后处理线程按相同顺序取出
+        docs = _iter_docs(pdf_bytes_list, lang_list, parse_method)
+        opened_docs = deque()
+
+        render_queue = queue.Queue(maxsize=self.queue_size)
+        infer_queue = queue.Queue(maxsize=self.queue_size)
+
+        start_time = time.time()
+        render_thread = threading.Thread(
+            target=self._render_stage, args=(docs, opened_docs, window_size, render_queue), name='mineru-render',
+            daemon=True
+        )
+        postprocess_thread = threading.Thread(
+            target=self._postprocess_stage, args=(opened_docs, infer_queue, postprocess_fn), name='mineru-postprocess',
+            daemon=True
+        )
+        render_thread.start()
+        postprocess_thread.start()
+        try:
+            self._infer_stage(render_queue, infer_queue)
+        except _StageAborted:
+            pass
+        except Exception as e:
+            self._fail(e)
+        finally:
+            render_thread.join()
+            postprocess_thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        report = self.report(time.time() - start_time)
+        logger.info(
+            'pipeline stage occupancy: ' + ', '.join(
+                f"{name} {stats['occupancy']:.0%}" for name, stats in report['stages'].items()
+            ) + f", wall time: {report['wall_time']}s, bottleneck: {report['bottleneck']}"
+        )
+        return report
+
+    def report(self, wall_time):
+        stages = {name: self.stats[name].to_dict(wall_time) for name in self.STAGES}
+        bottleneck = max(self.STAGES, key=lambda name: self.stats[name].busy_time)
+        return {'wall_time': round(wall_time, 3), 'bottleneck': bottleneck, 'stages': stages}
+
+    def _fail(self, e):
+        self._errors.append(e)
+        self._stop.set()
+
+    def _put(self, q, item, stats):
+        wait_start = time.time()
+        while True:
+            if self._stop.is_set():
+                raise _StageAborted()
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        stats.wait_output_time += time.time() - wait_start
+
+    def _get(self, q, stats):
+        wait_start = time.time()
+        while True:
+            if self._stop.is_set():
+                raise _StageAborted()
+            try:
+                item = q.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        stats.wait_input_time += time.time() - wait_start
+        return item
+
+    def _render_stage(self, docs, opened_docs, window_size, render_queue):
+        stats = self.stats['render']
+        try:
+            windows = _iter_page_windows(docs, window_size, opened_docs=opened_docs)
+            while True:
+                busy_start = time.time()
+                window = next(windows, None)
+                stats.busy_time += time.time() - busy_start
+                if window is None:
+                    break
+                stats.items += len(window)
+                self._put(render_queue, window, stats)
+            self._put(render_queue, _SENTINEL, stats)
+        except _StageAborted:
+            pass
+        except Exception as e:
+            self._fail(e)
+
+    def _infer_stage(self, render_queue, infer_queue):
+        stats = self.stats['infer']
+
+        def windows_from_queue():
+            while True:
+                window = self._get(render_queue, stats)
+                if window is _SENTINEL:
+                    return
+                yield window
+
+        results = _infer_windows(windows_from_queue(), self.formula_enable, self.table_enable, self.devices)
+        index = 0
+        while True:
+            busy_start = time.time()
+            wait_input_before = stats.wait_input_time
+            item = next(results, None)
+            # 等待渲染队列的时间不计入推理耗时
+            stats.busy_time += time.time() - busy_start - (stats.wait_input_time - wait_input_before)
+            if item is None:
+                break
+            window, _ = item
+            index += 1
+            stats.items += len(window)
+            logger.info(f'Batch {index}: {stats.items} pages')
+
+            self._put(infer_queue, item, stats)
+            del item, window
+        self._put(infer_queue, _SENTINEL, stats)
+
+    def _postprocess_stage(self, opened_docs, infer_queue, postprocess_fn):
+        stats = self.stats['postprocess']
+        try:
+            while True:
+                item = self._get(infer_queue, stats)
+                if item is _SENTINEL:
+                    break
+                window, batch_results = item
+                del item
+
+                busy_start = time.time()
+                for (doc, page_idx, image_dict, is_blank), result in zip(window, batch_results):
+                    doc.add_page(page_idx, image_dict, result, is_blank)
+                del window, batch_results
+
+                # 文档的页面全部进入窗口前不会打开下一个文档，队首未完成时后面的文档也不会完成
+                while opened_docs and opened_docs[0].is_complete():
+                    doc = opened_docs.popleft()
+                    postprocess_fn(*doc.to_result())
+                    stats.items += doc.page_count
+                    del doc
+                stats.busy_time += time.time() - busy_start
+
+            # 剩余的文档（如空文档），渲染线程发出结束标记前已经打开了所有文档
+            busy_start = time.time()
+            while opened_docs:
+                postprocess_fn(*opened_docs.popleft().to_result())
+            stats.busy_time += time.time() - busy_start
+        except _StageAborted:
+            pass
+        except Exception as e:
+            self._fail(e)
@@ -2,7 +2,6 @@ import re
 
 from mineru.utils.cut_image import cut_image_and_table
 from mineru.utils.enum_class import BlockType, ContentType
-from mineru.utils.hash_utils import str_md5
 from mineru.backend.vlm.vlm_magic_model import MagicModel
 from mineru.version import __version__
 
@@ -15,8 +14,8 @@ def token_to_page_info(token, image_dict, page, image_writer, page_index) -> dic
     # 提取所有完整块，每个块从<|box_start|>开始到<|md_end|>或<|im_end|>结束
 
     scale = image_dict["scale"]
-    page_pil_img = image_dict["img_pil"]
-    page_img_md5 = str_md5(image_dict["img_base64"])
+    page_img = image_dict["img_np"]
+    page_img_md5 = image_dict.fingerprint
     width, height = map(int, page.get_size())
 
     magic_model = MagicModel(token, width, height)
@@ -30,7 +29,7 @@ def token_to_page_info(token, image_dict, page, image_writer, page_index) -> dic
     # 对image/table/interline_equation的span截图
     for span in all_spans:
         if span["type"] in [ContentType.IMAGE, ContentType.TABLE, ContentType.INTERLINE_EQUATION]:
-            span = cut_image_and_table(span, page_pil_img, page_img_md5, page_index, image_writer, scale=scale)
+            span = cut_image_and_table(span, page_img, page_img_md5, page_index, image_writer, scale=scale)
 
     page_blocks = []
     page_blocks.extend([*image_blocks, *table_blocks, *title_blocks, *text_blocks, *interline_equation_blocks])
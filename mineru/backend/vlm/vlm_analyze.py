@@ -4,6 +4,7 @@ import time
 from loguru import logger
 
 from ...data.data_reader_writer import DataWriter
+from mineru.utils.metrics import stage_timer
 from mineru.utils.pdf_image_tools import load_images_from_pdf
 from .base_predictor import BasePredictor
 from .predictor import get_predictor
@@ -49,18 +50,15 @@ def doc_analyze(
     if predictor is None:
         predictor = ModelSingleton().get_model(backend, model_path, server_url)
 
-    # load_images_start = time.time()
-    images_list, pdf_doc = load_images_from_pdf(pdf_bytes)
-    images_base64_list = [image_dict["img_base64"] for image_dict in images_list]
-    # load_images_time = round(time.time() - load_images_start, 2)
-    # logger.info(f"load images cost: {load_images_time}, speed: {round(len(images_base64_list)/load_images_time, 3)} images/s")
+    with stage_timer('load_images'):
+        images_list, pdf_doc = load_images_from_pdf(pdf_bytes)
+        images_base64_list = [image_dict["img_base64"] for image_dict in images_list]
 
-    # infer_start = time.time()
-    results = predictor.batch_predict(images=images_base64_list)
-    # infer_time = round(time.time() - infer_start, 2)
-    # logger.info(f"infer finished, cost: {infer_time}, speed: {round(len(results)/infer_time, 3)} page/s")
+    with stage_timer('vlm_infer', items=len(images_base64_list)):
+        results = predictor.batch_predict(images=images_base64_list)
 
-    middle_json = result_to_middle_json(results, images_list, pdf_doc, image_writer)
+    with stage_timer('vlm_middle_json', items=len(results)):
+        middle_json = result_to_middle_json(results, images_list, pdf_doc, image_writer)
     return middle_json, results
 
 
@@ -82,8 +80,10 @@ async def aio_doc_analyze(
     logger.info(f"load images cost: {load_images_time}, speed: {round(len(images_base64_list)/load_images_time, 3)} images/s")
 
     infer_start = time.time()
-    results = await predictor.aio_batch_predict(images=images_base64_list)
+    with stage_timer('vlm_infer', items=len(images_base64_list)):
+        results = await predictor.aio_batch_predict(images=images_base64_list)
     infer_time = round(time.time() - infer_start, 2)
     logger.info(f"infer finished, cost: {infer_time}, speed: {round(len(results)/infer_time, 3)} page/s")
-    middle_json = result_to_middle_json(results, images_list, pdf_doc, image_writer)
+    with stage_timer('vlm_middle_json', items=len(results)):
+        middle_json = result_to_middle_json(results, images_list, pdf_doc, image_writer)
     return middle_json
@@ -5,9 +5,11 @@ from pathlib import Path
 from loguru import logger
 
 from mineru.utils.config_reader import get_device
-from mineru.utils.model_utils import get_vram
+from mineru.utils.hash_utils import file_md5
 from ..version import __version__
-from .common import do_parse, read_fn, pdf_suffixes, image_suffixes
+from .common import do_parse
+from .ingest import iter_input_paths, iter_named_paths, iter_work_units, prefetch_work_units
+from .run_manifest import RunManifest
 
 @click.command()
 @click.version_option(__version__,
@@ -19,8 +21,37 @@ from .common import do_parse, read_fn, pdf_suffixes, image_suffixes
     '--path',
     'input_path',
     type=click.Path(exists=True),
-    required=True,
+    required=False,
     help='local filepath or directory. support pdf, png, jpg, jpeg files',
+    default=None,
+)
+@click.option(
+    '--from-file',
+    'from_file',
+    type=click.Path(exists=True, dir_okay=False),
+    help='A text file listing the files to parse, one path per line. Relative paths are resolved against the list file. Can be used instead of or together with --path.',
+    default=None,
+)
+@click.option(
+    '--glob',
+    'glob_pattern',
+    type=str,
+    help='Glob pattern used to match files when --path is a directory, e.g. "**/*.pdf" to search subdirectories recursively. Default is "*".',
+    default='*',
+)
+@click.option(
+    '--unit-pages',
+    'unit_pages',
+    type=int,
+    help='Files are read lazily and parsed in work units of at most this many pages. Default is 1000.',
+    default=1000,
+)
+@click.option(
+    '--max-inflight',
+    'max_inflight',
+    type=int,
+    help='Maximum number of work units read ahead while the current unit is being parsed. Default is 2.',
+    default=2,
 )
 @click.option(
     '-o',
@@ -118,6 +149,13 @@ from .common import do_parse, read_fn, pdf_suffixes, image_suffixes
     help='Device mode for model inference, e.g., "cpu", "cuda", "cuda:0", "npu", "npu:0", "mps". Adapted only for the case where the backend is set to "pipeline". ',
     default=None,
 )
+@click.option(
+    '--devices',
+    'devices',
+    type=str,
+    help='Comma-separated devices for data-parallel inference, e.g., "cuda:0,cuda:1". One worker process with its own models is started per device. Adapted only for the case where the backend is set to "pipeline". ',
+    default=None,
+)
 @click.option(
     '--vram',
     'virtual_vram',
@@ -134,9 +172,23 @@ from .common import do_parse, read_fn, pdf_suffixes, image_suffixes
     """,
     default='huggingface',
 )
+@click.option(
+    '--resume',
+    'resume',
+    is_flag=True,
+    help="""
+    Keep a manifest (mineru_manifest.jsonl) in the output directory and skip documents that were already parsed
+    with the same input and options. Each document's results are written to a temp dir and renamed into place
+    when complete, so an interrupted run can be restarted without re-parsing finished documents.
+    """,
+    default=False,
+)
+
 
+def main(input_path, from_file, glob_pattern, unit_pages, max_inflight, output_dir, method, backend, lang, server_url, start_page_id, end_page_id, formula_enable, table_enable, device_mode, devices, virtual_vram, model_source, resume):
 
-def main(input_path, output_dir, method, backend, lang, server_url, start_page_id, end_page_id, formula_enable, table_enable, device_mode, virtual_vram, model_source):
+    if input_path is None and from_file is None:
+        raise click.UsageError("either -p/--path or --from-file is required")
 
     if not backend.endswith('-client'):
         def get_device_mode() -> str:
@@ -147,28 +199,46 @@ def main(input_path, output_dir, method, backend, lang, server_url, start_page_i
         if os.getenv('MINERU_DEVICE_MODE', None) is None:
             os.environ['MINERU_DEVICE_MODE'] = get_device_mode()
 
-        def get_virtual_vram_size() -> int:
-            if virtual_vram is not None:
-                return virtual_vram
-            if get_device_mode().startswith("cuda") or get_device_mode().startswith("npu"):
-                return round(get_vram(get_device_mode()))
-            return 1
-        if os.getenv('MINERU_VIRTUAL_VRAM_SIZE', None) is None:
-            os.environ['MINERU_VIRTUAL_VRAM_SIZE']= str(get_virtual_vram_size())
+        # 只在用户通过--vram指定时设置，未指定时pipeline按当前可用显存计算batch大小
+        if virtual_vram is not None and os.getenv('MINERU_VIRTUAL_VRAM_SIZE', None) is None:
+            os.environ['MINERU_VIRTUAL_VRAM_SIZE'] = str(virtual_vram)
 
         if os.getenv('MINERU_MODEL_SOURCE', None) is None:
             os.environ['MINERU_MODEL_SOURCE'] = model_source
 
     os.makedirs(output_dir, exist_ok=True)
 
-    def parse_doc(path_list: list[Path]):
+    manifest = None
+    if resume:
+        manifest = RunManifest(output_dir, config={
+            'backend': backend,
+            'method': method,
+            'lang': lang,
+            'formula_enable': formula_enable,
+            'table_enable': table_enable,
+            'start_page_id': start_page_id,
+            'end_page_id': end_page_id,
+        })
+
+    skipped_count = 0
+
+    def filter_done_docs(named_paths):
+        """跳过清单中已完成的文档，其余文档记录为pending"""
+        nonlocal skipped_count
+        for path, file_name in named_paths:
+            input_hash = file_md5(path)
+            if manifest.is_done(file_name, input_hash):
+                skipped_count += 1
+                continue
+            manifest.add_pending(file_name, path, input_hash)
+            yield path, file_name
+
+    def parse_doc(docs):
+        file_name_list = []
         try:
-            file_name_list = []
             pdf_bytes_list = []
             lang_list = []
-            for path in path_list:
-                file_name = str(Path(path).stem)
-                pdf_bytes = read_fn(path)
+            for path, file_name, pdf_bytes in docs:
                 file_name_list.append(file_name)
                 pdf_bytes_list.append(pdf_bytes)
                 lang_list.append(lang)
@@ -183,19 +253,31 @@ def main(input_path, output_dir, method, backend, lang, server_url, start_page_i
                 p_table_enable=table_enable,
                 server_url=server_url,
                 start_page_id=start_page_id,
-                end_page_id=end_page_id
+                end_page_id=end_page_id,
+                devices=devices,
+                manifest=manifest,
             )
         except Exception as e:
             logger.exception(e)
+            if manifest is not None:
+                # 推理等批次级的错误会中断整个工作单元，未完成的文档全部记为失败，下次运行时重新解析
+                manifest.mark_unfinished_failed(file_name_list, e)
 
-    if os.path.isdir(input_path):
-        doc_path_list = []
-        for doc_path in Path(input_path).glob('*'):
-            if doc_path.suffix in pdf_suffixes + image_suffixes:
-                doc_path_list.append(doc_path)
-        parse_doc(doc_path_list)
-    else:
-        parse_doc([Path(input_path)])
+    # 逐个读取文件并按页数分组，后台线程预读有限数量的工作单元，内存占用不随文件数量增长
+    named_paths = iter_named_paths(iter_input_paths(input_path, glob_pattern, from_file))
+    if manifest is not None:
+        named_paths = filter_done_docs(named_paths)
+    # 无法打开或读取的文件记为失败，不会一直停留在pending状态
+    on_skip = manifest.mark_failed if manifest is not None else None
+    doc_count = 0
+    units = iter_work_units(named_paths, unit_pages, on_skip=on_skip)
+    for docs in prefetch_work_units(units, max_inflight, on_skip=on_skip):
+        doc_count += len(docs)
+        parse_doc(docs)
+    if manifest is not None:
+        manifest.close()
+    if skipped_count > 0:
+        logger.info(f"resume: skipped {skipped_count} completed documents, parsed {doc_count} documents")
 
 if __name__ == '__main__':
     main()
@@ -1,16 +1,18 @@
 # Copyright (c) Opendatalab. All rights reserved.
-import io
 import json
 import os
 import copy
+from contextlib import contextmanager
+from functools import partial
 from pathlib import Path
 
-import pypdfium2 as pdfium
 from loguru import logger
 
 from mineru.data.data_reader_writer import FileBasedDataWriter
+from mineru.utils.document_context import DocumentContext, ImageDocument
 from mineru.utils.draw_bbox import draw_layout_bbox, draw_span_bbox
 from mineru.utils.enum_class import MakeMode
+from mineru.utils.metrics import collect_metrics, get_metrics_collector
 from mineru.utils.pdf_image_tools import images_bytes_to_pdf_bytes
 from mineru.backend.vlm.vlm_middle_json_mkcontent import union_make as vlm_union_make
 from mineru.backend.vlm.vlm_analyze import doc_analyze as vlm_doc_analyze
@@ -32,6 +34,18 @@ def read_fn(path):
             raise Exception(f"Unknown file suffix: {path.suffix}")
 
 
+def read_doc(path):
+    """
+    与read_fn相同，但png/jpg输入返回ImageDocument，解析时直接解码图片（最长边超过2560像素时缩小），不转换为pdf
+    """
+    if not isinstance(path, Path):
+        path = Path(path)
+    if path.suffix in image_suffixes:
+        with open(str(path), "rb") as input_file:
+            return ImageDocument(input_file.read())
+    return read_fn(path)
+
+
 def prepare_env(output_dir, pdf_file_name, parse_method):
     local_md_dir = str(os.path.join(output_dir, pdf_file_name, parse_method))
     local_image_dir = os.path.join(str(local_md_dir), "images")
@@ -40,40 +54,64 @@ def prepare_env(output_dir, pdf_file_name, parse_method):
     return local_image_dir, local_md_dir
 
 
-def convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, start_page_id=0, end_page_id=None):
-
-    # 从字节数据加载PDF
-    pdf = pdfium.PdfDocument(pdf_bytes)
+@contextmanager
+def doc_output_env(output_dir, pdf_file_name, parse_method, manifest=None):
+    """
+    准备单个文档的输出目录，返回(local_image_dir, local_md_dir)。
+    传入manifest时结果先写入临时目录，with块正常结束后原子地重命名到最终目录；
+    单个文档出错时记录到manifest并跳过，不影响其他文档。
+    """
+    if manifest is None:
+        yield prepare_env(output_dir, pdf_file_name, parse_method)
+        return
 
-    # 确定结束页
-    end_page_id = end_page_id if end_page_id is not None and end_page_id >= 0 else len(pdf) - 1
-    if end_page_id > len(pdf) - 1:
-        logger.warning("end_page_id is out of range, use pdf_docs length")
-        end_page_id = len(pdf) - 1
+    staging_dir = manifest.make_staging_dir(pdf_file_name)
+    try:
+        yield prepare_env(staging_dir, pdf_file_name, parse_method)
+    except Exception as e:
+        logger.exception(f"failed to parse {pdf_file_name}: {e}")
+        manifest.discard(staging_dir)
+        manifest.mark_failed(pdf_file_name, e)
+        return
+    manifest.commit(pdf_file_name, staging_dir, os.path.join(pdf_file_name, parse_method))
 
-    # 创建一个新的PDF文档
-    output_pdf = pdfium.PdfDocument.new()
 
-    # 选择要导入的页面索引
-    page_indices = list(range(start_page_id, end_page_id + 1))
+def open_doc(pdf_file_name, pdf_bytes, start_page_id=0, end_page_id=None, manifest=None):
+    """打开单个文档，失败时记录到manifest并返回None，由调用方跳过该文档"""
+    if isinstance(pdf_bytes, ImageDocument):
+        return pdf_bytes
+    try:
+        return DocumentContext(pdf_bytes, start_page_id, end_page_id)
+    except Exception as e:
+        logger.exception(f"failed to open {pdf_file_name}: {e}")
+        if manifest is not None:
+            manifest.mark_failed(pdf_file_name, e)
+        return None
 
-    # 从原PDF导入页面到新PDF
-    output_pdf.import_pages(pdf, page_indices)
 
-    # 将新PDF保存到内存缓冲区
-    output_buffer = io.BytesIO()
-    output_pdf.save(output_buffer)
+def convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, start_page_id=0, end_page_id=None):
+    """生成页面范围对应的pdf，范围覆盖整个文档时直接返回原始数据。解析流程中请直接使用DocumentContext，不需要重新生成pdf"""
+    with DocumentContext(pdf_bytes, start_page_id, end_page_id) as pdf_doc:
+        return pdf_doc.pdf_bytes
 
-    # 获取字节数据
-    output_bytes = output_buffer.getvalue()
 
-    pdf.close()  # 关闭原PDF文档以释放资源
-    output_pdf.close()  # 关闭新PDF文档以释放资源
+def do_parse(output_dir, *args, **kwargs):
+    """
+    参数同_do_parse。
+    环境变量MINERU_METRICS_DUMP为true时统计各阶段耗时，并在output_dir下写出metrics.json。
+    """
+    if os.getenv('MINERU_METRICS_DUMP', 'false').lower() != 'true':
+        return _do_parse(output_dir, *args, **kwargs)
 
-    return output_bytes
+    with collect_metrics(get_metrics_collector()) as collector:
+        _do_parse(output_dir, *args, **kwargs)
+    os.makedirs(output_dir, exist_ok=True)
+    metrics_path = os.path.join(output_dir, 'metrics.json')
+    collector.dump(metrics_path)
+    logger.info(f"metrics saved to {metrics_path}")
 
 
-def do_parse(
+def _do_parse(
     output_dir,
     pdf_file_names: list[str],
     pdf_bytes_list: list[bytes],
@@ -93,77 +131,92 @@ def do_parse(
     f_make_md_mode=MakeMode.MM_MD,
     start_page_id=0,
     end_page_id=None,
+    devices=None,
+    manifest=None,
 ):
 
+    if manifest is not None:
+        manifest.mark_running(pdf_file_names)
+
     if backend == "pipeline":
 
         from mineru.backend.pipeline.pipeline_middle_json_mkcontent import union_make as pipeline_union_make
         from mineru.backend.pipeline.model_json_to_middle_json import result_to_middle_json as pipeline_result_to_middle_json
-        from mineru.backend.pipeline.pipeline_analyze import doc_analyze as pipeline_doc_analyze
-
-        for idx, pdf_bytes in enumerate(pdf_bytes_list):
-            new_pdf_bytes = convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, start_page_id, end_page_id)
-            pdf_bytes_list[idx] = new_pdf_bytes
+        from mineru.backend.pipeline.pipeline_analyze import doc_analyze_streaming as pipeline_doc_analyze_streaming
 
-        infer_results, all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list = pipeline_doc_analyze(pdf_bytes_list, p_lang_list, parse_method=parse_method, formula_enable=p_formula_enable,table_enable=p_table_enable)
+        # 页面范围只作为DocumentContext上的视图，不重新生成pdf；图片输入只有一页，不需要处理页面范围
+        # 文档在其页面进入推理窗口时才打开，无法打开的文档记录失败后跳过，不影响同一批次中的其他文档
+        pdf_bytes_list = [
+            partial(open_doc, pdf_file_name, pdf_bytes, start_page_id, end_page_id, manifest)
+            for pdf_file_name, pdf_bytes in zip(pdf_file_names, pdf_bytes_list)
+        ]
 
-        for idx, model_list in enumerate(infer_results):
+        def process_pipeline_doc(idx, model_list, images_list, pdf_doc, _lang, _ocr_enable):
             model_json = copy.deepcopy(model_list)
             pdf_file_name = pdf_file_names[idx]
-            local_image_dir, local_md_dir = prepare_env(output_dir, pdf_file_name, parse_method)
-            image_writer, md_writer = FileBasedDataWriter(local_image_dir), FileBasedDataWriter(local_md_dir)
-
-            images_list = all_image_lists[idx]
-            pdf_doc = all_pdf_docs[idx]
-            _lang = lang_list[idx]
-            _ocr_enable = ocr_enabled_list[idx]
-
-            middle_json = pipeline_result_to_middle_json(model_list, images_list, pdf_doc, image_writer, _lang, _ocr_enable, p_formula_enable)
-
-            pdf_info = middle_json["pdf_info"]
-
-            pdf_bytes = pdf_bytes_list[idx]
-            if f_draw_layout_bbox:
-                draw_layout_bbox(pdf_info, pdf_bytes, local_md_dir, f"{pdf_file_name}_layout.pdf")
-
-            if f_draw_span_bbox:
-                draw_span_bbox(pdf_info, pdf_bytes, local_md_dir, f"{pdf_file_name}_span.pdf")
-
-            if f_dump_orig_pdf:
-                md_writer.write(
-                    f"{pdf_file_name}_origin.pdf",
-                    pdf_bytes,
-                )
+            with doc_output_env(output_dir, pdf_file_name, parse_method, manifest) as (local_image_dir, local_md_dir):
+                image_writer, md_writer = FileBasedDataWriter(local_image_dir), FileBasedDataWriter(local_md_dir)
 
-            if f_dump_md:
-                image_dir = str(os.path.basename(local_image_dir))
-                md_content_str = pipeline_union_make(pdf_info, f_make_md_mode, image_dir)
-                md_writer.write_string(
-                    f"{pdf_file_name}.md",
-                    md_content_str,
+                middle_json = pipeline_result_to_middle_json(
+                    model_list, images_list, pdf_doc, image_writer, _lang, _ocr_enable, p_formula_enable
                 )
 
-            if f_dump_content_list:
-                image_dir = str(os.path.basename(local_image_dir))
-                content_list = pipeline_union_make(pdf_info, MakeMode.CONTENT_LIST, image_dir)
-                md_writer.write_string(
-                    f"{pdf_file_name}_content_list.json",
-                    json.dumps(content_list, ensure_ascii=False, indent=4),
-                )
-
-            if f_dump_middle_json:
-                md_writer.write_string(
-                    f"{pdf_file_name}_middle.json",
-                    json.dumps(middle_json, ensure_ascii=False, indent=4),
-                )
-
-            if f_dump_model_output:
-                md_writer.write_string(
-                    f"{pdf_file_name}_model.json",
-                    json.dumps(model_json, ensure_ascii=False, indent=4),
-                )
-
-            logger.info(f"local output dir is {local_md_dir}")
+                pdf_info = middle_json["pdf_info"]
+
+                if f_draw_layout_bbox:
+                    draw_layout_bbox(pdf_info, pdf_doc, local_md_dir, f"{pdf_file_name}_layout.pdf")
+
+                if f_draw_span_bbox:
+                    draw_span_bbox(pdf_info, pdf_doc, local_md_dir, f"{pdf_file_name}_span.pdf")
+
+                if f_dump_orig_pdf:
+                    md_writer.write(
+                        f"{pdf_file_name}_origin.pdf",
+                        pdf_doc.pdf_bytes,
+                    )
+
+                if f_dump_md:
+                    image_dir = str(os.path.basename(local_image_dir))
+                    md_content_str = pipeline_union_make(pdf_info, f_make_md_mode, image_dir)
+                    md_writer.write_string(
+                        f"{pdf_file_name}.md",
+                        md_content_str,
+                    )
+
+                if f_dump_content_list:
+                    image_dir = str(os.path.basename(local_image_dir))
+                    content_list = pipeline_union_make(pdf_info, MakeMode.CONTENT_LIST, image_dir)
+                    md_writer.write_string(
+                        f"{pdf_file_name}_content_list.json",
+                        json.dumps(content_list, ensure_ascii=False, indent=4),
+                    )
+
+                if f_dump_middle_json:
+                    md_writer.write_string(
+                        f"{pdf_file_name}_middle.json",
+                        json.dumps(middle_json, ensure_ascii=False, indent=4),
+                    )
+
+                if f_dump_model_output:
+                    md_writer.write_string(
+                        f"{pdf_file_name}_model.json",
+                        json.dumps(model_json, ensure_ascii=False, indent=4),
+                    )
+
+            logger.info(f"local output dir is {os.path.join(output_dir, pdf_file_name, parse_method)}")
+
+        if os.getenv('MINERU_PIPELINE_STAGE_OVERLAP', 'false').lower() == 'true':
+            # 渲染、推理、后处理三阶段流水线并行
+            from mineru.backend.pipeline.stage_executor import PipelineStageExecutor
+            executor = PipelineStageExecutor(formula_enable=p_formula_enable, table_enable=p_table_enable, devices=devices)
+            executor.run(pdf_bytes_list, p_lang_list, process_pipeline_doc, parse_method=parse_method)
+        else:
+            # 流式推理，每个文档推理完成后立即后处理并落盘，避免所有页面图像同时驻留内存
+            for doc_result in pipeline_doc_analyze_streaming(
+                    pdf_bytes_list, p_lang_list, parse_method=parse_method, formula_enable=p_formula_enable, table_enable=p_table_enable,
+                    devices=devices
+            ):
+                process_pipeline_doc(*doc_result)
     else:
 
         if backend.startswith("vlm-"):
@@ -173,55 +226,58 @@ def do_parse(
         parse_method = "vlm"
         for idx, pdf_bytes in enumerate(pdf_bytes_list):
             pdf_file_name = pdf_file_names[idx]
-            pdf_bytes = convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, start_page_id, end_page_id)
-            local_image_dir, local_md_dir = prepare_env(output_dir, pdf_file_name, parse_method)
-            image_writer, md_writer = FileBasedDataWriter(local_image_dir), FileBasedDataWriter(local_md_dir)
-            middle_json, infer_result = vlm_doc_analyze(pdf_bytes, image_writer=image_writer, backend=backend, server_url=server_url)
-
-            pdf_info = middle_json["pdf_info"]
-
-            if f_draw_layout_bbox:
-                draw_layout_bbox(pdf_info, pdf_bytes, local_md_dir, f"{pdf_file_name}_layout.pdf")
-
-            if f_draw_span_bbox:
-                draw_span_bbox(pdf_info, pdf_bytes, local_md_dir, f"{pdf_file_name}_span.pdf")
-
-            if f_dump_orig_pdf:
-                md_writer.write(
-                    f"{pdf_file_name}_origin.pdf",
-                    pdf_bytes,
-                )
-
-            if f_dump_md:
-                image_dir = str(os.path.basename(local_image_dir))
-                md_content_str = vlm_union_make(pdf_info, f_make_md_mode, image_dir)
-                md_writer.write_string(
-                    f"{pdf_file_name}.md",
-                    md_content_str,
-                )
-
-            if f_dump_content_list:
-                image_dir = str(os.path.basename(local_image_dir))
-                content_list = vlm_union_make(pdf_info, MakeMode.CONTENT_LIST, image_dir)
-                md_writer.write_string(
-                    f"{pdf_file_name}_content_list.json",
-                    json.dumps(content_list, ensure_ascii=False, indent=4),
-                )
-
-            if f_dump_middle_json:
-                md_writer.write_string(
-                    f"{pdf_file_name}_middle.json",
-                    json.dumps(middle_json, ensure_ascii=False, indent=4),
-                )
-
-            if f_dump_model_output:
-                model_output = ("\n" + "-" * 50 + "\n").join(infer_result)
-                md_writer.write_string(
-                    f"{pdf_file_name}_model_output.txt",
-                    model_output,
-                )
-
-            logger.info(f"local output dir is {local_md_dir}")
+            pdf_doc = open_doc(pdf_file_name, pdf_bytes, start_page_id, end_page_id, manifest)
+            if pdf_doc is None:
+                continue
+            # 文档处理完成（包括出错）后关闭pdfium句柄
+            with pdf_doc, doc_output_env(output_dir, pdf_file_name, parse_method, manifest) as (local_image_dir, local_md_dir):
+                image_writer, md_writer = FileBasedDataWriter(local_image_dir), FileBasedDataWriter(local_md_dir)
+                middle_json, infer_result = vlm_doc_analyze(pdf_doc, image_writer=image_writer, backend=backend, server_url=server_url)
+
+                pdf_info = middle_json["pdf_info"]
+
+                if f_draw_layout_bbox:
+                    draw_layout_bbox(pdf_info, pdf_doc, local_md_dir, f"{pdf_file_name}_layout.pdf")
+
+                if f_draw_span_bbox:
+                    draw_span_bbox(pdf_info, pdf_doc, local_md_dir, f"{pdf_file_name}_span.pdf")
+
+                if f_dump_orig_pdf:
+                    md_writer.write(
+                        f"{pdf_file_name}_origin.pdf",
+                        pdf_doc.pdf_bytes,
+                    )
+
+                if f_dump_md:
+                    image_dir = str(os.path.basename(local_image_dir))
+                    md_content_str = vlm_union_make(pdf_info, f_make_md_mode, image_dir)
+                    md_writer.write_string(
+                        f"{pdf_file_name}.md",
+                        md_content_str,
+                    )
+
+                if f_dump_content_list:
+                    image_dir = str(os.path.basename(local_image_dir))
+                    content_list = vlm_union_make(pdf_info, MakeMode.CONTENT_LIST, image_dir)
+                    md_writer.write_string(
+                        f"{pdf_file_name}_content_list.json",
+                        json.dumps(content_list, ensure_ascii=False, indent=4),
+                    )
+
+                if f_dump_middle_json:
+                    md_writer.write_string(
+                        f"{pdf_file_name}_middle.json",
+                        json.dumps(middle_json, ensure_ascii=False, indent=4),
+                    )
+
+                if f_dump_model_output:
+                    model_output = ("\n" + "-" * 50 + "\n").join(infer_result)
+                    md_writer.write_string(
+                        f"{pdf_file_name}_model_output.txt",
+                        model_output,
+                    )
+
+            logger.info(f"local output dir is {os.path.join(output_dir, pdf_file_name, parse_method)}")
 
 
 
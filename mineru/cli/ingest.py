@@ -0,0 +1,160 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import queue
+import threading
+from pathlib import Path
+
+import pypdfium2 as pdfium
+from loguru import logger
+
+from mineru.utils.pdf_reader import pdfium_lock
+from .common import read_doc, pdf_suffixes, image_suffixes
+
+_END = object()
+
+
+def iter_input_paths(input_path=None, glob_pattern='*', from_file=None):
+    """
+    按顺序产出待解析的文件路径，支持的输入：
+    1. input_path为文件：只解析该文件；
+    2. input_path为目录：按glob_pattern匹配，'**/*'等模式可以递归子目录；
+    3. from_file：每行一个文件路径，空行和#开头的行会被忽略，相对路径相对于列表文件所在目录。
+    """
+    if input_path is not None:
+        input_path = Path(input_path)
+        if input_path.is_dir():
+            for doc_path in sorted(input_path.glob(glob_pattern)):
+                if doc_path.is_file() and doc_path.suffix in pdf_suffixes + image_suffixes:
+                    yield doc_path
+        else:
+            yield input_path
+
+    if from_file is not None:
+        base_dir = Path(from_file).parent
+        with open(from_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                doc_path = Path(line)
+                if not doc_path.is_absolute():
+                    doc_path = base_dir / doc_path
+                if not doc_path.is_file():
+                    logger.warning(f"file not found, skip: {doc_path}")
+                    continue
+                if doc_path.suffix not in pdf_suffixes + image_suffixes:
+                    logger.warning(f"unsupported file type, skip: {doc_path}")
+                    continue
+                yield doc_path
+
+
+def get_page_count(path):
+    """只读取pdf的页数，不加载页面内容"""
+    path = Path(path)
+    if path.suffix in image_suffixes:
+        return 1
+    with pdfium_lock:
+        pdf_doc = pdfium.PdfDocument(str(path))
+        try:
+            return len(pdf_doc)
+        finally:
+            pdf_doc.close()
+
+
+def iter_named_paths(paths):
+    """
+    为每个文件生成输出目录名，默认为文件名(不含后缀)。
+    递归匹配或文件列表中出现同名文件时，依次加上父目录名和序号，避免结果互相覆盖。
+    """
+    used_names = set()
+    for path in paths:
+        name = path.stem
+        if name in used_names:
+            name = f"{path.parent.name}_{path.stem}"
+        base_name, index = name, 1
+        while name in used_names:
+            name = f"{base_name}_{index}"
+            index += 1
+        if name != path.stem:
+            logger.warning(f"duplicate file name {path.stem}, output dir of {path} is renamed to {name}")
+        used_names.add(name)
+        yield path, name
+
+
+def iter_work_units(named_paths, max_pages, on_skip=None):
+    """
+    将文件按页数分组，每组总页数不超过max_pages（单个文件超过时单独成组）。
+    无法打开的文件被跳过，传入on_skip(name, error)时通知调用方。
+    产出[(path, name, page_count), ...]
+    """
+    unit, unit_pages = [], 0
+    for path, name in named_paths:
+        try:
+            page_count = get_page_count(path)
+        except Exception as e:
+            logger.warning(f"failed to open {path}, skip: {e}")
+            if on_skip is not None:
+                on_skip(name, e)
+            continue
+        if unit and unit_pages + page_count > max_pages:
+            yield unit
+            unit, unit_pages = [], 0
+        unit.append((path, name, page_count))
+        unit_pages += page_count
+    if unit:
+        yield unit
+
+
+def _load_unit(unit, on_skip=None):
+    docs = []
+    for path, name, page_count in unit:
+        try:
+            docs.append((path, name, read_doc(path)))
+        except Exception as e:
+            logger.warning(f"failed to read {path}, skip: {e}")
+            if on_skip is not None:
+                on_skip(name, e)
+    return docs
+
+
+def prefetch_work_units(units, max_inflight=2, on_skip=None):
+    """
+    在后台线程中依次读取每个工作单元的文件内容，最多预读max_inflight个单元，
+    当前单元解析时下一个单元的读取同步进行，内存中同时只保留有限数量的文件。
+    读取失败的文件被跳过，传入on_skip(name, error)时在读取线程中通知调用方。
+    产出[(path, name, pdf_bytes), ...]
+    """
+    unit_queue = queue.Queue(maxsize=max(1, max_inflight))
+    stop_event = threading.Event()
+
+    def producer():
+        try:
+            for unit in units:
+                if stop_event.is_set():
+                    return
+                docs = _load_unit(unit, on_skip)
+                if docs:
+                    unit_queue.put(docs)
+        except Exception as e:
+            unit_queue.put(e)
+        finally:
+            unit_queue.put(_END)
+
+    thread = threading.Thread(target=producer, name='mineru-ingest', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = unit_queue.get()
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop_event.set()
+        # 提前退出时清空队列，使阻塞在put上的读取线程能够结束
+        while thread.is_alive():
+            try:
+                unit_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
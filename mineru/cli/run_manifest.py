@@ -0,0 +1,194 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from loguru import logger
+
+from mineru.utils.hash_utils import dict_md5
+
+MANIFEST_FILE_NAME = 'mineru_manifest.jsonl'
+STAGING_DIR_NAME = '.mineru_staging'
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+class RunManifest:
+    """
+    可断点续跑的运行清单，保存在输出目录下的mineru_manifest.jsonl中。
+
+    每个文档记录输入哈希、解析参数、状态、输出目录和耗时，
+    输入哈希和解析参数都未变化且状态为done的文档在重新运行时会被跳过。
+    每个文档的结果先写入输出目录下的临时目录，全部写完后再重命名到最终位置，
+    进程在任意时刻被杀掉都不会留下不完整的结果。
+
+    清单是只追加的日志，每次状态变化追加一行该文档变化的字段，写入量与文档数成正比；
+    加载时按顺序合并各行，再压缩为每个文档一行。进程被杀掉时最后一行可能不完整，加载时忽略。
+
+    同一输出目录同一时间只应有一个进程使用。
+    """
+
+    def __init__(self, output_dir, config=None):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+        self.config = config or {}
+        self.config_hash = dict_md5(self.config)
+        self._lock = threading.RLock()
+        self.documents = {}
+        self._journal = None
+        self._load()
+        self._compact()
+        self._clean_staging()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line_no, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 写入时被中断的行，丢弃该次变化
+                        logger.warning(f'skip corrupted line {line_no} in manifest {self.path}')
+                        continue
+                    name = record.pop('name', None)
+                    if name is None:
+                        continue
+                    if record.pop('reset', False):
+                        self.documents.pop(name, None)
+                    entry = self.documents.setdefault(name, {})
+                    for key, value in record.items():
+                        if value is None:
+                            entry.pop(key, None)
+                        else:
+                            entry[key] = value
+        except Exception as e:
+            # 清单无法读取时重新解析所有文档，而不是中断运行
+            logger.warning(f'failed to load manifest {self.path}, all documents will be parsed again: {e}')
+            self.documents = {}
+
+    def _compact(self):
+        """先写临时文件再替换，把日志压缩为每个文档一行，之后的变化追加到该文件"""
+        with self._lock:
+            os.makedirs(self.output_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix='.manifest_', suffix='.jsonl', dir=self.output_dir)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    for name, entry in self.documents.items():
+                        f.write(json.dumps({'name': name, **entry}, ensure_ascii=False) + '\n')
+                os.replace(tmp_path, self.path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            self._journal = open(self.path, 'a', encoding='utf-8')
+
+    def _clean_staging(self):
+        # 清理上次运行被中断时遗留的临时目录
+        staging_root = os.path.join(self.output_dir, STAGING_DIR_NAME)
+        if os.path.isdir(staging_root):
+            shutil.rmtree(staging_root, ignore_errors=True)
+
+    def _update(self, name, reset=False, **changes):
+        """更新文档记录并把变化的字段追加到日志，值为None的字段被删除，reset为True时先清空原有记录"""
+        with self._lock:
+            if reset:
+                self.documents.pop(name, None)
+                changes = {'reset': True, **changes}
+            entry = self.documents.setdefault(name, {'config_hash': self.config_hash})
+            for key, value in changes.items():
+                if key == 'reset':
+                    continue
+                if value is None:
+                    entry.pop(key, None)
+                else:
+                    entry[key] = value
+            self._journal.write(json.dumps({'name': name, **changes}, ensure_ascii=False) + '\n')
+            self._journal.flush()
+
+    def close(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def is_done(self, name, input_hash):
+        entry = self.documents.get(name)
+        if entry is None or entry.get('status') != STATUS_DONE:
+            return False
+        if entry.get('input_hash') != input_hash or entry.get('config_hash') != self.config_hash:
+            return False
+        # 结果目录被手动删除时重新解析
+        return os.path.isdir(os.path.join(self.output_dir, entry.get('output_dir', name)))
+
+    def add_pending(self, name, input_path, input_hash):
+        # 重新开始的文档不保留上次运行的结果信息
+        self._update(
+            name, reset=True, input_path=str(input_path), input_hash=input_hash, config_hash=self.config_hash,
+            status=STATUS_PENDING,
+        )
+
+    def mark_running(self, names):
+        with self._lock:
+            started_at = time.time()
+            for name in names:
+                self._update(name, status=STATUS_RUNNING, started_at=started_at, error=None)
+
+    def mark_done(self, name, output_dir):
+        with self._lock:
+            finished_at = time.time()
+            started_at = self.documents.get(name, {}).get('started_at')
+            elapsed = round(finished_at - started_at, 3) if started_at is not None else None
+            self._update(name, status=STATUS_DONE, output_dir=output_dir, finished_at=finished_at, elapsed=elapsed)
+
+    def mark_failed(self, name, error):
+        self._update(name, status=STATUS_FAILED, error=str(error), finished_at=time.time())
+
+    def mark_unfinished_failed(self, names, error):
+        """将names中尚未结束（pending/running）的文档标记为失败，已经记录为done或failed的文档保持不变"""
+        with self._lock:
+            for name in names:
+                entry = self.documents.get(name)
+                if entry is None or entry.get('status') in (STATUS_PENDING, STATUS_RUNNING):
+                    self.mark_failed(name, error)
+
+    def discard(self, staging_dir):
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        try:
+            # 没有其他文档正在写入时一并删除临时目录的根目录
+            os.rmdir(os.path.dirname(staging_dir))
+        except OSError:
+            pass
+
+    def make_staging_dir(self, name):
+        """在输出目录下创建临时目录，与最终目录位于同一文件系统，保证重命名是原子操作"""
+        staging_dir = os.path.join(self.output_dir, STAGING_DIR_NAME, f'{name}_{uuid.uuid4().hex[:8]}')
+        os.makedirs(staging_dir, exist_ok=True)
+        return staging_dir
+
+    def commit(self, name, staging_dir, relative_dir):
+        """
+        将staging_dir/relative_dir重命名到output_dir/relative_dir，并把文档标记为done。
+        已存在的旧结果先移动到临时目录再删除，避免出现新旧结果混合的状态。
+        """
+        final_dir = os.path.join(self.output_dir, relative_dir)
+        os.makedirs(os.path.dirname(final_dir), exist_ok=True)
+        if os.path.exists(final_dir):
+            trash_dir = os.path.join(self.output_dir, STAGING_DIR_NAME, f'trash_{uuid.uuid4().hex[:8]}')
+            os.replace(final_dir, trash_dir)
+            shutil.rmtree(trash_dir, ignore_errors=True)
+        os.replace(os.path.join(staging_dir, relative_dir), final_dir)
+        self.discard(staging_dir)
+        self.mark_done(name, relative_dir)
+        return final_dir
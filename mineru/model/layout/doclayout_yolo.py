@@ -1,19 +1,28 @@
+import os
+
 from doclayout_yolo import YOLOv10
-from tqdm import tqdm
+
+from mineru.utils.yolo_batch import YoloBatchPredictor
 
 
 class DocLayoutYOLOModel(object):
-    def __init__(self, weight, device):
+    def __init__(self, weight, device, imgsz=1280, conf=0.10, iou=0.45):
         self.model = YOLOv10(weight)
         self.device = device
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        # 模型权重和推理参数的标识，用于推理结果缓存
+        self.cache_id = f'doclayout_yolo/{os.path.basename(weight)}/imgsz={imgsz}/conf={conf}/iou={iou}'
+        self.batch_predictor = YoloBatchPredictor(self.model, device, imgsz, conf, iou)
 
     def predict(self, image):
         layout_res = []
         doclayout_yolo_res = self.model.predict(
             image,
-            imgsz=1280,
-            conf=0.10,
-            iou=0.45,
+            imgsz=self.imgsz,
+            conf=self.conf,
+            iou=self.iou,
             verbose=False, device=self.device
         )[0]
         for xyxy, conf, cla in zip(
@@ -30,35 +39,26 @@ class DocLayoutYOLOModel(object):
             layout_res.append(new_item)
         return layout_res
 
-    def batch_predict(self, images: list, batch_size: int) -> list:
-        images_layout_res = []
-        # for index in range(0, len(images), batch_size):
-        for index in tqdm(range(0, len(images), batch_size), desc="Layout Predict"):
-            doclayout_yolo_res = [
-                image_res.cpu()
-                for image_res in self.model.predict(
-                    images[index : index + batch_size],
-                    imgsz=1280,
-                    conf=0.10,
-                    iou=0.45,
-                    verbose=False,
-                    device=self.device,
-                )
-            ]
-            for image_res in doclayout_yolo_res:
-                layout_res = []
-                for xyxy, conf, cla in zip(
-                    image_res.boxes.xyxy,
-                    image_res.boxes.conf,
-                    image_res.boxes.cls,
-                ):
-                    xmin, ymin, xmax, ymax = [int(p.item()) for p in xyxy]
-                    new_item = {
-                        "category_id": int(cla.item()),
-                        "poly": [xmin, ymin, xmax, ymin, xmax, ymax, xmin, ymax],
-                        "score": round(float(conf.item()), 3),
-                    }
-                    layout_res.append(new_item)
-                images_layout_res.append(layout_res)
+    def batch_predict(self, images: list, batch_size: int, batch_controller=None) -> list:
+        """
+        images为BGR numpy数组，按letterbox后的尺寸分桶批量推理，
+        传入batch_controller时由其决定batch大小并在OOM时减半重试
+        """
+        images_boxes = self.batch_predictor.batch_predict(
+            images, batch_size, 'layout', batch_controller=batch_controller, desc="Layout Predict"
+        )
+        return [boxes_to_layout_res(boxes) for boxes in images_boxes]
+
 
-        return images_layout_res
+def boxes_to_layout_res(boxes):
+    """(n, 6)的检测框数组转为版面检测结果，坐标截断为整数"""
+    layout_res = []
+    for (xmin, ymin, xmax, ymax), conf, cla in zip(
+        boxes[:, :4].astype(int).tolist(), boxes[:, 4].tolist(), boxes[:, 5].astype(int).tolist()
+    ):
+        layout_res.append({
+            "category_id": cla,
+            "poly": [xmin, ymin, xmax, ymin, xmax, ymax, xmin, ymax],
+            "score": round(conf, 3),
+        })
+    return layout_res
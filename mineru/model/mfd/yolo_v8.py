@@ -1,33 +1,43 @@
-from tqdm import tqdm
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import torch
 from ultralytics import YOLO
 
+from mineru.utils.yolo_batch import YoloBatchPredictor
+
 
 class YOLOv8MFDModel(object):
-    def __init__(self, weight, device="cpu"):
+    def __init__(self, weight, device="cpu", imgsz=1888, conf=0.25, iou=0.45):
         self.mfd_model = YOLO(weight)
         self.device = device
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        # 模型权重和推理参数的标识，用于推理结果缓存
+        self.cache_id = f'yolo_v8_mfd/{os.path.basename(weight)}/imgsz={imgsz}/conf={conf}/iou={iou}'
+        self.batch_predictor = YoloBatchPredictor(self.mfd_model, device, imgsz, conf, iou)
 
     def predict(self, image):
         mfd_res = self.mfd_model.predict(
-            image, imgsz=1888, conf=0.25, iou=0.45, verbose=False, device=self.device
+            image, imgsz=self.imgsz, conf=self.conf, iou=self.iou, verbose=False, device=self.device
         )[0]
         return mfd_res
 
-    def batch_predict(self, images: list, batch_size: int) -> list:
-        images_mfd_res = []
-        # for index in range(0, len(images), batch_size):
-        for index in tqdm(range(0, len(images), batch_size), desc="MFD Predict"):
-            mfd_res = [
-                image_res.cpu()
-                for image_res in self.mfd_model.predict(
-                    images[index : index + batch_size],
-                    imgsz=1888,
-                    conf=0.25,
-                    iou=0.45,
-                    verbose=False,
-                    device=self.device,
-                )
-            ]
-            for image_res in mfd_res:
-                images_mfd_res.append(image_res)
-        return images_mfd_res
+    def batch_predict(self, images: list, batch_size: int, batch_controller=None) -> list:
+        """
+        images为BGR numpy数组，按letterbox后的尺寸分桶批量推理，
+        返回的结果只保留boxes.xyxy/conf/cls（cpu张量），与ultralytics Results.boxes的接口一致
+        """
+        images_boxes = self.batch_predictor.batch_predict(
+            images, batch_size, 'mfd', batch_controller=batch_controller, desc="MFD Predict"
+        )
+        return [
+            SimpleNamespace(boxes=SimpleNamespace(
+                xyxy=torch.from_numpy(np.ascontiguousarray(boxes[:, :4])),
+                conf=torch.from_numpy(np.ascontiguousarray(boxes[:, 4])),
+                cls=torch.from_numpy(np.ascontiguousarray(boxes[:, 5])),
+            ))
+            for boxes in images_boxes
+        ]
@@ -1,21 +1,119 @@
+import hashlib
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from loguru import logger
+from PIL import Image
 import torch
-from torch.utils.data import DataLoader, Dataset
 from tqdm import tqdm
 
+from mineru.utils.metrics import get_metrics_collector
+
+# 连续批处理解码时，每个解码窗口中的公式数为同时解码的序列数的倍数
+MFR_DECODE_WINDOW = 4
+DEFAULT_MFR_PREPROCESS_WORKERS = 4
+
+
+def get_mfr_preprocess_workers():
+    """
+    公式裁剪图预处理的线程数，通过环境变量MINERU_MFR_PREPROCESS_WORKERS设置，默认为min(4, cpu核数)，
+    设为0时在主线程中预处理，不与解码重叠
+    """
+    default_workers = min(DEFAULT_MFR_PREPROCESS_WORKERS, os.cpu_count() or 1)
+    try:
+        return max(0, int(os.getenv('MINERU_MFR_PREPROCESS_WORKERS', default_workers)))
+    except ValueError:
+        logger.warning(f'MINERU_MFR_PREPROCESS_WORKERS is not a valid integer, use default {default_workers}')
+        return default_workers
+
+
+def _get_crop_size(image):
+    if isinstance(image, Image.Image):
+        return image.width, image.height
+    return image.shape[1], image.shape[0]
+
+
+def _get_line_height(sizes):
+    """行内公式高度的中位数作为行高"""
+    heights = sorted(height for _, height in sizes)
+    return max(1, heights[len(heights) // 2]) if heights else 1
+
+
+def estimate_latex_length(width, height, line_height):
+    """
+    根据公式裁剪图的几何尺寸估计LaTeX的长度：单行公式与宽度除以行高成正比，多行公式再乘以行数。
+    只用于解码调度时的排序，不需要精确
+    """
+    lines = max(1.0, height / line_height)
+    return lines * width / line_height
+
+
+class FormulaPreprocessPrefetcher:
+    """
+    按解码顺序预处理公式裁剪图（裁边、缩放、填充、转灰度）。
 
-class MathDataset(Dataset):
-    def __init__(self, image_paths, transform=None):
-        self.image_paths = image_paths
-        self.transform = transform
+    取一个batch时，后面一个同样大小的batch会提交给工作线程预处理，与当前batch的解码重叠；
+    uint8结果写入复用的缓冲区（cuda上为锁页内存），整个batch一次拷贝到设备后再做归一化。
+    OOM减半重试时会再次取同一段公式，因此已完成的结果保留到取数起点越过它们为止。
+    """
 
-    def __len__(self):
-        return len(self.image_paths)
+    def __init__(self, processor, images, device, dtype, executor=None):
+        self.processor = processor
+        self.images = images
+        self.device = device
+        self.dtype = dtype
+        self.executor = executor
+        self._pin_memory = str(device).startswith('cuda') and torch.cuda.is_available()
+        self._buffer = None
+        # 上一次异步拷贝完成后才能改写锁页缓冲区
+        self._copy_event = None
+        # 下标 -> 预处理结果或future
+        self._prepared = {}
+        self._next_index = 0
 
-    def __getitem__(self, idx):
-        raw_image = self.image_paths[idx]
-        if self.transform:
-            image = self.transform(raw_image)
-            return image
+    def _prefetch_until(self, end):
+        end = min(end, len(self.images))
+        while self._next_index < end:
+            image = self.images[self._next_index]
+            if self.executor is not None:
+                self._prepared[self._next_index] = self.executor.submit(self.processor.prepare_gray, image)
+            self._next_index += 1
+
+    def _get_prepared(self, index):
+        prepared = self._prepared.get(index)
+        if prepared is None:
+            prepared = self._prepared[index] = self.processor.prepare_gray(self.images[index])
+        elif not isinstance(prepared, np.ndarray):
+            prepared = self._prepared[index] = prepared.result()
+        return prepared
+
+    def _get_buffer(self, batch_size):
+        if self._buffer is None or self._buffer.shape[0] < batch_size:
+            self._buffer = torch.empty(
+                (batch_size, *self.processor.input_size), dtype=torch.uint8, pin_memory=self._pin_memory
+            )
+        elif self._copy_event is not None:
+            self._copy_event.synchronize()
+        return self._buffer[:batch_size]
+
+    def get(self, indices):
+        """返回indices（连续、递增）对应公式的模型输入(N, 1, H, W)，位于目标设备上"""
+        start, end = indices[0], indices[-1] + 1
+        for index in [index for index in self._prepared if index < start]:
+            del self._prepared[index]
+        self._prefetch_until(end + len(indices))
+
+        buffer = self._get_buffer(len(indices))
+        buffer_np = buffer.numpy()
+        for row, index in enumerate(indices):
+            buffer_np[row] = self._get_prepared(index)
+        tensor = buffer.to(self.device, non_blocking=self._pin_memory)
+        if self._pin_memory:
+            self._copy_event = torch.cuda.Event()
+            self._copy_event.record(torch.cuda.current_stream(tensor.device))
+        return self.processor.batch_normalize(tensor, self.dtype)
 
 
 class UnimernetModel(object):
@@ -30,6 +128,8 @@ class UnimernetModel(object):
         if not _device_.startswith("cpu"):
             self.model = self.model.to(dtype=torch.float16)
         self.model.eval()
+        # 模型权重和精度的标识，用于推理结果缓存
+        self.cache_id = f'unimernet/{os.path.basename(os.path.normpath(weight_dir))}/{self.model.dtype}'
 
     def predict(self, mfd_res, image):
         formula_list = []
@@ -48,12 +148,10 @@ class UnimernetModel(object):
             bbox_img = image[ymin:ymax, xmin:xmax]
             mf_image_list.append(bbox_img)
 
-        dataset = MathDataset(mf_image_list, transform=self.model.transform)
-        dataloader = DataLoader(dataset, batch_size=32, num_workers=0)
+        prefetcher = FormulaPreprocessPrefetcher(self.model.transform, mf_image_list, self.device, self.model.dtype)
         mfr_res = []
-        for mf_img in dataloader:
-            mf_img = mf_img.to(dtype=self.model.dtype)
-            mf_img = mf_img.to(self.device)
+        for index in range(0, len(mf_image_list), 32):
+            mf_img = prefetcher.get(list(range(index, min(index + 32, len(mf_image_list)))))
             with torch.no_grad():
                 output = self.model.generate({"image": mf_img})
             mfr_res.extend(output["fixed_str"])
@@ -61,75 +159,156 @@ class UnimernetModel(object):
             res["latex"] = latex
         return formula_list
 
-    def batch_predict(self, images_mfd_res: list, images: list, batch_size: int = 64) -> list:
+    @property
+    def continuous_decoding(self):
+        """是否使用连续批处理解码，生成参数不支持时回退到transformers的generate"""
+        from .unimernet_hf.decoding import get_continuous_decoding_enable, supports_continuous_decoding
+        return get_continuous_decoding_enable() and supports_continuous_decoding(self.model.generation_config)
+
+    def crop_hash(self, image):
+        """
+        公式裁剪图的内容哈希，直接按裁剪图的像素计算。
+        裁边在预处理中进行，这里不再为计算哈希额外裁一次边，不同位置的同一公式检测框大小一致时即可命中
+        """
+        array = np.asarray(image.convert('RGB')) if isinstance(image, Image.Image) else image
+        array = np.ascontiguousarray(array)
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(str(array.shape).encode('utf-8'))
+        hasher.update(array.data)
+        return hasher.hexdigest()
+
+    def batch_predict(
+            self, images_mfd_res: list, images: list, batch_size: int = 64, batch_controller=None, latex_cache=None,
+            formula_filter=None,
+    ) -> list:
+        """
+        批量公式识别。内容相同的公式裁剪图只识别一次；传入latex_cache时先查询缓存，只对未命中的公式调用模型。
+        传入formula_filter(image_index, formula_list)时，其返回False的公式不裁剪也不识别，latex保持为空
+        """
         images_formula_list = []
         mf_image_list = []
         backfill_list = []
-        image_info = []  # Store (area, original_index, image) tuples
+        pruned = 0
 
         # Collect images with their original indices
         for image_index in range(len(images_mfd_res)):
             mfd_res = images_mfd_res[image_index]
-            pil_img = images[image_index]
+            image = images[image_index]
             formula_list = []
 
-            for idx, (xyxy, conf, cla) in enumerate(zip(
-                    mfd_res.boxes.xyxy, mfd_res.boxes.conf, mfd_res.boxes.cls
-            )):
-                xmin, ymin, xmax, ymax = [int(p.item()) for p in xyxy]
+            # 每页只拷贝一次检测框到cpu，不逐个调用.item()
+            for xyxy, conf, cla in zip(
+                mfd_res.boxes.xyxy.cpu().numpy().astype(int).tolist(),
+                mfd_res.boxes.conf.cpu().numpy().tolist(),
+                mfd_res.boxes.cls.cpu().numpy().astype(int).tolist(),
+            ):
+                xmin, ymin, xmax, ymax = xyxy
                 new_item = {
-                    "category_id": 13 + int(cla.item()),
+                    "category_id": 13 + cla,
                     "poly": [xmin, ymin, xmax, ymin, xmax, ymax, xmin, ymax],
-                    "score": round(float(conf.item()), 2),
+                    "score": round(conf, 2),
                     "latex": "",
                 }
                 formula_list.append(new_item)
-                bbox_img = pil_img.crop((xmin, ymin, xmax, ymax))
-                area = (xmax - xmin) * (ymax - ymin)
 
-                curr_idx = len(mf_image_list)
-                image_info.append((area, curr_idx, bbox_img))
+            keep_list = formula_filter(image_index, formula_list) if formula_filter is not None else None
+            for formula_index, new_item in enumerate(formula_list):
+                if keep_list is not None and not keep_list[formula_index]:
+                    pruned += 1
+                    continue
+                xmin, ymin, _, _, xmax, ymax, _, _ = new_item["poly"]
+                if not isinstance(image, Image.Image):
+                    # 页面为BGR数组（或按区域渲染的多分辨率页面），只拷贝公式区域并转为模型预处理需要的RGB
+                    bbox_img = np.ascontiguousarray(image[ymin:ymax, xmin:xmax, ::-1])
+                else:
+                    bbox_img = image.crop((xmin, ymin, xmax, ymax))
                 mf_image_list.append(bbox_img)
+                backfill_list.append(new_item)
 
             images_formula_list.append(formula_list)
-            backfill_list += formula_list
 
-        # Stable sort by area
-        image_info.sort(key=lambda x: x[0])  # sort by area
-        sorted_indices = [x[1] for x in image_info]
+        # 按内容哈希去重，同一批次内相同的公式只保留第一个
+        crop_hashes = [self.crop_hash(img) for img in mf_image_list]
+        unique_indices = {}
+        for index, crop_hash in enumerate(crop_hashes):
+            unique_indices.setdefault(crop_hash, index)
+        latex_by_hash = latex_cache.get_many(self.cache_id, list(unique_indices)) if latex_cache is not None else {}
+
+        # 只识别去重后未命中缓存的公式，按预计的输出长度从长到短排列
+        pending = [(crop_hash, index) for crop_hash, index in unique_indices.items() if crop_hash not in latex_by_hash]
+        sizes = [_get_crop_size(mf_image_list[index]) for _, index in pending]
+        line_height = _get_line_height(
+            [size for size, (_, index) in zip(sizes, pending) if backfill_list[index]["category_id"] == 13] or sizes
+        )
+        image_info = [
+            (estimate_latex_length(width, height, line_height), crop_hash, mf_image_list[index])
+            for (width, height), (crop_hash, index) in zip(sizes, pending)
+        ]
+        image_info.sort(key=lambda x: -x[0])
+        sorted_lengths = [x[0] for x in image_info]
+        sorted_hashes = [x[1] for x in image_info]
         sorted_images = [x[2] for x in image_info]
 
-        # Create mapping for results
-        index_mapping = {new_idx: old_idx for new_idx, old_idx in enumerate(sorted_indices)}
+        # 连续批处理解码时，每次交给模型batch_size*MFR_DECODE_WINDOW个公式，其中同时解码batch_size个，
+        # 结束的序列空出的槽位由窗口内剩余的公式补入
+        window = MFR_DECODE_WINDOW if self.continuous_decoding else 1
+        num_workers = get_mfr_preprocess_workers()
+        executor = ThreadPoolExecutor(num_workers, thread_name_prefix='mfr_preprocess') if num_workers > 0 else None
+        prefetcher = FormulaPreprocessPrefetcher(
+            self.model.transform, sorted_images, self.device, self.model.dtype, executor=executor
+        )
 
-        # Create dataset with sorted images
-        dataset = MathDataset(sorted_images, transform=self.model.transform)
-        dataloader = DataLoader(dataset, batch_size=batch_size, num_workers=0)
+        def infer_batch(batch_indices):
+            # 同时解码的序列数由当前的窗口大小决定，最后一个不满的窗口也使用同样多的槽位
+            window_size = batch_size * window
+            if batch_controller is not None:
+                window_size = batch_controller.get_batch_size('mfr', window_size)
+            mf_img = prefetcher.get(batch_indices)
+            with torch.no_grad():
+                output = self.model.generate({"image": mf_img}, max_active=math.ceil(window_size / window))
+            return output["fixed_str"]
 
-        # Process batches and store results
-        mfr_res = []
-        # for mf_img in dataloader:
-
-        with tqdm(total=len(sorted_images), desc="MFR Predict") as pbar:
-            for index, mf_img in enumerate(dataloader):
-                mf_img = mf_img.to(dtype=self.model.dtype)
-                mf_img = mf_img.to(self.device)
-                with torch.no_grad():
-                    output = self.model.generate({"image": mf_img})
-                mfr_res.extend(output["fixed_str"])
-
-                # 更新进度条，每次增加batch_size，但要注意最后一个batch可能不足batch_size
-                current_batch_size = min(batch_size, len(sorted_images) - index * batch_size)
-                pbar.update(current_batch_size)
-
-        # Restore original order
-        unsorted_results = [""] * len(mfr_res)
-        for new_idx, latex in enumerate(mfr_res):
-            original_idx = index_mapping[new_idx]
-            unsorted_results[original_idx] = latex
+        # 按下标分批，预处理由prefetcher按解码顺序提前进行
+        sorted_indices = list(range(len(sorted_images)))
+        try:
+            if not sorted_indices:
+                mfr_res = []
+            elif batch_controller is not None:
+                # 由batch_controller决定每个batch的大小，OOM时自动减半重试
+                # 公式按预计长度从长到短排列，吞吐按预计的token数统计，前后batch才具有可比性
+                mfr_res = batch_controller.run(
+                    'mfr', sorted_indices, infer_batch, base_batch_size=batch_size * window, desc="MFR Predict",
+                    cost_fn=lambda index: max(sorted_lengths[index], 1),
+                )
+            else:
+                mfr_res = []
+                with tqdm(total=len(sorted_indices), desc="MFR Predict") as pbar:
+                    for index in range(0, len(sorted_indices), batch_size * window):
+                        batch_indices = sorted_indices[index: index + batch_size * window]
+                        mfr_res.extend(infer_batch(batch_indices))
+                        pbar.update(len(batch_indices))
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+        new_results = list(zip(sorted_hashes, mfr_res))
+        latex_by_hash.update(new_results)
+        deduplicated = len(crop_hashes) - len(unique_indices)
+        cache_hits = len(unique_indices) - len(sorted_images)
+        if latex_cache is not None:
+            latex_cache.put_many(self.cache_id, new_results)
+            latex_cache.record_crops(len(crop_hashes), deduplicated)
+        collector = get_metrics_collector()
+        if collector is not None:
+            if deduplicated:
+                collector.record('mfr_dedup', 0, items=deduplicated)
+            if cache_hits:
+                collector.record('mfr_cache_hit', 0, items=cache_hits)
+            if pruned:
+                collector.record('mfr_prune', 0, items=pruned)
 
         # Fill results back
-        for res, latex in zip(backfill_list, unsorted_results):
-            res["latex"] = latex
+        for res, crop_hash in zip(backfill_list, crop_hashes):
+            res["latex"] = latex_by_hash[crop_hash]
 
         return images_formula_list
@@ -0,0 +1,282 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import os
+
+import torch
+from torch.nn import functional as F
+from transformers.generation import (
+    ForcedBOSTokenLogitsProcessor,
+    ForcedEOSTokenLogitsProcessor,
+    LogitsProcessorList,
+    MinLengthLogitsProcessor,
+    NoRepeatNGramLogitsProcessor,
+    RepetitionPenaltyLogitsProcessor,
+)
+
+# 活跃序列数空出该比例的槽位后再补入新的公式，避免每次只补一两个公式导致编码器的batch过小
+REFILL_RATIO = 0.25
+
+# 生成参数为这些取值以外的值时，连续批处理无法保证与transformers的generate结果一致，回退到generate
+_DEFAULT_GENERATION_PARAMS = {
+    'num_beams': 1,
+    'num_beam_groups': 1,
+    'penalty_alpha': None,
+    'bad_words_ids': None,
+    'force_words_ids': None,
+    'forced_decoder_ids': None,
+    'suppress_tokens': None,
+    'begin_suppress_tokens': None,
+    'sequence_bias': None,
+    'encoder_no_repeat_ngram_size': 0,
+    'exponential_decay_length_penalty': None,
+    'min_new_tokens': None,
+    'guidance_scale': None,
+}
+
+
+def get_continuous_decoding_enable():
+    """公式识别是否使用连续批处理解码，可以通过环境变量MINERU_MFR_CONTINUOUS_BATCHING=false回退到transformers的generate"""
+    return os.getenv('MINERU_MFR_CONTINUOUS_BATCHING', 'true').lower() == 'true'
+
+
+def supports_continuous_decoding(generation_config):
+    for name, default in _DEFAULT_GENERATION_PARAMS.items():
+        value = getattr(generation_config, name, None)
+        if value is not None and value != default:
+            return False
+    return True
+
+
+def _get_eos_token_ids(generation_config, default_eos_token_id):
+    eos_token_id = generation_config.eos_token_id
+    if eos_token_id is None:
+        eos_token_id = default_eos_token_id
+    return [eos_token_id] if isinstance(eos_token_id, int) else list(eos_token_id)
+
+
+def _build_logits_processor(generation_config, max_length, eos_token_ids, device):
+    """按transformers中的顺序构造贪心解码用到的logits处理器"""
+    processors = LogitsProcessorList()
+    if generation_config.repetition_penalty is not None and generation_config.repetition_penalty != 1.0:
+        processors.append(RepetitionPenaltyLogitsProcessor(penalty=generation_config.repetition_penalty))
+    if generation_config.no_repeat_ngram_size is not None and generation_config.no_repeat_ngram_size > 0:
+        processors.append(NoRepeatNGramLogitsProcessor(generation_config.no_repeat_ngram_size))
+    if generation_config.min_length is not None and generation_config.min_length > 0:
+        processors.append(MinLengthLogitsProcessor(generation_config.min_length, eos_token_ids, device=device))
+    if generation_config.forced_bos_token_id is not None:
+        processors.append(ForcedBOSTokenLogitsProcessor(generation_config.forced_bos_token_id))
+    if generation_config.forced_eos_token_id is not None:
+        processors.append(
+            ForcedEOSTokenLogitsProcessor(max_length, generation_config.forced_eos_token_id, device=device)
+        )
+    return processors
+
+
+class _ActiveBatch:
+    """
+    正在解码的序列。各序列加入的时间不同，已生成的长度也不同，token和self-attention的kv-cache左侧补齐，
+    通过attention_mask屏蔽补齐的位置，位置编码按各序列自身的长度计算。
+    tokens的最后一列为下一步输入解码器的token，kv-cache的长度比tokens少1。
+    """
+
+    def __init__(self, row_ids, tokens, attention_mask, lengths, encoder_hidden_states, past_key_values, pad_token_id):
+        self.row_ids = row_ids
+        self.tokens = tokens
+        self.attention_mask = attention_mask
+        self.lengths = lengths
+        self.encoder_hidden_states = encoder_hidden_states
+        self.past_key_values = past_key_values
+        self.pad_token_id = pad_token_id
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    def _left_pad(self, width):
+        """左侧补齐到width列"""
+        pad = width - self.tokens.shape[1]
+        if pad <= 0:
+            return
+        self.tokens = F.pad(self.tokens, (pad, 0), value=self.pad_token_id)
+        self.attention_mask = F.pad(self.attention_mask, (pad, 0), value=0)
+        self.past_key_values = tuple(
+            (F.pad(layer[0], (0, 0, pad, 0)), F.pad(layer[1], (0, 0, pad, 0))) + tuple(layer[2:])
+            for layer in self.past_key_values
+        )
+
+    def merge(self, other):
+        width = max(self.tokens.shape[1], other.tokens.shape[1])
+        self._left_pad(width)
+        other._left_pad(width)
+        self.row_ids += other.row_ids
+        self.lengths += other.lengths
+        self.tokens = torch.cat([self.tokens, other.tokens])
+        self.attention_mask = torch.cat([self.attention_mask, other.attention_mask])
+        self.encoder_hidden_states = torch.cat([self.encoder_hidden_states, other.encoder_hidden_states])
+        self.past_key_values = tuple(
+            tuple(torch.cat([state, other_state]) for state, other_state in zip(layer, other_layer))
+            for layer, other_layer in zip(self.past_key_values, other.past_key_values)
+        )
+
+    def retire(self, keep):
+        """移除已结束的序列，并裁掉所有剩余序列都为补齐位置的列（kv-cache压缩）"""
+        keep_index = torch.tensor(keep, dtype=torch.long, device=self.tokens.device)
+        self.row_ids = [self.row_ids[i] for i in keep]
+        self.lengths = [self.lengths[i] for i in keep]
+        trim = self.tokens.shape[1] - max(self.lengths)
+        self.tokens = self.tokens.index_select(0, keep_index)[:, trim:]
+        self.attention_mask = self.attention_mask.index_select(0, keep_index)[:, trim:]
+        self.encoder_hidden_states = self.encoder_hidden_states.index_select(0, keep_index)
+        self.past_key_values = tuple(
+            (
+                layer[0].index_select(0, keep_index)[:, :, trim:],
+                layer[1].index_select(0, keep_index)[:, :, trim:],
+            ) + tuple(state.index_select(0, keep_index) for state in layer[2:])
+            for layer in self.past_key_values
+        )
+
+
+class ContinuousGreedyDecoder:
+    """
+    UniMERNet的连续批处理贪心解码。
+
+    transformers的generate中，同一个batch的所有序列都要解码到最长的序列结束，已结束的序列仍然参与计算。
+    这里每一步之后移除已结束的序列并压缩kv-cache，空出的槽位由待解码的公式补入，
+    新补入的公式单独完成编码器和第一步解码后再与正在解码的序列合并。
+    调用方按预计的输出长度从长到短排列输入，长公式先开始解码，末尾剩下的都是很快结束的短公式。
+    """
+
+    def __init__(self, model, max_new_tokens, decoder_start_token_id, eos_token_id, pad_token_id):
+        self.model = model
+        self.generation_config = model.generation_config
+        self.max_length = max_new_tokens + 1
+        self.decoder_start_token_id = decoder_start_token_id
+        self.eos_token_ids = _get_eos_token_ids(self.generation_config, eos_token_id)
+        pad = self.generation_config.pad_token_id
+        self.pad_token_id = pad if pad is not None else pad_token_id
+
+    def _encode(self, pixel_values):
+        model = self.model
+        encoder_hidden_states = model.encoder(pixel_values=pixel_values, return_dict=True).last_hidden_state
+        # 与VisionEncoderDecoderModel.forward一致
+        if (
+            model.encoder.config.hidden_size != model.decoder.config.hidden_size
+            and model.decoder.config.cross_attention_hidden_size is None
+        ):
+            encoder_hidden_states = model.enc_to_dec_proj(encoder_hidden_states)
+        return encoder_hidden_states
+
+    def _next_tokens(self, batch, logits, processors):
+        """对每个序列只使用其自身的token调用logits处理器，长度相同的序列一起处理"""
+        scores = logits[:, -1, :].float()
+        if processors:
+            cohorts = {}
+            for index, length in enumerate(batch.lengths):
+                cohorts.setdefault(length, []).append(index)
+            if len(cohorts) == 1:
+                length = batch.lengths[0]
+                scores = processors(batch.tokens[:, -length:], scores)
+            else:
+                for length, indices in cohorts.items():
+                    index = torch.tensor(indices, dtype=torch.long, device=scores.device)
+                    scores[index] = processors(batch.tokens.index_select(0, index)[:, -length:], scores[index])
+        return scores.argmax(dim=-1)
+
+    def _prefill(self, row_ids, pixel_values, processors):
+        """新补入的公式：编码，并以decoder_start_token解码第一步"""
+        device = pixel_values.device
+        count = len(row_ids)
+        encoder_hidden_states = self._encode(pixel_values)
+        tokens = torch.full((count, 1), self.decoder_start_token_id, dtype=torch.long, device=device)
+        attention_mask = torch.ones_like(tokens)
+        outputs = self.model.decoder(
+            input_ids=tokens,
+            attention_mask=attention_mask,
+            encoder_hidden_states=encoder_hidden_states,
+            use_cache=True,
+            return_dict=True,
+        )
+        batch = _ActiveBatch(
+            list(row_ids), tokens, attention_mask, [1] * count, encoder_hidden_states, outputs.past_key_values,
+            self.pad_token_id,
+        )
+        self._append(batch, self._next_tokens(batch, outputs.logits, processors))
+        return batch
+
+    def _step(self, batch, processors):
+        position_ids = torch.tensor(batch.lengths, dtype=torch.long, device=batch.tokens.device).unsqueeze(1) - 1
+        outputs = self.model.decoder(
+            input_ids=batch.tokens[:, -1:],
+            attention_mask=batch.attention_mask,
+            encoder_hidden_states=batch.encoder_hidden_states,
+            past_key_values=batch.past_key_values,
+            use_cache=True,
+            return_dict=True,
+            position_ids=position_ids,
+        )
+        batch.past_key_values = outputs.past_key_values
+        self._append(batch, self._next_tokens(batch, outputs.logits, processors))
+
+    @staticmethod
+    def _append(batch, next_tokens):
+        batch.tokens = torch.cat([batch.tokens, next_tokens.unsqueeze(1)], dim=1)
+        batch.attention_mask = F.pad(batch.attention_mask, (0, 1), value=1)
+        batch.lengths = [length + 1 for length in batch.lengths]
+
+    def _collect_finished(self, batch, eos_token_ids, results):
+        """结束的序列写入results，返回仍在解码的序列下标"""
+        finished = torch.isin(batch.tokens[:, -1], eos_token_ids).tolist()
+        finished = [done or length >= self.max_length for done, length in zip(finished, batch.lengths)]
+        if not any(finished):
+            return None
+        finished_indices = [i for i, done in enumerate(finished) if done]
+        finished_tokens = batch.tokens[finished_indices].cpu()
+        for row, index in enumerate(finished_indices):
+            results[batch.row_ids[index]] = finished_tokens[row, -batch.lengths[index]:]
+        return [i for i, done in enumerate(finished) if not done]
+
+    @torch.no_grad()
+    def generate(self, pixel_values, max_active=None):
+        """
+        Args:
+            pixel_values: (N, 3, H, W)，按预计输出长度从长到短排列效果最好
+            max_active: 同时解码的序列数上限，默认为N，即只移除已结束的序列而不补入新的公式
+
+        Returns:
+            torch.LongTensor: (N, L)，以decoder_start_token开头，结束后以pad_token补齐，与generate的输出一致
+        """
+        num_rows = pixel_values.shape[0]
+        max_active = num_rows if not max_active else min(max_active, num_rows)
+        refill_size = max(1, int(max_active * REFILL_RATIO))
+        device = pixel_values.device
+        eos_token_ids = torch.tensor(self.eos_token_ids, dtype=torch.long, device=device)
+        processors = _build_logits_processor(self.generation_config, self.max_length, self.eos_token_ids, device)
+
+        results = [None] * num_rows
+        next_row = 0
+        batch = None
+        while next_row < num_rows or batch is not None:
+            active = len(batch) if batch is not None else 0
+            pending = num_rows - next_row
+            if pending and (active == 0 or max_active - active >= min(refill_size, pending)):
+                count = min(max_active - active, pending)
+                new_batch = self._prefill(
+                    range(next_row, next_row + count), pixel_values[next_row: next_row + count], processors
+                )
+                next_row += count
+                if batch is None:
+                    batch = new_batch
+                else:
+                    batch.merge(new_batch)
+            else:
+                self._step(batch, processors)
+
+            keep = self._collect_finished(batch, eos_token_ids, results)
+            if keep is not None:
+                if keep:
+                    batch.retire(keep)
+                else:
+                    batch = None
+
+        output = torch.full((num_rows, max(len(tokens) for tokens in results)), self.pad_token_id, dtype=torch.long)
+        for row, tokens in enumerate(results):
+            output[row, :len(tokens)] = tokens
+        return output
@@ -11,6 +11,7 @@ from transformers import AutoConfig, AutoModel, AutoModelForCausalLM, AutoTokeni
 from transformers import VisionEncoderDecoderConfig, VisionEncoderDecoderModel
 from transformers.models.vision_encoder_decoder.modeling_vision_encoder_decoder import logger as base_model_logger
 
+from .decoding import ContinuousGreedyDecoder, get_continuous_decoding_enable, supports_continuous_decoding
 from .unimer_swin import UnimerSwinConfig, UnimerSwinModel, UnimerSwinImageProcessor
 from .unimer_mbart import UnimerMBartConfig, UnimerMBartForCausalLM
 
@@ -468,24 +469,39 @@ class UnimernetModel(VisionEncoderDecoderModel):
         ).loss
         return {"loss": loss}
 
-    def generate(self, samples, do_sample: bool = False, temperature: float = 0.2, top_p: float = 0.95):
+    def generate(
+        self, samples, do_sample: bool = False, temperature: float = 0.2, top_p: float = 0.95, max_active=None
+    ):
+        """
+        max_active: 贪心解码时同时解码的序列数上限，小于输入数量时已结束序列空出的槽位由剩余的公式补入，
+        输入最好按预计输出长度从长到短排列
+        """
         pixel_values = samples["image"]
         num_channels = pixel_values.shape[1]
         if num_channels == 1:
             pixel_values = pixel_values.repeat(1, 3, 1, 1)
-        
-        kwargs = {}
-        if do_sample:
-            kwargs["temperature"] = temperature
-            kwargs["top_p"] = top_p
-        
-        outputs = super().generate(
-            pixel_values=pixel_values,
-            max_new_tokens=self.tokenizer.tokenizer.model_max_length, # required
-            decoder_start_token_id=self.tokenizer.tokenizer.bos_token_id,
-            do_sample=do_sample,
-            **kwargs,
-        )
+
+        if not do_sample and get_continuous_decoding_enable() and supports_continuous_decoding(self.generation_config):
+            outputs = ContinuousGreedyDecoder(
+                self,
+                max_new_tokens=self.tokenizer.tokenizer.model_max_length,
+                decoder_start_token_id=self.tokenizer.tokenizer.bos_token_id,
+                eos_token_id=self.tokenizer.tokenizer.eos_token_id,
+                pad_token_id=self.tokenizer.tokenizer.pad_token_id,
+            ).generate(pixel_values, max_active=max_active)
+        else:
+            kwargs = {}
+            if do_sample:
+                kwargs["temperature"] = temperature
+                kwargs["top_p"] = top_p
+
+            outputs = super().generate(
+                pixel_values=pixel_values,
+                max_new_tokens=self.tokenizer.tokenizer.model_max_length, # required
+                decoder_start_token_id=self.tokenizer.tokenizer.bos_token_id,
+                do_sample=do_sample,
+                **kwargs,
+            )
 
         outputs = outputs[:, 1:].cpu().numpy()
         pred_tokens = self.tokenizer.detokenize(outputs)
@@ -152,9 +152,15 @@ class UnimerMBartLearnedPositionalEmbedding(nn.Embedding):
         self.offset = 2
         super().__init__(num_embeddings + self.offset, embedding_dim)
 
-    def forward(self, input_ids: torch.Tensor, past_key_values_length: int = 0):
+    def forward(
+        self, input_ids: torch.Tensor, past_key_values_length: int = 0, position_ids: Optional[torch.LongTensor] = None
+    ):
         """`input_ids' shape is expected to be [bsz x seqlen]."""
 
+        if position_ids is not None:
+            # 批内各序列的解码进度不同（连续批处理），按序列传入位置
+            return super().forward(position_ids.to(self.weight.device) + self.offset)
+
         bsz, seq_len = input_ids.shape[:2]
         positions = torch.arange(
             past_key_values_length, past_key_values_length + seq_len, dtype=torch.long, device=self.weight.device
@@ -1329,6 +1335,7 @@ class UnimerMBartDecoder(UnimerMBartPreTrainedModel):
         output_attentions: Optional[bool] = None,
         output_hidden_states: Optional[bool] = None,
         return_dict: Optional[bool] = None,
+        position_ids: Optional[torch.LongTensor] = None,
     ) -> Union[Tuple, BaseModelOutputWithPastAndCrossAttentions]:
         r"""
         Args:
@@ -1459,7 +1466,7 @@ class UnimerMBartDecoder(UnimerMBartPreTrainedModel):
                 )
 
         # embed positions
-        positions = self.embed_positions(input, past_key_values_length)
+        positions = self.embed_positions(input, past_key_values_length, position_ids=position_ids)
 
         hidden_states = inputs_embeds + positions.to(inputs_embeds.device)
 
@@ -2182,6 +2189,7 @@ class UnimerMBartForCausalLM(UnimerMBartPreTrainedModel, GenerationMixin):
         output_hidden_states: Optional[bool] = None,
         return_dict: Optional[bool] = None,
         count_gt: Optional[torch.LongTensor] = None,
+        position_ids: Optional[torch.LongTensor] = None,
     ) -> Union[Tuple, CausalLMOutputWithCrossAttentions]:
         r"""
         Args:
@@ -2291,6 +2299,7 @@ class UnimerMBartForCausalLM(UnimerMBartPreTrainedModel, GenerationMixin):
             output_attentions=output_attentions,
             output_hidden_states=output_hidden_states,
             return_dict=return_dict,
+            position_ids=position_ids,
         )
 
         logits = self.lm_head(outputs[0])
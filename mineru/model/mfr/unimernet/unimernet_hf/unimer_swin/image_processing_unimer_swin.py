@@ -3,12 +3,17 @@ from transformers.image_processing_utils import BaseImageProcessor
 import numpy as np
 import cv2
 import albumentations as alb
+import torch
 from albumentations.pytorch import ToTensorV2
 from torchvision.transforms.functional import resize
 
 
 # TODO: dereference cv2 if possible
 class UnimerSwinImageProcessor(BaseImageProcessor):
+    # grayscale normalization, same as the Normalize step of self.transform
+    mean = 0.7931
+    std = 0.1738
+
     def __init__(
             self,
             image_size = (192, 672),
@@ -19,7 +24,7 @@ class UnimerSwinImageProcessor(BaseImageProcessor):
         self.transform = alb.Compose(
             [
                 alb.ToGray(),
-                alb.Normalize((0.7931, 0.7931, 0.7931), (0.1738, 0.1738, 0.1738)),
+                alb.Normalize((self.mean,) * 3, (self.std,) * 3),
                 # alb.Sharpen()
                 ToTensorV2(),
             ]
@@ -29,6 +34,42 @@ class UnimerSwinImageProcessor(BaseImageProcessor):
         image = self.prepare_input(item)
         return self.transform(image=image)['image'][:1]
 
+    def prepare_gray(self, item) -> np.ndarray:
+        """
+        Crop margins, resize and pad like `prepare_input`, then convert to grayscale.
+        Returns a (H, W) uint8 array; images that cannot be processed become blank (padding color).
+        """
+        image = self.prepare_input(item)
+        if image is None:
+            return np.zeros(self.input_size, dtype=np.uint8)
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        return image
+
+    def batch_prepare(self, items, out: np.ndarray = None, executor=None) -> np.ndarray:
+        """
+        Prepare many images into a (N, H, W) uint8 array, optionally written into `out`
+        (e.g. a pinned-memory buffer). With an executor the images are prepared in worker threads;
+        cv2 releases the GIL, so this scales with the number of threads.
+        """
+        if out is None:
+            out = np.empty((len(items), *self.input_size), dtype=np.uint8)
+        prepared = executor.map(self.prepare_gray, items) if executor is not None else map(self.prepare_gray, items)
+        for index, image in enumerate(prepared):
+            out[index] = image
+        return out
+
+    def batch_normalize(self, images: torch.Tensor, dtype=torch.float32) -> torch.Tensor:
+        """Normalize a (N, H, W) uint8 tensor to model input (N, 1, H, W) on the tensor's device."""
+        # (x / 255 - mean) / std, computed in place to avoid extra full-size temporaries
+        images = images.to(dtype=torch.float32)
+        images.mul_(1 / (self.std * 255)).sub_(self.mean / self.std)
+        return images.unsqueeze(1).to(dtype=dtype)
+
+    def batch_call(self, items, dtype=torch.float32, executor=None) -> torch.Tensor:
+        """Batched equivalent of stacking `__call__` over items (with grayscale conversion always applied)."""
+        return self.batch_normalize(torch.from_numpy(self.batch_prepare(items, executor=executor)), dtype)
+
     @staticmethod
     def crop_margin(img: Image.Image) -> Image.Image:
         data = np.array(img.convert("L"))
@@ -95,12 +95,19 @@ class PytorchPaddleOCR(TextSystem):
 
         super().__init__(args)
 
+        # 模型权重和检测参数的标识，用于推理结果缓存
+        self.cache_id = (
+            f'pytorch_paddle/{self.lang}/{det}/{rec}'
+            f'/box_thresh={args.det_db_box_thresh}/unclip_ratio={args.det_db_unclip_ratio}/dilation={args.use_dilation}'
+        )
+
     def ocr(self,
             img,
             det=True,
             rec=True,
             mfd_res=None,
             tqdm_enable=False,
+            rec_batch_num=None,
             ):
         assert isinstance(img, (np.ndarray, list, str, bytes))
         if isinstance(img, list) and det == True:
@@ -144,7 +151,7 @@ class PytorchPaddleOCR(TextSystem):
                     if not isinstance(img, list):
                         img = preprocess_image(img)
                         img = [img]
-                    rec_res, elapse = self.text_recognizer(img, tqdm_enable=tqdm_enable)
+                    rec_res, elapse = self.text_recognizer(img, tqdm_enable=tqdm_enable, batch_num=rec_batch_num)
                     # logger.debug("rec_res num  : {}, elapsed : {}".format(len(rec_res), elapse))
                     ocr_res.append(rec_res)
                 return ocr_res
@@ -288,7 +288,7 @@ class TextRecognizer(BaseOCRV20):
 
         return img
 
-    def __call__(self, img_list, tqdm_enable=False):
+    def __call__(self, img_list, tqdm_enable=False, batch_num=None):
         img_num = len(img_list)
         # Calculate the aspect ratio of all text bars
         width_list = []
@@ -299,7 +299,8 @@ class TextRecognizer(BaseOCRV20):
 
         # rec_res = []
         rec_res = [['', 0.0]] * img_num
-        batch_num = self.rec_batch_num
+        # batch_num由调用方按次传入，不修改共享的rec_batch_num，避免与其他线程中的识别互相影响
+        batch_num = batch_num or self.rec_batch_num
         elapse = 0
         # for beg_img_no in range(0, img_num, batch_num):
         with tqdm(total=img_num, desc='OCR-rec Predict', disable=not tqdm_enable) as pbar:
@@ -20,10 +20,16 @@ class RapidTableModel(object):
         input_args = RapidTableInput(model_type='slanet_plus', model_path=slanet_plus_model_path)
         self.table_model = RapidTable(input_args)
         self.ocr_engine = ocr_engine
+        # 模型权重和所用ocr引擎的标识，用于推理结果缓存
+        self.cache_id = f'rapid_table/{ModelPath.slanet_plus}/{getattr(ocr_engine, "cache_id", "")}'
 
 
     def predict(self, image):
-        bgr_image = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+        # image为BGR numpy数组（页面裁剪视图），兼容传入RGB的PIL图像
+        if isinstance(image, np.ndarray):
+            bgr_image = image
+        else:
+            bgr_image = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
 
         # First check the overall image aspect ratio (height/width)
         img_height, img_width = bgr_image.shape[:2]
@@ -63,8 +69,7 @@ class RapidTableModel(object):
             # Rotate image if necessary
             if is_rotated:
                 # logger.debug("Table appears to be in portrait orientation, rotating 90 degrees clockwise")
-                image = cv2.rotate(np.asarray(image), cv2.ROTATE_90_CLOCKWISE)
-                bgr_image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+                bgr_image = cv2.rotate(bgr_image, cv2.ROTATE_90_CLOCKWISE)
 
         # Continue with OCR on potentially rotated image
         ocr_result = self.ocr_engine.ocr(bgr_image)[0]
@@ -76,7 +81,8 @@ class RapidTableModel(object):
 
 
         if ocr_result:
-            table_results = self.table_model(np.asarray(image), ocr_result)
+            # rapid_table将numpy输入视为BGR（与cv2.imread一致）
+            table_results = self.table_model(bgr_image, ocr_result)
             html_code = table_results.pred_html
             table_cell_bboxes = table_results.cell_bboxes
             logic_points = table_results.logic_points
@@ -20,6 +20,12 @@ def sort_blocks_by_bbox(blocks, page_w, page_h, footnote_blocks):
     """获取所有line并对line排序"""
     sorted_bboxes = sort_lines_by_model(blocks, page_w, page_h, line_height, footnote_blocks)
 
+    return sort_blocks_by_sorted_lines(blocks, sorted_bboxes)
+
+
+def sort_blocks_by_sorted_lines(blocks, sorted_bboxes):
+    """根据已排序的line（sorted_bboxes为None时使用xycut）计算block顺序并重排"""
+
     """根据line的中位数算block的序列关系"""
     blocks = cal_block_index(blocks, sorted_bboxes)
 
@@ -55,6 +61,27 @@ def get_line_height(blocks):
 
 
 def sort_lines_by_model(fix_blocks, page_w, page_h, line_height, footnote_blocks):
+    page_line_list, boxes = prepare_lines_for_model(fix_blocks, page_w, page_h, line_height, footnote_blocks)
+    if boxes is None:
+        return None
+
+    # 使用layoutreader排序
+    model_manager = ModelSingleton()
+    model = model_manager.get_model('layoutreader')
+    with torch.no_grad():
+        orders = do_predict(boxes, model)
+    sorted_bboxes = [page_line_list[i] for i in orders]
+
+    return sorted_bboxes
+
+
+def prepare_lines_for_model(fix_blocks, page_w, page_h, line_height, footnote_blocks):
+    """
+    生成所有line（必要时向block插入虚拟line），并把line bbox缩放到layoutreader的1000x1000坐标系。
+
+    Returns:
+        tuple: (page_line_list, boxes)，line数量超过layoutreader上限时boxes为None，此时应使用xycut排序
+    """
     page_line_list = []
 
     def add_lines_to_block(b):
@@ -88,7 +115,7 @@ def sort_lines_by_model(fix_blocks, page_w, page_h, line_height, footnote_blocks
         add_lines_to_block(footnote_block)
 
     if len(page_line_list) > 200:  # layoutreader最高支持512line
-        return None
+        return page_line_list, None
 
     # 使用layoutreader排序
     x_scale = 1000.0 / page_w
@@ -125,13 +152,8 @@ def sort_lines_by_model(fix_blocks, page_w, page_h, line_height, footnote_blocks
             1000 >= right >= left >= 0 and 1000 >= bottom >= top >= 0
         ), f'Invalid box. right: {right}, left: {left}, bottom: {bottom}, top: {top}'  # noqa: E126, E121
         boxes.append([left, top, right, bottom])
-    model_manager = ModelSingleton()
-    model = model_manager.get_model('layoutreader')
-    with torch.no_grad():
-        orders = do_predict(boxes, model)
-    sorted_bboxes = [page_line_list[i] for i in orders]
 
-    return sorted_bboxes
+    return page_line_list, boxes
 
 
 def insert_lines_into_block(block_bbox, line_height, page_w, page_h):
@@ -238,6 +260,25 @@ def do_predict(boxes: List[List[int]], model) -> List[int]:
     return parse_logits(logits, len(boxes))
 
 
+def do_predict_batch(boxes_list: List[List[List[int]]], model, batch_size: int = 16) -> List[List[int]]:
+    """多个页面的line一起送入layoutreader，按batch_size分批并padding到批内最长序列"""
+    from mineru.model.reading_order.layout_reader import (
+        batch_boxes2inputs, parse_logits, prepare_inputs)
+
+    orders_list = []
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=FutureWarning, module="transformers")
+
+        for index in range(0, len(boxes_list), batch_size):
+            batch_boxes = boxes_list[index: index + batch_size]
+            inputs = batch_boxes2inputs(batch_boxes)
+            inputs = prepare_inputs(inputs, model)
+            logits = model(**inputs).logits.cpu()
+            for i, boxes in enumerate(batch_boxes):
+                orders_list.append(parse_logits(logits[i], len(boxes)))
+    return orders_list
+
+
 def cal_block_index(fix_blocks, sorted_bboxes):
 
     if sorted_bboxes is not None:
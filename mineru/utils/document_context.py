@@ -0,0 +1,225 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import io
+import math
+import os
+
+import numpy as np
+import pypdfium2 as pdfium
+from loguru import logger
+from PIL import Image
+
+from mineru.utils.pdf_reader import pdfium_lock
+
+
+def get_textpage_cache_size():
+    """缓存的文本页数量上限，通过环境变量MINERU_TEXTPAGE_CACHE_SIZE设置，设为0时不缓存"""
+    try:
+        return max(0, int(os.getenv('MINERU_TEXTPAGE_CACHE_SIZE', 64)))
+    except ValueError:
+        logger.warning('MINERU_TEXTPAGE_CACHE_SIZE is not a valid integer, use default 64')
+        return 64
+
+
+class DocumentContext:
+    """
+    只打开一次的pdf文档，分类、渲染、文本提取和可视化共用同一个pdfium句柄。
+
+    页面范围只是原文档上的视图，不会重新生成pdf：下标0对应start_page_id，
+    len()为范围内的页数，用法与pdfium.PdfDocument一致（ctx[i]、len(ctx)、close()）。
+    分类时创建的文本页会被缓存，文本提取阶段直接复用，用完后通过release_textpage释放。
+    """
+
+    def __init__(self, pdf_bytes: bytes, start_page_id=0, end_page_id=None):
+        self.source_bytes = pdf_bytes
+        with pdfium_lock:
+            self._pdf_doc = pdfium.PdfDocument(pdf_bytes)
+            page_num = len(self._pdf_doc)
+
+        end_page_id = end_page_id if end_page_id is not None and end_page_id >= 0 else page_num - 1
+        if end_page_id > page_num - 1:
+            logger.warning("end_page_id is out of range, use pdf_docs length")
+            end_page_id = page_num - 1
+        self.start_page_id = max(0, start_page_id)
+        self.end_page_id = end_page_id
+        self.page_count = max(0, self.end_page_id - self.start_page_id + 1)
+        self.is_full_range = self.start_page_id == 0 and self.page_count == page_num
+
+        self._range_bytes = pdf_bytes if self.is_full_range else None
+        # page_index -> (page, textpage)
+        self._textpages = {}
+        self._textpage_cache_size = get_textpage_cache_size()
+
+    def __len__(self):
+        return self.page_count
+
+    def __getitem__(self, page_index):
+        """返回范围内第page_index页，调用方负责关闭"""
+        return self._pdf_doc[self.to_source_index(page_index)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._pdf_doc is None
+
+    @property
+    def raw(self):
+        """底层pdfium文档的原始句柄，与pdfium.PdfDocument.raw一致，调用方需要持有pdfium_lock"""
+        return self._pdf_doc.raw
+
+    def get_page_size(self, page_index):
+        """第page_index页的尺寸，与page.get_size()一致，不需要加载页面，调用方需要持有pdfium_lock"""
+        return self._pdf_doc.get_page_size(self.to_source_index(page_index))
+
+    def to_source_index(self, page_index):
+        if not 0 <= page_index < self.page_count:
+            raise IndexError(f'page index {page_index} out of range [0, {self.page_count})')
+        return self.start_page_id + page_index
+
+    def get_textpage(self, page_index):
+        """获取第page_index页的文本页，调用方需要持有pdfium_lock，不能关闭返回的文本页，用完后调用release_textpage"""
+        cached = self._textpages.get(page_index)
+        if cached is not None:
+            return cached[1]
+        page = self[page_index]
+        textpage = page.get_textpage()
+        self._textpages[page_index] = (page, textpage)
+        return textpage
+
+    def release_textpage(self, page_index, keep_cached=False):
+        """
+        释放第page_index页的文本页。
+        keep_cached为True时（如分类阶段），缓存未满则保留该文本页供文本提取阶段复用，最多缓存MINERU_TEXTPAGE_CACHE_SIZE页；
+        缓存满后不淘汰已有的页面，保证按页序处理时靠前的页面能命中
+        """
+        with pdfium_lock:
+            # 不计入当前页面，其他缓存的页面未达到上限时才保留当前页面
+            cached_count = len(self._textpages) - (page_index in self._textpages)
+            if keep_cached and cached_count < self._textpage_cache_size:
+                return
+            cached = self._textpages.pop(page_index, None)
+            if cached is not None:
+                page, textpage = cached
+                textpage.close()
+                page.close()
+
+    @property
+    def pdf_bytes(self):
+        """
+        页面范围对应的pdf字节数据，只在需要完整文件时（如落盘原始pdf、多进程后处理）才生成并缓存，
+        范围覆盖整个文档时直接返回原始数据
+        """
+        if self._range_bytes is None:
+            with pdfium_lock:
+                src_doc = self._pdf_doc if self._pdf_doc is not None else pdfium.PdfDocument(self.source_bytes)
+                output_pdf = pdfium.PdfDocument.new()
+                try:
+                    output_pdf.import_pages(src_doc, list(range(self.start_page_id, self.end_page_id + 1)))
+                    output_buffer = io.BytesIO()
+                    output_pdf.save(output_buffer)
+                    self._range_bytes = output_buffer.getvalue()
+                finally:
+                    output_pdf.close()
+                    if src_doc is not self._pdf_doc:
+                        src_doc.close()
+        return self._range_bytes
+
+    def close(self):
+        """关闭pdfium句柄，之后仍然可以通过pdf_bytes获取页面范围的数据"""
+        with pdfium_lock:
+            if self._pdf_doc is None:
+                return
+            for page, textpage in self._textpages.values():
+                textpage.close()
+                page.close()
+            self._textpages.clear()
+            self._pdf_doc.close()
+            self._pdf_doc = None
+
+
+class ImagePage:
+    """图片文档中的页面，提供后处理用到的pdfium页面接口，尺寸以像素为单位（对应72dpi下的pdf坐标）"""
+
+    def __init__(self, image_doc):
+        self._image_doc = image_doc
+
+    def get_size(self):
+        return float(self._image_doc.width), float(self._image_doc.height)
+
+    def get_bbox(self):
+        return 0.0, 0.0, float(self._image_doc.width), float(self._image_doc.height)
+
+    def get_rotation(self):
+        return 0
+
+    def to_numpy(self, max_width_or_height=2560):
+        """
+        解码为BGR numpy数组，返回(img_np, scale)。与pdf页面的渲染一致，最长边超过max_width_or_height时按最长边缩小，
+        否则保持原始分辨率，scale为1
+        """
+        width, height = self._image_doc.width, self._image_doc.height
+        scale = 1.0
+        if max(width, height) > max_width_or_height:
+            scale = max_width_or_height / max(width, height)
+        with Image.open(io.BytesIO(self._image_doc.source_bytes)) as image:
+            image = image.convert("RGB")
+            if scale < 1:
+                # 位图尺寸的取整方式与pdfium渲染一致
+                image = image.resize((math.ceil(width * scale), math.ceil(height * scale)), Image.Resampling.LANCZOS)
+            image_np = np.asarray(image)
+        return np.ascontiguousarray(image_np[..., ::-1]), scale
+
+    def close(self):
+        pass
+
+
+class ImageDocument:
+    """
+    png/jpg输入的单页文档，用法与DocumentContext一致。
+    页面直接解码后送入模型，不经过图片->pdf->图片的转换，最长边超过2560像素时与pdf页面一样按最长边缩小，
+    只有可视化、落盘原始pdf等需要pdf文件的步骤才通过pdf_bytes生成pdf。
+    """
+
+    start_page_id = 0
+    end_page_id = 0
+    page_count = 1
+    is_full_range = True
+
+    def __init__(self, image_bytes: bytes):
+        self.source_bytes = image_bytes
+        # 只读取图片头获取尺寸，像素数据在渲染时才解码
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            self.width, self.height = image.size
+        self._pdf_bytes = None
+
+    def __len__(self):
+        return self.page_count
+
+    def __getitem__(self, page_index):
+        if page_index != 0:
+            raise IndexError(f'page index {page_index} out of range [0, 1)')
+        return ImagePage(self)
+
+    def get_page_size(self, page_index):
+        return self[page_index].get_size()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def pdf_bytes(self):
+        """按需生成的单页pdf，页面尺寸与图片像素尺寸一致"""
+        if self._pdf_bytes is None:
+            from mineru.utils.pdf_image_tools import images_bytes_to_pdf_bytes
+            self._pdf_bytes = images_bytes_to_pdf_bytes(self.source_bytes)
+        return self._pdf_bytes
+
+    def close(self):
+        pass
@@ -5,9 +5,21 @@ from loguru import logger
 from pypdf import PdfReader, PdfWriter
 from reportlab.pdfgen import canvas
 
+from .document_context import DocumentContext, ImageDocument
 from .enum_class import BlockType, ContentType
 
 
+def read_pdf_pages(pdf_bytes):
+    """pdf_bytes为DocumentContext时直接从原始数据中读取范围内的页面，不需要重新生成页面范围的pdf"""
+    if isinstance(pdf_bytes, DocumentContext):
+        pdf_docs = PdfReader(BytesIO(pdf_bytes.source_bytes))
+        return pdf_docs.pages[pdf_bytes.start_page_id:pdf_bytes.end_page_id + 1]
+    if isinstance(pdf_bytes, ImageDocument):
+        # 图片输入只在可视化时才生成pdf
+        return PdfReader(BytesIO(pdf_bytes.pdf_bytes)).pages
+    return PdfReader(BytesIO(pdf_bytes)).pages
+
+
 def draw_bbox_without_number(i, bbox_list, page, c, rgb_config, fill_config):
     new_rgb = [float(color) / 255 for color in rgb_config]
     page_data = bbox_list[i]
@@ -152,11 +164,9 @@ def draw_layout_bbox(pdf_info, pdf_bytes, out_path, filename):
 
         layout_bbox_list.append(page_block_list)
 
-    pdf_bytes_io = BytesIO(pdf_bytes)
-    pdf_docs = PdfReader(pdf_bytes_io)
     output_pdf = PdfWriter()
 
-    for i, page in enumerate(pdf_docs.pages):
+    for i, page in enumerate(read_pdf_pages(pdf_bytes)):
         # 获取原始页面尺寸
         page_width, page_height = float(page.cropbox[2]), float(page.cropbox[3])
         custom_page_size = (page_width, page_height)
@@ -273,11 +283,9 @@ def draw_span_bbox(pdf_info, pdf_bytes, out_path, filename):
         image_list.append(page_image_list)
         table_list.append(page_table_list)
 
-    pdf_bytes_io = BytesIO(pdf_bytes)
-    pdf_docs = PdfReader(pdf_bytes_io)
     output_pdf = PdfWriter()
 
-    for i, page in enumerate(pdf_docs.pages):
+    for i, page in enumerate(read_pdf_pages(pdf_bytes)):
         # 获取原始页面尺寸
         page_width, page_height = float(page.cropbox[2]), float(page.cropbox[3])
         custom_page_size = (page_width, page_height)
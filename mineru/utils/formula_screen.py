@@ -0,0 +1,146 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import ctypes
+import math
+import os
+import re
+
+import pypdfium2.raw as pdfium_c
+
+from mineru.utils.enum_class import CategoryId
+from mineru.utils.pdf_classify import _get_obj_bounds, _get_obj_matrix
+
+# 数学字体：TeX的Computer Modern/AMS数学字体、STIX/XITS、Cambria Math、Word公式编辑器使用的Symbol/MT Extra等
+_MATH_FONT_PATTERN = re.compile(
+    r'CMMI|CMSY|CMEX|CMBSY|MSAM|MSBM|EUFM|EUSM|RSFS|STIX|XITS|Math|Symbol|MTExtra|MT-Extra|Euclid|MnSymbol|'
+    r'ESINT|WASY|TXSY|TXMI|TXEX|PXSY|PXMI|PXEX',
+    re.IGNORECASE
+)
+# 数学运算符、补充数学运算符、杂项数学符号、数学字母数字符号，减号、乘号等普通文档中也很常见的运算符不计入
+_MATH_SYMBOL_PATTERN = re.compile(
+    r'[\u2200-\u2211\u2213-\u2216\u2218\u221a-\u22ff\u27c0-\u27ef\u2980-\u2aff\U0001d400-\U0001d7ff]'
+)
+# 希腊字母、上下标字符
+_SCRIPT_CHAR_PATTERN = re.compile(r'[\u0391-\u03c9\u2070-\u209f\u00b2\u00b3\u00b9]')
+# 数学字体中的这些字符在普通文档中常作为项目符号，不计入
+_BULLET_PATTERN = re.compile(r'[\s\u2022\u25cf\u25aa\u25a0\uf0b7\uf0a7\uf0d8\uf076]')
+
+# 上下标判断：文本对象的字号小于前一个文本对象的该比例，且基线偏移超过前一个文本对象字号的该比例
+SCRIPT_SIZE_RATIO = 0.8
+SCRIPT_RISE_RATIO = 0.15
+# 希腊字母和上下标在单位、脚注中也很常见，数量达到该值才认为页面可能包含公式
+SCRIPT_CHARS_THRESHOLD = 5
+
+
+def get_formula_screen_enable():
+    """
+    是否开启公式预筛，通过环境变量MINERU_FORMULA_SCREEN设置，默认关闭。
+    开启后只有可能包含公式的页面才进行公式检测和识别，不含公式的页面省去MFD和MFR的耗时，
+    但扫描页中只有行内公式、没有行间公式的页面会漏检
+    """
+    return os.getenv('MINERU_FORMULA_SCREEN', 'false').lower() == 'true'
+
+
+def _get_font_name(raw_obj, font_names):
+    raw_font = pdfium_c.FPDFTextObj_GetFont(raw_obj)
+    if not raw_font:
+        return ''
+    # 同一页面中的文本对象共用少量字体，按字体句柄缓存字体名
+    font_key = ctypes.cast(raw_font, ctypes.c_void_p).value
+    font_name = font_names.get(font_key)
+    if font_name is None:
+        length = pdfium_c.FPDFFont_GetBaseFontName(raw_font, None, 0)
+        buffer = ctypes.create_string_buffer(max(length, 1))
+        if length > 0:
+            pdfium_c.FPDFFont_GetBaseFontName(raw_font, buffer, length)
+        font_name = buffer.value.decode('utf-8', errors='ignore')
+        font_names[font_key] = font_name
+    return font_name
+
+
+def _get_obj_text(raw_obj, raw_text_page):
+    length = pdfium_c.FPDFTextObj_GetText(raw_obj, raw_text_page, None, 0)
+    if length <= 2:
+        return ''
+    buffer = ctypes.create_string_buffer(length)
+    pdfium_c.FPDFTextObj_GetText(raw_obj, raw_text_page, ctypes.cast(buffer, ctypes.POINTER(pdfium_c.FPDF_WCHAR)), length)
+    return buffer.raw[:length - 2].decode('utf-16-le', errors='ignore')
+
+
+def _get_obj_font_size(raw_obj):
+    """文本对象在页面坐标系下的字号"""
+    font_size = ctypes.c_float()
+    if not pdfium_c.FPDFTextObj_GetFontSize(raw_obj, ctypes.byref(font_size)):
+        return 0
+    _, _, c, d, _, _ = _get_obj_matrix(raw_obj)
+    return font_size.value * math.hypot(c, d)
+
+
+def get_text_formula_signals(text_page, stop_early=False):
+    """
+    统计页面中公式相关的信号，调用方需要持有pdfium_lock。
+    数学符号和上下标字符从整页文本中用正则统计，数学字体和字号变小、基线偏移的上下标逐个文本对象判断，
+    不逐字符调用pdfium，单页耗时在毫秒级。stop_early为True时，一旦可以判定页面包含公式就停止统计。
+
+    Returns:
+        dict: math_font_chars 数学字体中的字符数，math_symbols 数学运算符/符号数，
+              script_chars 希腊字母、上下标字符以及字号变小且基线偏移的文本对象数
+    """
+    text = text_page.get_text_range()
+    math_symbols = len(_MATH_SYMBOL_PATTERN.findall(text))
+    script_chars = len(_SCRIPT_CHAR_PATTERN.findall(text))
+    if stop_early and (math_symbols > 0 or script_chars >= SCRIPT_CHARS_THRESHOLD):
+        return {'math_font_chars': 0, 'math_symbols': math_symbols, 'script_chars': script_chars}
+
+    # 文本对象的文字只能通过所属页面的文本页获取
+    raw_page = text_page.page.raw
+    raw_text_page = text_page.raw
+    math_font_chars = 0
+    font_names = {}
+    prev = None
+    for index in range(pdfium_c.FPDFPage_CountObjects(raw_page)):
+        raw_obj = pdfium_c.FPDFPage_GetObject(raw_page, index)
+        if pdfium_c.FPDFPageObj_GetType(raw_obj) != pdfium_c.FPDF_PAGEOBJ_TEXT:
+            continue
+        if _MATH_FONT_PATTERN.search(_get_font_name(raw_obj, font_names)):
+            math_font_chars += len(_BULLET_PATTERN.sub('', _get_obj_text(raw_obj, raw_text_page)))
+            if stop_early and math_font_chars > 0:
+                break
+
+        box = _get_obj_bounds(raw_obj)
+        if box is None:
+            continue
+        font_size = _get_obj_font_size(raw_obj)
+        baseline = _get_obj_matrix(raw_obj)[5]
+        if prev is not None:
+            prev_size, prev_baseline, prev_right = prev
+            rise = abs(baseline - prev_baseline)
+            if (
+                0 < font_size < prev_size * SCRIPT_SIZE_RATIO
+                and prev_size * SCRIPT_RISE_RATIO < rise < prev_size
+                # 紧跟在前一个文本对象之后
+                and prev_right - prev_size <= box[0] <= prev_right + prev_size
+            ):
+                script_chars += 1
+                if stop_early and script_chars >= SCRIPT_CHARS_THRESHOLD:
+                    break
+                continue
+        prev = (font_size, baseline, box[2])
+    return {'math_font_chars': math_font_chars, 'math_symbols': math_symbols, 'script_chars': script_chars}
+
+
+def text_page_may_contain_formula(text_page):
+    """根据字符流判断文本页是否可能包含公式，宁可多判，调用方需要持有pdfium_lock"""
+    signals = get_text_formula_signals(text_page, stop_early=True)
+    return (
+        signals['math_font_chars'] > 0
+        or signals['math_symbols'] > 0
+        or signals['script_chars'] >= SCRIPT_CHARS_THRESHOLD
+    )
+
+
+def layout_may_contain_formula(layout_res):
+    """版面检测结果中包含行间公式或公式编号时，页面需要进行公式检测"""
+    for res in layout_res:
+        if int(res['category_id']) in (CategoryId.InterlineEquation_Layout, CategoryId.InterlineEquationNumber_Layout):
+            return True
+    return False
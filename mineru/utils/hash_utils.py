@@ -27,4 +27,12 @@ def str_sha256(input_string):
 
 def dict_md5(d):
     json_str = json.dumps(d, sort_keys=True, ensure_ascii=False)
-    return hashlib.md5(json_str.encode('utf-8')).hexdigest()
\ No newline at end of file
+    return hashlib.md5(json_str.encode('utf-8')).hexdigest()
+
+def file_md5(file_path, chunk_size=1024 * 1024):
+    # 分块读取，避免大文件一次性读入内存
+    hasher = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest().upper()
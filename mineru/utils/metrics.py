@@ -0,0 +1,138 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from loguru import logger
+
+_active_collector = None
+
+
+class MetricsCollector:
+    """
+    推理和后处理各阶段的耗时统计。
+
+    每条记录为一个dict，包含stage、items、batch_size、elapsed、items_per_sec等字段，
+    可以通过callbacks实时获取每条记录，也可以在结束后通过summary()/dump()获取汇总结果。
+
+    Example:
+        with collect_metrics() as collector:
+            do_parse(...)
+        print(collector.summary())
+    """
+
+    def __init__(self, callbacks=None):
+        self.records = []
+        self.callbacks = list(callbacks or [])
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def record(self, stage, elapsed, items=1, batch_size=None, **extra):
+        record = {
+            'stage': stage,
+            'items': items,
+            'batch_size': batch_size if batch_size is not None else items,
+            'elapsed': round(elapsed, 6),
+            'items_per_sec': round(items / elapsed, 3) if elapsed > 0 else None,
+            'timestamp': round(time.time() - self.start_time, 6),
+        }
+        record.update(extra)
+        with self._lock:
+            self.records.append(record)
+        for callback in self.callbacks:
+            try:
+                callback(record)
+            except Exception as e:
+                logger.warning(f'metrics callback failed: {e}')
+        return record
+
+    def summary(self):
+        """按stage汇总总耗时、批次数、处理数量和吞吐"""
+        stages = {}
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            stage = stages.setdefault(record['stage'], {'elapsed': 0.0, 'batches': 0, 'items': 0})
+            stage['elapsed'] += record['elapsed']
+            stage['batches'] += 1
+            stage['items'] += record['items']
+        for stage in stages.values():
+            stage['items_per_sec'] = round(stage['items'] / stage['elapsed'], 3) if stage['elapsed'] > 0 else None
+            stage['elapsed'] = round(stage['elapsed'], 3)
+        return {'wall_time': round(time.time() - self.start_time, 3), 'stages': stages}
+
+    def to_dict(self):
+        with self._lock:
+            records = list(self.records)
+        return {'summary': self.summary(), 'records': records}
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=4)
+
+
+def get_metrics_collector():
+    return _active_collector
+
+
+def set_metrics_collector(collector):
+    """设置全局的collector，传入None关闭统计；返回之前的collector"""
+    global _active_collector
+    previous = _active_collector
+    _active_collector = collector
+    return previous
+
+
+@contextmanager
+def collect_metrics(collector=None, callbacks=None):
+    """在with块内启用统计，退出后恢复之前的collector"""
+    if collector is None:
+        collector = MetricsCollector(callbacks=callbacks)
+    previous = set_metrics_collector(collector)
+    try:
+        yield collector
+    finally:
+        set_metrics_collector(previous)
+
+
+class _StageTimer:
+    __slots__ = ('collector', 'stage', 'items', 'batch_size', 'extra', 'start')
+
+    def __init__(self, collector, stage, items, batch_size, extra):
+        self.collector = collector
+        self.stage = stage
+        self.items = items
+        self.batch_size = batch_size
+        self.extra = extra
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.collector.record(
+                self.stage, time.perf_counter() - self.start, items=self.items, batch_size=self.batch_size, **self.extra
+            )
+        return False
+
+
+_NULL_TIMER = nullcontext()
+
+
+def stage_timer(stage, items=1, batch_size=None, **extra):
+    """
+    统计with块的耗时，未启用统计时返回空的上下文管理器，几乎没有额外开销。
+
+    Example:
+        with stage_timer('layout', items=len(images)):
+            layout_res = layout_model.batch_predict(images, batch_size)
+    """
+    collector = _active_collector
+    if collector is None:
+        return _NULL_TIMER
+    return _StageTimer(collector, stage, items, batch_size, extra)
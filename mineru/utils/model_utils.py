@@ -22,10 +22,16 @@ def crop_img(input_res, input_img, crop_paste_x=0, crop_paste_y=0):
     crop_new_width = crop_xmax - crop_xmin + crop_paste_x * 2
     crop_new_height = crop_ymax - crop_ymin + crop_paste_y * 2
 
-    if isinstance(input_img, np.ndarray):
+    # BGR数组，或可以按区域渲染的多分辨率页面（同样支持numpy切片）
+    if not isinstance(input_img, Image.Image):
+
+        # 不需要留白时直接返回切片视图，不做拷贝
+        if crop_paste_x == 0 and crop_paste_y == 0:
+            return_list = [0, 0, crop_xmin, crop_ymin, crop_xmax, crop_ymax, crop_new_width, crop_new_height]
+            return input_img[crop_ymin:crop_ymax, crop_xmin:crop_xmax], return_list
 
         # Create a white background array
-        return_image = np.ones((crop_new_height, crop_new_width, 3), dtype=np.uint8) * 255
+        return_image = np.full((crop_new_height, crop_new_width, 3), 255, dtype=np.uint8)
 
         # Crop the original image using numpy slicing
         cropped_img = input_img[crop_ymin:crop_ymax, crop_xmin:crop_xmax]
@@ -0,0 +1,152 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from loguru import logger
+from PIL import Image
+
+
+class PageImageStore:
+    """
+    限制常驻内存的页面位图总大小。超出预算时按最近访问顺序淘汰页面位图，再次访问时按需重建：
+    默认从pdfium重新渲染，开启spill或页面无法重新渲染时，淘汰前将位图以低压缩级别的png写入临时目录，之后从文件读回。
+    页面的middle json确定后调用PageImage.release()释放，页面同时从store中移除。
+    """
+
+    def __init__(self, budget_mb, spill=False, spill_dir=None):
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.spill = spill
+        self._spill_root = spill_dir
+        self._spill_dir = None
+        self._spill_count = 0
+        self._lock = threading.RLock()
+        # id(page_image) -> page_image，按最近访问排序，只包含位图常驻内存的页面
+        self._resident = OrderedDict()
+        self._resident_bytes = 0
+        self.stats = {'evicted': 0, 'reloaded': 0, 'spilled': 0}
+
+    @property
+    def resident_bytes(self):
+        return self._resident_bytes
+
+    def add(self, page_image, render_fn=None):
+        """
+        注册页面，render_fn为重新渲染该页、返回BGR数组的函数，未提供时淘汰前写入spill文件。
+        """
+        with self._lock:
+            page_image._store = self
+            page_image._render_fn = render_fn
+            self._on_resident(page_image)
+
+    def touch(self, page_image):
+        with self._lock:
+            key = id(page_image)
+            if key in self._resident:
+                self._resident.move_to_end(key)
+
+    def on_reload(self, page_image):
+        """淘汰后的页面被重新加载"""
+        with self._lock:
+            self.stats['reloaded'] += 1
+            self._on_resident(page_image)
+
+    def discard(self, page_image):
+        """页面已经释放，不再需要重建"""
+        with self._lock:
+            self._forget(page_image)
+            spill_path = page_image._spill_path
+            page_image._spill_path = None
+        if spill_path is not None:
+            try:
+                os.remove(spill_path)
+            except OSError:
+                pass
+
+    def _on_resident(self, page_image):
+        key = id(page_image)
+        if key in self._resident:
+            self._resident.move_to_end(key)
+            return
+        self._resident[key] = page_image
+        self._resident_bytes += page_image.nbytes
+        # 刚加载的页面在队尾，不会被立即淘汰
+        while self._resident_bytes > self.budget and len(self._resident) > 1:
+            _, victim = self._resident.popitem(last=False)
+            self._resident_bytes -= victim.nbytes
+            self._evict(victim)
+
+    def _forget(self, page_image):
+        if self._resident.pop(id(page_image), None) is not None:
+            self._resident_bytes -= page_image.nbytes
+
+    def _evict(self, page_image):
+        img_np = page_image._img_np
+        if img_np is None:
+            return
+        if (self.spill or page_image._render_fn is None) and page_image._spill_path is None:
+            page_image._spill_path = self._write_spill(img_np)
+            self.stats['spilled'] += 1
+        page_image._drop_bitmaps()
+        self.stats['evicted'] += 1
+
+    def load(self, page_image):
+        """重建被淘汰的页面位图"""
+        if page_image._spill_path is not None:
+            with Image.open(page_image._spill_path) as image:
+                return np.ascontiguousarray(np.asarray(image.convert('RGB'))[..., ::-1])
+        if page_image._render_fn is not None:
+            return page_image._render_fn()
+        raise RuntimeError('page image has been released')
+
+    def _write_spill(self, img_np):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix='mineru_pages_', dir=self._spill_root)
+            atexit.register(shutil.rmtree, self._spill_dir, True)
+        self._spill_count += 1
+        spill_path = os.path.join(self._spill_dir, f'{self._spill_count}.png')
+        # png无损，压缩级别1在速度和体积之间取折中
+        Image.fromarray(np.ascontiguousarray(img_np[..., ::-1])).save(spill_path, format='PNG', compress_level=1)
+        return spill_path
+
+    def close(self):
+        with self._lock:
+            self._resident.clear()
+            self._resident_bytes = 0
+            spill_dir, self._spill_dir = self._spill_dir, None
+        if spill_dir is not None:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_page_image_store():
+    """
+    进程内共享的页面位图store，通过环境变量配置：
+    MINERU_PAGE_IMAGE_BUDGET_MB 常驻页面位图的总大小上限(MB)，默认0表示不限制（不启用store）；
+    MINERU_PAGE_IMAGE_SPILL 为true时淘汰的页面写入临时文件而不是重新渲染；
+    MINERU_PAGE_IMAGE_SPILL_DIR spill文件所在目录，默认为系统临时目录。
+    """
+    global _store
+    try:
+        budget_mb = float(os.getenv('MINERU_PAGE_IMAGE_BUDGET_MB', 0))
+    except ValueError:
+        logger.warning('MINERU_PAGE_IMAGE_BUDGET_MB is not a valid number, page image store disabled')
+        return None
+    if budget_mb <= 0:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = PageImageStore(
+                budget_mb,
+                spill=os.getenv('MINERU_PAGE_IMAGE_SPILL', 'false').lower() == 'true',
+                spill_dir=os.getenv('MINERU_PAGE_IMAGE_SPILL_DIR', None),
+            )
+            logger.info(f'page image store enabled, budget: {budget_mb}MB, spill: {_store.spill}')
+        return _store
@@ -1,17 +1,30 @@
 # Copyright (c) Opendatalab. All rights reserved.
+import ctypes
 import re
-from io import BytesIO
+
 import numpy as np
 import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
 from loguru import logger
-from pdfminer.high_level import extract_text
-from pdfminer.pdfparser import PDFParser
-from pdfminer.pdfdocument import PDFDocument
-from pdfminer.pdfpage import PDFPage
-from pdfminer.pdfinterp import PDFResourceManager
-from pdfminer.pdfinterp import PDFPageInterpreter
-from pdfminer.layout import LAParams, LTImage, LTFigure
-from pdfminer.converter import PDFPageAggregator
+
+from mineru.utils.document_context import DocumentContext
+from mineru.utils.pdf_reader import pdfium_lock
+
+# 每页清理后的有效字符数低于该值时，认为文本层缺失
+CHARS_THRESHOLD = 50
+# 无法映射到unicode的字符占比超过该值时，认为是乱码
+INVALID_CHARS_THRESHOLD = 0.05
+# 图像覆盖页面面积的比例超过该值时，认为是扫描页
+IMAGE_COVERAGE_THRESHOLD = 0.8
+# 有效字符很少的页面中，图像覆盖面积的比例超过该值时，认为文本在图像中；插图页的小图和图注不会因此使用OCR
+TEXTLESS_IMAGE_COVERAGE_THRESHOLD = 0.5
+# 文档级判断时最多抽样的页数
+MAX_SAMPLE_PAGES = 10
+# 文档权限中的"复制或提取文本"位
+_PERMISSION_EXTRACT = 0x10
+
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+_IDENTITY_MATRIX = (1, 0, 0, 1, 0, 0)
 
 
 def classify(pdf_bytes):
@@ -25,236 +38,325 @@ def classify(pdf_bytes):
         str: 'txt' 表示可以直接提取文本，'ocr' 表示需要OCR
     """
     try:
-        # 从字节数据加载PDF
-        sample_pdf_bytes = extract_pages(pdf_bytes)
-        pdf = pdfium.PdfDocument(sample_pdf_bytes)
-
-        # 获取PDF页数
-        page_count = len(pdf)
-
-        # 如果PDF页数为0，直接返回OCR
-        if page_count == 0:
-            return 'ocr'
-
-        # 检查的页面数（最多检查10页）
-        pages_to_check = min(page_count, 10)
-
-        # 设置阈值：如果每页平均少于50个有效字符，认为需要OCR
-        chars_threshold = 50
-
-        if (get_avg_cleaned_chars_per_page(pdf, pages_to_check) < chars_threshold) or detect_invalid_chars(sample_pdf_bytes):
-            return 'ocr'
-        else:
-
-            if get_high_image_coverage_ratio(sample_pdf_bytes, pages_to_check) >= 0.8:
-                return 'ocr'
-
-            return 'txt'
+        with pdfium_lock:
+            pdf = pdfium.PdfDocument(pdf_bytes)
+            try:
+                page_count = len(pdf)
+                # 如果PDF页数为0，直接返回OCR
+                if page_count == 0:
+                    return 'ocr'
+                # 随机抽取最多10页，只用pdfium遍历一次
+                page_stats = [get_page_stats(pdf, page_index) for page_index in sample_page_indices(page_count)]
+                extractable = is_text_extractable(pdf)
+            finally:
+                pdf.close()
+        return classify_doc(page_stats, extractable)
     except Exception as e:
         logger.error(f"判断PDF类型时出错: {e}")
         # 出错时默认使用OCR
         return 'ocr'
 
 
-def get_avg_cleaned_chars_per_page(pdf_doc, pages_to_check):
-    # 总字符数
-    total_chars = 0
-    # 清理后的总字符数
-    cleaned_total_chars = 0
+def sample_page_indices(page_count):
+    """文档级判断时随机抽样的页面，最多MAX_SAMPLE_PAGES页，按页序排列"""
+    page_indices = np.random.choice(page_count, min(page_count, MAX_SAMPLE_PAGES), replace=False).tolist()
+    return sorted(page_indices)
 
-    # 检查前几页的文本
-    for i in range(pages_to_check):
-        page = pdf_doc[i]
-        text_page = page.get_textpage()
-        text = text_page.get_text_bounded()
-        total_chars += len(text)
 
-        # 清理提取的文本，移除空白字符
-        cleaned_text = re.sub(r'\s+', '', text)
-        cleaned_total_chars += len(cleaned_text)
-
-    # 计算平均每页字符数
-    avg_cleaned_chars_per_page = cleaned_total_chars / pages_to_check
+def is_text_extractable(pdf):
+    """
+    与原先pdfminer的is_extractable一致，加密文档没有授予提取文本的权限时返回False，调用方需要持有pdfium_lock
 
-    # logger.debug(f"PDF分析: 平均每页清理后{avg_cleaned_chars_per_page:.1f}字符")
+    Args:
+        pdf: pdfium.PdfDocument或DocumentContext
+    """
+    return bool(pdfium_c.FPDF_GetDocPermissions(pdf.raw) & _PERMISSION_EXTRACT)
 
-    pdf_doc.close()  # 关闭PDF文档
 
-    return avg_cleaned_chars_per_page
+class PageClassifier:
+    """
+    auto模式下逐页判断每一页是可以直接提取文本还是需要OCR。
 
+    文档级判断与原先一致，只抽样最多MAX_SAMPLE_PAGES页，需要OCR的文档所有页面都使用OCR（doc_decision为'ocr'）；
+    可以直接提取文本的文档，其余页面的统计量在classify(page_index)时才计算，流水线中即页面进入推理窗口时，
+    不需要在开始推理前扫描整个文档。
+    """
 
-def get_high_image_coverage_ratio(sample_pdf_bytes, pages_to_check):
-    # 创建内存文件对象
-    pdf_stream = BytesIO(sample_pdf_bytes)
+    def __init__(self, pdf_doc):
+        """pdf_doc为pdfium.PdfDocument或DocumentContext，后者在缓存未满时保留文本页供文本提取复用"""
+        self.pdf_doc = pdf_doc
+        # 抽样页面的统计量，逐页判断时复用一次
+        self._sample_stats = {}
+        try:
+            with pdfium_lock:
+                page_count = len(pdf_doc)
+                extractable = is_text_extractable(pdf_doc)
+            for page_index in sample_page_indices(page_count) if page_count > 0 else []:
+                # 每页单独持锁，扫描期间其他线程（如流水线中的渲染线程）可以穿插使用pdfium
+                with pdfium_lock:
+                    self._sample_stats[page_index] = get_page_stats(pdf_doc, page_index)
+            self.doc_decision = classify_doc(list(self._sample_stats.values()), extractable)
+        except Exception as e:
+            logger.error(f"判断PDF类型时出错: {e}")
+            # 出错时默认全部使用OCR
+            self.doc_decision = 'ocr'
+        if self.doc_decision == 'ocr':
+            self._sample_stats.clear()
+
+    def classify(self, page_index):
+        """第page_index页的判断结果，'txt' 或 'ocr'"""
+        if self.doc_decision == 'ocr':
+            return 'ocr'
+        stats = self._sample_stats.pop(page_index, None)
+        if stats is None:
+            try:
+                with pdfium_lock:
+                    stats = get_page_stats(self.pdf_doc, page_index)
+            except Exception as e:
+                logger.error(f"判断第{page_index}页类型时出错: {e}")
+                return 'ocr'
+        return classify_page(stats)
 
-    # 创建PDF解析器
-    parser = PDFParser(pdf_stream)
 
-    # 创建PDF文档对象
-    document = PDFDocument(parser)
+def classify_pages(pdf_bytes):
+    """
+    逐页判断PDF的每一页是可以直接提取文本还是需要OCR，混合文档中只有扫描页需要OCR
 
-    # 检查文档是否允许文本提取
-    if not document.is_extractable:
-        # logger.warning("PDF不允许内容提取")
-        return 1.0  # 默认为高覆盖率，因为无法提取内容
+    Args:
+        pdf_bytes: PDF文件的字节数据，或已打开的DocumentContext（复用其句柄，并缓存文本页供后续文本提取使用）
 
-    # 创建资源管理器和参数对象
-    rsrcmgr = PDFResourceManager()
-    laparams = LAParams(
-        line_overlap=0.5,
-        char_margin=2.0,
-        line_margin=0.5,
-        word_margin=0.1,
-        boxes_flow=None,
-        detect_vertical=False,
-        all_texts=False,
-    )
+    Returns:
+        list[str]: 每页的判断结果，'txt' 或 'ocr'，无法打开的文件返回空列表
+    """
+    if isinstance(pdf_bytes, DocumentContext):
+        pdf = pdf_bytes
+    else:
+        try:
+            with pdfium_lock:
+                pdf = pdfium.PdfDocument(pdf_bytes)
+        except Exception as e:
+            logger.error(f"判断PDF类型时出错: {e}")
+            return []
+    try:
+        classifier = PageClassifier(pdf)
+        return [classifier.classify(page_index) for page_index in range(len(pdf))]
+    finally:
+        if pdf is not pdf_bytes:
+            with pdfium_lock:
+                pdf.close()
 
-    # 创建聚合器
-    device = PDFPageAggregator(rsrcmgr, laparams=laparams)
 
-    # 创建解释器
-    interpreter = PDFPageInterpreter(rsrcmgr, device)
+def get_ocr_enable(page_decisions):
+    """
+    将逐页判断结果转为ocr_enable：所有页面结论相同时返回bool，否则返回按页的bool列表
+    """
+    page_ocr_list = [decision == 'ocr' for decision in page_decisions]
+    if len(page_ocr_list) == 0 or all(page_ocr_list):
+        return True
+    if not any(page_ocr_list):
+        return False
+    return page_ocr_list
 
-    # 记录高图像覆盖率的页面数量
-    high_image_coverage_pages = 0
-    page_count = 0
 
-    # 遍历页面
-    for page in PDFPage.create_pages(document):
-        # 控制检查的页数
-        if page_count >= pages_to_check:
-            break
+def get_page_ocr_enable(ocr_enable, page_index):
+    """ocr_enable可以是整个文档的bool，也可以是按页的bool列表"""
+    if isinstance(ocr_enable, (list, tuple)):
+        return ocr_enable[page_index]
+    return ocr_enable
 
-        # 处理页面
-        interpreter.process_page(page)
-        layout = device.get_result()
 
-        # 页面尺寸
-        page_width = layout.width
-        page_height = layout.height
-        page_area = page_width * page_height
+def classify_page(stats):
+    """
+    单页判断，以下情况需要OCR：
+    1. 乱码字符占比过高；
+    2. 图像几乎覆盖整个页面；
+    3. 有效字符很少，且图像覆盖了页面的大部分（文本在图像中）。
+    只有小图和图注的插图页、没有图像也没有文本的页面（空白页、矢量绘制的文字）单独判断时按txt处理，
+    与原先的文档级判断一致，文本缺失的span会在后处理中单独OCR；整个文档都是这样的页面时，由文档级规则判断为OCR。
+    """
+    if get_invalid_chars_ratio(stats['cleaned_chars'], stats['invalid_chars']) > INVALID_CHARS_THRESHOLD:
+        return 'ocr'
+    if stats['image_coverage'] >= IMAGE_COVERAGE_THRESHOLD:
+        return 'ocr'
+    if stats['cleaned_chars'] < CHARS_THRESHOLD and stats['image_coverage'] >= TEXTLESS_IMAGE_COVERAGE_THRESHOLD:
+        return 'ocr'
+    return 'txt'
 
-        # 计算图像覆盖的总面积
-        image_area = 0
 
-        # 遍历页面元素
-        for element in layout:
-            # 检查是否为图像或图形元素
-            if isinstance(element, (LTImage, LTFigure)):
-                # 计算图像边界框面积
-                img_width = element.width
-                img_height = element.height
-                img_area = img_width * img_height
-                image_area += img_area
+def classify_doc(page_stats, extractable=True):
+    """文档级判断，与逐页判断使用相同的统计量，阈值规则与原先基于pdfminer的实现一致"""
+    if len(page_stats) == 0:
+        return 'ocr'
 
-        # 计算覆盖率
-        coverage_ratio = min(image_area / page_area, 1.0) if page_area > 0 else 0
-        # logger.debug(f"PDF分析: 页面 {page_count + 1} 图像覆盖率: {coverage_ratio:.2f}")
+    # 原先不允许提取内容的文档按图像覆盖率为1处理，即使用OCR
+    if not extractable:
+        return 'ocr'
 
-        # 判断是否为高覆盖率
-        if coverage_ratio >= 0.8:  # 使用80%作为高覆盖率的阈值
-            high_image_coverage_pages += 1
+    # 平均每页有效字符数过少
+    cleaned_chars = sum(stats['cleaned_chars'] for stats in page_stats)
+    if cleaned_chars / len(page_stats) < CHARS_THRESHOLD:
+        return 'ocr'
 
-        page_count += 1
+    # 乱码字符占比过高
+    invalid_chars = sum(stats['invalid_chars'] for stats in page_stats)
+    if get_invalid_chars_ratio(cleaned_chars, invalid_chars) > INVALID_CHARS_THRESHOLD:
+        return 'ocr'
 
-    # 如果没有处理任何页面，返回0
-    if page_count == 0:
-        return 0.0
+    # 大部分页面被图像覆盖
+    high_coverage_pages = sum(1 for stats in page_stats if stats['image_coverage'] >= IMAGE_COVERAGE_THRESHOLD)
+    if high_coverage_pages / len(page_stats) >= 0.8:
+        return 'ocr'
 
-    # 计算高图像覆盖率的页面比例
-    high_coverage_ratio = high_image_coverage_pages / page_count
-    # logger.debug(f"PDF分析: 高图像覆盖页面比例: {high_coverage_ratio:.2f}")
+    return 'txt'
 
-    # 关闭资源
-    pdf_stream.close()
 
-    return high_coverage_ratio
+def get_invalid_chars_ratio(cleaned_chars, invalid_chars):
+    if cleaned_chars == 0:
+        return 0
+    return invalid_chars / cleaned_chars
 
 
-def extract_pages(src_pdf_bytes: bytes) -> bytes:
+def get_page_stats(pdf_doc, page_index):
     """
-    从PDF字节数据中随机提取最多10页，返回新的PDF字节数据
-
-    Args:
-        src_pdf_bytes: PDF文件的字节数据
+    用pdfium一次遍历获取单页的分类统计量，调用方需要持有pdfium_lock。
+    pdf_doc为DocumentContext时，文本页在缓存未满时保留，供后续文本提取复用
 
     Returns:
-        bytes: 提取页面后的PDF字节数据
+        dict: cleaned_chars 去除空白后的字符数，invalid_chars 无法映射到unicode的字符数，
+              image_count 图像对象数量，image_coverage 图像覆盖页面面积的比例
     """
+    page = pdf_doc[page_index]
+    try:
+        if isinstance(pdf_doc, DocumentContext):
+            try:
+                cleaned_chars, invalid_chars = _count_chars(pdf_doc.get_textpage(page_index))
+            finally:
+                pdf_doc.release_textpage(page_index, keep_cached=True)
+        else:
+            text_page = page.get_textpage()
+            try:
+                cleaned_chars, invalid_chars = _count_chars(text_page)
+            finally:
+                text_page.close()
+
+        page_width, page_height = page.get_size()
+        image_boxes = []
+        _collect_image_boxes(page.raw, _IDENTITY_MATRIX, image_boxes, is_form=False)
+        image_coverage = _get_coverage(image_boxes, page_width, page_height)
+    finally:
+        page.close()
+
+    return {
+        'cleaned_chars': cleaned_chars,
+        'invalid_chars': invalid_chars,
+        'image_count': len(image_boxes),
+        'image_coverage': image_coverage,
+    }
+
+
+def _count_chars(text_page):
+    """
+    统计有效字符数和乱码字符数。
+    字体缺少ToUnicode映射时pdfminer会输出(cid:xxx)，pdfium中对应的字符会标记unicode映射错误。
+    """
+    text = text_page.get_text_range()
+    cleaned_chars = len(_WHITESPACE_PATTERN.sub('', text))
+    if cleaned_chars == 0:
+        return 0, 0
+
+    raw_text_page = text_page.raw
+    invalid_chars = 0
+    if hasattr(pdfium_c, 'FPDFText_HasUnicodeMapError'):
+        for index in range(text_page.count_chars()):
+            if pdfium_c.FPDFText_HasUnicodeMapError(raw_text_page, index) == 1:
+                invalid_chars += 1
+    else:
+        # 较旧的pdfium没有该接口，退化为统计替换字符
+        for index in range(text_page.count_chars()):
+            if pdfium_c.FPDFText_GetUnicode(raw_text_page, index) == 0xFFFD:
+                invalid_chars += 1
+    return cleaned_chars, invalid_chars
+
+
+def _multiply_matrix(m1, m2):
+    """先应用m1再应用m2，矩阵格式与pdf一致：(a, b, c, d, e, f)"""
+    a1, b1, c1, d1, e1, f1 = m1
+    a2, b2, c2, d2, e2, f2 = m2
+    return (
+        a1 * a2 + b1 * c2,
+        a1 * b2 + b1 * d2,
+        c1 * a2 + d1 * c2,
+        c1 * b2 + d1 * d2,
+        e1 * a2 + f1 * c2 + e2,
+        e1 * b2 + f1 * d2 + f2,
+    )
 
-    # 从字节数据加载PDF
-    pdf = pdfium.PdfDocument(src_pdf_bytes)
-
-    # 获取PDF页数
-    total_page = len(pdf)
-    if total_page == 0:
-        # 如果PDF没有页面，直接返回空文档
-        logger.warning("PDF is empty, return empty document")
-        return b''
-
-    # 选择最多10页
-    select_page_cnt = min(10, total_page)
 
-    # 从总页数中随机选择页面
-    page_indices = np.random.choice(total_page, select_page_cnt, replace=False).tolist()
+def _transform_box(box, matrix):
+    a, b, c, d, e, f = matrix
+    left, bottom, right, top = box
+    xs, ys = [], []
+    for x, y in ((left, bottom), (left, top), (right, bottom), (right, top)):
+        xs.append(a * x + c * y + e)
+        ys.append(b * x + d * y + f)
+    return min(xs), min(ys), max(xs), max(ys)
 
-    # 创建一个新的PDF文档
-    sample_docs = pdfium.PdfDocument.new()
 
-    try:
-        # 将选择的页面导入新文档
-        sample_docs.import_pages(pdf, page_indices)
+def _get_obj_bounds(raw_obj):
+    left, bottom, right, top = ctypes.c_float(), ctypes.c_float(), ctypes.c_float(), ctypes.c_float()
+    ok = pdfium_c.FPDFPageObj_GetBounds(
+        raw_obj, ctypes.byref(left), ctypes.byref(bottom), ctypes.byref(right), ctypes.byref(top)
+    )
+    if not ok:
+        return None
+    return left.value, bottom.value, right.value, top.value
 
-        # 将新PDF保存到内存缓冲区
-        output_buffer = BytesIO()
-        sample_docs.save(output_buffer)
 
-        # 获取字节数据
-        return output_buffer.getvalue()
-    except Exception as e:
-        logger.exception(e)
-        return b''  # 出错时返回空字节
+def _get_obj_matrix(raw_obj):
+    fs_matrix = pdfium_c.FS_MATRIX()
+    if not pdfium_c.FPDFPageObj_GetMatrix(raw_obj, ctypes.byref(fs_matrix)):
+        return _IDENTITY_MATRIX
+    return fs_matrix.a, fs_matrix.b, fs_matrix.c, fs_matrix.d, fs_matrix.e, fs_matrix.f
 
 
-def detect_invalid_chars(sample_pdf_bytes: bytes) -> bool:
-    """"
-    检测PDF中是否包含非法字符
-    """
-    '''pdfminer比较慢,需要先随机抽取10页左右的sample'''
-    # sample_pdf_bytes = extract_pages(src_pdf_bytes)
-    sample_pdf_file_like_object = BytesIO(sample_pdf_bytes)
-    laparams = LAParams(
-        line_overlap=0.5,
-        char_margin=2.0,
-        line_margin=0.5,
-        word_margin=0.1,
-        boxes_flow=None,
-        detect_vertical=False,
-        all_texts=False,
-    )
-    text = extract_text(pdf_file=sample_pdf_file_like_object, laparams=laparams)
-    text = text.replace("\n", "")
-    # logger.info(text)
-    '''乱码文本用pdfminer提取出来的文本特征是(cid:xxx)'''
-    cid_pattern = re.compile(r'\(cid:\d+\)')
-    matches = cid_pattern.findall(text)
-    cid_count = len(matches)
-    cid_len = sum(len(match) for match in matches)
-    text_len = len(text)
-    if text_len == 0:
-        cid_chars_radio = 0
-    else:
-        cid_chars_radio = cid_count/(cid_count + text_len - cid_len)
-    # logger.debug(f"cid_count: {cid_count}, text_len: {text_len}, cid_chars_radio: {cid_chars_radio}")
-    '''当一篇文章存在5%以上的文本是乱码时,认为该文档为乱码文档'''
-    if cid_chars_radio > 0.05:
-        return True  # 乱码文档
+def _collect_image_boxes(raw_parent, matrix, image_boxes, is_form, depth=0):
+    """收集页面（包括嵌套的form xobject）中所有图像对象在页面坐标系下的外接框"""
+    if is_form:
+        obj_count = pdfium_c.FPDFFormObj_CountObjects(raw_parent)
+        get_object = pdfium_c.FPDFFormObj_GetObject
     else:
-        return False   # 正常文档
+        obj_count = pdfium_c.FPDFPage_CountObjects(raw_parent)
+        get_object = pdfium_c.FPDFPage_GetObject
+
+    for index in range(obj_count):
+        raw_obj = get_object(raw_parent, index)
+        obj_type = pdfium_c.FPDFPageObj_GetType(raw_obj)
+        if obj_type == pdfium_c.FPDF_PAGEOBJ_IMAGE:
+            box = _get_obj_bounds(raw_obj)
+            if box is not None:
+                image_boxes.append(_transform_box(box, matrix))
+        elif obj_type == pdfium_c.FPDF_PAGEOBJ_FORM and depth < 15:
+            # form内对象的坐标在form空间中，需要叠加form的变换矩阵
+            form_matrix = _multiply_matrix(_get_obj_matrix(raw_obj), matrix)
+            _collect_image_boxes(raw_obj, form_matrix, image_boxes, is_form=True, depth=depth + 1)
+
+
+def _get_coverage(boxes, page_width, page_height):
+    """图像面积（裁剪到页面范围内）之和占页面面积的比例，最大为1"""
+    page_area = page_width * page_height
+    if page_area <= 0:
+        return 0
+    image_area = 0
+    for left, bottom, right, top in boxes:
+        width = min(right, page_width) - max(left, 0)
+        height = min(top, page_height) - max(bottom, 0)
+        if width > 0 and height > 0:
+            image_area += width * height
+    return min(image_area / page_area, 1.0)
 
 
 if __name__ == '__main__':
     with open('/Users/myhloli/pdf/luanma2x10.pdf', 'rb') as f:
         p_bytes = f.read()
-        logger.info(f"PDF分类结果: {classify(p_bytes)}")
\ No newline at end of file
+        logger.info(f"PDF分类结果: {classify(p_bytes)}")
+        logger.info(f"逐页分类结果: {classify_pages(p_bytes)}")
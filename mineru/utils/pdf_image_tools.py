@@ -1,60 +1,356 @@
 # Copyright (c) Opendatalab. All rights reserved.
+import base64
+import hashlib
+import math
+import os
 from io import BytesIO
 
+import numpy as np
 import pypdfium2 as pdfium
 from loguru import logger
 from PIL import Image
 
 from mineru.data.data_reader_writer import FileBasedDataWriter
-from mineru.utils.pdf_reader import image_to_b64str, image_to_bytes, page_to_image
+from mineru.utils.document_context import DocumentContext, ImageDocument, ImagePage
+from mineru.utils.pdf_reader import bgr_to_pil, get_render_scale, image_to_bytes, page_region_to_numpy, page_to_numpy, \
+    pdfium_lock, render_page_at_scale
+from mineru.utils.pdf_render_pool import get_render_workers, iter_rendered_pages
 from .hash_utils import str_sha256
 
 
-def pdf_page_to_image(page: pdfium.PdfPage, dpi=200) -> dict:
-    """Convert pdfium.PdfDocument to image, Then convert the image to base64.
+class PageImage:
+    """
+    渲染后的页面图像，只保存一份连续的BGR numpy位图(img_np)，模型推理和裁剪都直接使用该数组，裁剪为零拷贝视图。
+    PIL图像、PNG/JPEG编码和base64字符串在第一次访问时才生成并缓存。
+
+    兼容原来的image_dict用法，image_dict["img_pil"]、image_dict["scale"]、image_dict["img_base64"]仍然可用。
+    裁剪图片命名只需要页面的内容指纹，使用fingerprint可以避免对整页做PNG编码。
+
+    由PageImageStore管理时，位图可能被淘汰，访问img_np时自动重新渲染或从spill文件读回；
+    页面的middle json确定后调用release()释放位图。
+    """
+
+    _KEYS = ("img_base64", "img_pil", "img_np", "scale")
+
+    def __init__(self, image, scale: float):
+        """image为BGR的np.ndarray或PIL图像"""
+        if isinstance(image, np.ndarray):
+            self._img_np = image
+            self._img_pil = None
+            self._shape = image.shape
+        else:
+            self._img_np = None
+            self._img_pil = image
+            self._shape = None
+        self.scale = scale
+        self._png_bytes = None
+        self._img_base64 = None
+        self._fingerprint = None
+        self._store = None
+        self._render_fn = None
+        self._spill_path = None
+
+    @property
+    def img_np(self) -> np.ndarray:
+        # 先取到局部变量，store在其他线程中淘汰该页时不会返回None
+        img_np = self._img_np
+        if img_np is not None:
+            if self._store is not None:
+                self._store.touch(self)
+            return img_np
+        if self._img_pil is not None:
+            img_np = np.ascontiguousarray(np.asarray(self._img_pil.convert("RGB"))[..., ::-1])
+            self._img_np = img_np
+        elif self._store is not None:
+            img_np = self._store.load(self)
+            self._img_np = img_np
+            self._store.on_reload(self)
+        else:
+            raise RuntimeError("page image has been released")
+        self._shape = img_np.shape
+        return img_np
+
+    @property
+    def img_pil(self) -> Image.Image:
+        if self._img_pil is None:
+            self._img_pil = bgr_to_pil(self.img_np)
+        return self._img_pil
+
+    @property
+    def width(self) -> int:
+        if self._shape is None:
+            self._shape = self.img_np.shape
+        return self._shape[1]
+
+    @property
+    def height(self) -> int:
+        if self._shape is None:
+            self._shape = self.img_np.shape
+        return self._shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        """位图常驻内存时占用的字节数"""
+        return self.height * self.width * 3
+
+    def _drop_bitmaps(self):
+        self._img_np = None
+        self._img_pil = None
+        self._png_bytes = None
+        self._img_base64 = None
+
+    def release(self):
+        """页面的后处理已经完成，释放位图和派生的编码结果"""
+        if self._store is not None:
+            self._store.discard(self)
+            self._store = None
+            self._render_fn = None
+        self._drop_bitmaps()
+
+    @property
+    def png_bytes(self) -> bytes:
+        if self._png_bytes is None:
+            self._png_bytes = image_to_bytes(self.img_pil, image_format="PNG")
+        return self._png_bytes
+
+    @property
+    def jpeg_bytes(self) -> bytes:
+        # jpeg只在少数场景使用，不做缓存
+        return image_to_bytes(self.img_pil.convert("RGB"), image_format="JPEG")
+
+    @property
+    def img_base64(self) -> str:
+        if self._img_base64 is None:
+            self._img_base64 = base64.b64encode(self.png_bytes).decode("utf-8")
+        return self._img_base64
+
+    @property
+    def fingerprint(self) -> str:
+        """基于原始像素缓冲区的内容指纹，像素和尺寸相同的页面指纹相同"""
+        if self._fingerprint is None:
+            hasher = hashlib.blake2b(digest_size=16)
+            hasher.update(str(self.img_np.shape).encode("utf-8"))
+            hasher.update(self.img_np.data)
+            self._fingerprint = hasher.hexdigest()
+        return self._fingerprint
+
+    @property
+    def crop_source(self):
+        """裁剪ocr、公式、表格等区域时使用的页面图像"""
+        return self.img_np
+
+    def __getitem__(self, key):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self._KEYS
+
+    def __getstate__(self):
+        # 传给子进程时只传一份位图，不携带由位图派生的PIL图像和编码结果
+        state = self.__dict__.copy()
+        if self._store is not None:
+            # 子进程中没有store，被淘汰的页面先在主进程中重建
+            state["_img_np"] = self.img_np
+        state["_store"] = None
+        state["_render_fn"] = None
+        state["_spill_path"] = None
+        if state["_img_np"] is not None:
+            state["_img_pil"] = None
+        state["_png_bytes"] = None
+        state["_img_base64"] = None
+        return state
+
+
+class MultiResolutionPage(PageImage):
+    """
+    多分辨率页面，整页只按检测模型实际使用的分辨率渲染一次(detection_image)，
+    ocr、公式、表格等需要识别的区域在裁剪时才从矢量页面按scale单独渲染，文本稀疏的页面可以少渲染大量像素。
+
+    对外的坐标系仍然是scale下的整页位图，可以像BGR数组一样切片(page[y0:y1, x0:x1])，下游代码不需要区分；
+    需要整页位图(img_np)的场景才按scale渲染整页。传给子进程时转为普通的PageImage。
+    页面的middle json确定后调用release()，在pdfium_lock内关闭页面，不依赖垃圾回收在锁外关闭。
+    """
+
+    def __init__(self, page: pdfium.PdfPage, scale: float, detection_image: np.ndarray, detection_scale: float):
+        super().__init__(detection_image, scale)
+        self._img_np = None
+        self._page = page
+        self.detection_image = detection_image
+        self.detection_ratio = scale / detection_scale
+        with pdfium_lock:
+            self._width = math.ceil(page.get_width() * scale)
+            self._height = math.ceil(page.get_height() * scale)
+
+    def _render_region(self, box):
+        if self._page is None:
+            raise RuntimeError("page image has been released")
+        return page_region_to_numpy(self._page, self.scale, box)
+
+    @property
+    def img_np(self) -> np.ndarray:
+        if self._img_np is None:
+            self._img_np = self._render_region((0, 0, self._width, self._height))
+        return self._img_np
+
+    def release(self):
+        """释放位图并关闭页面，之后不能再渲染区域"""
+        super().release()
+        self.detection_image = None
+        if self._page is not None:
+            with pdfium_lock:
+                self._page.close()
+            self._page = None
+
+    @property
+    def width(self) -> int:
+        return self._width
+
+    @property
+    def height(self) -> int:
+        return self._height
+
+    @property
+    def shape(self):
+        return self._height, self._width, 3
+
+    @property
+    def crop_source(self):
+        return self
+
+    @property
+    def fingerprint(self) -> str:
+        """基于检测分辨率位图和scale的内容指纹，不需要渲染整页"""
+        if self._fingerprint is None:
+            hasher = hashlib.blake2b(digest_size=16)
+            hasher.update(f"{self.shape}|{self.scale}".encode("utf-8"))
+            hasher.update(self.detection_image.data)
+            self._fingerprint = hasher.hexdigest()
+        return self._fingerprint
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return super().__getitem__(key)
+        # 按numpy切片语义只渲染前两维对应的区域，其余维度（如通道翻转）作用在渲染结果上
+        if not isinstance(key, tuple):
+            key = (key,)
+        rows = key[0] if len(key) > 0 else slice(None)
+        cols = key[1] if len(key) > 1 else slice(None)
+        if not (isinstance(rows, slice) and isinstance(cols, slice)) or rows.step not in (None, 1) or cols.step not in (None, 1):
+            return self.img_np[key]
+        y0, y1, _ = rows.indices(self._height)
+        x0, x1, _ = cols.indices(self._width)
+        region = self._render_region((x0, y0, max(x0, x1), max(y0, y1)))
+        if len(key) > 2:
+            return region[(slice(None), slice(None)) + key[2:]]
+        return region
+
+    def __contains__(self, key):
+        return key in self._KEYS
+
+    def __reduce__(self):
+        return PageImage, (self.img_np, self.scale)
+
+
+def get_detection_max_side():
+    """
+    多分辨率模式下检测用整页位图的最长边，通过环境变量MINERU_DETECTION_MAX_SIDE设置，
+    默认1888，与公式检测模型的输入尺寸一致（版面检测为1280）
+    """
+    try:
+        return int(os.getenv('MINERU_DETECTION_MAX_SIDE', 1888))
+    except ValueError:
+        logger.warning('MINERU_DETECTION_MAX_SIDE is not a valid integer, use default 1888')
+        return 1888
+
+
+def is_multi_resolution_enabled():
+    """通过环境变量MINERU_MULTI_RESOLUTION开启多分辨率渲染，默认关闭"""
+    return os.getenv('MINERU_MULTI_RESOLUTION', 'false').lower() == 'true'
+
+
+def pdf_page_to_multi_resolution_image(page: pdfium.PdfPage, dpi=200, max_width_or_height=2560) -> PageImage:
+    """
+    按检测分辨率渲染整页，识别区域在裁剪时按dpi渲染。页面需要保持打开，直到该页后处理完成。
+    检测分辨率不低于dpi对应的分辨率时，直接按dpi渲染整页。
+    """
+    scale = get_render_scale(page, dpi, max_width_or_height)
+    # 检测分辨率按渲染后位图的最长边（像素）计算
+    detection_scale = min(scale, get_detection_max_side() / max(*page.get_size()))
+    detection_image = render_page_at_scale(page, detection_scale)
+    if detection_scale >= scale:
+        return PageImage(detection_image, scale)
+    return MultiResolutionPage(page, scale, detection_image, detection_scale)
+
+
+def pdf_page_to_image(page: pdfium.PdfPage, dpi=200) -> PageImage:
+    """Render pdfium.PdfPage to a lazily encoded page image.
 
     Args:
         page (_type_): pdfium.PdfPage
         dpi (int, optional): reset the dpi of dpi. Defaults to 200.
 
     Returns:
-        dict:  {'img_base64': str, 'img_pil': pil_img, 'scale': float }
+        PageImage: holds a contiguous BGR numpy bitmap, supports image_dict['img_np'], image_dict['img_pil'],
+        image_dict['img_base64'], image_dict['scale']. The PIL image and base64 string are only built on first access.
     """
-    pil_img, scale = page_to_image(page, dpi=dpi)
-    img_base64 = image_to_b64str(pil_img)
+    if isinstance(page, ImagePage):
+        # 图片输入直接解码，不经过pdf渲染，最长边的上限与pdf页面相同
+        img_np, scale = page.to_numpy()
+    else:
+        img_np, scale = page_to_numpy(page, dpi=dpi)
+    return PageImage(img_np, scale)
+
 
-    image_dict = {
-        "img_base64": img_base64,
-        "img_pil": pil_img,
-        "scale": scale,
-    }
-    return image_dict
+def make_page_render_fn(pdf_doc, page_index, dpi=200):
+    """返回重新渲染pdf_doc第page_index页的函数，PageImageStore淘汰该页后用于重建位图，pdf_doc需要保持打开"""
+    def render():
+        with pdfium_lock:
+            page = pdf_doc[page_index]
+        try:
+            return pdf_page_to_image(page, dpi=dpi).img_np
+        finally:
+            with pdfium_lock:
+                page.close()
+    return render
 
 
 def load_images_from_pdf(
-    pdf_bytes: bytes,
+    pdf_bytes,
     dpi=200,
     start_page_id=0,
     end_page_id=None,
 ):
+    """
+    渲染页面范围内的所有页面，pdf_bytes可以是pdf字节数据，也可以是已打开的DocumentContext或ImageDocument
+    （此时忽略start_page_id和end_page_id）。返回的pdf_doc下标0对应范围内的第一页。
+    """
     images_list = []
-    pdf_doc = pdfium.PdfDocument(pdf_bytes)
-    pdf_page_num = len(pdf_doc)
-    end_page_id = end_page_id if end_page_id is not None and end_page_id >= 0 else pdf_page_num - 1
-    if end_page_id > pdf_page_num - 1:
-        logger.warning("end_page_id is out of range, use images length")
-        end_page_id = pdf_page_num - 1
-
-    for index in range(0, pdf_page_num):
-        if start_page_id <= index <= end_page_id:
-            page = pdf_doc[index]
-            image_dict = pdf_page_to_image(page, dpi=dpi)
-            images_list.append(image_dict)
+    if isinstance(pdf_bytes, (DocumentContext, ImageDocument)):
+        pdf_doc = pdf_bytes
+    else:
+        pdf_doc = DocumentContext(pdf_bytes, start_page_id, end_page_id)
+
+    # 启用渲染进程池时，页面由多个worker进程并行渲染
+    render_workers = get_render_workers()
+    if render_workers > 1 and len(pdf_doc) > 1:
+        for _, img_np, scale in iter_rendered_pages(
+            pdf_doc.source_bytes, render_workers, dpi=dpi,
+            start_page_id=pdf_doc.start_page_id, end_page_id=pdf_doc.end_page_id
+        ):
+            images_list.append(PageImage(img_np, scale))
+        return images_list, pdf_doc
+
+    for index in range(len(pdf_doc)):
+        page = pdf_doc[index]
+        image_dict = pdf_page_to_image(page, dpi=dpi)
+        images_list.append(image_dict)
 
     return images_list, pdf_doc
 
 
-def cut_image(bbox: tuple, page_num: int, page_pil_img, return_path, image_writer: FileBasedDataWriter, scale=2):
+def cut_image(bbox: tuple, page_num: int, page_img, return_path, image_writer: FileBasedDataWriter, scale=2):
     """从第page_num页的page中，根据bbox进行裁剪出一张jpg图片，返回图片路径 save_path：需要同时支持s3和本地,
     图片存放在save_path下，文件名是:
     {page_num}_{bbox[0]}_{bbox[1]}_{bbox[2]}_{bbox[3]}.jpg , bbox内数字取整。"""
@@ -69,7 +365,9 @@ def cut_image(bbox: tuple, page_num: int, page_pil_img, return_path, image_write
     img_hash256_path = f"{str_sha256(img_path)}.jpg"
     # img_hash256_path = f'{img_path}.jpg'
 
-    crop_img = get_crop_img(bbox, page_pil_img, scale=scale)
+    crop_img = get_crop_img(bbox, page_img, scale=scale)
+    if isinstance(crop_img, np.ndarray):
+        crop_img = bgr_to_pil(crop_img)
 
     img_bytes = image_to_bytes(crop_img, image_format="JPEG")
 
@@ -77,14 +375,18 @@ def cut_image(bbox: tuple, page_num: int, page_pil_img, return_path, image_write
     return img_hash256_path
 
 
-def get_crop_img(bbox: tuple, pil_img, scale=2):
+def get_crop_img(bbox: tuple, page_img, scale=2):
+    """page_img为BGR numpy数组时返回零拷贝的切片视图，为多分辨率页面时只渲染该区域，为PIL图像时返回PIL裁剪结果"""
     scale_bbox = (
         int(bbox[0] * scale),
         int(bbox[1] * scale),
         int(bbox[2] * scale),
         int(bbox[3] * scale),
     )
-    return pil_img.crop(scale_bbox)
+    if not isinstance(page_img, Image.Image):
+        x0, y0, x1, y1 = scale_bbox
+        return page_img[max(y0, 0):max(y1, 0), max(x0, 0):max(x1, 0)]
+    return page_img.crop(scale_bbox)
 
 
 def images_bytes_to_pdf_bytes(image_bytes):
@@ -1,34 +1,110 @@
 # Copyright (c) Opendatalab. All rights reserved.
 import base64
+import math
+import threading
 from io import BytesIO
 
+import numpy as np
+import pypdfium2.raw as pdfium_c
 from loguru import logger
 from PIL import Image
 from pypdfium2 import PdfBitmap, PdfDocument, PdfPage
 
+# pdfium不是线程安全的，多线程同时访问pdfium（渲染、文本提取等）时需要持有该锁
+pdfium_lock = threading.RLock()
 
-def page_to_image(
-    page: PdfPage,
-    dpi: int = 144,  # changed from 200 to 144
-    max_width_or_height: int = 2560,  # changed from 4500 to 2560
-) -> (Image.Image, float):
+
+def get_render_scale(page: PdfPage, dpi: int, max_width_or_height: int) -> float:
+    """按dpi渲染时的缩放比例，页面最长边超过max_width_or_height时按最长边缩小"""
     scale = dpi / 72
 
     long_side_length = max(*page.get_size())
     if long_side_length > max_width_or_height:
         scale = max_width_or_height / long_side_length
+    return scale
 
-    bitmap: PdfBitmap = page.render(scale=scale)  # type: ignore
-    try:
-        image = bitmap.to_pil()
-    finally:
+
+def page_to_image(
+    page: PdfPage,
+    dpi: int = 144,  # changed from 200 to 144
+    max_width_or_height: int = 2560,  # changed from 4500 to 2560
+) -> (Image.Image, float):
+    scale = get_render_scale(page, dpi, max_width_or_height)
+
+    with pdfium_lock:
+        bitmap: PdfBitmap = page.render(scale=scale)  # type: ignore
         try:
-            bitmap.close()
-        except Exception:
-            pass
+            image = bitmap.to_pil()
+        finally:
+            try:
+                bitmap.close()
+            except Exception:
+                pass
     return image, scale
 
 
+def page_to_numpy(
+    page: PdfPage,
+    dpi: int = 144,
+    max_width_or_height: int = 2560,
+) -> (np.ndarray, float):
+    """直接渲染为连续的BGR numpy数组(HxWx3)，即opencv、ocr和yolo模型使用的通道顺序，不经过PIL"""
+    scale = get_render_scale(page, dpi, max_width_or_height)
+    return render_page_at_scale(page, scale), scale
+
+
+def render_page_at_scale(page: PdfPage, scale: float) -> np.ndarray:
+    """按指定的缩放比例将整页渲染为连续的BGR numpy数组"""
+    with pdfium_lock:
+        bitmap: PdfBitmap = page.render(scale=scale, force_bitmap_format=pdfium_c.FPDFBitmap_BGR)  # type: ignore
+        try:
+            # to_numpy返回的是pdfium缓冲区的视图，行之间可能有填充，copy后得到连续数组，bitmap关闭后仍然有效
+            image = bitmap.to_numpy().copy()
+        finally:
+            try:
+                bitmap.close()
+            except Exception:
+                pass
+    return image
+
+
+def page_region_to_numpy(
+    page: PdfPage,
+    scale: float,
+    box: tuple,
+) -> np.ndarray:
+    """
+    只渲染页面中的一个区域，box为scale下整页位图中的像素坐标(x0, y0, x1, y1)。
+    页面在位图中的位置与page_to_numpy整页渲染时相同，结果等价于整页渲染后再切片，但只光栅化该区域。
+    """
+    with pdfium_lock:
+        src_width = math.ceil(page.get_width() * scale)
+        src_height = math.ceil(page.get_height() * scale)
+        x0, y0, x1, y1 = box
+        x0, x1 = min(max(x0, 0), src_width), min(max(x1, 0), src_width)
+        y0, y1 = min(max(y0, 0), src_height), min(max(y1, 0), src_height)
+        width, height = max(x1 - x0, 0), max(y1 - y0, 0)
+        if width == 0 or height == 0:
+            return np.zeros((height, width, 3), dtype=np.uint8)
+
+        bitmap = PdfBitmap.new_native(width, height, pdfium_c.FPDFBitmap_BGR)
+        try:
+            pdfium_c.FPDFBitmap_FillRect(bitmap, 0, 0, width, height, 0xFFFFFFFF)
+            pdfium_c.FPDF_RenderPageBitmap(bitmap, page, -x0, -y0, src_width, src_height, 0, pdfium_c.FPDF_ANNOT)
+            image = bitmap.to_numpy().copy()
+        finally:
+            try:
+                bitmap.close()
+            except Exception:
+                pass
+    return image
+
+
+def bgr_to_pil(image: np.ndarray) -> Image.Image:
+    """BGR numpy数组转为RGB的PIL图像"""
+    return Image.fromarray(np.ascontiguousarray(image[..., ::-1]))
+
+
 def image_to_bytes(
     image: Image.Image,
     image_format: str = "PNG",  # 也可以用 "JPEG"
@@ -53,6 +129,19 @@ def pdf_to_images(
     start_page_id: int = 0,
     end_page_id: int | None = None,
 ) -> list[Image.Image]:
+    if not isinstance(pdf, PdfDocument):
+        from mineru.utils.pdf_render_pool import get_render_workers, iter_rendered_pages
+        render_workers = get_render_workers()
+        if render_workers > 1:
+            if isinstance(pdf, str):
+                with open(pdf, 'rb') as f:
+                    pdf = f.read()
+            return [
+                bgr_to_pil(image) for _, image, _ in iter_rendered_pages(
+                    pdf, render_workers, dpi, max_width_or_height, start_page_id, end_page_id
+                )
+            ]
+
     doc = pdf if isinstance(pdf, PdfDocument) else PdfDocument(pdf)
     page_num = len(doc)
 
@@ -0,0 +1,195 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import atexit
+import math
+import multiprocessing
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pypdfium2 as pdfium
+from loguru import logger
+
+from mineru.utils.pdf_reader import page_to_numpy
+
+# 每个worker预取的页面块数量，控制同时存放在共享内存中的位图数量
+_CHUNKS_PER_WORKER = 2
+
+_executor = None
+_executor_workers = 0
+
+
+def get_render_workers():
+    """页面渲染的进程数，通过环境变量MINERU_RENDER_WORKERS设置，默认在当前进程中串行渲染"""
+    try:
+        return int(os.getenv('MINERU_RENDER_WORKERS', 0))
+    except ValueError:
+        logger.warning('MINERU_RENDER_WORKERS is not a valid integer, render process pool disabled')
+        return 0
+
+
+def _render_chunk(pdf_path, page_indices, dpi, max_width_or_height):
+    """
+    worker进程中渲染一组连续页面，位图写入共享内存，只把共享内存的名称和形状传回主进程。
+    pdf只在渲染本块期间打开，所有页面块完成后主进程即可删除临时文件（Windows上无法删除仍被打开的文件）。
+
+    Returns:
+        [(page_index, shm_name, shape, scale), ...]
+    """
+    pdf_doc = pdfium.PdfDocument(pdf_path)
+    results = []
+    try:
+        for page_index in page_indices:
+            page = pdf_doc[page_index]
+            try:
+                array, scale = page_to_numpy(page, dpi, max_width_or_height)
+            finally:
+                page.close()
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            try:
+                np.ndarray(array.shape, dtype=np.uint8, buffer=shm.buf)[...] = array
+            finally:
+                shm.close()
+            results.append((page_index, shm.name, array.shape, scale))
+    except Exception:
+        # 渲染失败时释放本块中已经写入的共享内存，避免泄漏
+        _release_results(results)
+        raise
+    finally:
+        pdf_doc.close()
+    return results
+
+
+def _release_shm(shm_name):
+    try:
+        shm = shared_memory.SharedMemory(name=shm_name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def _release_results(results):
+    for _, shm_name, _, _ in results:
+        _release_shm(shm_name)
+
+
+class _SharedBitmap:
+    """
+    共享内存中的页面位图。np.asarray()得到的数组以该对象为base，数组及其切片直接引用共享内存，不做复制；
+    最后一个引用被回收时（页面release()后，裁剪出的视图也不再使用）才关闭共享内存。
+    """
+
+    def __init__(self, shm_name, shape):
+        self._shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            # 立即删除名称，映射在关闭前仍然有效，主进程异常退出时也不会遗留共享内存
+            self._shm.unlink()
+            self._view = np.ndarray(shape, dtype=np.uint8, buffer=self._shm.buf)
+        except Exception:
+            self._shm.close()
+            raise
+        self.__array_interface__ = self._view.__array_interface__
+
+    def __del__(self):
+        self._view = None
+        self._shm.close()
+
+
+def _load_bitmap(shm_name, shape):
+    """共享内存上的零拷贝页面位图，生命周期与返回的数组（即PageImage中的img_np）一致"""
+    return np.asarray(_SharedBitmap(shm_name, shape))
+
+
+def get_render_executor(max_workers):
+    """进程池在多个文档之间复用，worker数量变化时重建"""
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers != max_workers:
+        shutdown_render_executor()
+        _executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+        _executor_workers = max_workers
+        logger.info(f'started render process pool with {max_workers} workers')
+    return _executor
+
+
+def shutdown_render_executor():
+    global _executor, _executor_workers
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+        _executor_workers = 0
+
+
+atexit.register(shutdown_render_executor)
+
+
+def _split_pages(start_page_id, end_page_id, max_workers):
+    """把页面范围切分为连续的页面块，块数约为worker数的4倍，使各worker负载均衡"""
+    page_indices = list(range(start_page_id, end_page_id + 1))
+    chunk_size = max(1, math.ceil(len(page_indices) / (max_workers * 4)))
+    return [page_indices[i:i + chunk_size] for i in range(0, len(page_indices), chunk_size)]
+
+
+def iter_rendered_pages(
+    pdf_bytes: bytes,
+    max_workers: int,
+    dpi: int = 200,
+    max_width_or_height: int = 2560,
+    start_page_id: int = 0,
+    end_page_id: int | None = None,
+):
+    """
+    多进程渲染pdf页面，每个worker自行打开文档并渲染连续的页面块，
+    位图通过共享内存传回主进程，按页面顺序依次产出(page_index, BGR numpy数组, scale)。
+    产出的数组是共享内存上的视图，不会再复制一次，数组不再被引用时共享内存随之释放。
+
+    同时在途的页面块数量有上限，调用方消费较慢时不会把整个文档的位图都堆积在内存中。
+    """
+    # worker通过文件路径打开pdf，避免每个页面块任务都传输完整的pdf bytes
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
+        f.write(pdf_bytes)
+        pdf_path = f.name
+
+    pending = deque()
+    current = deque()
+    try:
+        pdf_doc = pdfium.PdfDocument(pdf_path)
+        try:
+            page_num = len(pdf_doc)
+        finally:
+            pdf_doc.close()
+        end_page_id = end_page_id if end_page_id is not None and end_page_id >= 0 else page_num - 1
+        if end_page_id > page_num - 1:
+            logger.warning("end_page_id is out of range, use images length")
+            end_page_id = page_num - 1
+
+        executor = get_render_executor(max_workers)
+        chunks = deque(_split_pages(start_page_id, end_page_id, max_workers))
+        max_pending = max_workers * _CHUNKS_PER_WORKER
+        while chunks or pending:
+            while chunks and len(pending) < max_pending:
+                pending.append(executor.submit(_render_chunk, pdf_path, chunks.popleft(), dpi, max_width_or_height))
+            current.extend(pending.popleft().result())
+            while current:
+                page_index, shm_name, shape, scale = current.popleft()
+                yield page_index, _load_bitmap(shm_name, shape), scale
+    finally:
+        # 提前退出或出错时，等待在途的页面块完成并释放它们的共享内存
+        _release_results(current)
+        while pending:
+            future = pending.popleft()
+            if future.cancel():
+                continue
+            try:
+                _release_results(future.result())
+            except Exception:
+                pass
+        try:
+            os.remove(pdf_path)
+        except OSError as e:
+            logger.warning(f'failed to remove temp pdf {pdf_path}: {e}')
@@ -5,26 +5,37 @@ import pypdfium2 as pdfium
 from pdftext.pdf.chars import get_chars, deduplicate_chars
 from pdftext.pdf.pages import get_spans, get_lines, assign_scripts, get_blocks
 
+from mineru.utils.pdf_reader import pdfium_lock
+
 
 def get_page(
     page: pdfium.PdfPage,
     quote_loosebox: bool =True,
     superscript_height_threshold: float = 0.7,
     line_distance_threshold: float = 0.1,
+    textpage: pdfium.PdfTextPage = None,
 ) -> dict:
 
-        textpage = page.get_textpage()
-        page_bbox: List[float] = page.get_bbox()
-        page_width = math.ceil(abs(page_bbox[2] - page_bbox[0]))
-        page_height = math.ceil(abs(page_bbox[1] - page_bbox[3]))
+        with pdfium_lock:
+            # 传入的textpage由调用方管理（如DocumentContext缓存的文本页），这里只关闭自己创建的
+            own_textpage = textpage is None
+            if own_textpage:
+                textpage = page.get_textpage()
+            page_bbox: List[float] = page.get_bbox()
+            page_width = math.ceil(abs(page_bbox[2] - page_bbox[0]))
+            page_height = math.ceil(abs(page_bbox[1] - page_bbox[3]))
 
-        page_rotation = 0
-        try:
-            page_rotation = page.get_rotation()
-        except:
-            pass
+            page_rotation = 0
+            try:
+                page_rotation = page.get_rotation()
+            except:
+                pass
 
-        chars = deduplicate_chars(get_chars(textpage, page_bbox, page_rotation, quote_loosebox))
+            try:
+                chars = deduplicate_chars(get_chars(textpage, page_bbox, page_rotation, quote_loosebox))
+            finally:
+                if own_textpage:
+                    textpage.close()
         spans = get_spans(chars, superscript_height_threshold=superscript_height_threshold, line_distance_threshold=line_distance_threshold)
         lines = get_lines(spans)
         assign_scripts(lines, height_threshold=superscript_height_threshold, line_distance_threshold=line_distance_threshold)
@@ -5,6 +5,7 @@ import statistics
 import cv2
 import numpy as np
 from loguru import logger
+from PIL import Image
 
 from mineru.utils.boxbase import calculate_overlap_area_in_bbox1_area_ratio, calculate_iou, \
     get_minbox_if_overlap_by_ratio
@@ -119,9 +120,9 @@ def __replace_unicode(text: str):
 
 
 """pdf_text dict方案 char级别"""
-def txt_spans_extract(pdf_page, spans, pil_img, scale, all_bboxes, all_discarded_blocks):
+def txt_spans_extract(pdf_page, spans, page_img, scale, all_bboxes, all_discarded_blocks, textpage=None):
 
-    page_dict = get_page(pdf_page)
+    page_dict = get_page(pdf_page, textpage=textpage)
 
     page_all_chars = []
     page_all_lines = []
@@ -194,8 +195,11 @@ def txt_spans_extract(pdf_page, spans, pil_img, scale, all_bboxes, all_discarded
 
         for span in need_ocr_spans:
             # 对span的bbox截图再ocr
-            span_pil_img = get_crop_img(span['bbox'], pil_img, scale)
-            span_img = cv2.cvtColor(np.array(span_pil_img), cv2.COLOR_RGB2BGR)
+            if not isinstance(page_img, Image.Image):
+                # BGR页面数组（或按区域渲染的多分辨率页面）的切片即为ocr需要的span截图
+                span_img = get_crop_img(span['bbox'], page_img, scale)
+            else:
+                span_img = cv2.cvtColor(np.array(get_crop_img(span['bbox'], page_img, scale)), cv2.COLOR_RGB2BGR)
             # 计算span的对比度，低于0.20的span不进行ocr
             if calculate_contrast(span_img, img_mode='bgr') <= 0.17:
                 spans.remove(span)
@@ -203,7 +207,8 @@ def txt_spans_extract(pdf_page, spans, pil_img, scale, all_bboxes, all_discarded
 
             span['content'] = ''
             span['score'] = 1.0
-            span['np_img'] = span_img
+            # 截图在页面处理完成后才统一ocr，切片视图需要拷贝，否则会让整页位图在页面释放后仍然驻留内存
+            span['np_img'] = span_img if span_img.base is None else span_img.copy()
 
     return spans
 
@@ -0,0 +1,170 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import importlib
+import os
+from collections import OrderedDict
+from itertools import groupby
+
+import cv2
+import numpy as np
+import torch
+from tqdm import tqdm
+
+# 与ultralytics LetterBox一致的填充值
+LETTERBOX_FILL = 114
+# 复用的输入缓冲区数量上限，每个letterbox尺寸一个，锁页内存不宜过多
+_MAX_CACHED_BUFFERS = 2
+
+
+def get_detection_half_enable(device):
+    """检测模型是否使用FP16推理，仅cuda设备支持，可以通过环境变量MINERU_DETECTION_FP16=false关闭"""
+    if not str(device).startswith('cuda'):
+        return False
+    return os.getenv('MINERU_DETECTION_FP16', 'true').lower() == 'true'
+
+
+def get_letterbox_shape(height, width, imgsz, stride=32):
+    """
+    与ultralytics rect模式的LetterBox一致：长边缩放到imgsz，短边只填充到stride的整数倍。
+    宽高比相近的页面letterbox后尺寸相同，可以放在同一个batch中推理。
+
+    Returns:
+        (new_height, new_width), (out_height, out_width)
+    """
+    ratio = min(imgsz / height, imgsz / width)
+    new_height, new_width = int(round(height * ratio)), int(round(width * ratio))
+    out_height = new_height + (imgsz - new_height) % stride
+    out_width = new_width + (imgsz - new_width) % stride
+    return (new_height, new_width), (out_height, out_width)
+
+
+def get_model_package_module(model, name):
+    """模型所属包（ultralytics或doclayout_yolo等分支）中的子模块，两者的默认参数和坐标映射不完全相同"""
+    package = type(model).__module__.split('.')[0]
+    return importlib.import_module(f'{package}.{name}')
+
+
+def get_precision_kwargs(model, half):
+    """ultralytics 8.4起用quantize=16代替已弃用的half参数，doclayout_yolo等较早的分支仍然使用half"""
+    if not half:
+        return {}
+    try:
+        default_cfg = get_model_package_module(model, 'cfg').DEFAULT_CFG_DICT
+    except (ImportError, AttributeError):
+        default_cfg = {}
+    return {'quantize': 16} if 'quantize' in default_cfg else {'half': True}
+
+
+class YoloBatchPredictor:
+    """
+    页面级yolo检测模型（版面检测、公式检测）的批量推理。
+
+    ultralytics对同一个batch中尺寸不同的图片会按imgsz*imgsz的正方形填充，逐页推理时每页单独letterbox。
+    这里先按letterbox后的尺寸分桶，同一桶的页面只做一次缩放，直接写入复用的uint8缓冲区（cuda上为锁页内存），
+    拷贝到设备后再做通道转换和归一化（cuda上为FP16），以张量形式交给模型；
+    检测框每个batch只拷贝一次到cpu，再用模型所属包的scale_boxes映射回页面坐标，与逐页推理的结果一致。
+    """
+
+    def __init__(self, model, device, imgsz, conf, iou, stride=32):
+        self.model = model
+        self.device = device
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        self.stride = stride
+        self.half = get_detection_half_enable(device)
+        # 张量输入会被转换为模型的精度，仍需通过参数让模型以FP16加载
+        self._precision_kwargs = get_precision_kwargs(model, self.half)
+        self._scale_boxes = get_model_package_module(model, 'utils.ops').scale_boxes
+        self._pin_memory = str(device).startswith('cuda') and torch.cuda.is_available()
+        # (out_height, out_width) -> uint8 tensor (N, H, W, 3)
+        self._buffers = OrderedDict()
+
+    def _get_buffer(self, batch_size, out_shape):
+        buffer = self._buffers.get(out_shape)
+        if buffer is None or buffer.shape[0] < batch_size:
+            buffer = torch.empty((batch_size, *out_shape, 3), dtype=torch.uint8, pin_memory=self._pin_memory)
+            self._buffers[out_shape] = buffer
+        self._buffers.move_to_end(out_shape)
+        while len(self._buffers) > _MAX_CACHED_BUFFERS:
+            self._buffers.popitem(last=False)
+        return buffer[:batch_size]
+
+    def _predict_bucket(self, images, out_shape):
+        """同一letterbox尺寸的页面推理，返回每页的(n, 6)数组：x1, y1, x2, y2, conf, cls，坐标为页面坐标"""
+        out_height, out_width = out_shape
+        buffer = self._get_buffer(len(images), out_shape)
+        buffer_np = buffer.numpy()
+        buffer_np.fill(LETTERBOX_FILL)
+        image_shapes = []
+        for index, image in enumerate(images):
+            height, width = image.shape[:2]
+            (new_height, new_width), _ = get_letterbox_shape(height, width, self.imgsz, self.stride)
+            if (new_height, new_width) != (height, width):
+                image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+            top = int(round((out_height - new_height) / 2 - 0.1))
+            left = int(round((out_width - new_width) / 2 - 0.1))
+            buffer_np[index, top:top + new_height, left:left + new_width] = image
+            image_shapes.append((height, width))
+
+        # 上一个batch的结果已经拷贝回cpu，此时异步拷贝不会与缓冲区的写入冲突
+        tensor = buffer.to(self.device, non_blocking=self._pin_memory)
+        # BGR->RGB，NHWC->NCHW，归一化到0~1
+        tensor = tensor.flip(-1).permute(0, 3, 1, 2).contiguous()
+        tensor = tensor.half() if self.half else tensor.float()
+        tensor /= 255
+        results = self.model.predict(
+            tensor, imgsz=self.imgsz, conf=self.conf, iou=self.iou, verbose=False, device=self.device,
+            **self._precision_kwargs
+        )
+
+        counts = [len(result.boxes) for result in results]
+        if sum(counts) > 0:
+            data = torch.cat([result.boxes.data[:, [0, 1, 2, 3, -2, -1]] for result in results]).float().cpu().numpy()
+        else:
+            data = np.zeros((0, 6), dtype=np.float32)
+        # ultralytics 8.4起scale_boxes按取整后的缩放尺寸计算填充，与较早版本及doclayout_yolo可能相差一个像素，使用模型所属包的实现与逐页推理保持一致
+        return [
+            self._scale_boxes(out_shape, boxes.copy(), image_shape)
+            for boxes, image_shape in zip(np.split(data, np.cumsum(counts)[:-1]), image_shapes)
+        ]
+
+    def _predict_batch(self, images):
+        """一个batch内的页面可能跨越多个letterbox尺寸，按尺寸拆分后分别推理"""
+        groups = OrderedDict()
+        for index, image in enumerate(images):
+            _, out_shape = get_letterbox_shape(*image.shape[:2], self.imgsz, self.stride)
+            groups.setdefault(out_shape, []).append(index)
+        outputs = [None] * len(images)
+        for out_shape, indices in groups.items():
+            for index, boxes in zip(indices, self._predict_bucket([images[i] for i in indices], out_shape)):
+                outputs[index] = boxes
+        return outputs
+
+    def batch_predict(self, images, batch_size, stage, batch_controller=None, desc=None):
+        """
+        按letterbox尺寸排序后分批推理，传入batch_controller时由其决定batch大小并在OOM时减半重试。
+
+        Returns:
+            list: 与images一一对应的(n, 6)数组
+        """
+        shapes = [get_letterbox_shape(*image.shape[:2], self.imgsz, self.stride)[1] for image in images]
+        order = sorted(range(len(images)), key=lambda i: shapes[i])
+        sorted_images = [images[i] for i in order]
+        if batch_controller is not None:
+            # 不同letterbox尺寸的计算量不同，每个尺寸独立调整batch大小
+            sorted_outputs = []
+            with tqdm(total=len(sorted_images), desc=desc, disable=desc is None) as pbar:
+                for out_shape, group in groupby(order, key=lambda i: shapes[i]):
+                    group_images = [images[i] for i in group]
+                    sorted_outputs += batch_controller.run(
+                        stage, group_images, self._predict_batch, batch_size, group=out_shape
+                    )
+                    pbar.update(len(group_images))
+        else:
+            sorted_outputs = []
+            for index in range(0, len(sorted_images), batch_size):
+                sorted_outputs += self._predict_batch(sorted_images[index: index + batch_size])
+        outputs = [None] * len(images)
+        for sorted_index, original_index in enumerate(order):
+            outputs[original_index] = sorted_outputs[sorted_index]
+        return outputs
@@ -0,0 +1,23 @@
+"""
+多设备测试中在spawn的worker进程里运行的推理替身，只依赖numpy，worker启动时不需要导入mineru的模型相关模块。
+"""
+import os
+import time
+
+import numpy as np
+
+
+def fake_device_analyze(images_with_extra_info, formula_enable=True, table_enable=True):
+    """
+    多设备worker中代替batch_image_analyze：返回每页左上角的像素值和worker的进程号，
+    像素值为偶数的页面延迟返回，使worker完成的顺序与提交顺序不同；像素值为255时抛出异常
+    """
+    results = []
+    for image, *_ in images_with_extra_info:
+        value = int(np.asarray(image)[0, 0, 0])
+        if value == 255:
+            raise ValueError('bad page')
+        if value % 2 == 0:
+            time.sleep(0.2)
+        results.append([{'value': value, 'pid': os.getpid()}])
+    return results
@@ -0,0 +1,318 @@
+"""
+生成后处理benchmark使用的合成页面数据，不依赖模型和真实pdf。
+
+页面为两栏排版，每个block包含若干line，每个line包含若干span，span数量决定页面高度，
+因此不同规模下的span密度保持一致，便于观察各函数的复杂度曲线。
+
+build_pdf按内容流手工生成小型pdf（文本页、扫描页、矢量文字页、乱码页等），供分类、渲染和流式推理的测试使用；
+fake_*为流式推理测试中代替模型的确定性替身。
+"""
+import copy
+import io
+import math
+import random
+
+import numpy as np
+
+from mineru.backend.pipeline.model_json_to_middle_json import make_page_info_dict
+from mineru.utils.block_sort import get_line_height, sort_blocks_by_sorted_lines
+from mineru.utils.enum_class import BlockType, ContentType
+from mineru.utils.span_block_fix import fill_spans_in_blocks, fix_block_spans
+
+PAGE_W = 612
+MARGIN = 40
+COLUMN_GAP = 12
+LINE_H = 10
+LINE_GAP = 4
+BLOCK_GAP = 12
+SPANS_PER_LINE = 3
+LINES_PER_BLOCK = 6
+CHARS_PER_SPAN = 4
+# 每隔多少个span生成一个与前一个span高度重叠、置信度更低的span
+DUPLICATE_EVERY = 20
+
+WORDS = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do']
+
+
+def _column_layout(num_spans):
+    num_lines = math.ceil(num_spans / SPANS_PER_LINE)
+    num_blocks = math.ceil(num_lines / LINES_PER_BLOCK)
+    blocks_per_column = math.ceil(num_blocks / 2)
+    block_h = LINES_PER_BLOCK * (LINE_H + LINE_GAP) + BLOCK_GAP
+    page_h = MARGIN * 2 + blocks_per_column * block_h
+    column_w = (PAGE_W - MARGIN * 2 - COLUMN_GAP) / 2
+    return num_blocks, blocks_per_column, block_h, page_h, column_w
+
+
+def make_page(num_spans, seed=0):
+    """
+    Returns:
+        dict: blocks为prepare_block_bboxes输出格式的block列表，spans为带content的span列表，
+              page_w/page_h为页面尺寸
+    """
+    rng = random.Random(seed)
+    num_blocks, blocks_per_column, block_h, page_h, column_w = _column_layout(num_spans)
+    span_w = column_w / SPANS_PER_LINE
+
+    blocks = []
+    spans = []
+    span_count = 0
+    for block_index in range(num_blocks):
+        if span_count >= num_spans:
+            break
+        column = block_index // blocks_per_column
+        row = block_index % blocks_per_column
+        x0 = MARGIN + column * (column_w + COLUMN_GAP)
+        y0 = MARGIN + row * block_h
+        block_type = BlockType.TITLE if block_index % 7 == 0 else BlockType.TEXT
+        block_y1 = y0
+        for line_index in range(LINES_PER_BLOCK):
+            if span_count >= num_spans:
+                break
+            line_y0 = y0 + line_index * (LINE_H + LINE_GAP)
+            block_y1 = line_y0 + LINE_H
+            for span_index in range(SPANS_PER_LINE):
+                if span_count >= num_spans:
+                    break
+                span_x0 = x0 + span_index * span_w
+                bbox = [round(span_x0, 2), line_y0, round(span_x0 + span_w - 2, 2), line_y0 + LINE_H]
+                span_count += 1
+                if span_count % DUPLICATE_EVERY == 0 and spans:
+                    # 与上一个span大面积重叠的低置信度span
+                    prev_bbox = spans[-1]['bbox']
+                    bbox = [prev_bbox[0] + 1, prev_bbox[1], prev_bbox[2] - 1, prev_bbox[3]]
+                    score = round(spans[-1]['score'] - 0.2, 3)
+                else:
+                    score = round(rng.uniform(0.6, 1.0), 3)
+                if rng.random() < 0.1:
+                    span_type = ContentType.INLINE_EQUATION
+                    content = 'x_{%d}^{2}' % span_count
+                else:
+                    span_type = ContentType.TEXT
+                    content = ' '.join(rng.choice(WORDS) for _ in range(CHARS_PER_SPAN))
+                spans.append({'type': span_type, 'bbox': bbox, 'score': score, 'content': content})
+        blocks.append([x0, y0, x0 + column_w, block_y1, None, None, None, block_type, None, None, None, None, 0.9])
+
+    return {'blocks': blocks, 'spans': spans, 'page_w': PAGE_W, 'page_h': page_h}
+
+
+def make_chars(spans):
+    """为text span生成pdf字符，用于fill_char_in_spans"""
+    text_spans = []
+    all_chars = []
+    char_idx = 0
+    for span in spans:
+        if span['type'] != ContentType.TEXT:
+            continue
+        x0, y0, x1, y1 = span['bbox']
+        text_spans.append({
+            'type': span['type'], 'bbox': span['bbox'], 'score': span['score'],
+            'content': '', 'chars': [], 'height': y1 - y0, 'width': x1 - x0,
+        })
+        char_w = (x1 - x0) / CHARS_PER_SPAN
+        for i in range(CHARS_PER_SPAN):
+            char_x0 = x0 + i * char_w
+            all_chars.append({
+                'char': WORDS[char_idx % len(WORDS)][0],
+                'bbox': [char_x0 + 0.5, y0 + 1, char_x0 + char_w - 0.5, y1 - 1],
+                'char_idx': char_idx,
+            })
+            char_idx += 1
+    return text_spans, all_chars
+
+
+def make_fix_blocks(page):
+    """span填充进block并fix后的未排序block"""
+    blocks = copy.deepcopy(page['blocks'])
+    spans = copy.deepcopy(page['spans'])
+    block_with_spans, _ = fill_spans_in_blocks(blocks, spans, 0.5)
+    return fix_block_spans(block_with_spans)
+
+
+def make_pdf_info(page, page_count=1):
+    """xycut排序后构造的page_info列表，用于para_split和union_make"""
+    pdf_info = []
+    for page_index in range(page_count):
+        fix_blocks = make_fix_blocks(page)
+        get_line_height(fix_blocks)
+        sorted_blocks = sort_blocks_by_sorted_lines(fix_blocks, None)
+        pdf_info.append(make_page_info_dict(sorted_blocks, page_index, page['page_w'], page['page_h'], []))
+    return pdf_info
+
+
+def make_det_boxes(page, scale=2.0):
+    """把span转换为ocr检测框，同一行相邻的框有少量重叠，用于merge_det_boxes和sorted_boxes"""
+    boxes = []
+    for span in page['spans']:
+        x0, y0, x1, y1 = [v * scale for v in span['bbox']]
+        x1 += 3
+        boxes.append([[x0, y0], [x1, y0], [x1, y1], [x0, y1]])
+    return np.array(boxes, dtype=np.float32)
+
+
+def make_otsl(num_cells, seed=0):
+    """生成包含合并单元格的OTSL表格"""
+    rng = random.Random(seed)
+    cols = max(2, int(math.sqrt(num_cells)))
+    rows = math.ceil(num_cells / cols)
+    otsl = ''
+    for row in range(rows):
+        for col in range(cols):
+            r = rng.random()
+            if col > 0 and r < 0.05:
+                otsl += '<lcel>'
+            elif row > 0 and r < 0.1:
+                otsl += '<ucel>'
+            elif r < 0.15:
+                otsl += '<ecel>'
+            else:
+                otsl += f'<fcel>{rng.choice(WORDS)} {row}-{col}'
+        otsl += '<nl>'
+    return otsl
+
+
+# 可打印ascii字符映射到不在标准字形表中的名字，pdfium无法转为unicode，相当于缺少ToUnicode的字体
+_DIFFERENCES = b' '.join(b'/g%d' % code for code in range(32, 127))
+
+
+def build_pdf(pages):
+    """按每页的内容流生成A4大小的pdf，F1为正常字体，F2为乱码字体，Im1为128x128的灰度图"""
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    fonts = {
+        b'F1': add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>'),
+        b'F2': add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding '
+                   b'<< /Type /Encoding /Differences [32 ' + _DIFFERENCES + b'] >> >>'),
+    }
+    pixels = bytes(range(256)) * 64
+    image = add(b'<< /Type /XObject /Subtype /Image /Width 128 /Height 128 /ColorSpace /DeviceGray '
+                b'/BitsPerComponent 8 /Length %d >>\nstream\n' % len(pixels) + pixels + b'\nendstream')
+    font_res = b' '.join(b'/%s %d 0 R' % (name, obj_id) for name, obj_id in fonts.items())
+    pages_id = len(objects) + 2 * len(pages) + 1
+    page_ids = []
+    for content in pages:
+        content_id = add(b'<< /Length %d >>\nstream\n' % len(content) + content + b'\nendstream')
+        page_ids.append(add(
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Contents %d 0 R '
+            b'/Resources << /Font << %s >> /XObject << /Im1 %d 0 R >> >> >>' % (pages_id, content_id, font_res, image)
+        ))
+    kids = b' '.join(b'%d 0 R' % page_id for page_id in page_ids)
+    add(b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(page_ids)))
+    catalog = add(b'<< /Type /Catalog /Pages %d 0 R >>' % pages_id)
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for obj_id, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b'%d 0 obj\n' % obj_id + body + b'\nendobj\n')
+    xref = out.tell()
+    out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    out.write(b''.join(b'%010d 00000 n \n' % offset for offset in offsets))
+    out.write(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, catalog, xref))
+    return out.getvalue()
+
+
+def text_page(lines=30, font=b'F1', label=b''):
+    """label加在每行开头，用于区分内容不同的文本页"""
+    return b''.join(
+        b'BT /%s 10 Tf 50 %d Td (%sThe quick brown fox jumps over the lazy dog %d) Tj ET\n'
+        % (font, 800 - 20 * i, label, i)
+        for i in range(lines)
+    )
+
+
+def scanned_page():
+    return b'q 595 0 0 842 0 0 cm /Im1 Do Q\n'
+
+
+def outlined_page():
+    """文字被转为矢量路径，页面中只有路径，没有文本和图像"""
+    return b''.join(b'%d %d 6 9 re f\n' % (50 + 9 * (i % 50), 800 - 20 * (i // 50)) for i in range(1500))
+
+
+def garbled_page():
+    return text_page(font=b'F2')
+
+
+def figure_page():
+    """只有一行图注和一张小图的插图页"""
+    return b'q 300 0 0 200 100 400 cm /Im1 Do Q\n' + text_page(lines=1)
+
+
+# 以下为流式推理测试使用的确定性模型替身，结果只取决于页面图像，不需要下载模型
+PDF_PAGE_H = 842
+
+
+def _poly(x0, y0, x1, y1, scale):
+    x0, y0, x1, y1 = [round(v * scale, 2) for v in (x0, y0, x1, y1)]
+    return [x0, y0, x1, y0, x1, y1, x0, y1]
+
+
+def fake_batch_image_analyze(images_with_extra_info, formula_enable=True, table_enable=True):
+    """
+    代替batch_image_analyze：每页输出一个覆盖text_page文本行的文本块和逐行的span，
+    文本块的置信度和ocr页面span的文本由像素均值决定，内容不同的页面结果不同
+    """
+    results = []
+    for image, ocr_enable, *_ in images_with_extra_info:
+        image = np.asarray(image)
+        scale = image.shape[1] / 595
+        mean = float(image.mean())
+        layout_dets = [{'category_id': 1, 'poly': _poly(45, 25, 565, 630, scale), 'score': round(0.5 + mean / 510, 3)}]
+        for i in range(30):
+            top = PDF_PAGE_H - (800 - 20 * i) - 10
+            span = {'category_id': 15, 'poly': _poly(48, top, 560, top + 13, scale), 'score': 1.0, 'text': ''}
+            if ocr_enable:
+                span['text'] = f'ocr {int(mean)} {i}'
+                span['score'] = 0.99
+            layout_dets.append(span)
+        results.append(layout_dets)
+    return results
+
+
+class FakeOcrModel:
+    """后置ocr的替身，识别结果为裁剪区域的像素均值"""
+
+    def ocr(self, img_crop_list, det=False, tqdm_enable=False):
+        return [[(f'crop {int(np.asarray(img).mean())}', 0.99) for img in img_crop_list]]
+
+
+class FakeModelSingleton:
+    """layoutreader和ocr模型管理器的替身，配合fake_do_predict使用"""
+
+    def get_model(self, *args, **kwargs):
+        return None
+
+    def get_atom_model(self, *args, **kwargs):
+        return FakeOcrModel()
+
+
+def fake_do_predict(boxes, model):
+    """按从上到下、从左到右的顺序代替layoutreader排序"""
+    return sorted(range(len(boxes)), key=lambda index: (boxes[index][1], boxes[index][0]))
+
+
+def fake_do_predict_batch(boxes_list, model, batch_size=16):
+    return [fake_do_predict(boxes, model) for boxes in boxes_list]
+
+
+def patch_pipeline_models(monkeypatch):
+    """把流式推理和后处理中用到的模型替换为上面的确定性替身"""
+    from mineru.backend.pipeline import model_json_to_middle_json, pipeline_analyze
+    from mineru.utils import block_sort
+
+    monkeypatch.setattr(pipeline_analyze, 'batch_image_analyze', fake_batch_image_analyze)
+    monkeypatch.setattr(model_json_to_middle_json, 'AtomModelSingleton', FakeModelSingleton)
+    monkeypatch.setattr(block_sort, 'ModelSingleton', FakeModelSingleton)
+    monkeypatch.setattr(block_sort, 'do_predict', fake_do_predict)
+    try:
+        from mineru.backend.pipeline import page_process_pool
+    except ImportError:
+        return
+    monkeypatch.setattr(page_process_pool, 'ModelSingleton', FakeModelSingleton)
+    monkeypatch.setattr(page_process_pool, 'do_predict_batch', fake_do_predict_batch)
@@ -0,0 +1,154 @@
+"""
+自适应batch控制器的cpu单元测试，用假的infer_fn模拟OOM和随batch大小变化的吞吐，计时使用假时钟。
+
+运行方式:
+    pytest tests/benchmark/test_batch_controller.py
+"""
+import pytest
+
+pytest.importorskip('torch')
+
+from mineru.backend.pipeline import batch_controller as bc  # noqa: E402
+from mineru.backend.pipeline.batch_controller import AdaptiveBatchController  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class FakeModel:
+    """
+    batch大小超过oom_above时抛出OOM；每个batch耗时为overhead + per_item_time(batch大小) * 计算量，
+    overhead让小batch的吞吐偏低，per_item_time随batch增大时吞吐出现峰值
+    """
+
+    def __init__(self, clock, oom_above=None, overhead=1.0, per_item_time=None, cost_fn=None):
+        self.clock = clock
+        self.oom_above = oom_above
+        self.overhead = overhead
+        self.per_item_time = per_item_time or (lambda batch_size: 0.1)
+        self.cost_fn = cost_fn or (lambda item: 1)
+        self.calls = []
+
+    def __call__(self, batch):
+        self.calls.append(len(batch))
+        if self.oom_above is not None and len(batch) > self.oom_above:
+            raise RuntimeError('CUDA out of memory. Tried to allocate 2.00 GiB')
+        cost = sum(self.cost_fn(item) for item in batch)
+        self.clock.now += self.overhead + self.per_item_time(len(batch)) * cost
+        return [item * 10 for item in batch]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(bc.time, 'time', clock.time)
+    monkeypatch.setattr(bc, 'clean_memory', lambda device: None)
+    monkeypatch.setattr(bc, 'get_rss', lambda: None)
+    return clock
+
+
+def _controller():
+    controller = AdaptiveBatchController('cpu', adaptive=True)
+    controller.cpu_memory_budget = None
+    return controller
+
+
+def test_oom_halves_and_retries(clock):
+    model = FakeModel(clock, oom_above=5)
+    controller = _controller()
+    items = list(range(40))
+    results = controller.run('mfr', items, model, base_batch_size=16)
+    assert results == [item * 10 for item in items]
+    # 16 -> 8 -> 4 后不再超过上限
+    assert model.calls[:3] == [16, 8, 4]
+    assert max(size for size in model.calls[3:]) <= 4
+    state = controller.stages['mfr']
+    assert state.oom_count == 2 and state.batch_limit == 4
+
+
+def test_oom_at_batch_size_one_raises(clock):
+    controller = _controller()
+    with pytest.raises(RuntimeError, match='out of memory with batch size 1'):
+        controller.run('mfr', [1, 2, 3], FakeModel(clock, oom_above=0), base_batch_size=2)
+
+
+def test_non_oom_error_propagates(clock):
+    def infer_fn(batch):
+        raise ValueError('broken input')
+
+    with pytest.raises(ValueError):
+        _controller().run('mfr', [1, 2, 3], infer_fn, base_batch_size=2)
+
+
+def test_grows_until_throughput_stops_improving(clock):
+    # 吞吐在batch为16时最高，32时单项耗时变大
+    model = FakeModel(clock, per_item_time=lambda batch_size: 0.1 if batch_size <= 16 else 0.3)
+    controller = _controller()
+    controller.run('ocr_rec', list(range(400)), model, base_batch_size=4, max_batch_size=64)
+    assert model.calls[:4] == [4, 8, 16, 32]
+    state = controller.stages['ocr_rec']
+    assert state.settled and state.batch_size == 16
+    assert set(model.calls[4:-1]) == {16}
+
+
+def test_growth_capped_by_max_batch_size(clock):
+    model = FakeModel(clock)
+    controller = _controller()
+    controller.run('ocr_rec', list(range(200)), model, base_batch_size=4, max_batch_size=16)
+    assert max(model.calls) == 16
+    assert controller.stages['ocr_rec'].settled
+
+
+def test_throughput_weighted_by_cost(clock):
+    # 按长度从长到短排列的输入，不按计算量统计时后面的batch显得更快，会把batch错误地放大到上限
+    items = [1000 / (index + 1) for index in range(256)]
+
+    def per_item_time(batch_size):
+        return 0.01 if batch_size <= 8 else 0.02
+
+    unweighted = FakeModel(clock, overhead=0.0, per_item_time=per_item_time, cost_fn=lambda item: item)
+    controller = _controller()
+    controller.run('mfr', items, unweighted, base_batch_size=4, max_batch_size=64)
+    assert controller.stages['mfr'].batch_size > 8
+
+    weighted = FakeModel(clock, overhead=0.0, per_item_time=per_item_time, cost_fn=lambda item: item)
+    controller = _controller()
+    controller.run('mfr', items, weighted, base_batch_size=4, max_batch_size=64, cost_fn=lambda item: item)
+    assert controller.stages['mfr'].batch_size <= 8
+
+
+def test_groups_have_independent_state(clock):
+    controller = _controller()
+    controller.run('ocr_det', list(range(20)), FakeModel(clock, oom_above=2), base_batch_size=8, group=('ch', 64, 640))
+    controller.run('ocr_det', list(range(20)), FakeModel(clock), base_batch_size=8, group=('ch', 32, 320))
+    assert controller.stages[('ocr_det', ('ch', 64, 640))].batch_limit == 2
+    small = controller.stages[('ocr_det', ('ch', 32, 320))]
+    assert small.oom_count == 0 and small.batch_size >= 8
+
+
+def test_oom_limit_expires_after_rounds(clock):
+    controller = _controller()
+    controller.run('mfr', list(range(32)), FakeModel(clock, oom_above=4), base_batch_size=8)
+    state = controller.stages['mfr']
+    assert state.batch_limit == 4 and state.settled
+    for _ in range(bc.OOM_LIMIT_ROUNDS - 1):
+        controller.new_round()
+        assert state.batch_limit == 4 and not state.settled
+    controller.new_round()
+    assert state.oom_limit is None and state.batch_limit == state.max_batch_size
+    # 上限恢复后可以重新增长
+    model = FakeModel(clock)
+    controller.run('mfr', list(range(200)), model, base_batch_size=8)
+    assert max(model.calls) > 4
+
+
+def test_not_adaptive_keeps_batch_size(clock):
+    model = FakeModel(clock)
+    controller = AdaptiveBatchController('cpu', adaptive=False)
+    controller.run('layout', list(range(50)), model, base_batch_size=8)
+    assert model.calls == [8] * 6 + [2]
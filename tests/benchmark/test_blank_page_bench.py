@@ -0,0 +1,72 @@
+"""
+空白页预筛的cpu benchmark，统计单页墨迹占比判断的耗时，相比于跳过的layout/mfd/ocr等模型推理可以忽略不计。
+
+运行方式:
+    pytest tests/benchmark/test_blank_page_bench.py --benchmark-group-by=group --benchmark-columns=min,mean,max,rounds
+"""
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+pdfium = pytest.importorskip('pypdfium2')
+
+from mineru.utils.blank_page import is_blank_image, is_empty_pdf_page  # noqa: E402
+from mineru.utils.pdf_image_tools import pdf_page_to_image  # noqa: E402
+
+PDF_PATH = Path(__file__).parents[2] / 'demo' / 'pdfs' / 'demo1.pdf'
+
+
+@pytest.fixture(scope='module')
+def page_np():
+    if not PDF_PATH.exists():
+        pytest.skip(f'{PDF_PATH} not found')
+    doc = pdfium.PdfDocument(str(PDF_PATH))
+    try:
+        yield pdf_page_to_image(doc[0]).img_np
+    finally:
+        doc.close()
+
+
+@pytest.fixture(scope='module')
+def scanned_back_np(page_np):
+    """模拟扫描件的空白背面：偏灰的纸张底色、噪点、透印和扫描仪黑边"""
+    rng = np.random.default_rng(0)
+    height, width = page_np.shape[:2]
+    image = np.clip(235 + rng.normal(0, 8, (height, width, 1)), 0, 255).astype(np.uint8).repeat(3, axis=2)
+    for _ in range(30):
+        y, x = rng.integers(0, height - 2), rng.integers(0, width - 2)
+        image[y:y + 2, x:x + 2] = 40
+    image[height // 8: height * 7 // 8, width // 8: width * 7 // 8] -= 20
+    image[:, :width // 50] = 20
+    return image
+
+
+@pytest.mark.benchmark(group='blank_page_screen')
+def test_screen_text_page(benchmark, page_np):
+    assert not benchmark(is_blank_image, page_np)
+
+
+@pytest.mark.benchmark(group='blank_page_screen')
+def test_screen_scanned_back(benchmark, scanned_back_np):
+    assert benchmark(is_blank_image, scanned_back_np)
+
+
+def test_single_text_line_is_not_blank(page_np):
+    image = np.full_like(page_np, 255)
+    height, width = page_np.shape[:2]
+    # 文本密集区域中的一行文字
+    band = slice(height // 2, height // 2 + 40)
+    image[band] = page_np[band]
+    assert not is_blank_image(image)
+
+
+def test_empty_pdf_page():
+    doc = pdfium.PdfDocument.new()
+    try:
+        page = doc.new_page(595, 842)
+        assert is_empty_pdf_page(page)
+        assert is_blank_image(pdf_page_to_image(page).img_np)
+    finally:
+        doc.close()
@@ -0,0 +1,137 @@
+"""
+DocumentContext和ImageDocument的单元测试：页面范围视图与重新生成的pdf一致，文本页缓存不超过上限，
+图片输入直接解码，最长边的上限与pdf页面相同。
+
+运行方式:
+    pytest tests/benchmark/test_document_context.py
+"""
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+pdfium = pytest.importorskip('pypdfium2')
+
+from mineru.utils.document_context import DocumentContext, ImageDocument  # noqa: E402
+from mineru.utils.pdf_image_tools import pdf_page_to_image  # noqa: E402
+from mineru.utils.pdf_reader import pdfium_lock  # noqa: E402
+from synthetic import build_pdf, text_page  # noqa: E402
+
+PAGE_COUNT = 6
+
+
+@pytest.fixture(scope='module')
+def pdf_bytes():
+    return build_pdf([text_page(lines=2, label=b'P%d ' % index) for index in range(PAGE_COUNT)])
+
+
+def _page_text(page):
+    textpage = page.get_textpage()
+    try:
+        return textpage.get_text_range()
+    finally:
+        textpage.close()
+        page.close()
+
+
+@pytest.mark.parametrize('page_range, expected', [
+    ((0, None), (0, 5)),
+    ((2, 4), (2, 4)),
+    ((3, 100), (3, 5)),
+    ((-1, -1), (0, 5)),
+])
+def test_page_range_view(pdf_bytes, page_range, expected):
+    with DocumentContext(pdf_bytes, *page_range) as doc:
+        start_page_id, end_page_id = expected
+        assert (doc.start_page_id, doc.end_page_id) == expected
+        assert len(doc) == end_page_id - start_page_id + 1
+        assert doc.is_full_range == (expected == (0, PAGE_COUNT - 1))
+        for page_index in range(len(doc)):
+            assert doc.to_source_index(page_index) == start_page_id + page_index
+            assert _page_text(doc[page_index]).startswith('P%d ' % (start_page_id + page_index))
+            assert doc.get_page_size(page_index) == (595, 842)
+        with pytest.raises(IndexError):
+            doc[len(doc)]
+        with pytest.raises(IndexError):
+            doc.to_source_index(-1)
+
+        # 视图对应的pdf按需生成，页面内容与视图一致
+        range_doc = pdfium.PdfDocument(doc.pdf_bytes)
+        try:
+            assert len(range_doc) == len(doc)
+            assert [_page_text(range_doc[i]) for i in range(len(doc))] == [
+                _page_text(doc[i]) for i in range(len(doc))
+            ]
+        finally:
+            range_doc.close()
+        if doc.is_full_range:
+            assert doc.pdf_bytes is pdf_bytes
+
+
+def test_pdf_bytes_after_close(pdf_bytes):
+    doc = DocumentContext(pdf_bytes, 1, 2)
+    doc.close()
+    doc.close()
+    assert doc.closed
+    assert len(pdfium.PdfDocument(doc.pdf_bytes)) == 2
+
+
+@pytest.mark.parametrize('cache_size', [0, 1, 3])
+def test_textpage_cache_bound(pdf_bytes, monkeypatch, cache_size):
+    monkeypatch.setenv('MINERU_TEXTPAGE_CACHE_SIZE', str(cache_size))
+    with DocumentContext(pdf_bytes) as doc:
+        for page_index in range(len(doc)):
+            with pdfium_lock:
+                doc.get_textpage(page_index)
+            doc.release_textpage(page_index, keep_cached=True)
+            assert len(doc._textpages) <= cache_size
+        # 缓存满后保留靠前的页面
+        assert sorted(doc._textpages) == list(range(cache_size))
+        # 同一页面再次保留时不重复计数
+        if cache_size > 0:
+            with pdfium_lock:
+                doc.get_textpage(0)
+            doc.release_textpage(0, keep_cached=True)
+            assert 0 in doc._textpages
+        for page_index in range(len(doc)):
+            doc.release_textpage(page_index)
+        assert doc._textpages == {}
+
+
+def _png_bytes(width, height):
+    rng = np.random.default_rng(0)
+    out = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8)).save(out, format='PNG')
+    return out.getvalue()
+
+
+@pytest.mark.parametrize('size, expected_shape, expected_scale', [
+    ((300, 200), (200, 300), 1.0),
+    ((5120, 1000), (500, 2560), 0.5),
+    ((1000, 3000), (2560, 854), 2560 / 3000),
+])
+def test_image_document(size, expected_shape, expected_scale):
+    width, height = size
+    image_bytes = _png_bytes(width, height)
+    with ImageDocument(image_bytes) as doc:
+        assert len(doc) == 1
+        assert doc.get_page_size(0) == (width, height)
+        with pytest.raises(IndexError):
+            doc[1]
+        image_dict = pdf_page_to_image(doc[0])
+        # 与pdf页面一样按最长边缩小，不放大小图
+        assert image_dict.img_np.shape == expected_shape + (3,)
+        assert image_dict.scale == pytest.approx(expected_scale)
+        assert image_dict.img_np.flags.c_contiguous
+        if expected_scale == 1.0:
+            decoded = np.asarray(Image.open(io.BytesIO(image_bytes)).convert('RGB'))
+            np.testing.assert_array_equal(image_dict.img_np, decoded[..., ::-1])
+
+        # 需要pdf文件时生成单页pdf，页面尺寸与图片像素尺寸一致
+        pdf_doc = pdfium.PdfDocument(doc.pdf_bytes)
+        try:
+            assert len(pdf_doc) == 1
+            assert tuple(round(v) for v in pdf_doc.get_page_size(0)) == (width, height)
+        finally:
+            pdf_doc.close()
@@ -0,0 +1,38 @@
+"""
+公式识别结果缓存的cpu benchmark，统计缓存查询的耗时，相比于一次自回归解码可以忽略不计。
+
+运行方式:
+    pytest tests/benchmark/test_formula_cache_bench.py --benchmark-group-by=group --benchmark-columns=min,mean,max,rounds
+"""
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+pytest.importorskip('torch')
+
+from mineru.backend.pipeline.inference_cache import FormulaLatexCache  # noqa: E402
+
+MODEL_ID = 'unimernet/test'
+
+
+@pytest.fixture(scope='module')
+def warm_cache():
+    cache = FormulaLatexCache(max_entries=20000)
+    cache.put_many(MODEL_ID, [(f'{i:032x}', f'x_{{{i}}}') for i in range(20000)])
+    return cache
+
+
+@pytest.mark.benchmark(group='formula_latex_cache')
+def test_lookup_1000_crops(benchmark, warm_cache):
+    content_hashes = [f'{i:032x}' for i in range(0, 2000, 2)]
+    results = benchmark(warm_cache.get_many, MODEL_ID, content_hashes)
+    assert len(results) == 1000
+
+
+def test_lru_eviction():
+    cache = FormulaLatexCache(max_entries=2)
+    cache.put_many(MODEL_ID, [('a', 'x'), ('b', 'y')])
+    # 访问a后再写入c，最久未访问的b被淘汰
+    assert cache.get_many(MODEL_ID, ['a']) == {'a': 'x'}
+    cache.put_many(MODEL_ID, [('c', 'z')])
+    assert cache.get_many(MODEL_ID, ['a', 'b', 'c']) == {'a': 'x', 'c': 'z'}
+    assert cache.get_many('other_model', ['a']) == {}
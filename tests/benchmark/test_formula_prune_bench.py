@@ -0,0 +1,73 @@
+"""
+公式识别前裁剪的cpu benchmark，统计按后处理规则判断单页公式能否保留的耗时，相比于公式识别可以忽略不计。
+
+运行方式:
+    pytest tests/benchmark/test_formula_prune_bench.py --benchmark-group-by=group --benchmark-columns=min,mean,max,rounds
+"""
+import random
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+pytest.importorskip('torch')
+
+from mineru.backend.pipeline.formula_prune import get_surviving_formulas  # noqa: E402
+
+SCALE = 200 / 72
+PAGE_GEOMETRY = (SCALE, 595, 842)
+
+
+def _poly(x0, y0, x1, y1):
+    return [x0, y0, x1, y0, x1, y1, x0, y1]
+
+
+def _det(category_id, bbox, score=0.9):
+    return {'category_id': category_id, 'poly': _poly(*bbox), 'score': score}
+
+
+def _formula(bbox, category_id=13):
+    return {**_det(category_id, bbox), 'latex': ''}
+
+
+@pytest.fixture(scope='module')
+def sample_page():
+    layout_res = [
+        _det(2, (100, 40, 1500, 120)),  # 页眉
+        _det(1, (100, 200, 1500, 600)),  # 正文
+        _det(3, (100, 700, 1500, 1300)),  # 图片
+        _det(4, (100, 1320, 1500, 1400)),  # 图片标题
+        _det(5, (100, 1500, 1500, 2100)),  # 表格
+    ]
+    formulas = [
+        _formula((300, 300, 500, 340)),  # 正文中的行内公式
+        _formula((300, 60, 400, 100)),  # 页眉中的公式，作为舍弃块的span保留
+        _formula((400, 900, 700, 960)),  # 图片中的公式
+        _formula((300, 1700, 600, 1760)),  # 表格中的公式
+        _formula((300, 650, 1300, 690), category_id=14),  # 独立的行间公式
+    ]
+    return layout_res, formulas
+
+
+def test_prune_formulas_in_figures_and_tables(sample_page):
+    layout_res, formulas = sample_page
+    keep_list = get_surviving_formulas(layout_res, formulas, PAGE_GEOMETRY)
+    assert keep_list == [True, True, False, False, True]
+    # 没有标题的图片在ocr页面中可能被当作文本块，不做裁剪
+    figure_only = [det for det in layout_res if det['category_id'] != 4]
+    assert get_surviving_formulas(figure_only, formulas, PAGE_GEOMETRY, ocr_enable=True) == [True] * len(formulas)
+    assert len(layout_res) == 5 and 'bbox' not in layout_res[0]
+
+
+@pytest.mark.benchmark(group='formula_prune')
+def test_prune_dense_page(benchmark):
+    rng = random.Random(0)
+    layout_res = [
+        _det(rng.choice([0, 1, 1, 1, 2, 3, 4, 5, 8]), (x, y, x + rng.randint(100, 800), y + rng.randint(30, 300)))
+        for x, y in ((rng.randint(0, 800), rng.randint(0, 2000)) for _ in range(40))
+    ]
+    formulas = [
+        _formula((x, y, x + rng.randint(20, 300), y + rng.randint(15, 60)), category_id=rng.choice([13, 13, 13, 14]))
+        for x, y in ((rng.randint(0, 1300), rng.randint(0, 2200)) for _ in range(100))
+    ]
+    keep_list = benchmark(get_surviving_formulas, layout_res, formulas, PAGE_GEOMETRY)
+    assert len(keep_list) == len(formulas)
@@ -0,0 +1,135 @@
+"""
+公式预筛的benchmark和准确率报告。
+
+运行方式:
+    pytest tests/benchmark/test_formula_screen_bench.py -s --benchmark-group-by=group --benchmark-columns=min,mean,max,rounds
+
+样本集默认为demo/pdfs，可以通过环境变量MINERU_FORMULA_SCREEN_SAMPLES指定包含pdf的目录。
+test_formula_screen_report输出每个文档的文本页数、预筛保留的页数和预筛耗时；
+安装了torch并且可以加载公式检测模型时，以MFD在整页上的检测结果为参照，
+统计包含公式的页面的召回率，以及被跳过的页面上节省的MFD耗时（不含MFR）。
+"""
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+pdfium = pytest.importorskip('pypdfium2')
+
+from mineru.utils.formula_screen import text_page_may_contain_formula  # noqa: E402
+
+DEMO_DIR = Path(__file__).parents[2] / 'demo' / 'pdfs'
+SAMPLE_DIR = Path(os.getenv('MINERU_FORMULA_SCREEN_SAMPLES', DEMO_DIR))
+
+
+def _sample_pdfs():
+    pdf_paths = sorted(SAMPLE_DIR.glob('*.pdf'))
+    if not pdf_paths:
+        pytest.skip(f'no pdf found in {SAMPLE_DIR}')
+    return pdf_paths
+
+
+def _screen_doc(pdf_doc):
+    """返回[(page_index, 是否为文本页, 是否保留, 耗时)]，没有文本层的页面由版面检测结果判断，不计入统计"""
+    results = []
+    for page_index in range(len(pdf_doc)):
+        page = pdf_doc[page_index]
+        text_page = page.get_textpage()
+        try:
+            is_text_page = text_page.count_chars() > 0
+            start = time.perf_counter()
+            keep = text_page_may_contain_formula(text_page) if is_text_page else True
+            results.append((page_index, is_text_page, keep, time.perf_counter() - start))
+        finally:
+            text_page.close()
+            page.close()
+    return results
+
+
+@pytest.fixture(scope='module')
+def text_pages():
+    """demo中包含公式和不包含公式的文本页"""
+    path = DEMO_DIR / 'demo2.pdf'
+    if not path.exists():
+        pytest.skip(f'{path} not found')
+    pdf_doc = pdfium.PdfDocument(str(path))
+    pages = {'formula': pdf_doc[2], 'plain': pdf_doc[5]}
+    text_pages = {name: page.get_textpage() for name, page in pages.items()}
+    yield text_pages
+    pdf_doc.close()
+
+
+@pytest.mark.benchmark(group='formula_screen')
+def test_screen_formula_page(benchmark, text_pages):
+    assert benchmark(text_page_may_contain_formula, text_pages['formula'])
+
+
+@pytest.mark.benchmark(group='formula_screen')
+def test_screen_plain_page(benchmark, text_pages):
+    assert not benchmark(text_page_may_contain_formula, text_pages['plain'])
+
+
+def test_formula_screen_report(capsys):
+    rows = []
+    for pdf_path in _sample_pdfs():
+        pdf_doc = pdfium.PdfDocument(str(pdf_path))
+        try:
+            results = _screen_doc(pdf_doc)
+        finally:
+            pdf_doc.close()
+        text_results = [result for result in results if result[1]]
+        rows.append((
+            pdf_path.name, len(results), len(text_results), sum(result[2] for result in text_results),
+            sum(result[3] for result in text_results) * 1000,
+        ))
+
+    with capsys.disabled():
+        print(f"\n{'document':<32}{'pages':>8}{'text':>8}{'kept':>8}{'screen_ms':>12}")
+        for name, pages, text, kept, screen_ms in rows:
+            print(f'{name:<32}{pages:>8}{text:>8}{kept:>8}{screen_ms:>12.1f}')
+
+
+def test_formula_screen_recall_against_mfd(capsys):
+    pytest.importorskip('torch')
+    pytest.importorskip('ultralytics')
+    from mineru.backend.pipeline.pipeline_analyze import ModelSingleton
+    from mineru.utils.pdf_image_tools import pdf_page_to_image
+
+    try:
+        mfd_model = ModelSingleton().get_model(lang=None, formula_enable=True, table_enable=False).mfd_model
+    except Exception as e:
+        pytest.skip(f'mfd model unavailable: {e}')
+
+    positives = recalled = kept_pages = text_pages = 0
+    saved_seconds = total_seconds = 0.0
+    for pdf_path in _sample_pdfs():
+        pdf_doc = pdfium.PdfDocument(str(pdf_path))
+        try:
+            for page_index, is_text_page, keep, _ in _screen_doc(pdf_doc):
+                if not is_text_page:
+                    continue
+                page = pdf_doc[page_index]
+                img_np = pdf_page_to_image(page).img_np
+                page.close()
+                start = time.perf_counter()
+                mfd_res = mfd_model.batch_predict([img_np], 1)[0]
+                elapsed = time.perf_counter() - start
+                text_pages += 1
+                kept_pages += keep
+                total_seconds += elapsed
+                if not keep:
+                    saved_seconds += elapsed
+                if len(mfd_res.boxes.xyxy) > 0:
+                    positives += 1
+                    recalled += keep
+        finally:
+            pdf_doc.close()
+
+    recall = recalled / positives if positives else 1.0
+    with capsys.disabled():
+        print(
+            f'\ntext pages: {text_pages}, kept: {kept_pages}, pages with formulas (mfd): {positives}, '
+            f'recall: {recall:.3f}, mfd time saved: {saved_seconds:.2f}s/{total_seconds:.2f}s'
+        )
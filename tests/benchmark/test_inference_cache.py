@@ -0,0 +1,95 @@
+"""
+推理结果缓存的单元测试：缓存值按json和np.save格式保存，不使用pickle，覆盖已有key时总大小不重复计算。
+
+运行方式:
+    pytest tests/benchmark/test_inference_cache.py
+"""
+import pickle
+
+import numpy as np
+import pytest
+
+pytest.importorskip('torch')
+
+from mineru.backend.pipeline.inference_cache import InferenceCache, decode_cache_value, encode_cache_value  # noqa: E402
+
+VALUES = {
+    'layout': [{'category_id': 1, 'poly': [1.0, 2.0, 3.0, 2.0, 3.0, 4.0, 1.0, 4.0], 'score': 0.93}],
+    'mfd': {
+        'xyxy': np.arange(8, dtype=np.float32).reshape(2, 4),
+        'conf': np.array([0.5, 0.9], dtype=np.float32),
+        'cls': np.array([0, 1], dtype=np.float32),
+    },
+    'ocr_det': (np.zeros((0, 4, 2), dtype=np.float32), 0.01),
+    'table': ('<table></table>', np.ones((3, 8)), [[0, 0, 1, 1]], np.float64(0.2)),
+    'mfr_crop': 'x^{2}',
+}
+
+
+def _assert_equal(actual, expected):
+    if isinstance(expected, np.ndarray):
+        assert isinstance(actual, np.ndarray) and actual.dtype == expected.dtype
+        np.testing.assert_array_equal(actual, expected)
+    elif isinstance(expected, dict):
+        assert actual.keys() == expected.keys()
+        for key in expected:
+            _assert_equal(actual[key], expected[key])
+    elif isinstance(expected, (list, tuple)):
+        assert isinstance(actual, list) and len(actual) == len(expected)
+        for actual_item, expected_item in zip(actual, expected):
+            _assert_equal(actual_item, expected_item)
+    else:
+        assert actual == expected and not isinstance(actual, np.generic)
+
+
+@pytest.mark.parametrize('stage', list(VALUES))
+def test_value_round_trip(stage):
+    _assert_equal(decode_cache_value(encode_cache_value(VALUES[stage])), VALUES[stage])
+
+
+def test_rejects_pickle_and_object_arrays():
+    with pytest.raises(ValueError):
+        decode_cache_value(pickle.dumps(VALUES['layout']))
+    with pytest.raises((TypeError, ValueError)):
+        encode_cache_value([np.array([object()], dtype=object)])
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = InferenceCache(str(tmp_path), max_size_gb=1)
+    yield cache
+    cache.close()
+
+
+def test_get_many_round_trip(cache):
+    cache.put_many('mfd', [('a', VALUES['mfd']), ('b', None)])
+    results = cache.get_many('mfd', ['a', 'b'])
+    assert list(results) == ['a']
+    _assert_equal(results['a'], VALUES['mfd'])
+    # 旧版本写入的pickle数据按未命中处理
+    cache._conn.execute(
+        'INSERT INTO cache (key, stage, value, size, last_access) VALUES (?, ?, ?, ?, ?)',
+        ('old', 'layout', pickle.dumps(VALUES['layout']), 10, 0)
+    )
+    assert cache.get_many('layout', ['old']) == {}
+
+
+def test_replaced_rows_not_double_counted(cache):
+    cache.put_many('layout', [('a', VALUES['layout']), ('b', VALUES['mfr_crop'])])
+    cache.put_many('layout', [('a', VALUES['layout'] * 3), ('a', VALUES['layout'] * 2)])
+    assert cache._total_size == cache._query_total_size()
+
+
+def test_evicts_least_recently_used(tmp_path):
+    value = np.zeros(1024, dtype=np.uint8)
+    entry_size = len(encode_cache_value(value))
+    cache = InferenceCache(str(tmp_path), max_size_gb=entry_size * 3.5 / 1024 ** 3)
+    try:
+        for key in 'abc':
+            cache.put_many('layout', [(key, value)])
+        cache.get_many('layout', ['a'])
+        cache.put_many('layout', [('d', value)])
+        assert sorted(cache.get_many('layout', list('abcd'))) == ['a', 'c', 'd']
+        assert cache._total_size == cache._query_total_size()
+    finally:
+        cache.close()
@@ -0,0 +1,127 @@
+"""
+命令行输入分批的单元测试：输入路径的枚举和重名处理、按页数划分工作单元、有界预读和提前退出，
+以及命令行按工作单元解析目录并在断点续跑时跳过已完成的文档。模型由synthetic中的确定性替身代替。
+
+运行方式:
+    pytest tests/benchmark/test_ingest.py
+"""
+import threading
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('pypdfium2')
+pytest.importorskip('click')
+
+from click.testing import CliRunner  # noqa: E402
+
+from mineru.backend.pipeline import pipeline_analyze  # noqa: E402
+from mineru.cli.client import main  # noqa: E402
+from mineru.cli.ingest import (  # noqa: E402
+    iter_input_paths, iter_named_paths, iter_work_units, prefetch_work_units,
+)
+from synthetic import build_pdf, fake_batch_image_analyze, patch_pipeline_models, scanned_page, text_page  # noqa: E402
+
+
+def _write_pdf(path, page_count, label=b''):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pages = [text_page(lines=3, label=label + b'%d ' % index) if index % 2 else scanned_page() for index in range(page_count)]
+    path.write_bytes(build_pdf(pages))
+    return path
+
+
+@pytest.fixture
+def input_dir(tmp_path):
+    root = tmp_path / 'input'
+    _write_pdf(root / 'a.pdf', 3, b'a')
+    _write_pdf(root / 'sub' / 'a.pdf', 2, b'sub a')
+    _write_pdf(root / 'sub' / 'deeper' / 'a.pdf', 1, b'deeper a')
+    _write_pdf(root / 'c.pdf', 4, b'c')
+    (root / 'notes.txt').write_text('not a document')
+    return root
+
+
+def test_iter_input_paths(input_dir, tmp_path):
+    assert [path.name for path in iter_input_paths(input_dir)] == ['a.pdf', 'c.pdf']
+    assert [path.relative_to(input_dir).as_posix() for path in iter_input_paths(input_dir, '**/*')] == [
+        'a.pdf', 'c.pdf', 'sub/a.pdf', 'sub/deeper/a.pdf',
+    ]
+    assert list(iter_input_paths(input_dir / 'c.pdf')) == [input_dir / 'c.pdf']
+
+    list_file = input_dir / 'list.txt'
+    list_file.write_text('# comment\n\nc.pdf\nmissing.pdf\nnotes.txt\n' + str(input_dir / 'sub' / 'a.pdf') + '\n')
+    assert list(iter_input_paths(from_file=str(list_file))) == [input_dir / 'c.pdf', input_dir / 'sub' / 'a.pdf']
+
+
+def test_duplicate_names_are_renamed(input_dir):
+    paths = [input_dir / 'a.pdf', input_dir / 'sub' / 'a.pdf', input_dir / 'sub' / 'deeper' / 'a.pdf',
+             Path('/other/sub/a.pdf')]
+    assert [name for _, name in iter_named_paths(paths)] == ['a', 'sub_a', 'deeper_a', 'sub_a_1']
+
+
+def test_work_units_split_by_pages(input_dir):
+    broken = input_dir / 'broken.pdf'
+    broken.write_bytes(b'%PDF-1.4 broken')
+    paths = [input_dir / 'a.pdf', input_dir / 'sub' / 'a.pdf', broken, input_dir / 'c.pdf',
+             input_dir / 'sub' / 'deeper' / 'a.pdf']
+    skipped = []
+    units = list(iter_work_units(iter_named_paths(paths), 5, on_skip=lambda name, e: skipped.append(name)))
+    # 每个单元的总页数不超过5页，无法打开的文件被跳过
+    assert [[(name, page_count) for _, name, page_count in unit] for unit in units] == [
+        [('a', 3), ('sub_a', 2)], [('c', 4), ('deeper_a', 1)],
+    ]
+    assert skipped == ['broken']
+    # 单个文件超过上限时单独成组
+    assert [len(unit) for unit in iter_work_units(iter_named_paths(paths[:4]), 2)] == [1, 1, 1]
+
+
+def test_prefetch_is_bounded_and_stops_on_early_exit(input_dir):
+    loaded = []
+
+    def units():
+        for index in range(20):
+            loaded.append(index)
+            yield [(input_dir / 'c.pdf', f'c{index}', 4)]
+
+    docs = prefetch_work_units(units(), max_inflight=1)
+    first = next(docs)
+    assert [name for _, name, _ in first] == ['c0']
+    assert isinstance(first[0][2], bytes)
+    # 读取线程最多比调用方多读max_inflight个单元，外加一个等待放入队列的单元
+    assert len(loaded) <= 3
+    docs.close()
+    assert not any(thread.name == 'mineru-ingest' for thread in threading.enumerate())
+    assert len(loaded) < 20
+
+
+def test_cli_resume_skips_done_documents(input_dir, tmp_path, monkeypatch):
+    patch_pipeline_models(monkeypatch)
+    monkeypatch.setenv('MINERU_DEVICE_MODE', 'cpu')
+    monkeypatch.setenv('MINERU_MODEL_SOURCE', 'local')
+    inferred_pages = []
+
+    def recording_analyze(images_with_extra_info, formula_enable=True, table_enable=True):
+        inferred_pages.append(len(images_with_extra_info))
+        return fake_batch_image_analyze(images_with_extra_info, formula_enable, table_enable)
+
+    monkeypatch.setattr(pipeline_analyze, 'batch_image_analyze', recording_analyze)
+    output_dir = tmp_path / 'output'
+    args = ['-p', str(input_dir), '--glob', '**/*.pdf', '--unit-pages', '3', '-o', str(output_dir),
+            '-b', 'pipeline', '--resume']
+
+    def run():
+        inferred_pages.clear()
+        result = CliRunner().invoke(main, args, catch_exceptions=False)
+        assert result.exit_code == 0, result.output
+        return sum(inferred_pages)
+
+    assert run() == 10
+    for name in ('a', 'c', 'sub_a', 'deeper_a'):
+        assert (output_dir / name / 'auto' / f'{name}.md').is_file()
+    # 已完成的文档不再推理，输入变化的文档重新解析
+    assert run() == 0
+    md_path = output_dir / 'sub_a' / 'auto' / 'sub_a.md'
+    old_md = md_path.read_text(encoding='utf-8')
+    _write_pdf(input_dir / 'sub' / 'a.pdf', 3, b'changed')
+    assert run() == 3
+    assert md_path.read_text(encoding='utf-8') != old_md
@@ -0,0 +1,149 @@
+"""
+公式识别连续批处理解码与transformers generate的等价性测试，在cpu上使用随机初始化的小型ViT编码器和UnimerMBart解码器。
+
+覆盖同时解码的序列数从1到N、eager和sdpa注意力、重复惩罚等logits处理器，以及输出长度不同时的补入和移除。
+transformers或UnimerMBart内部（kv-cache的tuple结构、4D attention mask的构造等）变化导致结果不一致时测试失败。
+
+运行方式:
+    pytest tests/benchmark/test_mfr_decoding.py
+"""
+import pytest
+
+torch = pytest.importorskip('torch')
+transformers = pytest.importorskip('transformers')
+
+from transformers import ViTConfig, ViTModel, VisionEncoderDecoderModel  # noqa: E402
+
+from mineru.model.mfr.unimernet.unimernet_hf.decoding import ContinuousGreedyDecoder  # noqa: E402
+from mineru.model.mfr.unimernet.unimernet_hf.unimer_mbart import (  # noqa: E402
+    UnimerMBartConfig, UnimerMBartForCausalLM,
+)
+
+BOS_TOKEN_ID, PAD_TOKEN_ID, EOS_TOKEN_ID = 0, 1, 2
+MAX_NEW_TOKENS = 30
+NUM_ROWS = 23
+
+
+class EosHead(torch.nn.Module):
+    """
+    随机权重的模型几乎不会输出eos，这里按最后一层隐状态的一个分量决定是否输出eos，
+    不同输入的结束步数不同，得到长短不一的输出
+    """
+
+    def __init__(self, head, threshold):
+        super().__init__()
+        self.head = head
+        self.weight = head.weight
+        self.threshold = threshold
+
+    def forward(self, hidden_states):
+        logits = self.head(hidden_states)
+        logits[..., EOS_TOKEN_ID] = torch.where(hidden_states[..., 4] < self.threshold, 1e4, -1e4)
+        return logits
+
+
+def _build_model(attn_implementation, processors, seed=0, threshold=0.7):
+    torch.manual_seed(seed)
+    encoder = ViTModel(ViTConfig(
+        hidden_size=32, num_hidden_layers=1, num_attention_heads=2, intermediate_size=64, image_size=32, patch_size=8,
+    ))
+    decoder_config = UnimerMBartConfig(
+        vocab_size=12, d_model=32, decoder_layers=2, decoder_attention_heads=2, decoder_ffn_dim=64,
+        max_position_embeddings=64, qk_squeeze=2, is_decoder=True, add_cross_attention=True,
+        bos_token_id=BOS_TOKEN_ID, pad_token_id=PAD_TOKEN_ID, eos_token_id=EOS_TOKEN_ID,
+        forced_eos_token_id=EOS_TOKEN_ID, decoder_start_token_id=BOS_TOKEN_ID,
+    )
+    decoder_config._attn_implementation = attn_implementation
+    decoder = UnimerMBartForCausalLM(decoder_config)
+    with torch.no_grad():
+        for param in list(decoder.parameters()) + list(encoder.parameters()):
+            param.normal_(0, 0.4)
+    decoder.lm_head = EosHead(decoder.lm_head, threshold)
+    model = VisionEncoderDecoderModel(encoder=encoder, decoder=decoder).eval()
+
+    model.config.decoder_start_token_id = BOS_TOKEN_ID
+    model.config.pad_token_id = PAD_TOKEN_ID
+    generation_config = model.generation_config
+    generation_config.decoder_start_token_id = BOS_TOKEN_ID
+    generation_config.pad_token_id = PAD_TOKEN_ID
+    generation_config.eos_token_id = EOS_TOKEN_ID
+    generation_config.forced_eos_token_id = EOS_TOKEN_ID
+    for name, value in processors.items():
+        setattr(generation_config, name, value)
+    return model
+
+
+def _pad_to(tokens, width):
+    return torch.nn.functional.pad(tokens, (0, width - tokens.shape[1]), value=PAD_TOKEN_ID)
+
+
+PROCESSORS = {
+    'plain': {},
+    'penalties': {'repetition_penalty': 1.3, 'no_repeat_ngram_size': 3, 'min_length': 5},
+}
+
+
+@pytest.fixture(scope='module', params=['eager', 'sdpa'])
+def attn_implementation(request):
+    return request.param
+
+
+@pytest.fixture(scope='module', params=list(PROCESSORS))
+def model_and_reference(request, attn_implementation):
+    model = _build_model(attn_implementation, PROCESSORS[request.param])
+    torch.manual_seed(1)
+    pixel_values = torch.randn(NUM_ROWS, 3, 32, 32) * 3
+    with torch.no_grad():
+        reference = model.generate(
+            pixel_values=pixel_values, max_new_tokens=MAX_NEW_TOKENS, decoder_start_token_id=BOS_TOKEN_ID,
+            do_sample=False,
+        )
+    return model, pixel_values, reference
+
+
+def test_reference_has_mixed_lengths(model_and_reference):
+    # 长度不一才能覆盖序列结束后的移除和补入
+    _, _, reference = model_and_reference
+    lengths = (reference != PAD_TOKEN_ID).sum(1).tolist()
+    assert len(set(lengths)) >= 4
+    assert max(lengths) == MAX_NEW_TOKENS + 1 and min(lengths) < MAX_NEW_TOKENS // 2
+
+
+@pytest.mark.parametrize('max_active', [None, 1, 2, 3, 5, 8, NUM_ROWS])
+def test_matches_generate(model_and_reference, max_active):
+    model, pixel_values, reference = model_and_reference
+    decoder = ContinuousGreedyDecoder(model, MAX_NEW_TOKENS, BOS_TOKEN_ID, EOS_TOKEN_ID, PAD_TOKEN_ID)
+    output = decoder.generate(pixel_values, max_active=max_active)
+    width = max(output.shape[1], reference.shape[1])
+    assert torch.equal(_pad_to(output, width), _pad_to(reference, width))
+
+
+def test_matches_generate_sorted_by_length(model_and_reference):
+    # 实际调用时输入按预计长度从长到短排列
+    model, pixel_values, reference = model_and_reference
+    order = torch.argsort((reference != PAD_TOKEN_ID).sum(1), descending=True, stable=True)
+    decoder = ContinuousGreedyDecoder(model, MAX_NEW_TOKENS, BOS_TOKEN_ID, EOS_TOKEN_ID, PAD_TOKEN_ID)
+    output = decoder.generate(pixel_values[order], max_active=4)
+    width = max(output.shape[1], reference.shape[1])
+    assert torch.equal(_pad_to(output, width), _pad_to(reference[order], width))
+
+
+def test_kv_cache_layout(attn_implementation):
+    """连续批处理按(self_k, self_v, cross_k, cross_v)的tuple结构补齐和裁剪kv-cache"""
+    model = _build_model(attn_implementation, {})
+    pixel_values = torch.randn(3, 3, 32, 32)
+    with torch.no_grad():
+        encoder_hidden_states = model.encoder(pixel_values=pixel_values).last_hidden_state
+        outputs = model.decoder(
+            input_ids=torch.full((3, 1), BOS_TOKEN_ID), attention_mask=torch.ones(3, 1, dtype=torch.long),
+            encoder_hidden_states=encoder_hidden_states, use_cache=True, return_dict=True,
+        )
+    past_key_values = outputs.past_key_values
+    assert isinstance(past_key_values, tuple) and len(past_key_values) == model.decoder.config.decoder_layers
+    for layer in past_key_values:
+        assert isinstance(layer, tuple) and len(layer) == 4
+        self_key, self_value, cross_key, cross_value = layer
+        # qk_squeeze压缩了key的维度，只比较batch、head和序列长度
+        assert self_key.shape[:3] == self_value.shape[:3] == (3, model.decoder.config.decoder_attention_heads, 1)
+        assert cross_key.shape[:3] == cross_value.shape[:3]
+        assert cross_key.shape[2] == encoder_hidden_states.shape[1]
@@ -0,0 +1,89 @@
+"""
+公式识别预处理的cpu benchmark，对比逐个裁剪图调用transform后stack与批量预处理（主线程/工作线程）的耗时。
+
+运行方式:
+    pytest tests/benchmark/test_mfr_preprocess_bench.py --benchmark-group-by=group --benchmark-columns=min,mean,max,rounds
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+torch = pytest.importorskip('torch')
+alb = pytest.importorskip('albumentations')
+
+from albumentations.pytorch import ToTensorV2  # noqa: E402
+
+from mineru.model.mfr.unimernet.Unimernet import FormulaPreprocessPrefetcher  # noqa: E402
+from mineru.model.mfr.unimernet.unimernet_hf.unimer_swin import UnimerSwinImageProcessor  # noqa: E402
+
+NUM_CROPS = 256
+
+
+def _make_crop(rng, width, height):
+    """白底上画几条黑色笔画的公式裁剪图，四周留白"""
+    crop = np.full((height, width, 3), 255, dtype=np.uint8)
+    for _ in range(rng.integers(3, 12)):
+        x, y = rng.integers(4, max(5, width - 12)), rng.integers(4, max(5, height - 6))
+        crop[y:y + 2, x:x + rng.integers(2, 10)] = rng.integers(0, 80)
+    return crop
+
+
+@pytest.fixture(scope='module')
+def processor():
+    return UnimerSwinImageProcessor()
+
+
+@pytest.fixture(scope='module')
+def crops():
+    rng = np.random.default_rng(0)
+    return [_make_crop(rng, int(rng.integers(20, 900)), int(rng.integers(12, 200))) for _ in range(NUM_CROPS)]
+
+
+def _reference(processor, crop):
+    # transform中的ToGray按概率生效，参照结果固定转灰度
+    transform = alb.Compose([
+        alb.ToGray(p=1.0),
+        alb.Normalize((processor.mean,) * 3, (processor.std,) * 3),
+        ToTensorV2(),
+    ])
+    return transform(image=processor.prepare_input(crop))['image'][:1]
+
+
+def test_batch_matches_per_crop_transform(processor, crops):
+    expected = torch.stack([_reference(processor, crop) for crop in crops])
+    batched = processor.batch_call(crops)
+    assert batched.shape == expected.shape
+    torch.testing.assert_close(batched, expected, atol=1e-5, rtol=0)
+
+
+def test_prefetcher_matches_batch_call(processor, crops):
+    with ThreadPoolExecutor(2) as executor:
+        prefetcher = FormulaPreprocessPrefetcher(processor, crops, 'cpu', torch.float32, executor=executor)
+        # OOM减半重试时会再次取同一段
+        first = prefetcher.get(list(range(0, 64)))
+        retry = prefetcher.get(list(range(0, 32)))
+        rest = prefetcher.get(list(range(32, len(crops))))
+    expected = processor.batch_call(crops)
+    torch.testing.assert_close(first, expected[:64])
+    torch.testing.assert_close(torch.cat([retry, rest]), expected)
+
+
+@pytest.mark.benchmark(group='mfr_preprocess')
+def test_per_crop_transform(benchmark, processor, crops):
+    result = benchmark(lambda: torch.stack([processor(crop) for crop in crops]))
+    assert result.shape[0] == NUM_CROPS
+
+
+@pytest.mark.benchmark(group='mfr_preprocess')
+def test_batch_prepare(benchmark, processor, crops):
+    result = benchmark(processor.batch_call, crops)
+    assert result.shape[0] == NUM_CROPS
+
+
+@pytest.mark.benchmark(group='mfr_preprocess')
+def test_batch_prepare_threads(benchmark, processor, crops):
+    with ThreadPoolExecutor(4) as executor:
+        result = benchmark(processor.batch_call, crops, executor=executor)
+    assert result.shape[0] == NUM_CROPS
@@ -0,0 +1,62 @@
+"""
+多设备数据并行推理的单元测试：worker完成顺序与提交顺序不同时结果仍按提交顺序返回，任务按需读取，
+worker出错时抛出异常，关闭后worker进程全部退出。worker中的推理由device_fakes.fake_device_analyze代替。
+
+运行方式:
+    pytest tests/benchmark/test_multi_device.py
+"""
+import numpy as np
+import pytest
+
+from mineru.backend.pipeline.multi_device import MultiDeviceBatchAnalyzer, get_device_env, parse_devices
+from device_fakes import fake_device_analyze
+
+DEVICES = ['cpu', 'cpu']
+
+
+def _task(tag, values):
+    return tag, [(np.full((4, 4, 3), value, dtype=np.uint8), False, 'en', None, None) for value in values]
+
+
+def test_parse_devices():
+    assert parse_devices(None) == []
+    assert parse_devices(' cuda:0, cuda:1,') == ['cuda:0', 'cuda:1']
+    assert get_device_env('cuda:1') == {'CUDA_VISIBLE_DEVICES': '1', 'MINERU_DEVICE_MODE': 'cuda'}
+    assert get_device_env('npu:2') == {'ASCEND_RT_VISIBLE_DEVICES': '2', 'MINERU_DEVICE_MODE': 'npu'}
+    assert get_device_env('cpu') == {'MINERU_DEVICE_MODE': 'cpu'}
+    with pytest.raises(ValueError):
+        MultiDeviceBatchAnalyzer([])
+
+
+def test_results_in_submission_order():
+    batches = [[index * 2, index * 2 + 1] if index % 2 else [index * 2] for index in range(10)]
+    submitted = []
+
+    def tasks():
+        for index, values in enumerate(batches):
+            submitted.append(index)
+            yield _task(index, values)
+
+    analyzer = MultiDeviceBatchAnalyzer(DEVICES, max_in_flight=3, analyze_fn=fake_device_analyze)
+    with analyzer:
+        results = []
+        for tag, batch_results in analyzer.imap(tasks()):
+            # 任务按需读取，在途的批次不超过max_in_flight
+            assert len(submitted) - tag <= 3
+            results.append((tag, [page_result[0]['value'] for page_result in batch_results]))
+            pids = {page_result[0]['pid'] for page_result in batch_results}
+            assert len(pids) == 1
+        workers = list(analyzer._workers)
+    assert results == list(enumerate(batches))
+    assert not any(worker.is_alive() for worker in workers)
+
+
+def test_worker_error_raises():
+    with MultiDeviceBatchAnalyzer(DEVICES, analyze_fn=fake_device_analyze) as analyzer:
+        results = analyzer.imap([_task('ok', [1]), _task('bad', [255]), _task('after', [3])])
+        tag, batch_results = next(results)
+        assert tag == 'ok' and batch_results[0][0]['value'] == 1
+        with pytest.raises(RuntimeError, match='bad page'):
+            next(results)
+        workers = list(analyzer._workers)
+    assert not any(worker.is_alive() for worker in workers)
@@ -0,0 +1,78 @@
+"""
+多分辨率渲染的cpu benchmark，对比整页按200dpi渲染后裁剪与按检测分辨率渲染整页、只渲染识别区域的耗时。
+
+运行方式:
+    pytest tests/benchmark/test_multi_resolution_bench.py --benchmark-group-by=group --benchmark-columns=min,mean,max,rounds
+"""
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+pdfium = pytest.importorskip('pypdfium2')
+
+from mineru.utils.model_utils import crop_img  # noqa: E402
+from mineru.utils.pdf_image_tools import MultiResolutionPage, pdf_page_to_image, \
+    pdf_page_to_multi_resolution_image  # noqa: E402
+
+PDF_PATH = Path(__file__).parents[2] / 'demo' / 'pdfs' / 'demo1.pdf'
+# 文本稀疏的页面：只有少量区域需要识别
+NUM_CROPS = 8
+
+
+@pytest.fixture(scope='module')
+def pdf_doc():
+    if not PDF_PATH.exists():
+        pytest.skip(f'{PDF_PATH} not found')
+    doc = pdfium.PdfDocument(str(PDF_PATH))
+    yield doc
+    doc.close()
+
+
+def _make_layout_res(width, height):
+    layout_res = []
+    for i in range(NUM_CROPS):
+        y = 100 + (i * 157) % (height - 300)
+        layout_res.append({'poly': [100, y, width - 100, y, width - 100, y + 80, 100, y + 80]})
+    return layout_res
+
+
+def _full_render_crops(page):
+    page_img = pdf_page_to_image(page)
+    layout_res = _make_layout_res(page_img.width, page_img.height)
+    return [crop_img(res, page_img.crop_source, crop_paste_x=50, crop_paste_y=50)[0] for res in layout_res]
+
+
+def _multi_resolution_crops(page):
+    page_img = pdf_page_to_multi_resolution_image(page)
+    layout_res = _make_layout_res(page_img.width, page_img.height)
+    return [crop_img(res, page_img.crop_source, crop_paste_x=50, crop_paste_y=50)[0] for res in layout_res]
+
+
+@pytest.mark.benchmark(group='page_render_crops')
+def test_full_render_crops(benchmark, pdf_doc):
+    crops = benchmark(_full_render_crops, pdf_doc[0])
+    assert len(crops) == NUM_CROPS
+
+
+@pytest.mark.benchmark(group='page_render_crops')
+def test_multi_resolution_crops(benchmark, pdf_doc):
+    page = pdf_doc[0]
+    assert isinstance(pdf_page_to_multi_resolution_image(page), MultiResolutionPage)
+    crops = benchmark(_multi_resolution_crops, page)
+    # 按区域渲染的裁剪结果与整页渲染后裁剪完全一致
+    for crop, expected in zip(crops, _full_render_crops(page)):
+        np.testing.assert_array_equal(crop, expected)
+
+
+def test_release_closes_page(pdf_doc):
+    page = pdf_doc[0]
+    page_img = pdf_page_to_multi_resolution_image(page)
+    assert page_img[0:10, 0:10].shape == (10, 10, 3)
+    page_img.release()
+    # 页面在pdfium_lock内关闭，不再等待垃圾回收
+    assert page.raw is None
+    with pytest.raises(RuntimeError):
+        page_img[0:10, 0:10]
+    page_img.release()
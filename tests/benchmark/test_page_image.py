@@ -0,0 +1,103 @@
+"""
+PageImage的单元测试：PIL图像、PNG编码和base64只在第一次访问时生成并缓存，内容指纹不需要编码，
+兼容原来的image_dict用法，传给子进程时不携带派生的编码结果。
+
+运行方式:
+    pytest tests/benchmark/test_page_image.py
+"""
+import base64
+import io
+import pickle
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from mineru.utils import pdf_image_tools
+from mineru.utils.pdf_image_tools import PageImage
+
+
+@pytest.fixture
+def bgr():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (60, 40, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def encode_count(monkeypatch):
+    calls = []
+    image_to_bytes = pdf_image_tools.image_to_bytes
+
+    def counting_image_to_bytes(image, image_format='PNG'):
+        calls.append(image_format)
+        return image_to_bytes(image, image_format=image_format)
+
+    monkeypatch.setattr(pdf_image_tools, 'image_to_bytes', counting_image_to_bytes)
+    return calls
+
+
+def _decode(png_bytes):
+    return np.asarray(Image.open(io.BytesIO(png_bytes)).convert('RGB'))
+
+
+def test_encodings_built_lazily_and_cached(bgr, encode_count):
+    page = PageImage(bgr, 2.0)
+    assert page.img_np is bgr
+    assert (page.width, page.height, page.nbytes) == (40, 60, bgr.nbytes)
+    # 指纹只需要原始像素，不触发任何编码
+    fingerprint = page.fingerprint
+    assert fingerprint == PageImage(bgr.copy(), 1.0).fingerprint
+    assert fingerprint != PageImage(np.ascontiguousarray(bgr[:, :20]), 2.0).fingerprint
+    assert page._img_pil is None and page._png_bytes is None and encode_count == []
+
+    img_pil = page.img_pil
+    assert page.img_pil is img_pil
+    np.testing.assert_array_equal(np.asarray(img_pil), bgr[..., ::-1])
+    assert encode_count == []
+
+    png_bytes = page.png_bytes
+    assert page.img_base64 == base64.b64encode(png_bytes).decode('utf-8')
+    assert page.png_bytes is png_bytes
+    np.testing.assert_array_equal(_decode(png_bytes), bgr[..., ::-1])
+    assert encode_count == ['PNG']
+    # jpeg不缓存
+    page.jpeg_bytes
+    page.jpeg_bytes
+    assert encode_count == ['PNG', 'JPEG', 'JPEG']
+
+
+def test_image_dict_compatibility(bgr):
+    page = PageImage(bgr, 2.0)
+    assert page['scale'] == 2.0 and page['img_np'] is bgr
+    assert page['img_pil'] is page.img_pil
+    assert page['img_base64'] == page.img_base64
+    assert 'img_pil' in page and 'width' not in page
+    with pytest.raises(KeyError):
+        page['width']
+
+
+def test_from_pil_builds_bgr_lazily(bgr):
+    img_pil = Image.fromarray(np.ascontiguousarray(bgr[..., ::-1]))
+    page = PageImage(img_pil, 1.0)
+    assert page._img_np is None and page.img_pil is img_pil
+    np.testing.assert_array_equal(page.img_np, bgr)
+    assert page.img_np.flags.c_contiguous
+
+
+def test_pickle_drops_derived_encodings(bgr):
+    page = PageImage(bgr, 2.0)
+    page.img_base64
+    state = page.__getstate__()
+    assert state['_img_pil'] is None and state['_png_bytes'] is None and state['_img_base64'] is None
+    restored = pickle.loads(pickle.dumps(page))
+    np.testing.assert_array_equal(restored.img_np, bgr)
+    assert restored.img_base64 == page.img_base64
+
+
+def test_release_drops_bitmaps(bgr):
+    page = PageImage(bgr, 2.0)
+    page.img_base64
+    page.release()
+    assert page._img_np is None and page._img_pil is None and page._png_bytes is None
+    with pytest.raises(RuntimeError):
+        page.img_np
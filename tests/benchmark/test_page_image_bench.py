@@ -0,0 +1,129 @@
+"""
+页面图像表示的cpu benchmark，对比PIL页面与BGR numpy页面在裁剪和颜色转换上的耗时和内存分配。
+
+运行方式:
+    pytest tests/benchmark/test_page_image_bench.py --benchmark-group-by=group --benchmark-columns=min,mean,max,rounds
+
+每个用例在benchmark.extra_info中记录单页处理过程中tracemalloc统计的内存分配峰值(alloc_peak_kb)，
+可以通过--benchmark-json导出后对比。
+"""
+import tracemalloc
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+cv2 = pytest.importorskip('cv2')
+
+from PIL import Image  # noqa: E402
+
+from mineru.utils.model_utils import crop_img  # noqa: E402
+from mineru.utils.pdf_image_tools import get_crop_img  # noqa: E402
+
+# 200dpi渲染的A4页面尺寸
+PAGE_W, PAGE_H = 1654, 2339
+NUM_CROPS = 60
+SCALE = 200 / 72
+
+
+def _make_page_bgr():
+    rng = np.random.default_rng(0)
+    page = np.full((PAGE_H, PAGE_W, 3), 255, dtype=np.uint8)
+    # 随机的深色文本行，避免页面为纯色
+    for y in range(100, PAGE_H - 100, 40):
+        page[y:y + 16, 100:PAGE_W - 100] = rng.integers(0, 80, size=(16, PAGE_W - 200, 3), dtype=np.uint8)
+    return page
+
+
+def _make_layout_res():
+    layout_res = []
+    for i in range(NUM_CROPS):
+        y = 100 + (i * 37) % (PAGE_H - 300)
+        layout_res.append({'poly': [100, y, PAGE_W - 100, y, PAGE_W - 100, y + 120, 100, y + 120]})
+    return layout_res
+
+
+@pytest.fixture(scope='module')
+def page_bgr():
+    return _make_page_bgr()
+
+
+@pytest.fixture(scope='module')
+def page_pil(page_bgr):
+    return Image.fromarray(np.ascontiguousarray(page_bgr[..., ::-1]))
+
+
+@pytest.fixture(scope='module')
+def layout_res():
+    return _make_layout_res()
+
+
+def _ocr_crops_pil(page_pil, layout_res):
+    """原流程：PIL裁剪并粘贴到白色背景，再转numpy并做RGB->BGR转换"""
+    crops = []
+    for res in layout_res:
+        new_image, _ = crop_img(res, page_pil, crop_paste_x=50, crop_paste_y=50)
+        crops.append(cv2.cvtColor(np.asarray(new_image), cv2.COLOR_RGB2BGR))
+    return crops
+
+
+def _ocr_crops_numpy(page_bgr, layout_res):
+    """页面为BGR数组时，裁剪结果直接用于OCR"""
+    return [crop_img(res, page_bgr, crop_paste_x=50, crop_paste_y=50)[0] for res in layout_res]
+
+
+def _span_crops_pil(page_pil, layout_res):
+    crops = []
+    for res in layout_res:
+        bbox = [p / SCALE for p in (res['poly'][0], res['poly'][1], res['poly'][4], res['poly'][5])]
+        crops.append(cv2.cvtColor(np.array(get_crop_img(bbox, page_pil, SCALE)), cv2.COLOR_RGB2BGR))
+    return crops
+
+
+def _span_crops_numpy(page_bgr, layout_res):
+    crops = []
+    for res in layout_res:
+        bbox = [p / SCALE for p in (res['poly'][0], res['poly'][1], res['poly'][4], res['poly'][5])]
+        crops.append(get_crop_img(bbox, page_bgr, SCALE))
+    return crops
+
+
+def _record_alloc_peak(benchmark, func, *args):
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info['alloc_peak_kb'] = round(peak / 1024, 1)
+
+
+@pytest.mark.benchmark(group='ocr_det_crops')
+def test_ocr_det_crops_pil(benchmark, page_pil, layout_res):
+    _record_alloc_peak(benchmark, _ocr_crops_pil, page_pil, layout_res)
+    crops = benchmark(_ocr_crops_pil, page_pil, layout_res)
+    assert len(crops) == NUM_CROPS
+
+
+@pytest.mark.benchmark(group='ocr_det_crops')
+def test_ocr_det_crops_numpy(benchmark, page_bgr, page_pil, layout_res):
+    _record_alloc_peak(benchmark, _ocr_crops_numpy, page_bgr, layout_res)
+    crops = benchmark(_ocr_crops_numpy, page_bgr, layout_res)
+    # 两种页面表示得到的OCR输入完全一致
+    for crop, expected in zip(crops, _ocr_crops_pil(page_pil, layout_res)):
+        np.testing.assert_array_equal(crop, expected)
+
+
+@pytest.mark.benchmark(group='span_crops')
+def test_span_crops_pil(benchmark, page_pil, layout_res):
+    _record_alloc_peak(benchmark, _span_crops_pil, page_pil, layout_res)
+    crops = benchmark(_span_crops_pil, page_pil, layout_res)
+    assert len(crops) == NUM_CROPS
+
+
+@pytest.mark.benchmark(group='span_crops')
+def test_span_crops_numpy(benchmark, page_bgr, page_pil, layout_res):
+    _record_alloc_peak(benchmark, _span_crops_numpy, page_bgr, layout_res)
+    crops = benchmark(_span_crops_numpy, page_bgr, layout_res)
+    for crop, expected in zip(crops, _span_crops_pil(page_pil, layout_res)):
+        np.testing.assert_array_equal(crop, expected)
@@ -0,0 +1,160 @@
+"""
+PageImageStore的单元测试：超出预算时按最近访问顺序淘汰页面位图，再次访问时重新渲染或从spill文件读回，
+结果与淘汰前完全一致；释放页面时删除spill文件；开启store后流式推理的middle json不变。
+
+运行方式:
+    pytest tests/benchmark/test_page_image_store.py
+"""
+import json
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pypdfium2')
+
+from mineru.backend.pipeline.model_json_to_middle_json import result_to_middle_json  # noqa: E402
+from mineru.backend.pipeline.pipeline_analyze import doc_analyze_streaming  # noqa: E402
+from mineru.data.data_reader_writer import FileBasedDataWriter  # noqa: E402
+from mineru.utils import page_image_store  # noqa: E402
+from mineru.utils.document_context import DocumentContext  # noqa: E402
+from mineru.utils.page_image_store import PageImageStore, get_page_image_store  # noqa: E402
+from mineru.utils.pdf_image_tools import PageImage, make_page_render_fn, pdf_page_to_image  # noqa: E402
+from synthetic import build_pdf, patch_pipeline_models, scanned_page, text_page  # noqa: E402
+
+SHAPE = (100, 80, 3)
+PAGE_BYTES = SHAPE[0] * SHAPE[1] * SHAPE[2]
+
+
+def _bitmap(index):
+    rng = np.random.default_rng(index)
+    return rng.integers(0, 256, SHAPE, dtype=np.uint8)
+
+
+class _Renderer:
+    """记录重新渲染次数的render_fn"""
+
+    def __init__(self, index):
+        self.index = index
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return _bitmap(self.index)
+
+
+def _add_pages(store, count, render=True):
+    pages, renderers = [], []
+    for index in range(count):
+        page = PageImage(_bitmap(index), 2.0)
+        renderer = _Renderer(index) if render else None
+        store.add(page, renderer)
+        pages.append(page)
+        renderers.append(renderer)
+    return pages, renderers
+
+
+def _resident(pages):
+    return [page._img_np is not None for page in pages]
+
+
+def test_evicts_least_recently_used_and_rerenders():
+    store = PageImageStore(2.5 * PAGE_BYTES / 1024 ** 2)
+    pages, renderers = _add_pages(store, 3)
+    assert _resident(pages) == [False, True, True]
+    assert store.resident_bytes == 2 * PAGE_BYTES
+
+    # 访问过的页面移到队尾，下一次淘汰最久未访问的页面
+    pages[1].img_np
+    more_pages, _ = _add_pages(store, 1)
+    assert _resident(pages + more_pages) == [False, True, False, True]
+
+    # 被淘汰的页面重新渲染，结果与淘汰前一致，重新加载的页面同样受预算限制
+    np.testing.assert_array_equal(pages[0].img_np, _bitmap(0))
+    assert renderers[0].calls == 1 and renderers[2].calls == 0
+    assert _resident(pages + more_pages) == [True, False, False, True]
+    assert store.stats == {'evicted': 3, 'reloaded': 1, 'spilled': 0}
+    assert store.resident_bytes <= 2.5 * PAGE_BYTES
+
+    # 释放后的页面从store中移除，不再重建
+    pages[0].release()
+    assert store.resident_bytes == PAGE_BYTES
+    with pytest.raises(RuntimeError):
+        pages[0].img_np
+
+
+@pytest.mark.parametrize('spill, render', [(True, True), (False, False)])
+def test_spill_round_trip(tmp_path, spill, render):
+    store = PageImageStore(1.5 * PAGE_BYTES / 1024 ** 2, spill=spill, spill_dir=str(tmp_path))
+    pages, renderers = _add_pages(store, 3, render=render)
+    # 开启spill或者无法重新渲染时，淘汰的页面写入png文件
+    spill_paths = [page._spill_path for page in pages[:2]]
+    assert all(path is not None and os.path.isfile(path) for path in spill_paths)
+    assert store.stats['spilled'] == 2
+
+    np.testing.assert_array_equal(pages[0].img_np, _bitmap(0))
+    if render:
+        assert renderers[0].calls == 0
+    pages[0].release()
+    assert not os.path.exists(spill_paths[0])
+    spill_dir = os.path.dirname(spill_paths[1])
+    store.close()
+    assert not os.path.exists(spill_dir)
+
+
+def test_make_page_render_fn_matches_render():
+    pdf_doc = DocumentContext(build_pdf([text_page(), scanned_page()]))
+    try:
+        for page_index in range(len(pdf_doc)):
+            page = pdf_doc[page_index]
+            expected = pdf_page_to_image(page, dpi=72).img_np
+            page.close()
+            np.testing.assert_array_equal(make_page_render_fn(pdf_doc, page_index, dpi=72)(), expected)
+    finally:
+        pdf_doc.close()
+
+
+@pytest.fixture
+def reset_store(monkeypatch):
+    monkeypatch.setattr(page_image_store, '_store', None)
+    yield
+    if page_image_store._store is not None:
+        page_image_store._store.close()
+
+
+def test_get_page_image_store(monkeypatch, reset_store):
+    monkeypatch.delenv('MINERU_PAGE_IMAGE_BUDGET_MB', raising=False)
+    assert get_page_image_store() is None
+    monkeypatch.setenv('MINERU_PAGE_IMAGE_BUDGET_MB', 'abc')
+    assert get_page_image_store() is None
+    monkeypatch.setenv('MINERU_PAGE_IMAGE_BUDGET_MB', '64')
+    monkeypatch.setenv('MINERU_PAGE_IMAGE_SPILL', 'true')
+    store = get_page_image_store()
+    assert store.budget == 64 * 1024 * 1024 and store.spill
+    assert get_page_image_store() is store
+
+
+def _run_streaming(monkeypatch, tmp_path, budget_mb):
+    monkeypatch.setenv('MINERU_PAGE_IMAGE_BUDGET_MB', str(budget_mb))
+    monkeypatch.setattr(page_image_store, '_store', None)
+    pages = [text_page(label=b'%d ' % index) if index % 2 else scanned_page() for index in range(6)]
+    outputs = []
+    for pdf_idx, model_list, images_list, pdf_doc, lang, ocr_enable in doc_analyze_streaming(
+            [DocumentContext(build_pdf(pages)), DocumentContext(build_pdf(pages[:3]))], ['en', 'en']
+    ):
+        image_writer = FileBasedDataWriter(str(tmp_path / f'{budget_mb}_{pdf_idx}'))
+        middle_json = result_to_middle_json(model_list, images_list, pdf_doc, image_writer, lang, ocr_enable)
+        middle_json.pop('_version_name')
+        outputs.append(json.dumps(middle_json, sort_keys=True))
+    return outputs, page_image_store._store
+
+
+def test_streaming_with_budget_matches_unbounded(monkeypatch, tmp_path, reset_store):
+    patch_pipeline_models(monkeypatch)
+    monkeypatch.setenv('MINERU_PAGE_PROCESS_WORKERS', '1')
+    expected, _ = _run_streaming(monkeypatch, tmp_path, 0)
+    # 预算只够常驻约一个200dpi的A4页面，推理后等待后处理的页面被淘汰并重新渲染
+    outputs, store = _run_streaming(monkeypatch, tmp_path, 12)
+    assert outputs == expected
+    assert store.stats['evicted'] > 0 and store.stats['reloaded'] > 0
+    assert store.resident_bytes == 0
@@ -0,0 +1,69 @@
+"""
+页面后处理进程池的单元测试：多进程构造页面block、主进程批量排序得到的middle json和切图与逐页处理一致。
+推理和layoutreader、ocr由synthetic中的确定性替身代替，worker中只做不需要模型的block构造。
+
+运行方式:
+    pytest tests/benchmark/test_page_process_pool.py
+"""
+import json
+import os
+
+import pytest
+
+pytest.importorskip('pypdfium2')
+
+from mineru.backend.pipeline import pipeline_analyze  # noqa: E402
+from mineru.backend.pipeline.model_json_to_middle_json import result_to_middle_json  # noqa: E402
+from mineru.backend.pipeline.page_process_pool import shutdown_page_executor  # noqa: E402
+from mineru.backend.pipeline.pipeline_analyze import doc_analyze_streaming  # noqa: E402
+from mineru.data.data_reader_writer import FileBasedDataWriter  # noqa: E402
+from mineru.utils.document_context import DocumentContext  # noqa: E402
+from synthetic import (  # noqa: E402
+    build_pdf, fake_batch_image_analyze, figure_page, patch_pipeline_models, scanned_page, text_page,
+)
+
+PAGES = [text_page(label=b'P%d ' % index) if index % 3 else scanned_page() for index in range(6)] + [figure_page()]
+
+
+@pytest.fixture(scope='module', autouse=True)
+def page_executor():
+    yield
+    shutdown_page_executor()
+
+
+def _analyze_with_figure(images_with_extra_info, formula_enable=True, table_enable=True):
+    # 每页加一个图片区块，覆盖worker中的切图
+    results = fake_batch_image_analyze(images_with_extra_info, formula_enable, table_enable)
+    for (image, *_), layout_dets in zip(images_with_extra_info, results):
+        scale = image.shape[1] / 595
+        x0, y0, x1, y1 = [round(v * scale, 2) for v in (100, 650, 400, 800)]
+        layout_dets.append({'category_id': 3, 'poly': [x0, y0, x1, y0, x1, y1, x0, y1], 'score': 0.9})
+    return results
+
+
+def _middle_jsons(monkeypatch, tmp_path, workers, docs):
+    monkeypatch.setenv('MINERU_PAGE_PROCESS_WORKERS', str(workers))
+    middle_jsons = []
+    for pdf_idx, model_list, images_list, pdf_doc, lang, ocr_enable in doc_analyze_streaming(docs, ['en'] * len(docs)):
+        image_dir = tmp_path / f'{workers}_{pdf_idx}'
+        middle_json = result_to_middle_json(
+            model_list, images_list, pdf_doc, FileBasedDataWriter(str(image_dir)), lang, ocr_enable
+        )
+        middle_json.pop('_version_name')
+        images = sorted(os.listdir(image_dir)) if image_dir.exists() else []
+        middle_jsons.append((json.dumps(middle_json, sort_keys=True), images))
+    return middle_jsons
+
+
+def test_parallel_matches_sequential(monkeypatch, tmp_path):
+    patch_pipeline_models(monkeypatch)
+    monkeypatch.setattr(pipeline_analyze, 'batch_image_analyze', _analyze_with_figure)
+    pdf_bytes = build_pdf(PAGES)
+
+    def docs():
+        # 完整文档、页面范围视图和单页文档（单页时不使用进程池）
+        return [DocumentContext(pdf_bytes), DocumentContext(pdf_bytes, 2, 5), DocumentContext(build_pdf(PAGES[1:2]))]
+
+    expected = _middle_jsons(monkeypatch, tmp_path, 1, docs())
+    assert all(images for _, images in expected)
+    assert _middle_jsons(monkeypatch, tmp_path, 2, docs()) == expected
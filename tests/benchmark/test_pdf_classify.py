@@ -0,0 +1,143 @@
+"""
+pdf分类的单元测试，在构造的文本页、扫描页、矢量文字页、乱码页和混合文档上检查classify_pages逐页结果、
+get_ocr_enable转换后的ocr_enable，以及流水线使用的PageClassifier只抽样做文档级判断、逐页统计量按需计算。
+
+运行方式:
+    pytest tests/benchmark/test_pdf_classify.py
+"""
+import io
+
+import pytest
+
+pdfium = pytest.importorskip('pypdfium2')
+
+from mineru.utils import pdf_classify  # noqa: E402
+from mineru.utils.document_context import DocumentContext  # noqa: E402
+from mineru.utils.pdf_classify import PageClassifier, classify, classify_pages, get_ocr_enable  # noqa: E402
+from mineru.utils.pdf_reader import pdfium_lock  # noqa: E402
+from synthetic import build_pdf, figure_page, garbled_page, outlined_page, scanned_page, text_page  # noqa: E402
+
+
+def text_in_image_page():
+    """图像覆盖了页面的大部分，只有一行可以提取的文本"""
+    return b'q 595 0 0 500 0 300 cm /Im1 Do Q\n' + text_page(lines=1)
+
+
+DOCUMENTS = {
+    # 名称: (页面, classify_pages的结果, get_ocr_enable的结果)
+    'text': ([text_page()] * 3, ['txt'] * 3, False),
+    'scanned': ([scanned_page()] * 3, ['ocr'] * 3, True),
+    'outlined_text': ([outlined_page()] * 3, ['ocr'] * 3, True),
+    'garbled': ([garbled_page()] * 3, ['ocr'] * 3, True),
+    # 可以提取文本的文档中只有扫描页和文本在图像中的页面使用OCR，
+    # 带小图和图注的插图页、单个矢量文字页与原先一样按txt处理
+    'mixed': (
+        [text_page(), scanned_page(), text_page(), figure_page(), outlined_page(), text_in_image_page(), text_page()],
+        ['txt', 'ocr', 'txt', 'txt', 'txt', 'ocr', 'txt'],
+        [False, True, False, False, False, True, False],
+    ),
+    # 乱码字符在整个文档中的占比过高时，与原先的文档级判断一致，整个文档使用OCR
+    'mixed_with_garbled': ([text_page(), garbled_page(), text_page()], ['ocr'] * 3, True),
+    # 扫描页占多数时与原先的文档级判断一致，整个文档使用OCR
+    'mostly_scanned': ([scanned_page()] * 4 + [text_page()], ['ocr'] * 5, True),
+}
+
+
+@pytest.mark.parametrize('name', list(DOCUMENTS))
+def test_classify_pages(name):
+    pages, expected_pages, expected_ocr_enable = DOCUMENTS[name]
+    pdf_bytes = build_pdf(pages)
+    decisions = classify_pages(pdf_bytes)
+    assert decisions == expected_pages
+    assert get_ocr_enable(decisions) == expected_ocr_enable
+    # 流水线中传入的是DocumentContext
+    with DocumentContext(pdf_bytes) as pdf_doc:
+        assert classify_pages(pdf_doc) == expected_pages
+
+
+@pytest.mark.parametrize('name', ['text', 'scanned', 'outlined_text', 'garbled'])
+def test_uniform_documents_match_doc_level_classify(name):
+    # 所有页面相同的文档，逐页判断与文档级判断一致
+    pages, _, expected_ocr_enable = DOCUMENTS[name]
+    assert classify(build_pdf(pages)) == ('ocr' if expected_ocr_enable else 'txt')
+
+
+def test_get_ocr_enable():
+    assert get_ocr_enable([]) is True
+    assert get_ocr_enable(['txt', 'txt']) is False
+    assert get_ocr_enable(['ocr', 'ocr']) is True
+    assert get_ocr_enable(['txt', 'ocr']) == [False, True]
+
+
+def test_broken_pdf_falls_back_to_ocr():
+    assert classify_pages(b'%PDF-1.4 not a pdf') == []
+    assert get_ocr_enable(classify_pages(b'%PDF-1.4 not a pdf')) is True
+
+
+def test_not_extractable_pdf_uses_ocr(tmp_path):
+    # 与原先pdfminer的is_extractable一致，加密文档没有授予提取文本的权限时使用OCR
+    pypdf = pytest.importorskip('pypdf')
+    writer = pypdf.PdfWriter(clone_from=pypdf.PdfReader(io.BytesIO(build_pdf([text_page()] * 2))))
+    writer.encrypt(user_password='', owner_password='owner', permissions_flag=0xFFFFFFFF & ~0x10, algorithm='RC4-128')
+    output = io.BytesIO()
+    writer.write(output)
+    pdf_bytes = output.getvalue()
+    assert classify(pdf_bytes) == 'ocr'
+    assert classify_pages(pdf_bytes) == ['ocr'] * 2
+
+
+def test_page_stats_computed_lazily(monkeypatch):
+    """文档级判断只统计抽样的页面，其余页面在classify(page_index)时才统计，抽样页面的统计量不重复计算"""
+    stats_pages = []
+    get_page_stats = pdf_classify.get_page_stats
+
+    def recording_get_page_stats(pdf_doc, page_index):
+        stats_pages.append(page_index)
+        return get_page_stats(pdf_doc, page_index)
+
+    monkeypatch.setattr(pdf_classify, 'get_page_stats', recording_get_page_stats)
+    page_count = pdf_classify.MAX_SAMPLE_PAGES * 3
+    with DocumentContext(build_pdf([text_page()] * page_count)) as pdf_doc:
+        classifier = PageClassifier(pdf_doc)
+        assert classifier.doc_decision == 'txt'
+        sampled = list(stats_pages)
+        assert len(sampled) == pdf_classify.MAX_SAMPLE_PAGES
+        assert [classifier.classify(page_index) for page_index in range(5)] == ['txt'] * 5
+    assert stats_pages == sampled + [page_index for page_index in range(5) if page_index not in sampled]
+
+
+def test_ocr_document_skips_per_page_stats(monkeypatch):
+    with DocumentContext(build_pdf([scanned_page()] * 12)) as pdf_doc:
+        classifier = PageClassifier(pdf_doc)
+        monkeypatch.setattr(pdf_classify, 'get_page_stats', None)
+        assert classifier.doc_decision == 'ocr'
+        assert [classifier.classify(page_index) for page_index in range(12)] == ['ocr'] * 12
+
+
+def test_lock_released_between_pages(monkeypatch):
+    """每页单独持有pdfium_lock，扫描期间其他线程可以在页与页之间使用pdfium"""
+    events = []
+
+    class RecordingLock:
+        def __enter__(self):
+            pdfium_lock.acquire()
+            events.append('acquire')
+
+        def __exit__(self, *exc_info):
+            events.append('release')
+            pdfium_lock.release()
+
+    get_page_stats = pdf_classify.get_page_stats
+
+    def recording_get_page_stats(pdf_doc, page_index):
+        events.append('page')
+        return get_page_stats(pdf_doc, page_index)
+
+    monkeypatch.setattr(pdf_classify, 'pdfium_lock', RecordingLock())
+    monkeypatch.setattr(pdf_classify, 'get_page_stats', recording_get_page_stats)
+    with DocumentContext(build_pdf([text_page()] * 5)) as pdf_doc:
+        assert classify_pages(pdf_doc) == ['txt'] * 5
+    page_events = [index for index, event in enumerate(events) if event == 'page']
+    assert len(page_events) == 5
+    for start, end in zip(page_events, page_events[1:]):
+        assert 'release' in events[start:end]
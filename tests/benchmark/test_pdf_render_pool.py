@@ -0,0 +1,99 @@
+"""
+渲染进程池的单元测试：结果与主进程中逐页渲染一致、位图是共享内存上的零拷贝视图，
+以及调用方提前退出时共享内存和临时pdf被释放。
+
+运行方式:
+    pytest tests/benchmark/test_pdf_render_pool.py
+"""
+import gc
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+pdfium = pytest.importorskip('pypdfium2')
+
+from mineru.utils import pdf_render_pool  # noqa: E402
+from mineru.utils.pdf_reader import page_to_numpy  # noqa: E402
+from mineru.utils.pdf_render_pool import iter_rendered_pages, shutdown_render_executor  # noqa: E402
+from synthetic import build_pdf, figure_page, scanned_page, text_page  # noqa: E402
+
+DPI = 72
+PAGES = [text_page(label=b'%d ' % index) if index % 3 else scanned_page() for index in range(7)] + [figure_page()]
+
+requires_dev_shm = pytest.mark.skipif(not os.path.isdir('/dev/shm'), reason='needs posix shared memory in /dev/shm')
+
+
+@pytest.fixture(scope='module')
+def pdf_bytes():
+    yield build_pdf(PAGES)
+    shutdown_render_executor()
+
+
+@pytest.fixture
+def temp_dir(tmp_path, monkeypatch):
+    # 临时pdf写入单独的目录，便于检查是否被删除
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    return tmp_path
+
+
+def _shm_names():
+    return set(os.listdir('/dev/shm'))
+
+
+def _render_in_process(pdf_bytes, start_page_id, end_page_id):
+    pdf_doc = pdfium.PdfDocument(pdf_bytes)
+    try:
+        return [page_to_numpy(pdf_doc[index], DPI) for index in range(start_page_id, end_page_id + 1)]
+    finally:
+        pdf_doc.close()
+
+
+@pytest.mark.parametrize('page_range', [(0, None), (2, 5)])
+def test_matches_in_process_render(pdf_bytes, temp_dir, page_range):
+    start_page_id, end_page_id = page_range
+    rendered = list(iter_rendered_pages(pdf_bytes, 2, DPI, start_page_id=start_page_id, end_page_id=end_page_id))
+    expected = _render_in_process(pdf_bytes, start_page_id, end_page_id if end_page_id is not None else len(PAGES) - 1)
+    assert [page_index for page_index, _, _ in rendered] == list(range(start_page_id, start_page_id + len(expected)))
+    for (_, image, scale), (expected_image, expected_scale) in zip(rendered, expected):
+        assert scale == expected_scale
+        np.testing.assert_array_equal(image, expected_image)
+    assert list(temp_dir.iterdir()) == []
+
+
+@requires_dev_shm
+def test_bitmaps_are_views_over_shared_memory(pdf_bytes, temp_dir):
+    before = _shm_names()
+    pages = iter_rendered_pages(pdf_bytes, 2, DPI)
+    _, image, _ = next(pages)
+    # 位图没有复制到主进程的内存中，名称已删除，映射仍然有效
+    assert isinstance(image.base, pdf_render_pool._SharedBitmap)
+    crop = image[10:20, 10:20]
+    assert np.shares_memory(crop, image)
+    pages.close()
+    del image
+    gc.collect()
+    # 裁剪出的视图仍在使用时，内容保持有效
+    assert crop.shape == (10, 10, 3) and int(crop.sum()) > 0
+    del crop
+    gc.collect()
+    assert _shm_names() <= before
+
+
+@requires_dev_shm
+def test_early_exit_releases_shared_memory_and_temp_pdf(pdf_bytes, temp_dir):
+    before = _shm_names()
+    pages = iter_rendered_pages(pdf_bytes, 2, DPI)
+    next(pages)
+    # 此时其他worker仍有在途的页面块，关闭生成器时需要等待并释放
+    pages.close()
+    gc.collect()
+    assert _shm_names() <= before
+    assert list(temp_dir.iterdir()) == []
+
+
+def test_render_error_removes_temp_pdf(temp_dir):
+    with pytest.raises(Exception):
+        list(iter_rendered_pages(b'%PDF-1.4 not a pdf', 2, DPI))
+    assert list(temp_dir.iterdir()) == []
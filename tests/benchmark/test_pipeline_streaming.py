@@ -0,0 +1,131 @@
+"""
+流式推理的单元测试：不同窗口大小下的推理结果和middle json与整批推理一致，文档在其页面进入窗口时才打开和分类，
+已完成的文档在下一个文档打开前产出。模型由synthetic中的确定性替身代替。
+
+运行方式:
+    pytest tests/benchmark/test_pipeline_streaming.py
+"""
+import copy
+import io
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip('pypdfium2')
+
+from mineru.backend.pipeline import pipeline_analyze  # noqa: E402
+from mineru.backend.pipeline.model_json_to_middle_json import result_to_middle_json  # noqa: E402
+from mineru.backend.pipeline.pipeline_analyze import doc_analyze_streaming  # noqa: E402
+from mineru.data.data_reader_writer import FileBasedDataWriter  # noqa: E402
+from mineru.utils.document_context import DocumentContext, ImageDocument  # noqa: E402
+from synthetic import build_pdf, fake_batch_image_analyze, patch_pipeline_models, scanned_page, text_page  # noqa: E402
+
+DOCS = [
+    [text_page(label=b'A%d ' % index) for index in range(5)],
+    [text_page(label=b'B0 '), scanned_page(), text_page(label=b'B2 ')],
+    None,
+    [scanned_page(), scanned_page()],
+    [text_page(lines=3)],
+]
+
+
+@pytest.fixture(autouse=True)
+def fake_models(monkeypatch):
+    patch_pipeline_models(monkeypatch)
+    monkeypatch.setenv('MINERU_PAGE_PROCESS_WORKERS', '1')
+
+
+def _openers(events=None):
+    def opener(pdf_idx, pages):
+        def open_doc():
+            if events is not None:
+                events.append(('open', pdf_idx))
+            return None if pages is None else DocumentContext(build_pdf(pages))
+        return open_doc
+    return [opener(pdf_idx, pages) for pdf_idx, pages in enumerate(DOCS)]
+
+
+def _run(monkeypatch, tmp_path, window_size):
+    monkeypatch.setenv('MINERU_MIN_BATCH_INFERENCE_SIZE', str(window_size))
+    outputs = []
+    image_writer = FileBasedDataWriter(str(tmp_path / str(window_size)))
+    for pdf_idx, model_list, images_list, pdf_doc, lang, ocr_enable in doc_analyze_streaming(
+            _openers(), ['en'] * len(DOCS)
+    ):
+        model_list_copy = copy.deepcopy(model_list)
+        middle_json = result_to_middle_json(model_list, images_list, pdf_doc, image_writer, lang, ocr_enable)
+        middle_json.pop('_version_name')
+        outputs.append((pdf_idx, model_list_copy, ocr_enable, json.dumps(middle_json, sort_keys=True)))
+    return outputs
+
+
+def test_windowed_matches_unwindowed(monkeypatch, tmp_path):
+    expected = _run(monkeypatch, tmp_path, 1000)
+    # 返回None的文档被跳过，其余文档按输入顺序产出
+    assert [pdf_idx for pdf_idx, _, _, _ in expected] == [0, 1, 3, 4]
+    assert [ocr_enable for _, _, ocr_enable, _ in expected] == [False, [False, True, False], True, False]
+    assert [len(model_list) for _, model_list, _, _ in expected] == [5, 3, 2, 1]
+    for window_size in (1, 2, 4):
+        assert _run(monkeypatch, tmp_path, window_size) == expected
+
+
+def test_documents_opened_lazily(monkeypatch):
+    events = []
+
+    def recording_analyze(images_with_extra_info, formula_enable=True, table_enable=True):
+        events.append(('infer', len(images_with_extra_info)))
+        return fake_batch_image_analyze(images_with_extra_info, formula_enable, table_enable)
+
+    monkeypatch.setattr(pipeline_analyze, 'batch_image_analyze', recording_analyze)
+    monkeypatch.setenv('MINERU_MIN_BATCH_INFERENCE_SIZE', '2')
+    for pdf_idx, *_ in doc_analyze_streaming(_openers(events), ['en'] * len(DOCS)):
+        events.append(('yield', pdf_idx))
+
+    # 下一个文档在上一个文档的页面全部进入窗口后才打开，已完成的文档在打开下一个文档前产出
+    assert events == [
+        ('open', 0), ('infer', 2), ('infer', 2),
+        ('open', 1), ('infer', 2), ('yield', 0),
+        ('infer', 2), ('yield', 1),
+        ('open', 2), ('open', 3), ('infer', 2), ('yield', 3),
+        ('open', 4), ('infer', 1), ('yield', 4),
+    ]
+
+
+@pytest.mark.parametrize('prune_enable', [False, True])
+def test_page_geometry_only_when_pruning(monkeypatch, prune_enable):
+    geometries = []
+
+    def recording_analyze(images_with_extra_info, formula_enable=True, table_enable=True):
+        geometries.extend(extra_info[4] for extra_info in images_with_extra_info)
+        return fake_batch_image_analyze(images_with_extra_info, formula_enable, table_enable)
+
+    monkeypatch.setattr(pipeline_analyze, 'batch_image_analyze', recording_analyze)
+    monkeypatch.setenv('MINERU_MFR_PRUNE', str(prune_enable).lower())
+    list(doc_analyze_streaming(_openers(), ['en'] * len(DOCS)))
+    assert len(geometries) == 11
+    if not prune_enable:
+        assert geometries == [None] * 11
+    else:
+        # 在当前进程推理时延迟到检测到公式时才读取页面尺寸
+        assert all(callable(geometry) for geometry in geometries)
+        scale, page_w, page_h = geometries[0]()
+        assert (page_w, page_h) == (595, 842) and scale == pytest.approx(200 / 72)
+
+
+def test_image_document_input(monkeypatch, tmp_path):
+    out = io.BytesIO()
+    Image.fromarray(np.full((3000, 1200, 3), 255, dtype=np.uint8)).save(out, format='PNG')
+    image_doc = ImageDocument(out.getvalue())
+    results = list(doc_analyze_streaming([image_doc, _openers()[4]], ['en', 'en']))
+    assert [pdf_idx for pdf_idx, *_ in results] == [0, 1]
+    _, model_list, images_list, pdf_doc, lang, ocr_enable = results[0]
+    # 图片没有文本层，始终使用OCR；页面尺寸为图片的像素尺寸，位图与pdf页面一样限制最长边
+    assert pdf_doc is image_doc and ocr_enable is True
+    assert model_list[0]['page_info'] == {'page_no': 0, 'width': 1024, 'height': 2560}
+    assert images_list[0].scale == pytest.approx(2560 / 3000)
+    middle_json = result_to_middle_json(
+        model_list, images_list, pdf_doc, FileBasedDataWriter(str(tmp_path)), lang, ocr_enable
+    )
+    assert middle_json['pdf_info'][0]['page_size'] == [1200, 3000]
@@ -0,0 +1,151 @@
+"""
+后处理热点函数的cpu benchmark，不需要gpu和模型权重。
+
+运行方式:
+    pytest tests/benchmark --benchmark-group-by=group --benchmark-columns=min,mean,max,rounds
+
+每个函数按span数量(10 ~ 5000)参数化，同一group内可以直接对比不同规模下的耗时，观察复杂度曲线。
+span两两比较的函数在5000规模下单轮耗时可达数分钟，
+可以通过环境变量MINERU_BENCH_MAX_SPANS限制最大规模，例如MINERU_BENCH_MAX_SPANS=1000。
+"""
+import copy
+import os
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from synthetic import make_chars, make_det_boxes, make_fix_blocks, make_otsl, make_page, make_pdf_info  # noqa: E402
+
+from mineru.backend.pipeline.para_split import para_split  # noqa: E402
+from mineru.backend.pipeline.pipeline_middle_json_mkcontent import union_make as pipeline_union_make  # noqa: E402
+from mineru.backend.vlm.vlm_middle_json_mkcontent import union_make as vlm_union_make  # noqa: E402
+from mineru.utils.block_sort import get_line_height, sort_blocks_by_sorted_lines  # noqa: E402
+from mineru.utils.enum_class import MakeMode  # noqa: E402
+from mineru.utils.format_utils import convert_otsl_to_html  # noqa: E402
+from mineru.utils.ocr_utils import merge_det_boxes, sorted_boxes  # noqa: E402
+from mineru.utils.span_block_fix import fill_spans_in_blocks  # noqa: E402
+from mineru.utils.span_pre_proc import fill_char_in_spans, remove_overlaps_low_confidence_spans, \
+    remove_overlaps_min_spans  # noqa: E402
+
+MAX_SPANS = int(os.getenv('MINERU_BENCH_MAX_SPANS', 5000))
+SPAN_COUNTS = [n for n in (10, 100, 1000, 5000) if n <= MAX_SPANS]
+
+
+def _rounds(num_spans):
+    # 大规模输入单轮耗时较长，减少轮数
+    if num_spans >= 1000:
+        return 1
+    if num_spans >= 100:
+        return 5
+    return 20
+
+
+@pytest.fixture(scope='module', params=SPAN_COUNTS, ids=lambda n: f'spans={n}')
+def num_spans(request):
+    return request.param
+
+
+@pytest.fixture(scope='module')
+def page(num_spans):
+    return make_page(num_spans)
+
+
+@pytest.fixture(scope='module')
+def pdf_info(page):
+    pdf_info = make_pdf_info(page)
+    para_split(pdf_info)
+    return pdf_info
+
+
+def _run(benchmark, func, make_args, num_spans):
+    """输入会被原地修改的函数，每轮通过setup重新生成输入，生成时间不计入结果"""
+    return benchmark.pedantic(
+        func, setup=lambda: (make_args(), {}), rounds=_rounds(num_spans), iterations=1
+    )
+
+
+@pytest.mark.benchmark(group='remove_overlaps_low_confidence_spans')
+def test_remove_overlaps_low_confidence_spans(benchmark, page, num_spans):
+    spans, dropped_spans = _run(
+        benchmark, remove_overlaps_low_confidence_spans, lambda: (copy.deepcopy(page['spans']),), num_spans
+    )
+    assert len(spans) + len(dropped_spans) == len(page['spans'])
+
+
+@pytest.mark.benchmark(group='remove_overlaps_min_spans')
+def test_remove_overlaps_min_spans(benchmark, page, num_spans):
+    spans, dropped_spans = _run(
+        benchmark, remove_overlaps_min_spans, lambda: (copy.deepcopy(page['spans']),), num_spans
+    )
+    assert len(spans) + len(dropped_spans) == len(page['spans'])
+
+
+@pytest.mark.benchmark(group='fill_char_in_spans')
+def test_fill_char_in_spans(benchmark, page, num_spans):
+    need_ocr_spans = _run(benchmark, fill_char_in_spans, lambda: make_chars(page['spans']), num_spans)
+    assert isinstance(need_ocr_spans, list)
+
+
+@pytest.mark.benchmark(group='fill_spans_in_blocks')
+def test_fill_spans_in_blocks(benchmark, page, num_spans):
+    block_with_spans, remaining_spans = _run(
+        benchmark, fill_spans_in_blocks,
+        lambda: (copy.deepcopy(page['blocks']), copy.deepcopy(page['spans']), 0.5), num_spans
+    )
+    assert len(block_with_spans) == len(page['blocks'])
+
+
+@pytest.mark.benchmark(group='sort_blocks_by_bbox_xycut')
+def test_sort_blocks_by_bbox_xycut(benchmark, page, num_spans):
+    def sort_by_xycut(fix_blocks):
+        get_line_height(fix_blocks)
+        return sort_blocks_by_sorted_lines(fix_blocks, None)
+
+    sorted_blocks = _run(benchmark, sort_by_xycut, lambda: (make_fix_blocks(page),), num_spans)
+    assert len(sorted_blocks) == len(page['blocks'])
+
+
+@pytest.mark.benchmark(group='para_split')
+def test_para_split(benchmark, page, num_spans):
+    page_info_list = _run(benchmark, lambda pdf_info: para_split(pdf_info) or pdf_info, lambda: (make_pdf_info(page),), num_spans)
+    assert 'para_blocks' in page_info_list[0]
+
+
+@pytest.mark.benchmark(group='pipeline_union_make')
+@pytest.mark.parametrize('make_mode', [MakeMode.MM_MD, MakeMode.CONTENT_LIST])
+def test_pipeline_union_make(benchmark, pdf_info, make_mode, num_spans):
+    result = benchmark.pedantic(
+        pipeline_union_make, args=(pdf_info, make_mode, 'images'), rounds=_rounds(num_spans), iterations=1
+    )
+    assert len(result) > 0
+
+
+@pytest.mark.benchmark(group='vlm_union_make')
+@pytest.mark.parametrize('make_mode', [MakeMode.MM_MD, MakeMode.CONTENT_LIST])
+def test_vlm_union_make(benchmark, pdf_info, make_mode, num_spans):
+    result = benchmark.pedantic(
+        vlm_union_make, args=(pdf_info, make_mode, 'images'), rounds=_rounds(num_spans), iterations=1
+    )
+    assert len(result) > 0
+
+
+@pytest.mark.benchmark(group='sorted_boxes')
+def test_sorted_boxes(benchmark, page, num_spans):
+    dt_boxes = make_det_boxes(page)
+    result = benchmark.pedantic(sorted_boxes, args=(dt_boxes,), rounds=_rounds(num_spans), iterations=1)
+    assert len(result) == len(dt_boxes)
+
+
+@pytest.mark.benchmark(group='merge_det_boxes')
+def test_merge_det_boxes(benchmark, page, num_spans):
+    dt_boxes = sorted_boxes(make_det_boxes(page))
+    result = benchmark.pedantic(merge_det_boxes, args=(dt_boxes,), rounds=_rounds(num_spans), iterations=1)
+    assert 0 < len(result) <= len(dt_boxes)
+
+
+@pytest.mark.benchmark(group='convert_otsl_to_html')
+def test_convert_otsl_to_html(benchmark, num_spans):
+    otsl = make_otsl(num_spans)
+    html = benchmark.pedantic(convert_otsl_to_html, args=(otsl,), rounds=_rounds(num_spans), iterations=1)
+    assert html.startswith('<table>')
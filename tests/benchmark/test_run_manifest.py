@@ -0,0 +1,156 @@
+"""
+断点续跑清单的单元测试：已完成文档的跳过、输入或参数变化后重新解析、提交被中断、日志行不完整，
+以及无法打开的文件和出错的文档被记为失败。
+
+运行方式:
+    pytest tests/benchmark/test_run_manifest.py
+"""
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('pypdfium2')
+
+from mineru.cli.common import doc_output_env, open_doc  # noqa: E402
+from mineru.cli.ingest import iter_work_units, prefetch_work_units  # noqa: E402
+from mineru.cli.run_manifest import (  # noqa: E402
+    MANIFEST_FILE_NAME, STAGING_DIR_NAME, STATUS_DONE, STATUS_FAILED, STATUS_PENDING, RunManifest,
+)
+
+CONFIG = {'backend': 'pipeline', 'method': 'auto', 'lang': 'ch'}
+
+
+def _parse(manifest, name, input_hash, content='# result'):
+    """模拟一次完整的解析：记录pending和running，在临时目录写出结果后提交"""
+    manifest.add_pending(name, f'/input/{name}.pdf', input_hash)
+    manifest.mark_running([name])
+    with doc_output_env(manifest.output_dir, name, 'auto', manifest) as (local_image_dir, local_md_dir):
+        Path(local_md_dir, f'{name}.md').write_text(content, encoding='utf-8')
+        Path(local_image_dir, 'page_0.jpg').write_bytes(b'jpg')
+
+
+def _journal_lines(output_dir):
+    with open(os.path.join(output_dir, MANIFEST_FILE_NAME), 'r', encoding='utf-8') as f:
+        return [line for line in f.read().splitlines() if line]
+
+
+def test_resume_skips_done_documents(tmp_path):
+    manifest = RunManifest(str(tmp_path), CONFIG)
+    _parse(manifest, 'a', 'hash_a')
+    _parse(manifest, 'b', 'hash_b')
+    manifest.close()
+
+    assert (tmp_path / 'a' / 'auto' / 'a.md').read_text(encoding='utf-8') == '# result'
+    resumed = RunManifest(str(tmp_path), CONFIG)
+    assert resumed.is_done('a', 'hash_a') and resumed.is_done('b', 'hash_b')
+    entry = resumed.documents['a']
+    assert entry['status'] == STATUS_DONE and entry['output_dir'] == os.path.join('a', 'auto')
+    assert 'outputs' not in entry and 'elapsed' in entry
+    # 加载时压缩为每个文档一行
+    assert len(_journal_lines(tmp_path)) == 2
+    resumed.close()
+
+
+def test_input_or_config_change_reparses(tmp_path):
+    manifest = RunManifest(str(tmp_path), CONFIG)
+    _parse(manifest, 'a', 'hash_a')
+    manifest.close()
+
+    assert not RunManifest(str(tmp_path), CONFIG).is_done('a', 'hash_changed')
+    assert not RunManifest(str(tmp_path), {**CONFIG, 'lang': 'en'}).is_done('a', 'hash_a')
+    # 结果目录被删除时重新解析
+    os.rename(tmp_path / 'a', tmp_path / 'a_moved')
+    assert not RunManifest(str(tmp_path), CONFIG).is_done('a', 'hash_a')
+
+
+def test_reparse_resets_previous_entry(tmp_path):
+    manifest = RunManifest(str(tmp_path), CONFIG)
+    _parse(manifest, 'a', 'hash_a')
+    manifest.add_pending('a', '/input/a.pdf', 'hash_new')
+    manifest.close()
+
+    entry = RunManifest(str(tmp_path), CONFIG).documents['a']
+    assert entry['status'] == STATUS_PENDING and entry['input_hash'] == 'hash_new'
+    assert 'output_dir' not in entry and 'finished_at' not in entry
+
+
+def test_interrupted_commit_is_reparsed(tmp_path):
+    manifest = RunManifest(str(tmp_path), CONFIG)
+    _parse(manifest, 'a', 'hash_a', content='old')
+    # 第二次解析在结果重命名到最终目录后、记录done之前被中断
+    manifest.add_pending('a', '/input/a.pdf', 'hash_a2')
+    manifest.mark_running(['a'])
+    staging_dir = manifest.make_staging_dir('a')
+    os.makedirs(os.path.join(staging_dir, 'a', 'auto'))
+    Path(staging_dir, 'a', 'auto', 'a.md').write_text('new', encoding='utf-8')
+    os.replace(tmp_path / 'a' / 'auto', tmp_path / 'a' / 'auto_old')
+    os.replace(os.path.join(staging_dir, 'a', 'auto'), tmp_path / 'a' / 'auto')
+    # 另一个文档还没写完
+    other_staging = manifest.make_staging_dir('b')
+    Path(other_staging, 'partial.md').write_text('partial', encoding='utf-8')
+    manifest.close()
+
+    resumed = RunManifest(str(tmp_path), CONFIG)
+    assert not resumed.is_done('a', 'hash_a2')
+    assert not (tmp_path / STAGING_DIR_NAME).exists()
+    _parse(resumed, 'a', 'hash_a2', content='again')
+    assert resumed.is_done('a', 'hash_a2')
+    assert (tmp_path / 'a' / 'auto' / 'a.md').read_text(encoding='utf-8') == 'again'
+    resumed.close()
+
+
+def test_truncated_journal_line_is_ignored(tmp_path):
+    manifest = RunManifest(str(tmp_path), CONFIG)
+    _parse(manifest, 'a', 'hash_a')
+    manifest.add_pending('b', '/input/b.pdf', 'hash_b')
+    manifest.close()
+    # 进程在写最后一行时被杀掉
+    with open(tmp_path / MANIFEST_FILE_NAME, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'name': 'b', 'status': STATUS_DONE})[:20])
+
+    resumed = RunManifest(str(tmp_path), CONFIG)
+    assert resumed.is_done('a', 'hash_a')
+    assert resumed.documents['b']['status'] == STATUS_PENDING
+    resumed.close()
+
+
+def test_journal_appends_one_line_per_change(tmp_path):
+    manifest = RunManifest(str(tmp_path), CONFIG)
+    names = [f'doc_{index}' for index in range(50)]
+    for name in names:
+        manifest.add_pending(name, f'/input/{name}.pdf', name)
+    manifest.mark_running(names)
+    for name in names:
+        manifest.mark_failed(name, 'boom')
+    assert len(_journal_lines(tmp_path)) == 3 * len(names)
+    manifest.close()
+    RunManifest(str(tmp_path), CONFIG).close()
+    assert len(_journal_lines(tmp_path)) == len(names)
+
+
+def test_failures_are_recorded(tmp_path):
+    manifest = RunManifest(str(tmp_path / 'out'), CONFIG)
+    bad_path = tmp_path / 'bad.pdf'
+    bad_path.write_bytes(b'%PDF-1.4 not a pdf')
+    for name in ('bad', 'broken', 'a', 'b'):
+        manifest.add_pending(name, f'/input/{name}.pdf', name)
+
+    # 无法打开的文件在分组时跳过
+    units = list(prefetch_work_units(iter_work_units([(bad_path, 'bad')], 100, on_skip=manifest.mark_failed)))
+    assert units == []
+    # 无法打开的文档不影响同批次的其他文档
+    assert open_doc('broken', b'not a pdf', manifest=manifest) is None
+    # 后处理出错的文档
+    manifest.mark_running(['a', 'b'])
+    with doc_output_env(manifest.output_dir, 'a', 'auto', manifest):
+        raise ValueError('post processing failed')
+    # 推理出错中断整个批次，未完成的文档记为失败
+    manifest.mark_unfinished_failed(['a', 'b'], RuntimeError('model failed'))
+
+    for name in ('bad', 'broken', 'a', 'b'):
+        assert manifest.documents[name]['status'] == STATUS_FAILED
+    assert manifest.documents['a']['error'] == 'post processing failed'
+    assert not (tmp_path / 'out' / 'a').exists()
+    manifest.close()
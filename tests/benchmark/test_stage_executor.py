@@ -0,0 +1,107 @@
+"""
+三阶段流水线执行器的单元测试：结果和调用顺序与doc_analyze_streaming一致，任一阶段出错时抛出该错误并结束所有线程。
+模型由synthetic中的确定性替身代替。
+
+运行方式:
+    pytest tests/benchmark/test_stage_executor.py
+"""
+import threading
+
+import pytest
+
+pytest.importorskip('pypdfium2')
+
+from mineru.backend.pipeline import pipeline_analyze  # noqa: E402
+from mineru.backend.pipeline.pipeline_analyze import doc_analyze_streaming  # noqa: E402
+from mineru.backend.pipeline.stage_executor import PipelineStageExecutor  # noqa: E402
+from mineru.utils.document_context import DocumentContext  # noqa: E402
+from synthetic import build_pdf, fake_batch_image_analyze, patch_pipeline_models, scanned_page, text_page  # noqa: E402
+
+DOCS = [
+    [text_page(label=b'A%d ' % index) for index in range(3)],
+    [scanned_page()],
+    [text_page(label=b'C0 '), scanned_page(), text_page(label=b'C2 '), text_page(label=b'C3 ')],
+    [text_page(lines=5)],
+]
+PAGE_COUNT = sum(len(pages) for pages in DOCS)
+
+
+@pytest.fixture(autouse=True)
+def fake_models(monkeypatch):
+    patch_pipeline_models(monkeypatch)
+    monkeypatch.setenv('MINERU_MIN_BATCH_INFERENCE_SIZE', '2')
+
+
+def _docs():
+    return [DocumentContext(build_pdf(pages)) for pages in DOCS]
+
+
+def _summary(pdf_idx, model_list, images_list, pdf_doc, lang, ocr_enable):
+    return pdf_idx, model_list, [image_dict.scale for image_dict in images_list], lang, ocr_enable
+
+
+def _stage_threads():
+    return [thread for thread in threading.enumerate() if thread.name in ('mineru-render', 'mineru-postprocess')]
+
+
+@pytest.mark.parametrize('queue_size', [1, 3])
+def test_matches_streaming(queue_size):
+    expected = [_summary(*result) for result in doc_analyze_streaming(_docs(), ['en'] * len(DOCS))]
+
+    results = []
+    threads = set()
+
+    def postprocess_fn(*result):
+        threads.add(threading.current_thread().name)
+        results.append(_summary(*result))
+
+    report = PipelineStageExecutor(queue_size=queue_size).run(_docs(), ['en'] * len(DOCS), postprocess_fn)
+    # 后处理在单独的线程中按输入顺序调用
+    assert results == expected
+    assert threads == {'mineru-postprocess'}
+    assert {name: stats['pages'] for name, stats in report['stages'].items()} == {
+        'render': PAGE_COUNT, 'infer': PAGE_COUNT, 'postprocess': PAGE_COUNT,
+    }
+    assert report['bottleneck'] in PipelineStageExecutor.STAGES
+    assert _stage_threads() == []
+
+
+class _StageError(Exception):
+    pass
+
+
+def _failing_opener():
+    raise _StageError('render')
+
+
+def _failing_analyze(images_with_extra_info, formula_enable=True, table_enable=True):
+    if any(not ocr_enable for _, ocr_enable, *_ in images_with_extra_info):
+        return fake_batch_image_analyze(images_with_extra_info, formula_enable, table_enable)
+    raise _StageError('infer')
+
+
+@pytest.mark.parametrize('stage', ['render', 'infer', 'postprocess'])
+def test_error_stops_all_stages(monkeypatch, stage):
+    docs = _docs()
+    if stage == 'render':
+        docs.insert(2, _failing_opener)
+    elif stage == 'infer':
+        # 第二个文档只有一页扫描页，单独组成的窗口推理失败
+        monkeypatch.setenv('MINERU_MIN_BATCH_INFERENCE_SIZE', '1')
+        monkeypatch.setattr(pipeline_analyze, 'batch_image_analyze', _failing_analyze)
+
+    processed = []
+
+    def postprocess_fn(pdf_idx, *_):
+        if stage == 'postprocess' and pdf_idx == 1:
+            raise _StageError('postprocess')
+        processed.append(pdf_idx)
+
+    with pytest.raises(_StageError, match=stage):
+        PipelineStageExecutor(queue_size=1).run(docs, ['en'] * len(docs), postprocess_fn)
+    # 出错的文档及之后的文档都不再后处理，所有阶段线程都已退出
+    failed_idx = 2 if stage == 'render' else 1
+    assert processed == list(range(len(processed))) and len(processed) <= failed_idx
+    if stage == 'postprocess':
+        assert processed == [0]
+    assert _stage_threads() == []
@@ -0,0 +1,87 @@
+"""
+页面级yolo批量推理与逐页predict的一致性测试，在cpu上使用随机初始化的YOLOv8（ultralytics，公式检测）
+和YOLOv10（doclayout_yolo，版面检测），输入为宽高比不同的页面。
+
+运行方式:
+    pytest tests/benchmark/test_yolo_batch.py
+"""
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from mineru.utils.yolo_batch import (  # noqa: E402
+    YoloBatchPredictor, get_model_package_module, get_precision_kwargs,
+)
+
+IMGSZ = 320
+CONF = 0.25
+IOU = 0.45
+# 不同宽高比的页面，其中420x300的缩放宽度不是整数，覆盖填充的取整
+IMAGE_SIZES = [(400, 300), (420, 300), (300, 400), (256, 256), (400, 300), (333, 250)]
+
+
+def _boost_cls_bias(heads):
+    """随机权重的模型几乎没有超过置信度阈值的框，调大分类分支的偏置得到足够多的检测结果"""
+    with torch.no_grad():
+        for head in heads:
+            for seq in head:
+                seq[-1].bias.normal_(-3, 1.5)
+
+
+def _yolov8():
+    ultralytics = pytest.importorskip('ultralytics')
+    torch.manual_seed(0)
+    model = ultralytics.YOLO('yolov8n.yaml')
+    _boost_cls_bias([model.model.model[-1].cv3])
+    return model
+
+
+def _yolov10():
+    doclayout_yolo = pytest.importorskip('doclayout_yolo')
+    torch.manual_seed(0)
+    model = doclayout_yolo.YOLOv10('yolov10n.yaml')
+    head = model.model.model[-1]
+    _boost_cls_bias([head.cv3, head.one2one_cv3])
+    return model
+
+
+MODELS = {'yolov8': _yolov8, 'yolov10': _yolov10}
+
+
+@pytest.fixture(scope='module')
+def images():
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for height, width in IMAGE_SIZES]
+
+
+@pytest.fixture(scope='module', params=list(MODELS))
+def model(request):
+    return MODELS[request.param]()
+
+
+def _predict_per_page(model, image):
+    result = model.predict(image, imgsz=IMGSZ, conf=CONF, iou=IOU, verbose=False, device='cpu')[0]
+    return result.boxes.data[:, [0, 1, 2, 3, -2, -1]].float().cpu().numpy()
+
+
+@pytest.mark.parametrize('batch_size', [1, 3, len(IMAGE_SIZES)])
+def test_matches_per_page_predict(model, images, batch_size):
+    predictor = YoloBatchPredictor(model, 'cpu', IMGSZ, CONF, IOU)
+    outputs = predictor.batch_predict(images, batch_size, 'layout')
+    assert len(outputs) == len(images)
+    total = 0
+    for boxes, image in zip(outputs, images):
+        reference = _predict_per_page(model, image)
+        assert boxes.shape == reference.shape
+        np.testing.assert_allclose(boxes, reference, atol=1e-3)
+        total += len(reference)
+    assert total > 0
+
+
+def test_precision_kwargs(model):
+    # ultralytics 8.4弃用了half，传入时每个batch都会输出警告
+    assert get_precision_kwargs(model, False) == {}
+    default_cfg = get_model_package_module(model, 'cfg').DEFAULT_CFG_DICT
+    expected = {'quantize': 16} if 'quantize' in default_cfg else {'half': True}
+    assert get_precision_kwargs(model, True) == expected